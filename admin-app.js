@@ -4,6 +4,13 @@ class RAIAdminPanel {
         this.currentSection = 'export';
         this.apiBaseUrl = 'http://localhost:5000/api';
         
+        // 評価一覧API（/api/admin/evaluations）の取得項目
+        // プレビューは本文の抜粋のみ、CSVは本文全体を取得する
+        this.previewFields = 'id,timestamp,user_id,chat_id,user_message_excerpt,ai_response_excerpt';
+        this.exportFields = 'id,timestamp,user_id,chat_id,user_message,ai_response';
+        this.previewLimit = 50;
+        this.exportPageSize = 100; // APIの1ページの上限
+        
         this.initializeElements();
         this.attachEventListeners();
         this.initializeAuth();
@@ -84,12 +91,26 @@ class RAIAdminPanel {
         this.userInfo.textContent = `${this.currentUser.name}さん`;
     }
 
-    redirectToLogin() {
+    async redirectToLogin() {
         // 実際の実装では教員用ログイン画面へ遷移
         alert('教員権限でログインしてください');
-        // モックアップでは仮の認証
-        localStorage.setItem('admin_token', 'mock-faculty-token');
-        location.reload();
+        // モックアップではモックモードのバックエンドに教員ユーザーでログイン
+        try {
+            const response = await fetch(`${this.apiBaseUrl}/auth/login`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ email: 'professor@fc.ritsumei.ac.jp', password: 'faculty123' })
+            });
+            const result = await response.json();
+            if (!result.success) {
+                throw new Error(result.message);
+            }
+            localStorage.setItem('admin_token', result.token);
+            location.reload();
+        } catch (error) {
+            console.error('Login error:', error);
+            this.showError('ログインに失敗しました');
+        }
     }
 
     logout() {
@@ -112,10 +133,10 @@ class RAIAdminPanel {
                 return;
             }
 
-            // モックデータ取得
-            const data = await this.fetchCompetencyData(startDate, endDate);
+            // 先頭ページのみ取得（本文は抜粋）
+            const page = await this.fetchCompetencyPage(startDate, endDate, this.previewFields, this.previewLimit);
             
-            this.displayPreview(data);
+            this.displayPreview(page.evaluations);
             this.previewArea.style.display = 'block';
             
         } catch (error) {
@@ -126,33 +147,42 @@ class RAIAdminPanel {
         }
     }
 
-    async fetchCompetencyData(startDate, endDate) {
-        // モックデータ
-        await new Promise(resolve => setTimeout(resolve, 1500));
+    async fetchCompetencyPage(startDate, endDate, fields, limit, cursor = null) {
+        // 評価一覧APIの1ページ分（絞り込み・並べ替えはサーバー側で行う）
+        const params = new URLSearchParams({
+            start_date: new Date(startDate).toISOString(),
+            end_date: new Date(endDate).toISOString(),
+            fields: fields,
+            limit: String(limit)
+        });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
         
-        return [
-            {
-                timestamp: '2024-01-15T10:30:00Z',
-                user_id: 'student001',
-                chat_id: 'chat_001_abc123',
-                user_message: 'ピアサポートの授業でグループワークを通じて、相手の話をじっくり聞くことの大切さを学びました。特に、相手の気持ちに寄り添うことで、より良いコミュニケーションができることを実感しました。',
-                ai_response: '【コンピテンシー評価結果】\\n\\n◆ 共感力 ★★★★☆ (4/5)\\n◆ チームワーク ★★★★☆ (4/5)\\n\\n【総評】\\nグループワークでの傾聴体験から、相手理解の重要性を深く学ばれています。共感力とチームワークが特に高く評価されます。'
-            },
-            {
-                timestamp: '2024-01-14T14:20:00Z',
-                user_id: 'student002',
-                chat_id: 'chat_002_def456',
-                user_message: '今日のロールプレイで初めて相談者役をやってみて、話すことの難しさを感じました。でも、それと同時に話を聞いてもらえることの安心感も理解できました。',
-                ai_response: '【コンピテンシー評価結果】\\n\\n◆ 自己効力感 ★★★☆☆ (3/5)\\n◆ 理解力 ★★★★☆ (4/5)\\n◆ しなやかさ ★★★★☆ (4/5)\\n\\n【総評】\\n新しい体験から多角的な学びを得られており、特に理解力としなやかさが発揮されています。'
-            },
-            {
-                timestamp: '2024-01-13T16:45:00Z',
-                user_id: 'student003',
-                chat_id: 'chat_003_ghi789',
-                user_message: 'グループディスカッションで他の人の異なる意見を聞いて、自分の考え方が狭かったことに気づきました。多様な視点を受け入れることの重要性を学びました。',
-                ai_response: '【コンピテンシー評価結果】\\n\\n◆ 変革力 ★★★★★ (5/5)\\n◆ 共感力 ★★★★☆ (4/5)\\n\\n【総評】\\n多様な視点への開放性と自己省察力が優秀です。変革力が特に高く評価され、継続的な成長が期待されます。'
-            }
-        ];
+        const response = await fetch(`${this.apiBaseUrl}/admin/evaluations?${params}`, {
+            headers: { 'Authorization': `Bearer ${localStorage.getItem('admin_token')}` }
+        });
+        if (response.status === 401) {
+            localStorage.removeItem('admin_token');
+            this.redirectToLogin();
+        }
+        if (!response.ok) {
+            throw new Error(`Evaluation list request failed: ${response.status}`);
+        }
+        return response.json();
+    }
+
+    async fetchCompetencyData(startDate, endDate, fields = this.exportFields) {
+        // next_cursor を辿って期間内の全件を取得（1回の応答は exportPageSize 件まで）
+        const records = [];
+        let cursor = null;
+        do {
+            const page = await this.fetchCompetencyPage(startDate, endDate, fields, this.exportPageSize, cursor);
+            records.push(...page.evaluations);
+            cursor = page.next_cursor;
+        } while (cursor);
+        
+        return records;
     }
 
     displayPreview(data) {
@@ -160,22 +190,21 @@ class RAIAdminPanel {
         
         data.forEach(record => {
             const row = document.createElement('tr');
+            row.dataset.id = record.id;
             
-            const formattedDate = new Date(record.timestamp).toLocaleString('ja-JP');
-            const truncatedMessage = record.user_message.length > 50 
-                ? record.user_message.substring(0, 50) + '...' 
-                : record.user_message;
-            const truncatedResponse = record.ai_response.length > 50 
-                ? record.ai_response.substring(0, 50) + '...' 
-                : record.ai_response;
-            
-            row.innerHTML = `
-                <td>${formattedDate}</td>
-                <td>${record.user_id}</td>
-                <td>${record.chat_id}</td>
-                <td title="${record.user_message}">${truncatedMessage}</td>
-                <td title="${record.ai_response}">${truncatedResponse}</td>
-            `;
+            // 本文はサーバー側で先頭50文字に切り詰めた抜粋を表示
+            const cells = [
+                new Date(record.timestamp).toLocaleString('ja-JP'),
+                record.user_id,
+                record.chat_id,
+                record.user_message_excerpt,
+                record.ai_response_excerpt
+            ];
+            cells.forEach(value => {
+                const cell = document.createElement('td');
+                cell.textContent = value;
+                row.appendChild(cell);
+            });
             
             this.previewTableBody.appendChild(row);
         });
@@ -204,28 +233,29 @@ class RAIAdminPanel {
         }
     }
 
-    downloadPreviewData() {
-        const data = this.getCurrentPreviewData();
-        this.downloadCSV(data);
+    async downloadPreviewData() {
+        try {
+            this.setLoading(true);
+            
+            // プレビューは抜粋のみのため、表示中の評価を本文付きで取得し直す
+            const page = await this.fetchCompetencyPage(
+                this.startDate.value, this.endDate.value, this.exportFields, this.previewLimit
+            );
+            const previewIds = new Set(this.getCurrentPreviewIds());
+            this.downloadCSV(page.evaluations.filter(record => previewIds.has(record.id)));
+            
+        } catch (error) {
+            console.error('Preview download error:', error);
+            this.showError('プレビューデータのダウンロードに失敗しました');
+        } finally {
+            this.setLoading(false);
+        }
     }
 
-    getCurrentPreviewData() {
-        // プレビューテーブルからデータを取得
+    getCurrentPreviewIds() {
+        // プレビューテーブルに表示中の評価ID
         const rows = this.previewTableBody.querySelectorAll('tr');
-        const data = [];
-        
-        rows.forEach(row => {
-            const cells = row.querySelectorAll('td');
-            data.push({
-                timestamp: cells[0].textContent,
-                user_id: cells[1].textContent,
-                chat_id: cells[2].textContent,
-                user_message: cells[3].getAttribute('title') || cells[3].textContent,
-                ai_response: cells[4].getAttribute('title') || cells[4].textContent
-            });
-        });
-        
-        return data;
+        return Array.from(rows, row => row.dataset.id);
     }
 
     downloadCSV(data) {
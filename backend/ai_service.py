@@ -2,60 +2,166 @@
 AIサービスモジュール
 Azure OpenAI連携とコンピテンシー評価
 """
-import json
+import asyncio
 import logging
 import random
 import time
-from typing import Dict, List, Optional
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 from datetime import datetime
 
 from config import Config
+from deployment_router import DeploymentRouter, load_targets
+from evaluation_cache import EvaluationCache
+from evaluation_format import (
+    EVALUATION_TOOL_OPTIONS, OUTPUT_FORMAT_JSON, parse_evaluation, render_evaluation, salvage_evaluation
+)
+from keyword_classifier import KeywordClassifier, KeywordMatch
+from latency import LatencyDistribution
+from metrics import REGISTRY, observe_stage, track_stage
+from model_tiering import MODE_COMPETENCY, MODE_GENERAL, TierDecision, load_tiers
+from prompt_registry import CompiledPrompts, PromptRegistry, estimate_tokens
+from single_flight import AsyncSingleFlight, SingleFlight, make_flight_key
 
 logger = logging.getLogger(__name__)
 
+MAX_COMPLETION_TOKENS = 1500
+
+# 失敗時に利用者へ返す応答（会話履歴・キャッシュには登録しない）
+COMPETENCY_ERROR_RESPONSE = "申し訳ございません。コンピテンシー評価中にエラーが発生しました。しばらく時間をおいてから再度お試しください。"
+GENERAL_ERROR_RESPONSE = "申し訳ございません。システムエラーが発生しました。しばらく時間をおいてから再度お試しください。"
+
+STRUCTURED_EVALUATIONS = REGISTRY.counter(
+    'rai_ai_structured_evaluations_total', 'Competency evaluations in JSON output mode per validation outcome', ['outcome']
+)
+
+# JSON出力モードの再送（整形できる項目が無い場合に1回だけ、関数呼び出しを強制したまま温度0で送る）
+STRUCTURED_RETRY_OPTIONS = {'temperature': 0}
+
+def _response_tokens(response) -> Optional[int]:
+    """応答のusageから実績トークン数を取得"""
+    usage = response.get('usage') if hasattr(response, 'get') else None
+    return usage.get('total_tokens') if usage else None
+
+def _response_text(response) -> str:
+    """応答本文の取得（関数呼び出しの場合は引数のJSON文字列）"""
+    message = response.choices[0].message
+    tool_calls = message.get('tool_calls')
+    if tool_calls:
+        return tool_calls[0]['function']['arguments']
+    return (message.get('content') or '').strip()
+
+def _stream_delta(chunk) -> Optional[str]:
+    """ストリーミング応答のチャンクから本文の差分を取得"""
+    # Azureではコンテンツフィルタ結果のみのチャンク（choicesが空）が先頭に届く
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.get("content")
+
+@dataclass
+class CompletionRequest:
+    """1回分の上流呼び出しの内容（同期版・asyncio版で共通）"""
+    messages: List[Dict]
+    tier: TierDecision
+    tokens: int  # TPM計上用の見積もり
+    options: Dict  # tools など追加のリクエストパラメータ
+    structured: bool = False  # JSON出力モード（関数呼び出しの引数を検証する）
+
 class AIService:
     """AIサービスクラス"""
     
+    flight_class = SingleFlight
+    
     def __init__(self):
         self.config = Config()
-        self.prompts = self._load_prompts()
+        self.mock_ai = self.config.MOCK_MODE and self.config.MOCK_AI
+        self.prompt_registry = PromptRegistry(self.config.PROMPTS_FILE, self.config.PROMPT_RELOAD_INTERVAL)
+        
+        # モック応答の遅延分布（未指定時はMOCK_AI_DELAYの固定値）
+        self.mock_latency = LatencyDistribution.from_spec(
+            self.config.MOCK_AI_LATENCY or str(self.config.MOCK_AI_DELAY),
+            self.config.MOCK_AI_LATENCY_SEED
+        )
+        
+        # コンピテンシー評価結果キャッシュ（プロンプト更新時は旧バージョンの結果を破棄）
+        self.evaluation_cache = None
+        if self.config.EVALUATION_CACHE_ENABLED:
+            self.evaluation_cache = EvaluationCache(
+                max_entries=self.config.EVALUATION_CACHE_MAX_ENTRIES,
+                ttl=self.config.EVALUATION_CACHE_TTL,
+                disk_path=self.config.EVALUATION_CACHE_DISK_PATH or None
+            )
+            self.evaluation_cache.set_prompt_version(self.prompt_registry.current().version)
+            self.prompt_registry.add_listener(
+                lambda compiled: self.evaluation_cache.set_prompt_version(compiled.version)
+            )
+        
+        # 送信先デプロイメントの選択（デプロイメントごとにTPM・RPMの送信制御とサーキットブレーカーを持つ）
+        self.router = DeploymentRouter(
+            load_targets(self.config),
+            ewma_alpha=self.config.ROUTER_EWMA_ALPHA,
+            hedge_enabled=self.config.ROUTER_HEDGE_ENABLED,
+            hedge_quantile=self.config.ROUTER_HEDGE_QUANTILE,
+            hedge_min_delay=self.config.ROUTER_HEDGE_MIN_DELAY
+        )
         
-        if not self.config.MOCK_MODE:
+        # 複雑さの採点によるモデル階層の選択（MODEL_TIERS未設定時は上記の送信先のみ）
+        self.model_tiers = load_tiers(self.config, self.router, MAX_COMPLETION_TOKENS)
+        
+        # 入力文のキーワード分類（keywords.jsonから一度だけ構築し、全リクエストで共有）
+        self.keyword_classifier = KeywordClassifier.from_file(self.config.KEYWORDS_FILE)
+        
+        # 同じ内容の同時呼び出しを上流1回にまとめる（モード別）
+        self.competency_flights = None
+        self.general_flights = None
+        if self.config.SINGLE_FLIGHT_ENABLED:
+            self.competency_flights = self.flight_class('competency')
+            self.general_flights = self.flight_class('general')
+        
+        if not self.mock_ai:
             self._initialize_openai_client()
     
-    def _load_prompts(self) -> Dict:
-        """プロンプト設定読み込み"""
-        try:
-            with open('../prompts.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            logger.warning("Prompts file not found, using default prompts")
-            return self._get_default_prompts()
-        except Exception as e:
-            logger.error(f"Error loading prompts: {str(e)}")
-            return self._get_default_prompts()
+    @property
+    def prompts(self) -> Dict:
+        """現行バージョンのプロンプト設定"""
+        return self.prompt_registry.current().prompts
+    
+    def get_prompt_set(self) -> CompiledPrompts:
+        """現行バージョンの構築済みプロンプト取得（1リクエスト内で同じ版を使うために呼び出し側で保持する）"""
+        with track_stage('ai.prompt_build'):
+            return self.prompt_registry.current()
+    
+    def classify_message(self, message: str) -> KeywordMatch:
+        """入力文のキーワード分類（該当するコンピテンシー・状況・話題を1回の走査で判定）"""
+        with track_stage('ai.classify'):
+            return self.keyword_classifier.classify(message)
     
-    def _get_default_prompts(self) -> Dict:
-        """デフォルトプロンプト"""
+    def get_cache_stats(self) -> Dict:
+        """評価キャッシュ統計取得"""
+        if not self.evaluation_cache:
+            return {'enabled': False}
+        return {'enabled': True, **self.evaluation_cache.get_stats()}
+    
+    def get_deployment_stats(self) -> List[Dict]:
+        """送信先デプロイメントごとの状態・送信制御の統計取得（全階層）"""
+        return [
+            {'tier': tier.name, **stats}
+            for tier in self.model_tiers.tiers
+            for stats in tier.router.get_stats()
+        ]
+    
+    def get_model_tier_stats(self) -> Dict:
+        """モデル階層ごとの件数・採点・応答時間の統計取得"""
+        return self.model_tiers.get_stats()
+    
+    def get_single_flight_stats(self) -> Dict:
+        """同時呼び出しのまとめ（シングルフライト）の統計取得"""
+        if not self.competency_flights:
+            return {'enabled': False}
         return {
-            "competency_evaluation_prompt": {
-                "system_role": "あなたは立命館大学の学習支援AIアシスタント「R-AI」です。",
-                "competency_definitions": {
-                    "competencies": [
-                        {"japanese": "しなやかさ", "description": "困ったことや失敗したことから学び立ち直る力"},
-                        {"japanese": "自発性", "description": "自分で自分の目標を決め、あきらめることなく取り組む"},
-                        {"japanese": "チームワーク", "description": "目的を達成するために他の人と協力する"},
-                        {"japanese": "自己効力感", "description": "自分ならどういうふうに問題解決し、自分を信じる感覚"},
-                        {"japanese": "理解力", "description": "科学的に物事を理解する"},
-                        {"japanese": "マルチタスキング", "description": "複数の課題にバランスよく取り組む"},
-                        {"japanese": "共感力", "description": "他人の気持ちを想像して、その心に寄り添う"},
-                        {"japanese": "変革力", "description": "新しい考え方で、物事に変化を生み出す"}
-                    ]
-                }
-            },
-            "general_chat_prompt": {
-                "system_role": "あなたは立命館大学の学習支援AIアシスタント「R-AI」です。"
-            }
+            'enabled': True,
+            'competency': self.competency_flights.get_stats(),
+            'general': self.general_flights.get_stats()
         }
     
     def _initialize_openai_client(self):
@@ -74,191 +180,363 @@ class AIService:
             logger.error(f"Azure OpenAI initialization error: {str(e)}")
             raise
     
-    def get_competency_evaluation(self, user_message: str) -> str:
+    def get_competency_evaluation(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None) -> str:
         """コンピテンシー評価実行"""
         try:
-            if self.config.MOCK_MODE:
-                # モック応答
-                time.sleep(self.config.MOCK_AI_DELAY)
-                return self._generate_mock_competency_response(user_message)
-            
-            # Azure OpenAI呼び出し
-            system_prompt = self._build_competency_system_prompt()
-            user_prompt = self._build_competency_user_prompt(user_message)
+            return self.evaluate_competency(user_message, prompt_set)
             
-            response = self._call_azure_openai(system_prompt, user_prompt)
-            
-            logger.info(f"Competency evaluation completed for message length: {len(user_message)}")
+        except Exception as e:
+            logger.error(f"Competency evaluation error: {str(e)}")
+            return COMPETENCY_ERROR_RESPONSE
+    
+    def evaluate_competency(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None) -> str:
+        """コンピテンシー評価実行（失敗時は例外を送出、一括評価など失敗を区別する呼び出し元用）"""
+        prompt_set = prompt_set or self.prompt_registry.current()
+        cached = self._get_cached_evaluation(user_message, prompt_set.version)
+        if cached is not None:
+            return cached
+        
+        response = self._single_flight(
+            self.competency_flights,
+            make_flight_key(prompt_set.version, 'competency', user_message),
+            lambda: self._request_competency_evaluation(user_message, prompt_set)
+        )
+        
+        self._cache_evaluation(user_message, prompt_set.version, response)
+        
+        logger.info(f"Competency evaluation completed for message length: {len(user_message)}")
+        return response
+    
+    def _request_competency_evaluation(self, user_message: str, prompt_set: CompiledPrompts) -> str:
+        """コンピテンシー評価の上流呼び出し"""
+        if self.mock_ai:
+            return self._mock_completion(MODE_COMPETENCY, user_message)
+        
+        request = self._competency_request(user_message, prompt_set)
+        response = self._call_azure_openai(request)
+        if not request.structured:
             return response
+        
+        rendered = self._render_structured_evaluation(response)
+        if rendered is None:
+            rendered = self._render_structured_evaluation(self._call_azure_openai(self._structured_retry(request)))
+        return self._structured_result(rendered)
+    
+    def _render_structured_evaluation(self, arguments: str) -> Optional[str]:
+        """JSON出力モードの応答の検証・整形（不正な場合は妥当な項目だけで整形し、それも無い場合はNone）"""
+        try:
+            evaluation = parse_evaluation(arguments)
+        except ValueError as e:
+            evaluation = salvage_evaluation(arguments)
+            if evaluation is None:
+                logger.warning(f"Structured evaluation rejected: {str(e)}")
+                return None
+            STRUCTURED_EVALUATIONS.labels('partial').inc()
+            logger.warning(f"Structured evaluation rendered from valid fields only: {str(e)}")
+            return render_evaluation(evaluation)
+        
+        STRUCTURED_EVALUATIONS.labels('valid').inc()
+        return render_evaluation(evaluation)
+    
+    def _structured_retry(self, request: CompletionRequest) -> CompletionRequest:
+        """JSON出力モードの再送内容（テキスト形式での再評価はせず、同じ関数呼び出しを1回だけ再送する）"""
+        STRUCTURED_EVALUATIONS.labels('retry').inc()
+        return replace(request, options={**request.options, **STRUCTURED_RETRY_OPTIONS})
+    
+    def _structured_result(self, rendered: Optional[str]) -> str:
+        """再送後も整形できない場合は失敗として例外を送出（エラー応答はキャッシュしない）"""
+        if rendered is None:
+            STRUCTURED_EVALUATIONS.labels('failed').inc()
+            raise ValueError('Structured evaluation could not be validated after retry')
+        return rendered
+    
+    def _select_tier(self, mode: str, user_message: str, history: Optional[List[Dict]] = None) -> TierDecision:
+        """入力文のキーワード分類・長さ・会話履歴からモデル階層を選択"""
+        return self.model_tiers.select(mode, user_message, history, self.classify_message(user_message))
+    
+    def _competency_request(self, user_message: str, prompt_set: CompiledPrompts) -> CompletionRequest:
+        """コンピテンシー評価の上流呼び出し内容（JSON出力モードは関数呼び出しで評価結果を受け取る）"""
+        user_prompt = prompt_set.render_competency_user(user_message)
+        tier = self._select_tier(MODE_COMPETENCY, user_message)
+        
+        if prompt_set.output_format == OUTPUT_FORMAT_JSON:
+            return self._build_request(prompt_set.competency_json_system, user_prompt, tier,
+                                       options=EVALUATION_TOOL_OPTIONS, structured=True)
+        return self._build_request(prompt_set.competency_system, user_prompt, tier)
+    
+    def _general_request(self, user_message: str, prompt_set: CompiledPrompts,
+                         history: Optional[List[Dict]] = None) -> CompletionRequest:
+        """一般チャット応答の上流呼び出し内容"""
+        tier = self._select_tier(MODE_GENERAL, user_message, history)
+        return self._build_request(prompt_set.general_system, user_message, tier, history)
+    
+    def _build_request(self, system_prompt: str, user_prompt: str, tier: TierDecision,
+                       history: Optional[List[Dict]] = None, options: Optional[Dict] = None,
+                       structured: bool = False) -> CompletionRequest:
+        """Chat Completions形式のメッセージとTPM計上用のトークン数見積もりを構築"""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            *(history or []),
+            {"role": "user", "content": user_prompt}
+        ]
+        tokens = self._estimate_request_tokens(messages, tier.max_tokens)
+        return CompletionRequest(messages, tier, tokens, dict(options or {}), structured)
+    
+    def _completion_kwargs(self, request: CompletionRequest, target, stream: bool = False) -> Dict:
+        """ChatCompletion.create・acreate の引数（送信先ごとの engine・api_base などを含む）"""
+        kwargs = {
+            'messages': request.messages,
+            'temperature': 0.7,
+            'max_tokens': request.tier.max_tokens,
+            'top_p': 0.95,
+            'frequency_penalty': 0,
+            'presence_penalty': 0,
+            **request.options,
+            **target.request_options()
+        }
+        if stream:
+            kwargs['stream'] = True
+        return kwargs
+    
+    def _single_flight(self, flights: Optional[SingleFlight], key: str, func):
+        """同じキーの呼び出しが実行中であればその結果を共有（無効時はそのまま実行）"""
+        if flights is None:
+            return func()
+        return flights.do(key, func)
+    
+    def _get_cached_evaluation(self, user_message: str, prompt_version: str) -> Optional[str]:
+        """キャッシュ済み評価結果取得"""
+        if not self.evaluation_cache:
+            return None
+        
+        with track_stage('ai.cache_lookup'):
+            cached = self.evaluation_cache.get(user_message, prompt_version)
+        if cached is not None:
+            logger.info(f"Competency evaluation cache hit for message length: {len(user_message)}")
+        return cached
+    
+    def _cache_evaluation(self, user_message: str, prompt_version: str, response: str):
+        """評価結果をキャッシュに登録（エラー応答は登録しない）"""
+        if self.evaluation_cache and response:
+            self.evaluation_cache.set(user_message, prompt_version, response)
+    
+    def get_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                             history: Optional[List[Dict]] = None) -> str:
+        """一般チャット応答（historyは同一チャットの会話履歴、Chat Completions形式）"""
+        try:
+            return self.generate_general_response(user_message, prompt_set, history)
             
         except Exception as e:
-            logger.error(f"Competency evaluation error: {str(e)}")
-            return "申し訳ございません。コンピテンシー評価中にエラーが発生しました。しばらく時間をおいてから再度お試しください。"
+            logger.error(f"General response error: {str(e)}")
+            return GENERAL_ERROR_RESPONSE
+    
+    def generate_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                                  history: Optional[List[Dict]] = None) -> str:
+        """一般チャット応答（失敗時は例外を送出、応答を会話履歴に追加する呼び出し元用）"""
+        prompt_set = prompt_set or self.prompt_registry.current()
+        response = self._single_flight(
+            self.general_flights,
+            make_flight_key(prompt_set.version, 'general', user_message, history),
+            lambda: self._request_general_response(user_message, prompt_set, history)
+        )
+        
+        logger.info(f"General response completed for message length: {len(user_message)}")
+        return response
+    
+    def _request_general_response(self, user_message: str, prompt_set: CompiledPrompts,
+                                  history: Optional[List[Dict]] = None) -> str:
+        """一般チャット応答の上流呼び出し"""
+        if self.mock_ai:
+            return self._mock_completion(MODE_GENERAL, user_message)
+        
+        return self._call_azure_openai(self._general_request(user_message, prompt_set, history))
     
-    def get_general_response(self, user_message: str) -> str:
-        """一般チャット応答"""
+    def stream_competency_evaluation(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None) -> Iterator[str]:
+        """コンピテンシー評価（ストリーミング）"""
         try:
-            if self.config.MOCK_MODE:
-                time.sleep(self.config.MOCK_AI_DELAY)
-                return self._generate_mock_general_response(user_message)
+            prompt_set = prompt_set or self.prompt_registry.current()
+            cached = self._get_cached_evaluation(user_message, prompt_set.version)
+            if cached is not None:
+                yield cached
+                return
             
-            # Azure OpenAI呼び出し
-            system_prompt = self._build_general_system_prompt()
-            user_prompt = user_message
+            if self.mock_ai:
+                deltas = self._stream_mock_text(self._mock_text(MODE_COMPETENCY, user_message))
+            elif prompt_set.output_format == OUTPUT_FORMAT_JSON:
+                # JSON出力モードは検証・整形後のテキストを1チャンクで返す（生成途中のJSONは表示できないため）
+                deltas = iter([self._request_competency_evaluation(user_message, prompt_set)])
+            else:
+                deltas = self._call_azure_openai_stream(self._competency_request(user_message, prompt_set))
             
-            response = self._call_azure_openai(system_prompt, user_prompt)
+            chunks = []
+            for delta in self._track_stream(deltas):
+                chunks.append(delta)
+                yield delta
             
-            logger.info(f"General response completed for message length: {len(user_message)}")
-            return response
+            self._cache_evaluation(user_message, prompt_set.version, ''.join(chunks))
+            
+            logger.info(f"Competency evaluation stream completed for message length: {len(user_message)}")
             
         except Exception as e:
-            logger.error(f"General response error: {str(e)}")
-            return "申し訳ございません。システムエラーが発生しました。しばらく時間をおいてから再度お試しください。"
+            logger.error(f"Competency evaluation stream error: {str(e)}")
+            yield COMPETENCY_ERROR_RESPONSE
+    
+    def stream_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                                history: Optional[List[Dict]] = None) -> Iterator[str]:
+        """一般チャット応答（ストリーミング）"""
+        try:
+            yield from self.iter_general_response(user_message, prompt_set, history)
+            
+        except Exception as e:
+            logger.error(f"General response stream error: {str(e)}")
+            yield GENERAL_ERROR_RESPONSE
+    
+    def iter_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                              history: Optional[List[Dict]] = None) -> Iterator[str]:
+        """一般チャット応答（ストリーミング、失敗時は例外を送出）"""
+        if self.mock_ai:
+            deltas = self._stream_mock_text(self._mock_text(MODE_GENERAL, user_message))
+        else:
+            prompt_set = prompt_set or self.prompt_registry.current()
+            deltas = self._call_azure_openai_stream(self._general_request(user_message, prompt_set, history))
+        
+        yield from self._track_stream(deltas)
+        
+        logger.info(f"General response stream completed for message length: {len(user_message)}")
+    
+    def _track_stream(self, deltas: Iterator[str]) -> Iterator[str]:
+        """ストリーミング応答の最初のチャンクまでの時間と全体の時間を記録"""
+        started = time.perf_counter()
+        first = True
+        with track_stage('ai.stream'):
+            for delta in deltas:
+                if first:
+                    observe_stage('ai.stream_first_token', time.perf_counter() - started)
+                    first = False
+                yield delta
+    
+    def _mock_text(self, mode: str, user_message: str) -> str:
+        """モードに応じたモック応答本文"""
+        if mode == MODE_COMPETENCY:
+            return self._generate_mock_competency_response(user_message)
+        return self._generate_mock_general_response(user_message)
     
-    def _call_azure_openai(self, system_prompt: str, user_prompt: str) -> str:
+    def _mock_chunks(self, text: str) -> List[str]:
+        """モック応答を一定サイズのチャンクに分割"""
+        chunk_size = max(1, self.config.MOCK_STREAM_CHUNK_SIZE)
+        return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    
+    def _mock_completion(self, mode: str, user_message: str) -> str:
+        """モック応答（遅延分布に従って待機してから全文を返す）"""
+        with track_stage('ai.completion'):
+            time.sleep(self.mock_latency.sample())
+            return self._mock_text(mode, user_message)
+    
+    def _stream_mock_text(self, text: str) -> Iterator[str]:
+        """モック応答をチャンクごとに逐次出力"""
+        chunks = self._mock_chunks(text)
+        
+        # 遅延分布から生成した応答全体の遅延を各チャンクに配分
+        delay = self.mock_latency.sample() / max(len(chunks), 1)
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+    
+    def _call_azure_openai(self, request: CompletionRequest) -> str:
         """Azure OpenAI API呼び出し"""
         try:
             import openai
             
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
+            tier = request.tier
             
-            response = openai.ChatCompletion.create(
-                engine=self.config.AZURE_OPENAI_DEPLOYMENT,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1500,
-                top_p=0.95,
-                frequency_penalty=0,
-                presence_penalty=0
-            )
+            def create(target):
+                with track_stage('ai.completion'):
+                    return openai.ChatCompletion.create(**self._completion_kwargs(request, target))
+            
+            started = time.perf_counter()
+            try:
+                response = tier.router.call(
+                    lambda target: target.governor.call(lambda: create(target), request.tokens, tier.priority,
+                                                        usage=_response_tokens)
+                )
+            except Exception:
+                tier.record(None)
+                raise
+            tier.record(time.perf_counter() - started)
             
-            return response.choices[0].message.content.strip()
+            return _response_text(response)
             
         except Exception as e:
             logger.error(f"Azure OpenAI API error: {str(e)}")
             raise
     
-    def _build_competency_system_prompt(self) -> str:
-        """コンピテンシー評価用システムプロンプト構築"""
-        prompt_config = self.prompts["competency_evaluation_prompt"]
-        
-        system_prompt = f"""
-{prompt_config["system_role"]}
-
-## コンピテンシー定義
-立命館大学では以下のコンピテンシーを重視しています：
-
-"""
-        
-        competencies = prompt_config["competency_definitions"]["competencies"]
-        for comp in competencies:
-            system_prompt += f"・{comp['japanese']}: {comp['description']}\n"
-        
-        system_prompt += """
-## 授業コンテキスト
-- 科目名: ピアサポート論
-- 学習方法: グループディスカッション、ペアワーク、体験学習、振り返り活動
-- 重要概念: ピアサポート、カウンセリングマインド、傾聴、共感、自己開示
-
-## 評価指針
-1. 学生の入力内容から特に発揮されているコンピテンシー2-3個を特定
-2. 5段階評価（1:発揮されていない〜5:優秀）で評価
-3. 建設的で具体的なフィードバックを提供
-4. 次の学習につながる示唆を含める
-
-## 回答フォーマット
-【コンピテンシー評価結果】
-
-◆ [コンピテンシー名] ★★★★☆ ([点数]/5)
-◆ [コンピテンシー名] ★★★★☆ ([点数]/5)
-
-【総評】
-[全体的な評価と成長のポイント]
-
-【今後の学習へのアドバイス】
-[具体的な提案]
-"""
-        return system_prompt
-    
-    def _build_competency_user_prompt(self, user_message: str) -> str:
-        """コンピテンシー評価用ユーザープロンプト構築"""
-        return f"""
-以下は学生がピアサポート論の授業で体験した内容や学びについて記述したものです。
-この内容からコンピテンシーを評価してください。
-
-【学生の入力】
-{user_message}
-
-上記の内容から、特に発揮されているコンピテンシーを評価し、建設的なフィードバックをお願いします。
-"""
+    def _call_azure_openai_stream(self, request: CompletionRequest) -> Iterator[str]:
+        """Azure OpenAI API呼び出し（ストリーミング、usageが返らないため推定トークン数で計上）"""
+        tier = request.tier
+        try:
+            import openai
+            
+            # ストリーミングは応答開始までを送信先の応答時間、応答完了までを階層の応答時間として記録する（ヘッジ送信はしない）
+            started = time.perf_counter()
+            response = tier.router.call(
+                lambda target: target.governor.call(
+                    lambda: openai.ChatCompletion.create(**self._completion_kwargs(request, target, stream=True)),
+                    request.tokens,
+                    tier.priority
+                ),
+                hedge=False
+            )
+            
+            for chunk in response:
+                content = _stream_delta(chunk)
+                if content:
+                    yield content
+            
+            tier.record(time.perf_counter() - started)
+            
+        except Exception as e:
+            logger.error(f"Azure OpenAI streaming API error: {str(e)}")
+            tier.record(None)
+            raise
     
-    def _build_general_system_prompt(self) -> str:
-        """一般チャット用システムプロンプト構築"""
-        prompt_config = self.prompts["general_chat_prompt"]
-        
-        return f"""
-{prompt_config["system_role"]}
-
-あなたは学生の学習をサポートし、授業に関連した質問や相談に適切な支援を提供します。
-
-## 対応範囲
-- ピアサポート論の授業内容に関する質問
-- カウンセリング基礎知識
-- コミュニケーション技法
-- グループワークに関する相談
-- 一般的な学習相談
-
-## 対応しない内容
-- リアルタイム情報（天気、最新ニュースなど）
-- 個人の成績や評価
-- 他の学生の個人情報
-- 大学の内部機密情報
-
-温かく支援的な態度で、学生の学習意欲を高める前向きな回答を心がけてください。
-"""
+    def _estimate_request_tokens(self, messages: List[Dict], max_tokens: int = MAX_COMPLETION_TOKENS) -> int:
+        """TPM計上用のトークン数見積もり（Azureと同様にmax_tokensを含める）"""
+        return sum(estimate_tokens(message['content']) for message in messages) + max_tokens
     
     def _generate_mock_competency_response(self, user_message: str) -> str:
         """モックコンピテンシー評価応答生成（実際の入力内容に基づく）"""
-        # 入力内容の分析
-        message_lower = user_message.lower()
-        
-        # 発揮されているコンピテンシーを入力内容から判定
-        competencies = []
+        # 入力内容の分析（キーワード分類）
+        match = self.classify_message(user_message)
         
-        # しなやかさ（困難・不安・失敗への対応）
-        if any(word in message_lower for word in ["不安", "困っ", "難し", "失敗", "うまくいかない", "ついていけない"]):
-            competencies.append({
+        feedback = {
+            # しなやかさ（困難・不安・失敗への対応）
+            "R": {
                 "code": "R",
                 "name": "Resilience（しなやかさ）",
                 "desc": "困難な状況に向き合い、課題を認識する力を示しています"
-            })
-        
-        # 自己効力感（自分の状況を客観視）
-        if any(word in message_lower for word in ["自分", "意見", "考え", "振り返り", "反省"]):
-            competencies.append({
+            },
+            # 自己効力感（自分の状況を客観視）
+            "S": {
                 "code": "S", 
                 "name": "Self-efficacy（自己効力感）",
                 "desc": "自分の現状を客観的に把握し、課題を認識する自己理解力を発揮しています"
-            })
-        
-        # チームワーク（グループワーク・ペアワーク参加）
-        if any(word in message_lower for word in ["ペア", "グループ", "チーム", "授業", "参加", "一緒"]):
-            competencies.append({
+            },
+            # チームワーク（グループワーク・ペアワーク参加）
+            "T": {
                 "code": "T",
                 "name": "Teamwork（チームワーク）",
                 "desc": "授業でのペアワークに参加し、協働学習の場に身を置く姿勢を示しています"
-            })
-        
-        # 共感力（他者や環境への配慮・観察）
-        if any(word in message_lower for word in ["エアコン", "寒い", "環境", "教室", "周り", "他の人"]):
-            competencies.append({
+            },
+            # 共感力（他者や環境への配慮・観察）
+            "E": {
                 "code": "E",
                 "name": "Empathy（共感力）",
                 "desc": "学習環境や周囲の状況に対する気づきと配慮を示しています"
-            })
+            }
+        }
+        
+        # 発揮されているコンピテンシーを入力内容から判定（keywords.jsonの記載順）
+        competencies = [feedback[code] for code in match.labels('competencies') if code in feedback]
         
         # コンピテンシーが見つからない場合のデフォルト
         if not competencies:
@@ -279,7 +557,7 @@ class AIService:
         selected = competencies[:3]
         
         # 入力内容に基づく現状分析
-        situation_analysis = self._analyze_learning_situation(user_message)
+        situation_analysis = self._analyze_learning_situation(user_message, match)
         
         # レスポンス生成
         response = "【コンピテンシー評価結果】\n\n"
@@ -301,19 +579,19 @@ class AIService:
         
         return response
     
-    def _analyze_learning_situation(self, user_message: str) -> dict:
+    def _analyze_learning_situation(self, user_message: str, match: Optional[KeywordMatch] = None) -> dict:
         """学習状況の分析とアドバイス生成"""
-        message_lower = user_message.lower()
+        situation = (match or self.classify_message(user_message)).first('situations')
         
         # 不安・困難に関する内容
-        if any(word in message_lower for word in ["不安", "ついていけない", "困っ"]):
+        if situation == 'anxiety':
             return {
                 "summary": "入学から間もない時期に感じる不安は自然なことです。現在の状況を正直に振り返り、課題を認識できていることは、今後の成長につながる重要な第一歩です。",
                 "advice": "・授業でわからないことは、遠慮せずに教員やクラスメートに質問してみましょう\n・ペアワークでは、まず相手の話をよく聞くことから始めてみてください\n・少しずつでも発言する機会を増やしていくことで、自信につながります"
             }
         
         # コミュニケーション・発言に関する内容
-        elif any(word in message_lower for word in ["意見", "言え", "話", "発言"]):
+        elif situation == 'communication':
             return {
                 "summary": "ペアワークで自分の意見を表現することの難しさを感じていらっしゃいますね。この気づき自体が、コミュニケーション能力向上への第一歩となります。",
                 "advice": "・相手の話に「うなずき」や「そうですね」といった相槌から始めてみましょう\n・「私はこう思うのですが、どうでしょうか？」と相手の意見も求める表現を使ってみてください\n・完璧な意見でなくても、自分なりの感想を伝えることから始めましょう"
@@ -387,11 +665,12 @@ class AIService:
         ]
         
         # キーワードベースの応答選択
-        if any(word in user_message for word in ["グループ", "チーム", "協力"]):
+        topic = self.classify_message(user_message).first('topics')
+        if topic == 'teamwork':
             return "グループでの協働について言及されていますね。チームワークやコミュニケーションの観点で、どのような学びがありましたか？"
-        elif any(word in user_message for word in ["聞く", "傾聴", "話"]):
+        elif topic == 'listening':
             return "傾聴やコミュニケーションに関する気づきですね。相手の立場に立って考えることで、どのような新しい発見がありましたか？"
-        elif any(word in user_message for word in ["難しい", "困った", "課題"]):
+        elif topic == 'difficulty':
             return "困難な状況での学びは特に価値がありますね。その経験から、どのような対処方法や解決策を見つけることができましたか？"
         else:
             return random.choice(responses)
@@ -402,4 +681,302 @@ class AIService:
     
     def get_competency_list(self) -> List[Dict]:
         """コンピテンシー一覧取得"""
-        return self.prompts["competency_evaluation_prompt"]["competency_definitions"]["competencies"]
\ No newline at end of file
+        return self.prompt_registry.current().competencies
+
+class AsyncAIService(AIService):
+    """AIサービスクラス（asyncio版）
+    
+    プロンプト構築・リクエスト内容・モック応答はAIServiceと共通。Azure OpenAI呼び出しは
+    ChatCompletion.acreateを使用し、評価キャッシュのディスク層とプロンプトの更新確認は
+    スレッドプールで実行してイベントループをブロックしない。
+    """
+    
+    flight_class = AsyncSingleFlight
+    
+    def __init__(self):
+        super().__init__()
+        self._session = None
+    
+    async def initialize(self):
+        """HTTPセッション初期化（接続をリクエスト間で再利用する）"""
+        if self.mock_ai:
+            return
+        
+        import aiohttp
+        self._session = aiohttp.ClientSession()
+    
+    async def close(self):
+        """HTTPセッション終了"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def get_prompt_set(self) -> CompiledPrompts:
+        """現行バージョンの構築済みプロンプト取得（1リクエスト内で同じ版を使うために呼び出し側で保持する）"""
+        with track_stage('ai.prompt_build'):
+            return await self._current_prompts()
+    
+    async def get_prompt_info(self) -> Dict:
+        """現行バージョン情報取得"""
+        await self._current_prompts()
+        return self.prompt_registry.get_info()
+    
+    async def _current_prompts(self, prompt_set: Optional[CompiledPrompts] = None) -> CompiledPrompts:
+        """プロンプト取得（更新確認のstat・再読み込みが必要な場合のみスレッドプールで実行）"""
+        if prompt_set is not None:
+            return prompt_set
+        if self.prompt_registry.check_due():
+            return await asyncio.to_thread(self.prompt_registry.current)
+        return self.prompt_registry.current()
+    
+    async def _evaluation_cache_call(self, func, *args):
+        """評価キャッシュの操作（ディスク層のsqlite読み書きはスレッドプールで実行）"""
+        if self.evaluation_cache.has_disk_tier:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+    
+    async def get_competency_evaluation(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None) -> str:
+        """コンピテンシー評価実行"""
+        try:
+            return await self.evaluate_competency(user_message, prompt_set)
+            
+        except Exception as e:
+            logger.error(f"Competency evaluation error: {str(e)}")
+            return COMPETENCY_ERROR_RESPONSE
+    
+    async def evaluate_competency(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None) -> str:
+        """コンピテンシー評価実行（失敗時は例外を送出）"""
+        prompt_set = await self._current_prompts(prompt_set)
+        cached = await self._get_cached_evaluation(user_message, prompt_set.version)
+        if cached is not None:
+            return cached
+        
+        response = await self._single_flight(
+            self.competency_flights,
+            make_flight_key(prompt_set.version, 'competency', user_message),
+            lambda: self._request_competency_evaluation(user_message, prompt_set)
+        )
+        
+        await self._cache_evaluation(user_message, prompt_set.version, response)
+        
+        logger.info(f"Competency evaluation completed for message length: {len(user_message)}")
+        return response
+    
+    async def _get_cached_evaluation(self, user_message: str, prompt_version: str) -> Optional[str]:
+        """キャッシュ済み評価結果取得"""
+        if not self.evaluation_cache:
+            return None
+        
+        with track_stage('ai.cache_lookup'):
+            cached = await self._evaluation_cache_call(self.evaluation_cache.get, user_message, prompt_version)
+        if cached is not None:
+            logger.info(f"Competency evaluation cache hit for message length: {len(user_message)}")
+        return cached
+    
+    async def _cache_evaluation(self, user_message: str, prompt_version: str, response: str):
+        """評価結果をキャッシュに登録（エラー応答は登録しない）"""
+        if self.evaluation_cache and response:
+            await self._evaluation_cache_call(self.evaluation_cache.set, user_message, prompt_version, response)
+    
+    async def get_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                                   history: Optional[List[Dict]] = None) -> str:
+        """一般チャット応答（historyは同一チャットの会話履歴、Chat Completions形式）"""
+        try:
+            return await self.generate_general_response(user_message, prompt_set, history)
+            
+        except Exception as e:
+            logger.error(f"General response error: {str(e)}")
+            return GENERAL_ERROR_RESPONSE
+    
+    async def generate_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                                        history: Optional[List[Dict]] = None) -> str:
+        """一般チャット応答（失敗時は例外を送出）"""
+        prompt_set = await self._current_prompts(prompt_set)
+        response = await self._single_flight(
+            self.general_flights,
+            make_flight_key(prompt_set.version, 'general', user_message, history),
+            lambda: self._request_general_response(user_message, prompt_set, history)
+        )
+        
+        logger.info(f"General response completed for message length: {len(user_message)}")
+        return response
+    
+    async def _request_competency_evaluation(self, user_message: str, prompt_set: CompiledPrompts) -> str:
+        """コンピテンシー評価の上流呼び出し"""
+        if self.mock_ai:
+            return await self._mock_completion(MODE_COMPETENCY, user_message)
+        
+        request = self._competency_request(user_message, prompt_set)
+        response = await self._call_azure_openai(request)
+        if not request.structured:
+            return response
+        
+        rendered = self._render_structured_evaluation(response)
+        if rendered is None:
+            rendered = self._render_structured_evaluation(await self._call_azure_openai(self._structured_retry(request)))
+        return self._structured_result(rendered)
+    
+    async def _request_general_response(self, user_message: str, prompt_set: CompiledPrompts,
+                                        history: Optional[List[Dict]] = None) -> str:
+        """一般チャット応答の上流呼び出し"""
+        if self.mock_ai:
+            return await self._mock_completion(MODE_GENERAL, user_message)
+        
+        return await self._call_azure_openai(self._general_request(user_message, prompt_set, history))
+    
+    async def stream_competency_evaluation(self, user_message: str,
+                                           prompt_set: Optional[CompiledPrompts] = None) -> AsyncIterator[str]:
+        """コンピテンシー評価（ストリーミング）"""
+        try:
+            prompt_set = await self._current_prompts(prompt_set)
+            cached = await self._get_cached_evaluation(user_message, prompt_set.version)
+            if cached is not None:
+                yield cached
+                return
+            
+            if self.mock_ai:
+                deltas = self._stream_mock_text(self._mock_text(MODE_COMPETENCY, user_message))
+            elif prompt_set.output_format == OUTPUT_FORMAT_JSON:
+                # JSON出力モードは検証・整形後のテキストを1チャンクで返す（生成途中のJSONは表示できないため）
+                deltas = self._stream_text(await self._request_competency_evaluation(user_message, prompt_set))
+            else:
+                deltas = self._call_azure_openai_stream(self._competency_request(user_message, prompt_set))
+            
+            chunks = []
+            async for delta in self._track_stream(deltas):
+                chunks.append(delta)
+                yield delta
+            
+            await self._cache_evaluation(user_message, prompt_set.version, ''.join(chunks))
+            
+            logger.info(f"Competency evaluation stream completed for message length: {len(user_message)}")
+            
+        except Exception as e:
+            logger.error(f"Competency evaluation stream error: {str(e)}")
+            yield COMPETENCY_ERROR_RESPONSE
+    
+    async def stream_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                                      history: Optional[List[Dict]] = None) -> AsyncIterator[str]:
+        """一般チャット応答（ストリーミング）"""
+        try:
+            async for delta in self.iter_general_response(user_message, prompt_set, history):
+                yield delta
+            
+        except Exception as e:
+            logger.error(f"General response stream error: {str(e)}")
+            yield GENERAL_ERROR_RESPONSE
+    
+    async def iter_general_response(self, user_message: str, prompt_set: Optional[CompiledPrompts] = None,
+                                    history: Optional[List[Dict]] = None) -> AsyncIterator[str]:
+        """一般チャット応答（ストリーミング、失敗時は例外を送出）"""
+        if self.mock_ai:
+            deltas = self._stream_mock_text(self._mock_text(MODE_GENERAL, user_message))
+        else:
+            prompt_set = await self._current_prompts(prompt_set)
+            deltas = self._call_azure_openai_stream(self._general_request(user_message, prompt_set, history))
+        
+        async for delta in self._track_stream(deltas):
+            yield delta
+        
+        logger.info(f"General response stream completed for message length: {len(user_message)}")
+    
+    async def _track_stream(self, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        """ストリーミング応答の最初のチャンクまでの時間と全体の時間を記録"""
+        started = time.perf_counter()
+        first = True
+        with track_stage('ai.stream'):
+            async for delta in deltas:
+                if first:
+                    observe_stage('ai.stream_first_token', time.perf_counter() - started)
+                    first = False
+                yield delta
+    
+    async def _stream_text(self, text: str) -> AsyncIterator[str]:
+        """生成済みのテキストを1チャンクで出力"""
+        yield text
+    
+    async def _mock_completion(self, mode: str, user_message: str) -> str:
+        """モック応答（遅延分布に従って待機してから全文を返す）"""
+        with track_stage('ai.completion'):
+            await asyncio.sleep(self.mock_latency.sample())
+            return self._mock_text(mode, user_message)
+    
+    async def _stream_mock_text(self, text: str) -> AsyncIterator[str]:
+        """モック応答をチャンクごとに逐次出力"""
+        chunks = self._mock_chunks(text)
+        
+        # 遅延分布から生成した応答全体の遅延を各チャンクに配分
+        delay = self.mock_latency.sample() / max(len(chunks), 1)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+    
+    async def _single_flight(self, flights: Optional[AsyncSingleFlight], key: str, func):
+        """同じキーの呼び出しが実行中であればその結果を共有（無効時はそのまま実行）"""
+        if flights is None:
+            return await func()
+        return await flights.do(key, func)
+    
+    async def _acreate(self, **kwargs):
+        """ChatCompletion.acreate（openai 0.28はコンテキスト変数のセッションを使用し、未設定時はリクエスト毎に生成する）"""
+        import openai
+        
+        session_token = openai.aiosession.set(self._session) if self._session else None
+        try:
+            return await openai.ChatCompletion.acreate(**kwargs)
+        finally:
+            if session_token is not None:
+                openai.aiosession.reset(session_token)
+            
+    async def _call_azure_openai(self, request: CompletionRequest) -> str:
+        """Azure OpenAI API非同期呼び出し"""
+        try:
+            tier = request.tier
+            
+            async def create(target):
+                with track_stage('ai.completion'):
+                    return await self._acreate(**self._completion_kwargs(request, target))
+            
+            started = time.perf_counter()
+            try:
+                response = await tier.router.call_async(
+                    lambda target: target.governor.call_async(lambda: create(target), request.tokens, tier.priority,
+                                                              usage=_response_tokens)
+                )
+            except Exception:
+                tier.record(None)
+                raise
+            tier.record(time.perf_counter() - started)
+            
+            return _response_text(response)
+            
+        except Exception as e:
+            logger.error(f"Azure OpenAI API error: {str(e)}")
+            raise
+
+    async def _call_azure_openai_stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        """Azure OpenAI API非同期呼び出し（ストリーミング、usageが返らないため推定トークン数で計上）"""
+        tier = request.tier
+        try:
+            # ストリーミングは応答開始までを送信先の応答時間、応答完了までを階層の応答時間として記録する（ヘッジ送信はしない）
+            started = time.perf_counter()
+            response = await tier.router.call_async(
+                lambda target: target.governor.call_async(
+                    lambda: self._acreate(**self._completion_kwargs(request, target, stream=True)),
+                    request.tokens,
+                    tier.priority
+                ),
+                hedge=False
+            )
+            
+            async for chunk in response:
+                content = _stream_delta(chunk)
+                if content:
+                    yield content
+            
+            tier.record(time.perf_counter() - started)
+            
+        except Exception as e:
+            logger.error(f"Azure OpenAI streaming API error: {str(e)}")
+            tier.record(None)
+            raise
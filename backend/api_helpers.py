@@ -0,0 +1,154 @@
+"""
+APIヘルパーモジュール
+Flask版（app.py）とASGI版（asgi_app.py）で共有するリクエスト・レスポンス処理
+"""
+import csv
+import json
+import zlib
+from datetime import datetime, timezone
+from io import StringIO
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+def build_message_data(chat_id: str, user_data: Dict, message: str, ai_response: str,
+                       is_competency: bool, user_agent: Optional[str], ip_address: Optional[str],
+                       prompt_version: Optional[str] = None) -> Dict:
+    """保存用チャットメッセージデータ構築"""
+    return {
+        'chat_id': chat_id,
+        'user_id': user_data['id'],
+        'user_message': message,
+        'ai_response': ai_response,
+        'is_competency_evaluation': is_competency,
+        'prompt_version': prompt_version,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'session_info': {
+            'user_agent': user_agent,
+            'ip_address': ip_address
+        }
+    }
+
+def format_sse(event: str, data: Dict) -> str:
+    """Server-Sent Eventsフレーム生成"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def parse_bulk_items(data: Dict, max_items: int, max_length: int) -> List[Dict]:
+    """一括評価の対象一覧の解析（不正な形式はValueError）"""
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError('items is required')
+    if len(items) > max_items:
+        raise ValueError(f'Too many items (max {max_items})')
+    
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'items[{index}] must be an object')
+        
+        user_id = item.get('user_id')
+        message = (item.get('message') or '').strip()
+        if not user_id or not message:
+            raise ValueError(f'items[{index}] requires user_id and message')
+        if len(message) > max_length:
+            raise ValueError(f'items[{index}] message is too long')
+        
+        parsed.append({'user_id': str(user_id), 'message': message, 'chat_id': item.get('chat_id')})
+    return parsed
+
+def parse_export_dates(data: Dict) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """エクスポート期間の解析（不正な形式はValueError）"""
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    
+    if start_date:
+        start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+    if end_date:
+        end_date = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+    
+    return start_date, end_date
+
+CSV_HEADER = [
+    '日時',
+    '学生ID', 
+    'ChatID',
+    '入力内容',
+    'AI評価結果'
+]
+
+CSV_FIELDS = ['timestamp', 'user_id', 'chat_id', 'user_message', 'ai_response']
+
+def csv_row(record: Dict) -> List:
+    """CSV1行分のデータ"""
+    return [record.get(field, '') for field in CSV_FIELDS]
+
+def generate_csv(data: List[Dict]) -> str:
+    """CSV形式のデータ生成"""
+    output = StringIO()
+    writer = csv.writer(output)
+    
+    # ヘッダー
+    writer.writerow(CSV_HEADER)
+    
+    # データ
+    for record in data:
+        writer.writerow(csv_row(record))
+    
+    return output.getvalue()
+
+def _csv_buffer(bom: bool):
+    """ヘッダーを書き込んだCSVの出力先とwriter"""
+    output = StringIO()
+    writer = csv.writer(output)
+    
+    if bom:
+        output.write('\ufeff')  # Excelで文字化けしないようBOMを付与
+    writer.writerow(CSV_HEADER)
+    return output, writer
+    
+def _take_chunk(output: StringIO) -> str:
+    """出力済みの内容を取り出してバッファを空にする"""
+    chunk = output.getvalue()
+    output.seek(0)
+    output.truncate()
+    return chunk
+
+def iter_csv(records: Iterable[Dict], bom: bool = False, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """CSVを一定サイズのチャンクで逐次生成（全件をメモリに保持しない）"""
+    output, writer = _csv_buffer(bom)
+    for record in records:
+        writer.writerow(csv_row(record))
+        if output.tell() >= chunk_size:
+            yield _take_chunk(output)
+    
+    yield output.getvalue()
+
+async def iter_csv_async(records: AsyncIterable[Dict], bom: bool = False,
+                         chunk_size: int = 64 * 1024) -> AsyncIterator[str]:
+    """CSVを一定サイズのチャンクで逐次生成（asyncio版）"""
+    output, writer = _csv_buffer(bom)
+    async for record in records:
+        writer.writerow(csv_row(record))
+        if output.tell() >= chunk_size:
+            yield _take_chunk(output)
+    
+    yield output.getvalue()
+
+def _gzip_compressor():
+    return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip形式
+
+def gzip_stream(chunks: Iterable[str]) -> Iterator[bytes]:
+    """文字列チャンクをgzip圧縮しながら逐次出力"""
+    compressor = _gzip_compressor()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+async def gzip_stream_async(chunks: AsyncIterable[str]) -> AsyncIterator[bytes]:
+    """文字列チャンクをgzip圧縮しながら逐次出力（asyncio版）"""
+    compressor = _gzip_compressor()
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -2,7 +2,7 @@
 立命館大学AIアドバイジングシステム - バックエンドAPI
 Updated: 2024-08-14 - New competency evaluation format
 """
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, stream_with_context
 from flask_cors import CORS
 import json
 import logging
@@ -11,14 +11,20 @@ import uuid
 import os
 from typing import Dict, List, Optional
 import time
-import csv
-from io import StringIO
 
 # 設定
 from config import Config
 from auth import AuthManager
 from database import DatabaseManager
-from ai_service import AIService
+from ai_service import GENERAL_ERROR_RESPONSE, AIService
+from conversation_context import ConversationContextStore
+from bulk_evaluation import BulkEvaluationManager
+from cohort_analytics import CohortAnalytics, CohortFilter
+from evaluation_query import EvaluationQuery
+from metrics import begin_request, end_request, get_health_summary, render_metrics
+from api_helpers import (
+    build_message_data, format_sse, generate_csv, gzip_stream, iter_csv, parse_bulk_items, parse_export_dates
+)
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -33,24 +39,87 @@ auth_manager = AuthManager()
 db_manager = DatabaseManager()
 ai_service = AIService()
 
+# 会話コンテキスト（一般チャットの直近のやり取り）
+conversation_store = ConversationContextStore(
+    max_chats=Config.CONVERSATION_MAX_CHATS,
+    max_turns=Config.CONVERSATION_MAX_TURNS,
+    token_budget=Config.CONVERSATION_TOKEN_BUDGET,
+    summary_tokens=Config.CONVERSATION_SUMMARY_TOKENS,
+    idle_ttl=Config.CONVERSATION_IDLE_TTL
+) if Config.CONVERSATION_ENABLED else None
+
+# 教員向け一括評価（全ジョブでワーカープールを共有）
+bulk_evaluations = BulkEvaluationManager(
+    db_manager.save_chat_messages,
+    max_workers=Config.BULK_EVALUATION_WORKERS,
+    save_batch_size=Config.BULK_EVALUATION_SAVE_BATCH_SIZE,
+    max_running_jobs=Config.BULK_EVALUATION_MAX_RUNNING_JOBS,
+    job_ttl=Config.BULK_EVALUATION_JOB_TTL
+)
+
+# コホート分析（集計結果は評価の保存時に破棄）
+cohort_analytics = CohortAnalytics(
+    db_manager.get_competency_score_records,
+    ttl=Config.ANALYTICS_CACHE_TTL,
+    max_entries=Config.ANALYTICS_CACHE_MAX_ENTRIES
+)
+db_manager.add_write_listener(cohort_analytics.invalidate)
+
+def get_conversation_history(user_id: str, chat_id: str, is_new_chat: bool) -> Optional[List[Dict]]:
+    """一般チャットの会話履歴取得（新規チャットはDBを参照しない）"""
+    if not conversation_store:
+        return None
+    
+    loader = None
+    if not is_new_chat:
+        loader = lambda uid, cid: db_manager.get_chat_turns(uid, cid, Config.CONVERSATION_MAX_TURNS)
+    return conversation_store.get_messages(user_id, chat_id, loader)
+
+@app.before_request
+def start_request_metrics():
+    """処理中リクエスト数の加算（/metrics自体は計測しない）"""
+    if request.endpoint != 'metrics':
+        g.metrics_started = begin_request(request.endpoint or 'unmatched')
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    """処理中リクエスト数の減算・所要時間の記録（ストリーミング応答は送信完了時）"""
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        status = 500 if error else g.get('metrics_status', 500)
+        end_request(request.endpoint or 'unmatched', request.method, status, started)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """ヘルスチェック"""
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now(timezone.utc).isoformat(),
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'prompt_version': ai_service.get_prompt_set().version,
+        'persistence': db_manager.get_persistence_metrics(),
+        'metrics': get_health_summary()
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus形式のメトリクス"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/auth/login', methods=['POST'])
 def login():
-    """EntraID認証（モックアップ版）"""
+    """EntraID認証"""
     try:
         data = request.get_json()
         
-        # 実際の実装ではEntraID認証を行う
-        # モックアップでは簡単な認証シミュレーション
-        user_data = auth_manager.authenticate_mock(data.get('email'), data.get('password'))
+        # id_token（ローカル署名検証）/ access_token（Graph）によるEntraID認証
+        # どちらも無い場合はモック認証
+        user_data = auth_manager.authenticate_login(data)
         
         if user_data:
             token = auth_manager.generate_token(user_data)
@@ -89,15 +158,12 @@ def verify_token():
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/chat/send', methods=['POST'])
+@auth_manager.require_auth()
 def send_message():
     """チャットメッセージ送信"""
     try:
-        # 認証確認
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        user_data = auth_manager.verify_token(token)
-        if not user_data:
-            return jsonify({'error': 'Unauthorized'}), 401
-            
+        user_data = g.user
+        
         data = request.get_json()
         message = data.get('message', '').strip()
         is_competency = data.get('is_competency_evaluation', False)
@@ -107,28 +173,31 @@ def send_message():
             return jsonify({'error': 'Message is required'}), 400
             
         # チャットIDが無い場合は新規作成
-        if not chat_id:
+        is_new_chat = not chat_id
+        if is_new_chat:
             chat_id = str(uuid.uuid4())
             
-        # AIサービスを呼び出し
+        # AIサービスを呼び出し（1リクエスト内は同じプロンプトバージョンを使用）
+        prompt_set = ai_service.get_prompt_set()
         if is_competency:
-            ai_response = ai_service.get_competency_evaluation(message)
+            ai_response = ai_service.get_competency_evaluation(message, prompt_set)
         else:
-            ai_response = ai_service.get_general_response(message)
+            history = get_conversation_history(user_data['id'], chat_id, is_new_chat)
+            try:
+                ai_response = ai_service.generate_general_response(message, prompt_set, history)
+            except Exception as e:
+                # エラー応答は会話履歴に追加しない（以降の応答で文脈として送らないため）
+                logger.error(f"General response error: {str(e)}")
+                ai_response = GENERAL_ERROR_RESPONSE
+            else:
+                if conversation_store:
+                    conversation_store.append_turn(user_data['id'], chat_id, message, ai_response)
             
         # データベースに保存
-        message_data = {
-            'chat_id': chat_id,
-            'user_id': user_data['id'],
-            'user_message': message,
-            'ai_response': ai_response,
-            'is_competency_evaluation': is_competency,
-            'timestamp': datetime.now(timezone.utc).isoformat(),
-            'session_info': {
-                'user_agent': request.headers.get('User-Agent'),
-                'ip_address': request.remote_addr
-            }
-        }
+        message_data = build_message_data(
+            chat_id, user_data, message, ai_response, is_competency,
+            request.headers.get('User-Agent'), request.remote_addr, prompt_set.version
+        )
         
         db_manager.save_chat_message(message_data)
         
@@ -136,6 +205,7 @@ def send_message():
             'success': True,
             'chat_id': chat_id,
             'message': ai_response,
+            'prompt_version': prompt_set.version,
             'timestamp': message_data['timestamp']
         })
         
@@ -143,27 +213,113 @@ def send_message():
         logger.error(f"Chat send error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+@auth_manager.require_auth()
+def stream_message():
+    """チャットメッセージ送信（Server-Sent Eventsによる逐次応答）"""
+    try:
+        user_data = g.user
+        
+        data = request.get_json()
+        message = data.get('message', '').strip()
+        is_competency = data.get('is_competency_evaluation', False)
+        chat_id = data.get('chat_id')
+        
+        if not message:
+            return jsonify({'error': 'Message is required'}), 400
+            
+        # チャットIDが無い場合は新規作成
+        is_new_chat = not chat_id
+        if is_new_chat:
+            chat_id = str(uuid.uuid4())
+            
+        user_agent = request.headers.get('User-Agent')
+        ip_address = request.remote_addr
+        
+        prompt_set = ai_service.get_prompt_set()
+        if is_competency:
+            deltas = ai_service.stream_competency_evaluation(message, prompt_set)
+        else:
+            history = get_conversation_history(user_data['id'], chat_id, is_new_chat)
+            deltas = ai_service.iter_general_response(message, prompt_set, history)
+        
+        def generate():
+            yield format_sse('start', {'chat_id': chat_id, 'prompt_version': prompt_set.version})
+            
+            chunks = []
+            succeeded = True
+            try:
+                for delta in deltas:
+                    chunks.append(delta)
+                    yield format_sse('delta', {'content': delta})
+            except Exception as e:
+                # 一般チャットの応答失敗（評価はサービス側でエラー応答に置き換える）
+                logger.error(f"General response stream error: {str(e)}")
+                succeeded = False
+                chunks.append(GENERAL_ERROR_RESPONSE)
+                yield format_sse('delta', {'content': GENERAL_ERROR_RESPONSE})
+            
+            # ストリーム完了後に全文をデータベースに保存
+            ai_response = ''.join(chunks)
+            message_data = build_message_data(
+                chat_id, user_data, message, ai_response, is_competency,
+                user_agent, ip_address, prompt_set.version
+            )
+            db_manager.save_chat_message(message_data)
+            if conversation_store and not is_competency and succeeded:
+                conversation_store.append_turn(user_data['id'], chat_id, message, ai_response)
+            
+            yield format_sse('done', {
+                'success': True,
+                'chat_id': chat_id,
+                'prompt_version': prompt_set.version,
+                'timestamp': message_data['timestamp']
+            })
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # リバースプロキシでのバッファリングを無効化
+            }
+        )
+        
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/chat/history/<user_id>', methods=['GET'])
+@auth_manager.require_auth(user_id_param='user_id')
 def get_chat_history(user_id):
     """チャット履歴取得"""
     try:
-        # 認証確認
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        user_data = auth_manager.verify_token(token)
-        if not user_data or user_data['id'] != user_id:
-            return jsonify({'error': 'Unauthorized'}), 401
-            
         # クエリパラメータ
         limit = min(int(request.args.get('limit', 50)), 100)
-        offset = int(request.args.get('offset', 0))
         
-        # 履歴取得
-        history = db_manager.get_chat_history(user_id, limit, offset)
+        # 従来のoffset指定（後方互換）
+        if 'offset' in request.args:
+            offset = int(request.args.get('offset', 0))
+            history = db_manager.get_chat_history(user_id, limit, offset)
+            
+            return jsonify({
+                'success': True,
+                'history': history,
+                'count': len(history)
+            })
+        
+        # カーソル指定（前回レスポンスのnext_cursorをそのまま渡す）
+        try:
+            page = db_manager.get_chat_history_page(user_id, limit, request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
         
         return jsonify({
             'success': True,
-            'history': history,
-            'count': len(history)
+            'history': page['items'],
+            'count': len(page['items']),
+            'next_cursor': page['next_cursor'],
+            'has_more': page['next_cursor'] is not None
         })
         
     except Exception as e:
@@ -171,28 +327,22 @@ def get_chat_history(user_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/export', methods=['POST'])
+@auth_manager.require_auth(role='faculty')
 def export_competency_data():
     """教員向けコンピテンシー評価データCSV出力"""
     try:
-        # 認証確認（教員権限）
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        user_data = auth_manager.verify_token(token)
-        if not user_data or user_data.get('role') != 'faculty':
-            return jsonify({'error': 'Unauthorized - Faculty access required'}), 401
-            
         data = request.get_json()
-        start_date = data.get('start_date')
-        end_date = data.get('end_date')
         
         # 日付検証
         try:
-            if start_date:
-                start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-            if end_date:
-                end_date = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+            start_date, end_date = parse_export_dates(data)
         except ValueError:
             return jsonify({'error': 'Invalid date format'}), 400
             
+        # ストリーミングモード: 全件を保持せずページ単位で取得しながらCSVを返す
+        if data.get('stream'):
+            return stream_competency_csv(start_date, end_date, data.get('gzip', False), data.get('bom', False))
+            
         # コンピテンシー評価データ取得
         competency_data = db_manager.get_competency_evaluations(start_date, end_date)
         
@@ -210,42 +360,194 @@ def export_competency_data():
         logger.error(f"Export error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-def generate_csv(data: List[Dict]) -> str:
-    """CSV形式のデータ生成"""
-    output = StringIO()
-    writer = csv.writer(output)
+def stream_competency_csv(start_date: Optional[datetime], end_date: Optional[datetime],
+                          use_gzip: bool, bom: bool) -> Response:
+    """コンピテンシー評価データのチャンク形式CSVレスポンス"""
+    records = db_manager.iter_competency_evaluations(start_date, end_date, Config.EXPORT_PAGE_SIZE)
+    chunks = iter_csv(records, bom=bom)
     
-    # ヘッダー
-    writer.writerow([
-        '日時',
-        '学生ID', 
-        'ChatID',
-        '入力内容',
-        'AI評価結果'
-    ])
+    filename = f"competency_evaluation_{datetime.now(timezone.utc).strftime('%Y%m%d')}.csv"
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    }
+    if use_gzip:
+        chunks = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
     
-    # データ
-    for record in data:
-        writer.writerow([
-            record.get('timestamp', ''),
-            record.get('user_id', ''),
-            record.get('chat_id', ''),
-            record.get('user_message', ''),
-            record.get('ai_response', '')
-        ])
+    return Response(
+        stream_with_context(chunks),
+        content_type='text/csv; charset=utf-8',
+        headers=headers
+    )
+
+@app.route('/api/admin/evaluations/bulk', methods=['POST'])
+@auth_manager.require_auth(role='faculty')
+def start_bulk_evaluation():
+    """教員向け一括コンピテンシー評価（Server-Sent Eventsで完了順に結果を配信）
     
-    return output.getvalue()
+    評価は接続が切れても継続する。進捗は GET、中止は DELETE /api/admin/evaluations/bulk/{job_id}
+    """
+    try:
+        user_data = g.user
+        data = request.get_json() or {}
+        
+        try:
+            items = parse_bulk_items(data, Config.BULK_EVALUATION_MAX_ITEMS, Config.MAX_MESSAGE_LENGTH)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+            
+        # ジョブ内は同じプロンプトバージョンで評価する
+        prompt_set = ai_service.get_prompt_set()
+        user_agent = request.headers.get('User-Agent')
+        ip_address = request.remote_addr
+        
+        def build_record(job, item, response):
+            message_data = build_message_data(
+                item['chat_id'] or str(uuid.uuid4()), {'id': item['user_id']}, item['message'], response,
+                True, user_agent, ip_address, prompt_set.version
+            )
+            message_data['session_info']['bulk_job_id'] = job.job_id
+            message_data['session_info']['requested_by'] = job.requested_by
+            return message_data
+        
+        try:
+            job = bulk_evaluations.start(
+                items,
+                lambda message: ai_service.evaluate_competency(message, prompt_set),
+                build_record,
+                user_data['id'],
+                prompt_set.version
+            )
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 429
+            
+        def generate():
+            for event, payload in job.iter_events():
+                yield format_sse(event, payload)
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+                'X-Bulk-Job-Id': job.job_id
+            }
+        )
+        
+    except Exception as e:
+        logger.error(f"Bulk evaluation error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/evaluations/bulk/<job_id>', methods=['GET', 'DELETE'])
+@auth_manager.require_auth(role='faculty')
+def manage_bulk_evaluation(job_id):
+    """一括評価の進捗取得（GET）・中止（DELETE）"""
+    try:
+        if request.method == 'DELETE':
+            job = bulk_evaluations.cancel(job_id)
+        else:
+            job = bulk_evaluations.get_job(job_id)
+            
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+            
+        return jsonify({
+            'success': True,
+            'job': job.progress()
+        })
+        
+    except Exception as e:
+        logger.error(f"Bulk evaluation status error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/competencies/stats', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+def get_competency_stats():
+    """教員向けコンピテンシー別の平均点・点数分布（保存時に構造化した評価結果から集計）"""
+    try:
+        # 日付検証
+        try:
+            start_date, end_date = parse_export_dates(request.args)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        prompt_version = request.args.get('prompt_version') or None
+        competencies = db_manager.get_competency_score_summary(start_date, end_date, prompt_version)
+        
+        return jsonify({
+            'success': True,
+            'competencies': competencies,
+            'start_date': start_date.isoformat() if start_date else None,
+            'end_date': end_date.isoformat() if end_date else None,
+            'prompt_version': prompt_version
+        })
+        
+    except Exception as e:
+        logger.error(f"Competency stats error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/evaluations', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+def list_competency_evaluations():
+    """教員向けコンピテンシー評価一覧（学生ID・コンピテンシー・本文の部分一致で絞り込み、並べ替え・カーソルでページング）"""
+    try:
+        # 日付・絞り込み条件の検証
+        try:
+            start_date, end_date = parse_export_dates(request.args)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        # 前回レスポンスのnext_cursorをそのまま渡す（並べ替え条件を変えた場合は先頭から取得し直す）
+        try:
+            query = EvaluationQuery.from_dict(request.args, start_date, end_date)
+            page = db_manager.get_competency_evaluation_page(query)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'evaluations': page['items'],
+            'count': len(page['items']),
+            'next_cursor': page['next_cursor'],
+            'has_more': page['next_cursor'] is not None
+        })
+        
+    except Exception as e:
+        logger.error(f"Competency evaluation list error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/analytics/cohort', methods=['POST'])
+@auth_manager.require_auth(role='faculty')
+def get_cohort_analytics():
+    """教員向けコホート分析（コンピテンシー別・セクション別の点数分布、週ごとの推移、学生ごとの傾向と順位）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        # 日付・絞り込み条件の検証
+        try:
+            start_date, end_date = parse_export_dates(data)
+            cohort_filter = CohortFilter.from_dict(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        report = cohort_analytics.get_report(start_date, end_date, cohort_filter)
+        
+        return jsonify({
+            'success': True,
+            'analytics': report
+        })
+        
+    except Exception as e:
+        logger.error(f"Cohort analytics error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/stats', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
 def get_admin_stats():
     """管理画面用統計データ"""
     try:
-        # 認証確認（教員権限）
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        user_data = auth_manager.verify_token(token)
-        if not user_data or user_data.get('role') != 'faculty':
-            return jsonify({'error': 'Unauthorized - Faculty access required'}), 401
-            
         stats = db_manager.get_usage_statistics()
         
         return jsonify({
@@ -257,6 +559,40 @@ def get_admin_stats():
         logger.error(f"Stats error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/admin/cache', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+def get_cache_stats():
+    """管理画面用キャッシュ統計"""
+    try:
+        return jsonify({
+            'success': True,
+            'evaluation_cache': ai_service.get_cache_stats(),
+            'single_flight': ai_service.get_single_flight_stats(),
+            'deployments': ai_service.get_deployment_stats(),
+            'model_tiers': ai_service.get_model_tier_stats(),
+            'cohort_analytics': cohort_analytics.get_stats(),
+            'token_cache': auth_manager.get_token_cache_stats(),
+            'conversation_context': conversation_store.get_stats() if conversation_store else None
+        })
+        
+    except Exception as e:
+        logger.error(f"Cache stats error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/prompts', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+def get_prompt_info():
+    """管理画面用プロンプトバージョン情報"""
+    try:
+        return jsonify({
+            'success': True,
+            'prompts': ai_service.prompt_registry.get_info()
+        })
+        
+    except Exception as e:
+        logger.error(f"Prompt info error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
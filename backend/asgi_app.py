@@ -0,0 +1,530 @@
+"""
+立命館大学AIアドバイジングシステム - バックエンドAPI（ASGI版）
+Quart + asyncio によるノンブロッキング実装。AI呼び出しやDBアクセスの待機中も
+ワーカーを占有しないため、1プロセスで多数の評価リクエストを同時に処理できる。
+
+起動例:
+    hypercorn asgi_app:app --bind 0.0.0.0:5000
+
+教員向け一括評価（/api/admin/evaluations/bulk）はスレッドプールでジョブを実行するためFlask版のみ提供する。
+"""
+from quart import Quart, Response, request, jsonify, g
+from quart_cors import cors
+import asyncio
+import logging
+from datetime import datetime, timezone
+import uuid
+from typing import Dict, List, Optional
+
+# 設定
+from config import Config
+from auth import AuthManager
+from database import AsyncDatabaseManager
+from ai_service import GENERAL_ERROR_RESPONSE, AsyncAIService
+from cohort_analytics import CohortAnalytics, CohortFilter
+from conversation_context import ConversationContextStore
+from evaluation_query import EvaluationQuery
+from metrics import begin_request, end_request, get_health_summary, render_metrics
+from api_helpers import (
+    build_message_data, format_sse, generate_csv, gzip_stream_async, iter_csv_async, parse_export_dates
+)
+
+app = Quart(__name__)
+app.config.from_object(Config)
+app = cors(app, allow_origin=["http://localhost:3000", "http://localhost:8000"])
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# サービス初期化
+auth_manager = AuthManager()
+db_manager = AsyncDatabaseManager()
+ai_service = AsyncAIService()
+
+# 会話コンテキスト（一般チャットの直近のやり取り）
+conversation_store = ConversationContextStore(
+    max_chats=Config.CONVERSATION_MAX_CHATS,
+    max_turns=Config.CONVERSATION_MAX_TURNS,
+    token_budget=Config.CONVERSATION_TOKEN_BUDGET,
+    summary_tokens=Config.CONVERSATION_SUMMARY_TOKENS,
+    idle_ttl=Config.CONVERSATION_IDLE_TTL
+) if Config.CONVERSATION_ENABLED else None
+
+# コホート分析（集計結果は評価の保存時に破棄）
+cohort_analytics = CohortAnalytics(
+    db_manager.get_competency_score_records,
+    ttl=Config.ANALYTICS_CACHE_TTL,
+    max_entries=Config.ANALYTICS_CACHE_MAX_ENTRIES
+)
+db_manager.add_write_listener(cohort_analytics.invalidate)
+
+async def get_conversation_history(user_id: str, chat_id: str, is_new_chat: bool) -> Optional[List[Dict]]:
+    """一般チャットの会話履歴取得（新規チャットはDBを参照しない）"""
+    if not conversation_store:
+        return None
+    
+    loader = None
+    if not is_new_chat:
+        loader = lambda uid, cid: db_manager.get_chat_turns(uid, cid, Config.CONVERSATION_MAX_TURNS)
+    return await conversation_store.get_messages_async(user_id, chat_id, loader)
+
+@app.before_serving
+async def startup():
+    """非同期クライアント初期化"""
+    await db_manager.initialize()
+    await ai_service.initialize()
+
+@app.after_serving
+async def shutdown():
+    """非同期クライアント終了"""
+    await ai_service.close()
+    await db_manager.close()
+
+@app.before_request
+async def start_request_metrics():
+    """処理中リクエスト数の加算（/metrics自体は計測しない）"""
+    if request.endpoint != 'metrics':
+        g.metrics_started = begin_request(request.endpoint or 'unmatched')
+
+@app.after_request
+async def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+async def finish_request_metrics(error=None):
+    """処理中リクエスト数の減算・所要時間の記録"""
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        status = 500 if error else g.get('metrics_status', 500)
+        end_request(request.endpoint or 'unmatched', request.method, status, started)
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """ヘルスチェック"""
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'version': '1.0.0',
+        'mode': 'asgi',
+        'prompt_version': (await ai_service.get_prompt_set()).version,
+        'persistence': db_manager.get_persistence_metrics(),
+        'metrics': get_health_summary()
+    })
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus形式のメトリクス"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/auth/login', methods=['POST'])
+async def login():
+    """EntraID認証"""
+    try:
+        data = await request.get_json()
+        
+        # JWKS・Graphの取得はブロッキングI/Oのためスレッドプールで実行
+        loop = asyncio.get_running_loop()
+        user_data = await loop.run_in_executor(None, auth_manager.authenticate_login, data)
+        
+        if user_data:
+            token = auth_manager.generate_token(user_data)
+            return jsonify({
+                'success': True,
+                'user': user_data,
+                'token': token
+            })
+        else:
+            return jsonify({
+                'success': False,
+                'message': '認証に失敗しました'
+            }), 401
+    
+    except Exception as e:
+        logger.error(f"Login error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/auth/verify', methods=['POST'])
+async def verify_token():
+    """トークン検証"""
+    try:
+        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        user_data = auth_manager.verify_token(token)
+        
+        if user_data:
+            return jsonify({
+                'valid': True,
+                'user': user_data
+            })
+        else:
+            return jsonify({'valid': False}), 401
+    
+    except Exception as e:
+        logger.error(f"Token verification error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/chat/send', methods=['POST'])
+@auth_manager.require_auth()
+async def send_message():
+    """チャットメッセージ送信"""
+    try:
+        user_data = g.user
+        
+        data = await request.get_json()
+        message = data.get('message', '').strip()
+        is_competency = data.get('is_competency_evaluation', False)
+        chat_id = data.get('chat_id')
+        
+        if not message:
+            return jsonify({'error': 'Message is required'}), 400
+        
+        # チャットIDが無い場合は新規作成
+        is_new_chat = not chat_id
+        if is_new_chat:
+            chat_id = str(uuid.uuid4())
+        
+        # AIサービスを呼び出し（1リクエスト内は同じプロンプトバージョンを使用）
+        prompt_set = await ai_service.get_prompt_set()
+        if is_competency:
+            ai_response = await ai_service.get_competency_evaluation(message, prompt_set)
+        else:
+            history = await get_conversation_history(user_data['id'], chat_id, is_new_chat)
+            try:
+                ai_response = await ai_service.generate_general_response(message, prompt_set, history)
+            except Exception as e:
+                # エラー応答は会話履歴に追加しない（以降の応答で文脈として送らないため）
+                logger.error(f"General response error: {str(e)}")
+                ai_response = GENERAL_ERROR_RESPONSE
+            else:
+                if conversation_store:
+                    conversation_store.append_turn(user_data['id'], chat_id, message, ai_response)
+        
+        # データベースに保存
+        message_data = build_message_data(
+            chat_id, user_data, message, ai_response, is_competency,
+            request.headers.get('User-Agent'), request.remote_addr, prompt_set.version
+        )
+        
+        await db_manager.save_chat_message(message_data)
+        
+        return jsonify({
+            'success': True,
+            'chat_id': chat_id,
+            'message': ai_response,
+            'prompt_version': prompt_set.version,
+            'timestamp': message_data['timestamp']
+        })
+    
+    except Exception as e:
+        logger.error(f"Chat send error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+@auth_manager.require_auth()
+async def stream_message():
+    """チャットメッセージ送信（Server-Sent Eventsによる逐次応答）"""
+    try:
+        user_data = g.user
+        
+        data = await request.get_json()
+        message = data.get('message', '').strip()
+        is_competency = data.get('is_competency_evaluation', False)
+        chat_id = data.get('chat_id')
+        
+        if not message:
+            return jsonify({'error': 'Message is required'}), 400
+        
+        # チャットIDが無い場合は新規作成
+        is_new_chat = not chat_id
+        if is_new_chat:
+            chat_id = str(uuid.uuid4())
+        
+        user_agent = request.headers.get('User-Agent')
+        ip_address = request.remote_addr
+        
+        prompt_set = await ai_service.get_prompt_set()
+        if is_competency:
+            deltas = ai_service.stream_competency_evaluation(message, prompt_set)
+        else:
+            history = await get_conversation_history(user_data['id'], chat_id, is_new_chat)
+            deltas = ai_service.iter_general_response(message, prompt_set, history)
+        
+        async def generate():
+            yield format_sse('start', {'chat_id': chat_id, 'prompt_version': prompt_set.version})
+            
+            chunks = []
+            succeeded = True
+            try:
+                async for delta in deltas:
+                    chunks.append(delta)
+                    yield format_sse('delta', {'content': delta})
+            except Exception as e:
+                # 一般チャットの応答失敗（評価はサービス側でエラー応答に置き換える）
+                logger.error(f"General response stream error: {str(e)}")
+                succeeded = False
+                chunks.append(GENERAL_ERROR_RESPONSE)
+                yield format_sse('delta', {'content': GENERAL_ERROR_RESPONSE})
+            
+            # ストリーム完了後に全文をデータベースに保存
+            ai_response = ''.join(chunks)
+            message_data = build_message_data(
+                chat_id, user_data, message, ai_response, is_competency,
+                user_agent, ip_address, prompt_set.version
+            )
+            await db_manager.save_chat_message(message_data)
+            if conversation_store and not is_competency and succeeded:
+                conversation_store.append_turn(user_data['id'], chat_id, message, ai_response)
+            
+            yield format_sse('done', {
+                'success': True,
+                'chat_id': chat_id,
+                'prompt_version': prompt_set.version,
+                'timestamp': message_data['timestamp']
+            })
+        
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # リバースプロキシでのバッファリングを無効化
+            }
+        )
+    
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/chat/history/<user_id>', methods=['GET'])
+@auth_manager.require_auth(user_id_param='user_id')
+async def get_chat_history(user_id):
+    """チャット履歴取得"""
+    try:
+        # クエリパラメータ
+        limit = min(int(request.args.get('limit', 50)), 100)
+        
+        # 従来のoffset指定（後方互換）
+        if 'offset' in request.args:
+            offset = int(request.args.get('offset', 0))
+            history = await db_manager.get_chat_history(user_id, limit, offset)
+            
+            return jsonify({
+                'success': True,
+                'history': history,
+                'count': len(history)
+            })
+        
+        # カーソル指定（前回レスポンスのnext_cursorをそのまま渡す）
+        try:
+            page = await db_manager.get_chat_history_page(user_id, limit, request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        return jsonify({
+            'success': True,
+            'history': page['items'],
+            'count': len(page['items']),
+            'next_cursor': page['next_cursor'],
+            'has_more': page['next_cursor'] is not None
+        })
+    
+    except Exception as e:
+        logger.error(f"Chat history error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/export', methods=['POST'])
+@auth_manager.require_auth(role='faculty')
+async def export_competency_data():
+    """教員向けコンピテンシー評価データCSV出力"""
+    try:
+        data = await request.get_json()
+        
+        # 日付検証
+        try:
+            start_date, end_date = parse_export_dates(data)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        # ストリーミングモード: 全件を保持せずページ単位で取得しながらCSVを返す
+        if data.get('stream'):
+            return stream_competency_csv(start_date, end_date, data.get('gzip', False), data.get('bom', False))
+        
+        # コンピテンシー評価データ取得
+        competency_data = await db_manager.get_competency_evaluations(start_date, end_date)
+        
+        # CSV生成
+        csv_content = generate_csv(competency_data)
+        
+        return jsonify({
+            'success': True,
+            'csv_data': csv_content,
+            'record_count': len(competency_data),
+            'export_timestamp': datetime.now(timezone.utc).isoformat()
+        })
+    
+    except Exception as e:
+        logger.error(f"Export error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def stream_competency_csv(start_date: Optional[datetime], end_date: Optional[datetime],
+                          use_gzip: bool, bom: bool) -> Response:
+    """コンピテンシー評価データのチャンク形式CSVレスポンス"""
+    records = db_manager.iter_competency_evaluations(start_date, end_date, Config.EXPORT_PAGE_SIZE)
+    chunks = iter_csv_async(records, bom=bom)
+    
+    filename = f"competency_evaluation_{datetime.now(timezone.utc).strftime('%Y%m%d')}.csv"
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    }
+    if use_gzip:
+        chunks = gzip_stream_async(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    
+    response = Response(chunks, content_type='text/csv; charset=utf-8', headers=headers)
+    response.timeout = None  # 全件の出力に RESPONSE_TIMEOUT（既定60秒）を超えても打ち切らない
+    return response
+
+@app.route('/api/admin/competencies/stats', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+async def get_competency_stats():
+    """教員向けコンピテンシー別の平均点・点数分布（保存時に構造化した評価結果から集計）"""
+    try:
+        # 日付検証
+        try:
+            start_date, end_date = parse_export_dates(request.args)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        prompt_version = request.args.get('prompt_version') or None
+        competencies = await db_manager.get_competency_score_summary(start_date, end_date, prompt_version)
+        
+        return jsonify({
+            'success': True,
+            'competencies': competencies,
+            'start_date': start_date.isoformat() if start_date else None,
+            'end_date': end_date.isoformat() if end_date else None,
+            'prompt_version': prompt_version
+        })
+    
+    except Exception as e:
+        logger.error(f"Competency stats error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/evaluations', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+async def list_competency_evaluations():
+    """教員向けコンピテンシー評価一覧（学生ID・コンピテンシー・本文の部分一致で絞り込み、並べ替え・カーソルでページング）"""
+    try:
+        # 日付・絞り込み条件の検証
+        try:
+            start_date, end_date = parse_export_dates(request.args)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        # 前回レスポンスのnext_cursorをそのまま渡す（並べ替え条件を変えた場合は先頭から取得し直す）
+        try:
+            query = EvaluationQuery.from_dict(request.args, start_date, end_date)
+            page = await db_manager.get_competency_evaluation_page(query)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'evaluations': page['items'],
+            'count': len(page['items']),
+            'next_cursor': page['next_cursor'],
+            'has_more': page['next_cursor'] is not None
+        })
+    
+    except Exception as e:
+        logger.error(f"Competency evaluation list error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/analytics/cohort', methods=['POST'])
+@auth_manager.require_auth(role='faculty')
+async def get_cohort_analytics():
+    """教員向けコホート分析（コンピテンシー別・セクション別の点数分布、週ごとの推移、学生ごとの傾向と順位）"""
+    try:
+        data = (await request.get_json(silent=True)) or {}
+        
+        # 日付・絞り込み条件の検証
+        try:
+            start_date, end_date = parse_export_dates(data)
+            cohort_filter = CohortFilter.from_dict(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        report = await cohort_analytics.get_report_async(start_date, end_date, cohort_filter)
+        
+        return jsonify({
+            'success': True,
+            'analytics': report
+        })
+    
+    except Exception as e:
+        logger.error(f"Cohort analytics error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/stats', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+async def get_admin_stats():
+    """管理画面用統計データ"""
+    try:
+        stats = await db_manager.get_usage_statistics()
+        
+        return jsonify({
+            'success': True,
+            'stats': stats
+        })
+    
+    except Exception as e:
+        logger.error(f"Stats error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/cache', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+async def get_cache_stats():
+    """管理画面用キャッシュ統計"""
+    try:
+        return jsonify({
+            'success': True,
+            'evaluation_cache': ai_service.get_cache_stats(),
+            'single_flight': ai_service.get_single_flight_stats(),
+            'deployments': ai_service.get_deployment_stats(),
+            'model_tiers': ai_service.get_model_tier_stats(),
+            'cohort_analytics': cohort_analytics.get_stats(),
+            'token_cache': auth_manager.get_token_cache_stats(),
+            'conversation_context': conversation_store.get_stats() if conversation_store else None
+        })
+    
+    except Exception as e:
+        logger.error(f"Cache stats error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/prompts', methods=['GET'])
+@auth_manager.require_auth(role='faculty')
+async def get_prompt_info():
+    """管理画面用プロンプトバージョン情報"""
+    try:
+        return jsonify({
+            'success': True,
+            'prompts': await ai_service.get_prompt_info()
+        })
+    
+    except Exception as e:
+        logger.error(f"Prompt info error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify({'error': 'Not found'}), 404
+
+@app.errorhandler(500)
+async def internal_error(error):
+    return jsonify({'error': 'Internal server error'}), 500
+
+if __name__ == '__main__':
+    # 開発環境での起動
+    app.run(debug=True, host='0.0.0.0', port=5000)
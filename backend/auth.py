@@ -4,21 +4,170 @@ EntraID認証とJWTトークン管理
 """
 import jwt
 import hashlib
+import inspect
 import logging
+import threading
+import time
 from datetime import datetime, timezone, timedelta
+from functools import wraps
 from typing import Dict, Optional
 import requests
 
 from config import Config
+from metrics import observe_stage, track_stage
 
 logger = logging.getLogger(__name__)
 
+class VerifiedTokenCache:
+    """検証済みトークンキャッシュ
+    
+    トークンのSHA-256ダイジェストをキーにユーザー情報を保持し、各トークンの
+    exp を過ぎたエントリは使用しない。検証に失敗したトークンは保持しない。
+    """
+    
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = {}  # digest -> (user_data, exp)
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'decodes': 0,
+            'decode_time_ms': 0.0
+        }
+    
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+    
+    def get(self, digest: str) -> Optional[Dict]:
+        """キャッシュ取得（期限切れ・未登録の場合はNone）"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[1] > now:
+                self._stats['hits'] += 1
+                return dict(entry[0])
+            if entry is not None:
+                del self._entries[digest]
+            self._stats['misses'] += 1
+            return None
+    
+    def set(self, digest: str, user_data: Dict, exp: float):
+        """キャッシュ登録"""
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._purge_expired()
+            if len(self._entries) >= self.max_entries:
+                # 期限切れが無い場合は最も早く期限切れになるエントリを破棄
+                del self._entries[min(self._entries, key=lambda key: self._entries[key][1])]
+            self._entries[digest] = (dict(user_data), exp)
+    
+    def record_decode(self, elapsed_ms: float):
+        """jwt.decodeの所要時間記録"""
+        with self._lock:
+            self._stats['decodes'] += 1
+            self._stats['decode_time_ms'] += elapsed_ms
+    
+    def _purge_expired(self):
+        now = time.time()
+        for digest in [key for key, entry in self._entries.items() if entry[1] <= now]:
+            del self._entries[digest]
+    
+    def get_stats(self) -> Dict:
+        """ヒット率・デコード時間の統計取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['avg_decode_ms'] = stats['decode_time_ms'] / stats['decodes'] if stats['decodes'] else 0.0
+        # キャッシュヒットにより省略できたデコード時間の推定値
+        stats['estimated_saved_ms'] = stats['hits'] * stats['avg_decode_ms']
+        return stats
+
+class JWKSCache:
+    """EntraID署名鍵（JWKS）キャッシュ
+    
+    refresh_interval 秒ごとに鍵セットを再取得する。未知の kid を受け取った場合は
+    鍵のローテーションとみなして再取得するが、min_refresh_interval 秒以内の
+    再取得は行わない（不正なトークンによる大量取得を防ぐ）。
+    """
+    
+    def __init__(self, jwks_uri: str, session: requests.Session, refresh_interval: float = 3600,
+                 min_refresh_interval: float = 30, timeout: float = 5):
+        self.jwks_uri = jwks_uri
+        self.session = session
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        
+        self._keys = {}
+        self._fetched_at = float('-inf')
+        self._lock = threading.Lock()
+    
+    def get_signing_key(self, kid: Optional[str]):
+        """kidに対応する公開鍵取得（見つからない場合はNone）"""
+        now = time.monotonic()
+        if now - self._fetched_at >= self.refresh_interval:
+            self._refresh(now)
+        elif kid not in self._keys and now - self._fetched_at >= self.min_refresh_interval:
+            self._refresh(now)
+        return self._keys.get(kid)
+    
+    def _refresh(self, now: float):
+        """鍵セット再取得（取得失敗時は既存の鍵を使い続ける）"""
+        with self._lock:
+            # 他スレッドが取得済みの場合は何もしない
+            if now < self._fetched_at:
+                return
+            try:
+                with track_stage('auth.jwks_refresh'):
+                    response = self.session.get(self.jwks_uri, timeout=self.timeout)
+                    response.raise_for_status()
+                
+                keys = {}
+                for jwk in response.json().get('keys', []):
+                    try:
+                        keys[jwk['kid']] = jwt.PyJWK(jwk).key
+                    except Exception as e:
+                        logger.warning(f"Skipping unusable JWK {jwk.get('kid')}: {str(e)}")
+                
+                self._keys = keys
+                logger.info(f"JWKS refreshed: {len(keys)} keys")
+                
+            except Exception as e:
+                logger.error(f"JWKS refresh error: {str(e)}")
+            finally:
+                self._fetched_at = time.monotonic()
+
 class AuthManager:
     """認証管理クラス"""
     
     def __init__(self):
         self.config = Config()
         self.mock_users = self._initialize_mock_users()
+        self.token_cache = VerifiedTokenCache(self.config.TOKEN_CACHE_MAX_ENTRIES)
+        
+        # EntraID連携（JWKS・Graphへの接続はセッションで再利用する）
+        self.http_session = self._create_http_session()
+        self.jwks_cache = JWKSCache(
+            self.config.ENTRA_JWKS_URI,
+            self.http_session,
+            refresh_interval=self.config.ENTRA_JWKS_REFRESH_INTERVAL,
+            min_refresh_interval=self.config.ENTRA_JWKS_MIN_REFRESH_INTERVAL,
+            timeout=self.config.ENTRA_HTTP_TIMEOUT
+        )
+        self.profile_cache = VerifiedTokenCache(self.config.TOKEN_CACHE_MAX_ENTRIES)
+    
+    def _create_http_session(self) -> requests.Session:
+        """接続プール付きHTTPセッション生成"""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=self.config.ENTRA_HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
     
     def _initialize_mock_users(self):
         """モックユーザーデータ初期化"""
@@ -77,40 +226,81 @@ class AuthManager:
         logger.warning(f"Mock authentication failed for user: {email}")
         return None
     
+    def authenticate_login(self, data: Dict) -> Optional[Dict]:
+        """ログインリクエストの認証（IDトークン → アクセストークン → モック認証の順に判定）"""
+        if data.get('id_token'):
+            return self.authenticate_entra_id_token(data['id_token'])
+        if data.get('access_token'):
+            return self.authenticate_entra_id(data['access_token'])
+        return self.authenticate_mock(data.get('email'), data.get('password'))
+    
+    def authenticate_entra_id_token(self, id_token: str) -> Optional[Dict]:
+        """EntraID IDトークン認証（キャッシュ済みJWKSによるローカル署名検証）"""
+        if self.config.MOCK_MODE:
+            logger.warning("EntraID authentication called in mock mode")
+            return None
+        
+        try:
+            kid = jwt.get_unverified_header(id_token).get('kid')
+            signing_key = self.jwks_cache.get_signing_key(kid)
+            if signing_key is None:
+                logger.warning(f"Unknown signing key id: {kid}")
+                return None
+            
+            started = time.perf_counter()
+            claims = jwt.decode(
+                id_token,
+                signing_key,
+                algorithms=['RS256'],
+                audience=self.config.ENTRA_CLIENT_ID,
+                issuer=self.config.ENTRA_ISSUER
+            )
+            observe_stage('auth.id_token_decode', time.perf_counter() - started)
+            
+            email = claims.get('preferred_username') or claims.get('email', '')
+            return self._build_entra_user(claims.get('oid'), claims.get('name'), email)
+            
+        except jwt.InvalidTokenError as e:
+            logger.warning(f"Invalid EntraID token: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"EntraID authentication error: {str(e)}")
+            return None
+    
     def authenticate_entra_id(self, access_token: str) -> Optional[Dict]:
-        """EntraID認証"""
+        """EntraID認証（Microsoft Graph /me によるフォールバック）"""
         if self.config.MOCK_MODE:
             logger.warning("EntraID authentication called in mock mode")
             return None
             
         try:
+            # 同一トークンでの再ログインはGraphを呼ばずにキャッシュから返す
+            digest = self.profile_cache.digest(access_token)
+            cached = self.profile_cache.get(digest)
+            if cached is not None:
+                return cached
+            
             # Microsoft Graph APIでユーザー情報を取得
             headers = {
                 'Authorization': f'Bearer {access_token}',
                 'Content-Type': 'application/json'
             }
             
-            response = requests.get('https://graph.microsoft.com/v1.0/me', headers=headers)
+            with track_stage('auth.graph_me'):
+                response = self.http_session.get(
+                    f"{self.config.GRAPH_API_ENDPOINT}/me",
+                    headers=headers,
+                    timeout=self.config.ENTRA_HTTP_TIMEOUT
+                )
             
             if response.status_code == 200:
                 user_info = response.json()
                 
-                # 立命館大学ドメインの確認
                 email = user_info.get('mail') or user_info.get('userPrincipalName', '')
-                if not self._is_valid_ritsumeikan_email(email):
-                    logger.warning(f"Invalid email domain for user: {email}")
-                    return None
-                
-                # ユーザーデータ構築
-                user_data = {
-                    'id': user_info.get('id'),
-                    'name': user_info.get('displayName'),
-                    'email': email,
-                    'role': self._determine_user_role(email),
-                    'entra_id': user_info.get('id')
-                }
+                user_data = self._build_entra_user(user_info.get('id'), user_info.get('displayName'), email)
                 
-                logger.info(f"EntraID authentication successful for user: {email}")
+                if user_data:
+                    self.profile_cache.set(digest, user_data, time.time() + self.config.ENTRA_PROFILE_CACHE_TTL)
                 return user_data
             
             else:
@@ -121,6 +311,29 @@ class AuthManager:
             logger.error(f"EntraID authentication error: {str(e)}")
             return None
     
+    def _build_entra_user(self, entra_id: Optional[str], name: Optional[str], email: str) -> Optional[Dict]:
+        """EntraIDのユーザー情報からユーザーデータ構築"""
+        # オブジェクトID（oid）が無い場合はユーザーを特定できないため拒否
+        if not entra_id:
+            logger.warning(f"EntraID user has no object id: {email}")
+            return None
+        
+        # 立命館大学ドメインの確認
+        if not self._is_valid_ritsumeikan_email(email):
+            logger.warning(f"Invalid email domain for user: {email}")
+            return None
+        
+        user_data = {
+            'id': entra_id,
+            'name': name,
+            'email': email,
+            'role': self._determine_user_role(email),
+            'entra_id': entra_id
+        }
+        
+        logger.info(f"EntraID authentication successful for user: {email}")
+        return user_data
+    
     def _is_valid_ritsumeikan_email(self, email: str) -> bool:
         """立命館大学メールドメインの確認"""
         valid_domains = [
@@ -168,20 +381,27 @@ class AuthManager:
     
     def verify_token(self, token: str) -> Optional[Dict]:
         """JWTトークン検証"""
+        verify_started = time.perf_counter()
         try:
             if not token:
                 return None
-                
+            
+            # 検証済みトークンはexpまで再デコードしない
+            digest = self.token_cache.digest(token)
+            cached = self.token_cache.get(digest)
+            if cached is not None:
+                return cached
+            
+            # 有効期限（exp）はjwt.decodeで検証される
+            started = time.perf_counter()
             payload = jwt.decode(
                 token,
                 self.config.JWT_SECRET_KEY,
                 algorithms=['HS256']
             )
-            
-            # トークン有効性チェック
-            if datetime.now(timezone.utc) > datetime.fromisoformat(payload['exp'].replace('Z', '+00:00')):
-                logger.warning("Token expired")
-                return None
+            decode_seconds = time.perf_counter() - started
+            self.token_cache.record_decode(decode_seconds * 1000)
+            observe_stage('auth.jwt_decode', decode_seconds)
             
             user_data = {
                 'id': payload['user_id'],
@@ -190,6 +410,7 @@ class AuthManager:
                 'name': payload['name']
             }
             
+            self.token_cache.set(digest, user_data, payload['exp'])
             return user_data
             
         except jwt.ExpiredSignatureError:
@@ -201,6 +422,61 @@ class AuthManager:
         except Exception as e:
             logger.error(f"Token verification error: {str(e)}")
             return None
+        finally:
+            observe_stage('auth.verify_token', time.perf_counter() - verify_started)
+    
+    def get_token_cache_stats(self) -> Dict:
+        """検証済みトークンキャッシュ統計取得"""
+        return self.token_cache.get_stats()
+    
+    def require_auth(self, role: Optional[str] = None, user_id_param: Optional[str] = None):
+        """認証・権限確認デコレータ
+        
+        Authorizationヘッダーのトークンを検証し、ユーザー情報を g.user に格納する。
+        role を指定した場合はその権限以上、user_id_param を指定した場合は
+        同名のURLパラメータと本人のIDが一致することを要求する。
+        Flaskのビュー関数とQuart（asgi_app.py）のコルーチンの両方に対応する。
+        """
+        if role:
+            denied_message = f'Unauthorized - {role.capitalize()} access required'
+        else:
+            denied_message = 'Unauthorized'
+        
+        def authorize(request, g, kwargs) -> bool:
+            token = request.headers.get('Authorization', '').replace('Bearer ', '')
+            user_data = self.verify_token(token)
+            if not user_data:
+                return False
+            if role and not self.check_permission(user_data, role):
+                return False
+            if user_id_param and user_data['id'] != kwargs.get(user_id_param):
+                return False
+            g.user = user_data
+            return True
+        
+        def decorator(view):
+            if inspect.iscoroutinefunction(view):
+                from quart import request, jsonify, g
+                
+                @wraps(view)
+                async def async_wrapper(*args, **kwargs):
+                    if not authorize(request, g, kwargs):
+                        return jsonify({'error': denied_message}), 401
+                    return await view(*args, **kwargs)
+                
+                return async_wrapper
+            
+            from flask import request, jsonify, g
+            
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not authorize(request, g, kwargs):
+                    return jsonify({'error': denied_message}), 401
+                return view(*args, **kwargs)
+            
+            return wrapper
+        
+        return decorator
     
     def refresh_token(self, token: str) -> Optional[str]:
         """トークンリフレッシュ"""
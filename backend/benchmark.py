@@ -0,0 +1,348 @@
+"""
+ベンチマーク（負荷試験）ツール
+主要エンドポイントを指定した並列数で呼び出し、エンドポイントごとのスループットと
+p50/p95/p99レイテンシを計測してJSONに保存する。コミット間の比較に使用する。
+
+実行例:
+    # プロセス内でモックモードのサーバーを起動して計測（DATABASE_TYPE=memory）
+    python benchmark.py --concurrency 20 --requests 200 --latency lognormal:1.2,0.5 --seed 42
+    
+    # AIをモックではなくAzure OpenAI互換スタブに接続して計測（実際のクライアント経路・429再試行を含む）
+    python benchmark.py --ai-stub --latency lognormal:1.2,0.5 --stub-rate-429 0.05
+    
+    # 起動済みのサーバーを計測
+    python benchmark.py --url http://localhost:5000 --concurrency 50
+    
+    # 前回の結果と比較
+    python benchmark.py --compare benchmark_results/benchmark_abc1234_20240101T000000.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+ENDPOINTS = [
+    'login',
+    'chat_send_general',
+    'chat_send_competency',
+    'chat_history',
+    'admin_export',
+    'admin_stats'
+]
+
+SAMPLE_MESSAGES = [
+    'ピアサポートの授業でグループワークを通じて、相手の話をじっくり聞くことの大切さを学びました。',
+    '今日のロールプレイで初めて相談者役をやってみて、話すことの難しさを感じました。',
+    'チームで意見が分かれたときに、全員の意見をまとめる役割を担当しました。',
+    '失敗した発表を振り返り、次回に向けて準備の仕方を見直しました。',
+    '傾聴のコツについてもう少し詳しく教えてください。'
+]
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """パーセンタイル（線形補間）"""
+    if not sorted_values:
+        return 0.0
+    
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+def summarize(latencies_ms: List[float], errors: int, duration: float) -> Dict:
+    """エンドポイント1つ分の計測結果集計"""
+    values = sorted(latencies_ms)
+    total = len(values) + errors
+    
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': errors / total if total else 0.0,
+        'duration_seconds': round(duration, 3),
+        'throughput_rps': round(len(values) / duration, 3) if duration > 0 else 0.0,
+        'latency_ms': {
+            'min': round(values[0], 2) if values else 0.0,
+            'mean': round(sum(values) / len(values), 2) if values else 0.0,
+            'p50': round(percentile(values, 50), 2),
+            'p95': round(percentile(values, 95), 2),
+            'p99': round(percentile(values, 99), 2),
+            'max': round(values[-1], 2) if values else 0.0
+        }
+    }
+
+class BenchmarkClient:
+    """エンドポイント呼び出し（スレッドごとにHTTPセッションを保持）"""
+    
+    def __init__(self, base_url: str, timeout: float, unique_messages: bool):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.unique_messages = unique_messages
+        
+        self.student_credentials = None
+        self.student = None
+        self.student_token = None
+        self.faculty_token = None
+        
+        self._local = threading.local()
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+    
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            self._local.session = session
+        return session
+    
+    def _request(self, method: str, path: str, token: Optional[str] = None, payload: Optional[Dict] = None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self._session().request(
+            method, self.base_url + path, json=payload, headers=headers, timeout=self.timeout
+        )
+        # ストリーミング応答も含め本文を最後まで読み切った時点を完了とする
+        response.content
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+        return response
+    
+    def _next_message(self) -> str:
+        with self._counter_lock:
+            self._counter += 1
+            index = self._counter
+        
+        message = SAMPLE_MESSAGES[index % len(SAMPLE_MESSAGES)]
+        # 評価キャッシュに当たらないよう既定では毎回異なる入力にする
+        return f"{message}（{index}）" if self.unique_messages else message
+    
+    def setup(self, student_credentials: Dict, faculty_credentials: Dict):
+        """計測用トークン取得"""
+        self.student_credentials = student_credentials
+        
+        data = self._request('POST', '/api/auth/login', payload=student_credentials).json()
+        self.student = data['user']
+        self.student_token = data['token']
+        
+        data = self._request('POST', '/api/auth/login', payload=faculty_credentials).json()
+        self.faculty_token = data['token']
+    
+    def login(self):
+        self._request('POST', '/api/auth/login', payload=self.student_credentials)
+    
+    def chat_send_general(self):
+        self._request('POST', '/api/chat/send', self.student_token, {
+            'message': self._next_message(),
+            'is_competency_evaluation': False
+        })
+    
+    def chat_send_competency(self):
+        self._request('POST', '/api/chat/send', self.student_token, {
+            'message': self._next_message(),
+            'is_competency_evaluation': True
+        })
+    
+    def chat_history(self):
+        self._request('GET', f"/api/chat/history/{self.student['id']}?limit=20", self.student_token)
+    
+    def admin_export(self):
+        self._request('POST', '/api/admin/export', self.faculty_token, {})
+    
+    def admin_stats(self):
+        self._request('GET', '/api/admin/stats', self.faculty_token)
+
+def run_endpoint(request_func: Callable[[], None], total: int, concurrency: int, warmup: int) -> Dict:
+    """1エンドポイントを指定並列数で total 回呼び出して計測"""
+    for _ in range(warmup):
+        try:
+            request_func()
+        except Exception:
+            pass
+    
+    latencies_ms = []
+    errors = []
+    lock = threading.Lock()
+    
+    def call():
+        started = time.perf_counter()
+        try:
+            request_func()
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies_ms.append(elapsed_ms)
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(total):
+            executor.submit(call)
+    duration = time.perf_counter() - started
+    
+    result = summarize(latencies_ms, len(errors), duration)
+    if errors:
+        result['sample_errors'] = sorted(set(errors))[:5]
+    return result
+
+def start_ai_stub(args) -> str:
+    """プロセス内でAzure OpenAI互換スタブを起動し、サーバーの接続先をスタブに向ける"""
+    from openai_stub_server import StubSettings, start_stub_server
+    
+    stub = start_stub_server(StubSettings(
+        latency=args.latency,
+        token_rate=args.stub_token_rate,
+        rate_429=args.stub_rate_429,
+        rate_500=args.stub_rate_500,
+        seed=args.seed
+    ))
+    os.environ['MOCK_AI'] = 'false'
+    os.environ['AZURE_OPENAI_ENDPOINT'] = stub.endpoint
+    os.environ['AZURE_OPENAI_KEY'] = 'stub'
+    os.environ.pop('AZURE_OPENAI_DEPLOYMENTS', None)
+    return stub.endpoint
+
+def start_local_server(args) -> str:
+    """プロセス内でモックモードのサーバーを起動（環境変数は未設定の場合のみ上書き）"""
+    if args.ai_stub:
+        start_ai_stub(args)
+    os.environ.setdefault('MOCK_MODE', 'true')
+    os.environ.setdefault('DATABASE_TYPE', 'memory')
+    os.environ.setdefault('MOCK_AI_LATENCY', args.latency)
+    if args.seed is not None:
+        os.environ.setdefault('MOCK_AI_LATENCY_SEED', str(args.seed))
+    
+    import logging
+    from werkzeug.serving import make_server
+    
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+def get_git_commit() -> Optional[str]:
+    """計測対象のコミットID（取得できない場合はNone）"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def compare_results(current: Dict, baseline: Dict) -> List[str]:
+    """前回結果との比較（スループット・p50/p95/p99の変化率）"""
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+    
+    lines = [
+        f"Baseline: {baseline.get('commit')} ({baseline.get('timestamp')})",
+        f"{'endpoint':<22}{'throughput':>12}{'p50':>10}{'p95':>10}{'p99':>10}"
+    ]
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        lines.append(
+            f"{name:<22}"
+            f"{change(result['throughput_rps'], base['throughput_rps']):>12}"
+            f"{change(result['latency_ms']['p50'], base['latency_ms']['p50']):>10}"
+            f"{change(result['latency_ms']['p95'], base['latency_ms']['p95']):>10}"
+            f"{change(result['latency_ms']['p99'], base['latency_ms']['p99']):>10}"
+        )
+    return lines
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='R-AI backend benchmark')
+    parser.add_argument('--url', help='計測対象のURL（省略時はプロセス内でモックモードのサーバーを起動）')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='計測するエンドポイント（カンマ区切り）')
+    parser.add_argument('--concurrency', type=int, default=10, help='並列数')
+    parser.add_argument('--requests', type=int, default=100, help='エンドポイントごとのリクエスト数')
+    parser.add_argument('--warmup', type=int, default=2, help='計測前のウォームアップ回数')
+    parser.add_argument('--timeout', type=float, default=60.0, help='リクエストのタイムアウト（秒）')
+    parser.add_argument('--latency', default='lognormal:0.8,0.4', help='プロセス内サーバーのモックAI遅延分布')
+    parser.add_argument('--ai-stub', action='store_true', help='モックAIの代わりにAzure OpenAI互換スタブに接続する')
+    parser.add_argument('--stub-token-rate', default='normal:40,10', help='スタブの生成速度の分布（トークン/秒）')
+    parser.add_argument('--stub-rate-429', type=float, default=0.0, help='スタブが429を返す確率')
+    parser.add_argument('--stub-rate-500', type=float, default=0.0, help='スタブが500を返す確率')
+    parser.add_argument('--seed', type=int, default=42, help='遅延分布の乱数シード（再現性のため）')
+    parser.add_argument('--repeat-messages', action='store_true', help='同じ入力を繰り返し送信する（評価キャッシュの効果を計測）')
+    parser.add_argument('--student-email', default='student001@st.ritsumei.ac.jp')
+    parser.add_argument('--student-password', default='password123')
+    parser.add_argument('--faculty-email', default='professor@fc.ritsumei.ac.jp')
+    parser.add_argument('--faculty-password', default='faculty123')
+    parser.add_argument('--output', help='結果JSONの保存先（省略時は benchmark_results/ 以下）')
+    parser.add_argument('--compare', help='比較対象の結果JSON')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        print(f"Unknown endpoints: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    
+    base_url = args.url or start_local_server(args)
+    client = BenchmarkClient(base_url, args.timeout, not args.repeat_messages)
+    client.setup(
+        {'email': args.student_email, 'password': args.student_password},
+        {'email': args.faculty_email, 'password': args.faculty_password}
+    )
+    
+    commit = get_git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'target': args.url or 'in-process',
+        'python': platform.python_version(),
+        'settings': {
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'latency': None if args.url else args.latency,
+            'ai': None if args.url else ('stub' if args.ai_stub else 'mock'),
+            'seed': args.seed,
+            'unique_messages': not args.repeat_messages
+        },
+        'results': {}
+    }
+    
+    print(f"Benchmarking {base_url} (concurrency={args.concurrency}, requests={args.requests})")
+    print(f"{'endpoint':<22}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name in endpoints:
+        result = run_endpoint(getattr(client, name), args.requests, args.concurrency, args.warmup)
+        report['results'][name] = result
+        latency = result['latency_ms']
+        print(f"{name:<22}{result['throughput_rps']:>10.1f}{latency['p50']:>10.1f}"
+              f"{latency['p95']:>10.1f}{latency['p99']:>10.1f}{result['errors']:>8}")
+    
+    output = args.output
+    if not output:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        output = os.path.join('benchmark_results', f"benchmark_{commit or 'unknown'}_{stamp}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results saved: {output}")
+    
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print('\n'.join(compare_results(report, baseline)))
+    
+    return 1 if any(result['errors'] for result in report['results'].values()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+一括コンピテンシー評価モジュール
+教員が指定した複数の振り返り文を上限付きのワーカープールで並行して評価し、
+完了した順に結果を配信する（評価結果はまとめてデータベースに保存）
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+
+from metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+class BulkEvaluationJob:
+    """一括評価ジョブ（結果は完了順にイベントとして保持し、購読者に配信する）"""
+    
+    def __init__(self, items: List[Dict], requested_by: str, prompt_version: str):
+        self.job_id = str(uuid.uuid4())
+        self.items = items
+        self.requested_by = requested_by
+        self.prompt_version = prompt_version
+        self.total = len(items)
+        self.completed = 0
+        self.failed = 0
+        self.saved = 0
+        self.save_failed = 0
+        self.status = 'running'  # running / completed / cancelled
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        self.finished_at = None
+        self.finished_monotonic = None
+        
+        self._events = []
+        self._condition = threading.Condition()
+        self._cancel_event = threading.Event()
+    
+    @property
+    def is_finished(self) -> bool:
+        return self.status != 'running'
+    
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+    
+    def cancel(self) -> bool:
+        """中止要求（未着手の項目は評価しない、実行中の項目は完了を待つ）"""
+        if self.is_finished:
+            return False
+        self._cancel_event.set()
+        return True
+    
+    def progress(self) -> Dict:
+        """進捗取得"""
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'total': self.total,
+            'completed': self.completed,
+            'failed': self.failed,
+            'saved': self.saved,
+            'save_failed': self.save_failed,
+            'prompt_version': self.prompt_version,
+            'requested_by': self.requested_by,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+    
+    def publish(self, event: str, data: Dict):
+        """イベント追加・購読者への通知"""
+        with self._condition:
+            self._events.append((event, data))
+            self._condition.notify_all()
+    
+    def finish(self, status: str):
+        self.status = status
+        self.finished_at = datetime.now(timezone.utc).isoformat()
+        self.finished_monotonic = time.monotonic()
+        self.publish('done', self.progress())
+    
+    def iter_events(self, keepalive: float = 15.0) -> Iterator[tuple]:
+        """最初からのイベントを順に取得（ジョブ完了まで待機、無通信が続く場合は keepalive を返す）"""
+        index = 0
+        while True:
+            with self._condition:
+                if index >= len(self._events):
+                    self._condition.wait(keepalive)
+                events = self._events[index:]
+            
+            if not events:
+                yield ('keepalive', {'completed': self.completed, 'total': self.total})
+                continue
+            
+            for event, data in events:
+                yield (event, data)
+                if event == 'done':
+                    return
+            index += len(events)
+
+class BulkEvaluationManager:
+    """一括評価ジョブの実行・管理
+    
+    全ジョブで共有する max_workers 件のワーカープールで評価し、各ジョブが同時に投入する
+    項目数も max_workers 件までに制限する（中止時に未着手の項目が残らないようにする）。
+    評価結果は save_batch_size 件ごとに save_func（保存に失敗したメッセージを返す）でまとめて保存する。
+    """
+    
+    def __init__(self, save_func: Callable[[List[Dict]], List[Dict]], max_workers: int = 4,
+                 save_batch_size: int = 20, max_running_jobs: int = 2, job_ttl: float = 3600):
+        self.save_func = save_func
+        self.max_workers = max(1, max_workers)
+        self.save_batch_size = max(1, save_batch_size)
+        self.max_running_jobs = max_running_jobs
+        self.job_ttl = job_ttl
+        
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bulk-evaluation')
+        self._jobs = {}  # job_id -> BulkEvaluationJob
+        self._lock = threading.Lock()
+        
+        QUEUE_DEPTH.labels('bulk_evaluation').set_function(self._pending_items)
+    
+    def start(self, items: List[Dict], evaluate_func: Callable[[str], str],
+              build_record: Callable[[BulkEvaluationJob, Dict, str], Dict],
+              requested_by: str, prompt_version: str) -> BulkEvaluationJob:
+        """ジョブ開始（実行中のジョブ数が上限に達している場合はRuntimeError）"""
+        with self._lock:
+            self._prune()
+            running = sum(1 for job in self._jobs.values() if not job.is_finished)
+            if running >= self.max_running_jobs:
+                raise RuntimeError('Too many bulk evaluation jobs are running')
+            
+            job = BulkEvaluationJob(items, requested_by, prompt_version)
+            self._jobs[job.job_id] = job
+        
+        job.publish('start', {'job_id': job.job_id, 'total': job.total, 'prompt_version': prompt_version})
+        threading.Thread(
+            target=self._run,
+            args=(job, evaluate_func, build_record),
+            name=f'bulk-evaluation-{job.job_id[:8]}',
+            daemon=True
+        ).start()
+        
+        logger.info(f"Bulk evaluation started: {job.job_id} ({job.total} items) by {requested_by}")
+        return job
+    
+    def get_job(self, job_id: str) -> Optional[BulkEvaluationJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def cancel(self, job_id: str) -> Optional[BulkEvaluationJob]:
+        """ジョブ中止（存在しない場合はNone）"""
+        job = self.get_job(job_id)
+        if job is not None and job.cancel():
+            logger.info(f"Bulk evaluation cancel requested: {job_id}")
+        return job
+    
+    def _run(self, job: BulkEvaluationJob, evaluate_func: Callable[[str], str],
+             build_record: Callable[[BulkEvaluationJob, Dict, str], Dict]):
+        pending = set()
+        batch = []
+        
+        try:
+            for index, item in enumerate(job.items):
+                while len(pending) >= self.max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(job, done, build_record, batch)
+                if job.is_cancelled:
+                    break
+                pending.add(self._executor.submit(self._evaluate, index, item, evaluate_func))
+            
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                self._collect(job, done, build_record, batch)
+        
+        except Exception as e:
+            logger.error(f"Bulk evaluation error: {str(e)}")
+        
+        finally:
+            self._flush(job, batch)
+            job.finish('cancelled' if job.is_cancelled else 'completed')
+            logger.info(f"Bulk evaluation {job.status}: {job.job_id} ({job.completed}/{job.total}, failed {job.failed})")
+    
+    def _evaluate(self, index: int, item: Dict, evaluate_func: Callable[[str], str]) -> tuple:
+        try:
+            return index, item, evaluate_func(item['message']), None
+        except Exception as e:
+            logger.error(f"Bulk evaluation item error: {str(e)}")
+            return index, item, None, str(e)
+    
+    def _collect(self, job: BulkEvaluationJob, done, build_record, batch: List[Dict]):
+        """完了した項目の結果配信・保存バッチへの追加"""
+        for future in done:
+            index, item, response, error = future.result()
+            job.completed += 1
+            
+            if error is not None:
+                job.failed += 1
+                job.publish('result', {
+                    'index': index,
+                    'user_id': item.get('user_id'),
+                    'success': False,
+                    'error': 'Evaluation failed',
+                    'completed': job.completed,
+                    'total': job.total
+                })
+                continue
+            
+            record = build_record(job, item, response)
+            batch.append(record)
+            job.publish('result', {
+                'index': index,
+                'user_id': record['user_id'],
+                'chat_id': record['chat_id'],
+                'success': True,
+                'message': response,
+                'completed': job.completed,
+                'total': job.total
+            })
+            
+            if len(batch) >= self.save_batch_size:
+                self._flush(job, batch)
+    
+    def _flush(self, job: BulkEvaluationJob, batch: List[Dict]):
+        """保存バッチの書き込み"""
+        if not batch:
+            return
+        
+        try:
+            failed = self.save_func(list(batch))
+        except Exception as e:
+            logger.error(f"Bulk evaluation save error: {str(e)}")
+            failed = batch
+        
+        job.saved += len(batch) - len(failed)
+        job.save_failed += len(failed)
+        job.publish('progress', job.progress())
+        batch.clear()
+    
+    def _pending_items(self) -> int:
+        with self._lock:
+            return sum(job.total - job.completed for job in self._jobs.values() if not job.is_finished)
+    
+    def _prune(self):
+        """保持期限を過ぎた完了済みジョブの破棄（ロック取得済みで呼び出す）"""
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_monotonic is not None and now - job.finished_monotonic > self.job_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+    
+    def shutdown(self):
+        """実行中のジョブを中止してワーカープールを停止"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,322 @@
+"""
+コホート分析モジュール
+保存時に構造化したコンピテンシー評価の点数を列指向のNumPy配列に読み込み、
+コンピテンシー別・セクション別の点数分布、週ごとの推移、学生ごとの傾向とパーセンタイル順位を
+ベクトル演算で集計する。結果は（期間, 絞り込み条件）ごとにキャッシュし、評価の保存時に破棄する
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from competency_scores import COMPETENCIES, MAX_SCORE
+from metrics import track_stage
+
+CODES = list(COMPETENCIES)
+CODE_INDEX = {code: index for index, code in enumerate(CODES)}
+SECONDS_PER_WEEK = 7 * 86400
+
+@dataclass
+class CohortFilter:
+    """集計の絞り込み条件（sections は セクション名 -> 学生IDの一覧、指定時は名簿の学生のみ集計）"""
+    competency: Optional[str] = None
+    prompt_version: Optional[str] = None
+    sections: Dict[str, List[str]] = field(default_factory=dict)
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CohortFilter':
+        """リクエストからの構築（不正な形式はValueError）"""
+        competency = data.get('competency') or None
+        if competency is not None and competency not in CODE_INDEX:
+            raise ValueError(f"Unknown competency: {competency}")
+        
+        sections = data.get('sections') or {}
+        if not isinstance(sections, dict) or not all(
+            isinstance(user_ids, list) and all(isinstance(user_id, str) for user_id in user_ids)
+            for user_ids in sections.values()
+        ):
+            raise ValueError('sections must map section names to lists of user ids')
+        
+        return cls(competency=competency, prompt_version=data.get('prompt_version') or None, sections=sections)
+    
+    def cache_key(self, start_date: Optional[datetime], end_date: Optional[datetime]) -> str:
+        return json.dumps([
+            start_date.isoformat() if start_date else None,
+            end_date.isoformat() if end_date else None,
+            self.competency,
+            self.prompt_version,
+            sorted((name, sorted(user_ids)) for name, user_ids in self.sections.items())
+        ], ensure_ascii=False)
+
+class ScoreColumns:
+    """評価点数の列指向表現（1行 = 1評価の1コンピテンシー）"""
+    
+    def __init__(self, user_ids: List[str], users: np.ndarray, codes: np.ndarray,
+                 scores: np.ndarray, seconds: np.ndarray):
+        self.user_ids = user_ids  # 学生インデックス -> user_id
+        self.users = users  # 学生インデックス（int64）
+        self.codes = codes  # コンピテンシーインデックス（CODESの順、int64）
+        self.scores = scores  # 点数 1〜5（int64）
+        self.seconds = seconds  # UNIX時刻（秒、int64）
+    
+    @classmethod
+    def from_rows(cls, rows: List[Dict]) -> 'ScoreColumns':
+        """{user_id, timestamp, code, score} の行から構築（一覧にないコード・範囲外の点数は除外）"""
+        rows = [
+            row for row in rows
+            if row.get('code') in CODE_INDEX and isinstance(row.get('score'), int) and 1 <= row['score'] <= MAX_SCORE
+        ]
+        
+        user_ids, users = np.unique(np.array([row['user_id'] for row in rows], dtype=str), return_inverse=True)
+        
+        # タイムスタンプはUTCのISO 8601形式で保存されているため、先頭19文字（秒まで）を一括で変換する
+        timestamps = np.array([row['timestamp'][:19] for row in rows], dtype='datetime64[s]')
+        
+        return cls(
+            user_ids=user_ids.tolist(),
+            users=users.astype(np.int64).reshape(-1),
+            codes=np.array([CODE_INDEX[row['code']] for row in rows], dtype=np.int64),
+            scores=np.array([row['score'] for row in rows], dtype=np.int64),
+            seconds=timestamps.astype(np.int64)
+        )
+    
+    def __len__(self) -> int:
+        return len(self.scores)
+    
+    def select(self, mask: np.ndarray) -> 'ScoreColumns':
+        return ScoreColumns(self.user_ids, self.users[mask], self.codes[mask], self.scores[mask], self.seconds[mask])
+
+def _histograms(groups: np.ndarray, codes: np.ndarray, scores: np.ndarray, group_count: int) -> np.ndarray:
+    """グループ × コンピテンシー × 点数 の件数（shape: group_count, コンピテンシー数, MAX_SCORE）"""
+    index = (groups * len(CODES) + codes) * MAX_SCORE + (scores - 1)
+    counts = np.bincount(index, minlength=group_count * len(CODES) * MAX_SCORE)
+    return counts.reshape(group_count, len(CODES), MAX_SCORE)
+
+def _means(histograms: np.ndarray) -> np.ndarray:
+    """点数分布からの平均（件数0はNaN）"""
+    counts = histograms.sum(axis=-1)
+    totals = (histograms * np.arange(1, MAX_SCORE + 1)).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+
+def _round(value) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), 3)
+
+def _competency_summary(histogram: np.ndarray, codes: List[int]) -> Dict:
+    """コンピテンシーごとの件数・平均・点数分布"""
+    means = _means(histogram)
+    return {
+        CODES[c]: {
+            'count': int(histogram[c].sum()),
+            'mean': _round(means[c]),
+            'histogram': {str(score): int(n) for score, n in enumerate(histogram[c], 1)}
+        }
+        for c in codes
+    }
+
+def _trend_slopes(columns: ScoreColumns, student_count: int) -> np.ndarray:
+    """学生 × コンピテンシーごとの点数の回帰直線の傾き（1週間あたり、2時点未満はNaN）"""
+    groups = columns.users * len(CODES) + columns.codes
+    size = student_count * len(CODES)
+    
+    # 最小二乗法の和をグループごとに集計（x は最初の評価からの経過週数）
+    x = (columns.seconds - columns.seconds.min()) / SECONDS_PER_WEEK if len(columns) else np.zeros(0)
+    y = columns.scores.astype(np.float64)
+    n = np.bincount(groups, minlength=size)
+    sx = np.bincount(groups, weights=x, minlength=size)
+    sy = np.bincount(groups, weights=y, minlength=size)
+    sxx = np.bincount(groups, weights=x * x, minlength=size)
+    sxy = np.bincount(groups, weights=x * y, minlength=size)
+    
+    denominator = n * sxx - sx * sx
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = np.where(denominator > 1e-12, (n * sxy - sx * sy) / denominator, np.nan)
+    return slopes.reshape(student_count, len(CODES))
+
+def _percentile_ranks(means: np.ndarray) -> np.ndarray:
+    """コンピテンシーごとの学生の平均点のパーセンタイル順位（同点は中間順位、データなしはNaN）"""
+    ranks = np.full(means.shape, np.nan)
+    for c in range(means.shape[1]):
+        column = means[:, c]
+        valid = ~np.isnan(column)
+        values = column[valid]
+        if not len(values):
+            continue
+        
+        ordered = np.sort(values)
+        below = np.searchsorted(ordered, values, side='left')
+        equal = np.searchsorted(ordered, values, side='right') - below
+        ranks[valid, c] = (below + 0.5 * equal) / len(values) * 100
+    return ranks
+
+def build_cohort_report(columns: ScoreColumns, cohort_filter: CohortFilter) -> Dict:
+    """コホート分析の集計（全てNumPyの配列演算で計算）"""
+    # セクション指定時は名簿の学生のみ（複数セクションに含まれる学生は最初のセクションに割り当てる）
+    section_names = list(cohort_filter.sections)
+    student_sections = np.full(len(columns.user_ids), -1, dtype=np.int64)
+    if section_names:
+        user_index = {user_id: index for index, user_id in enumerate(columns.user_ids)}
+        for section_index in reversed(range(len(section_names))):
+            members = [user_index[u] for u in cohort_filter.sections[section_names[section_index]] if u in user_index]
+            student_sections[members] = section_index
+        columns = columns.select(student_sections[columns.users] >= 0)
+    
+    if cohort_filter.competency:
+        columns = columns.select(columns.codes == CODE_INDEX[cohort_filter.competency])
+    codes = [CODE_INDEX[cohort_filter.competency]] if cohort_filter.competency else list(range(len(CODES)))
+    
+    student_count = len(columns.user_ids)
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'score_count': len(columns),
+        'student_count': int(len(np.unique(columns.users))),
+        'competencies': _competency_summary(_histograms(np.zeros_like(columns.codes), columns.codes, columns.scores, 1)[0], codes)
+    }
+    
+    # 週ごとの推移（月曜始まり、UNIX時刻0は木曜日）
+    days = columns.seconds // 86400
+    weeks = (days + 3) // 7
+    week_values, week_index = np.unique(weeks, return_inverse=True)
+    week_histograms = _histograms(week_index.reshape(-1), columns.codes, columns.scores, len(week_values))
+    report['weekly'] = [
+        {
+            'week_start': str(np.datetime64(int(week) * 7 - 3, 'D')),
+            'competencies': {
+                code: {key: value[key] for key in ('count', 'mean')}
+                for code, value in _competency_summary(week_histograms[w], codes).items()
+            }
+        }
+        for w, week in enumerate(week_values)
+    ]
+    
+    # セクション別の点数分布
+    if section_names:
+        row_sections = student_sections[columns.users]
+        section_histograms = _histograms(row_sections, columns.codes, columns.scores, len(section_names))
+        report['sections'] = [
+            {
+                'name': name,
+                'student_count': int(len(np.unique(columns.users[row_sections == s]))),
+                'competencies': _competency_summary(section_histograms[s], codes)
+            }
+            for s, name in enumerate(section_names)
+        ]
+    
+    # 学生ごとの平均・傾向（週あたりの変化量）・パーセンタイル順位
+    student_histograms = _histograms(columns.users, columns.codes, columns.scores, student_count)
+    student_counts = student_histograms.sum(axis=-1)
+    student_means = _means(student_histograms)
+    slopes = _trend_slopes(columns, student_count)
+    percentiles = _percentile_ranks(student_means)
+    
+    report['students'] = [
+        {
+            'user_id': columns.user_ids[u],
+            **({'section': section_names[student_sections[u]]} if section_names else {}),
+            'competencies': {
+                CODES[c]: {
+                    'count': int(student_counts[u, c]),
+                    'mean': _round(student_means[u, c]),
+                    'trend_per_week': _round(slopes[u, c]),
+                    'percentile': _round(percentiles[u, c])
+                }
+                for c in codes if student_counts[u, c]
+            }
+        }
+        for u in np.flatnonzero(student_counts.sum(axis=1))
+    ]
+    return report
+
+class CohortAnalytics:
+    """コホート分析の集計結果キャッシュ
+    
+    （期間, 絞り込み条件）ごとに集計結果を保持する。評価の保存時に invalidate() で全件を破棄し、
+    他プロセスからの保存は ttl 秒で反映する。集計中に保存があった場合は結果をキャッシュしない。
+    """
+    
+    def __init__(self, loader: Callable, ttl: float = 300, max_entries: int = 64):
+        self.loader = loader  # (start_date, end_date, prompt_version) -> [{user_id, timestamp, code, score}]
+        self.ttl = ttl
+        self.max_entries = max_entries
+        
+        self._entries = OrderedDict()  # key -> (report, expires_at)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0
+        }
+    
+    def invalidate(self, *_):
+        """評価の保存時に全ての集計結果を破棄"""
+        with self._lock:
+            self._generation += 1
+            if self._entries:
+                self._entries.clear()
+                self._stats['invalidations'] += 1
+    
+    def get_report(self, start_date: Optional[datetime], end_date: Optional[datetime],
+                   cohort_filter: CohortFilter) -> Dict:
+        key = cohort_filter.cache_key(start_date, end_date)
+        cached, generation = self._get(key)
+        if cached is not None:
+            return cached
+        
+        with track_stage('analytics.load'):
+            columns = ScoreColumns.from_rows(self.loader(start_date, end_date, cohort_filter.prompt_version))
+        with track_stage('analytics.compute'):
+            report = build_cohort_report(columns, cohort_filter)
+        
+        self._put(key, generation, report)
+        return report
+    
+    async def get_report_async(self, start_date: Optional[datetime], end_date: Optional[datetime],
+                               cohort_filter: CohortFilter) -> Dict:
+        """集計結果取得（asyncio版、loader はコルーチン関数、集計はスレッドプールで実行）"""
+        key = cohort_filter.cache_key(start_date, end_date)
+        cached, generation = self._get(key)
+        if cached is not None:
+            return cached
+        
+        rows = await self.loader(start_date, end_date, cohort_filter.prompt_version)
+        loop = asyncio.get_running_loop()
+        with track_stage('analytics.compute'):
+            columns = await loop.run_in_executor(None, ScoreColumns.from_rows, rows)
+            report = await loop.run_in_executor(None, build_cohort_report, columns, cohort_filter)
+        
+        self._put(key, generation, report)
+        return report
+    
+    def _get(self, key: str):
+        """キャッシュ済み結果と現在の世代の取得"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0], self._generation
+            
+            self._entries.pop(key, None)
+            self._stats['misses'] += 1
+            return None, self._generation
+    
+    def _put(self, key: str, generation: int, report: Dict):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (report, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, 'entries': len(self._entries), 'generation': self._generation}
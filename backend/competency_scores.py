@@ -0,0 +1,143 @@
+"""
+コンピテンシー評価結果の構造化モジュール
+AI評価結果の「◆ コンピテンシー名 ★★★★☆ (4/5)」形式の行を保存時に一度だけ解析して
+コンピテンシーコード・点数を取り出し、教員向けの集計（平均・分布）に使う
+"""
+import re
+from typing import Dict, Iterable, List, Optional
+
+from keyword_classifier import normalize_text
+from metrics import REGISTRY
+
+MAX_SCORE = 5
+
+# コンピテンシーコード -> (英語名, 日本語名)（prompts.jsonの記載順）
+COMPETENCIES = {
+    'R': ('Resilience', 'しなやかさ'),
+    'I': ('Initiative', '自発性'),
+    'T': ('Teamwork', 'チームワーク'),
+    'S': ('Self-efficacy', '自己効力感'),
+    'U': ('Understanding', '理解力'),
+    'M': ('Multitasking', 'マルチタスキング'),
+    'E': ('Empathy', '共感力'),
+    'C': ('Innovation', '変革力')
+}
+
+# 照合用の名称（正規化済み）-> コンピテンシーコード
+_ALIASES = [
+    (normalize_text(name), code)
+    for code, names in COMPETENCIES.items()
+    for name in names
+]
+
+_SCORE_PATTERN = re.compile(r'\(\s*(\d+(?:\.\d+)?)\s*/\s*(\d+)\s*\)')
+_STARS_PATTERN = re.compile(r'[★☆]+')
+
+PARSE_RESULTS = REGISTRY.counter(
+    'rai_competency_parse_total', 'Competency evaluations parsed at write time', ['outcome']
+)
+
+def _match_code(name: str) -> Optional[str]:
+    for alias, code in _ALIASES:
+        if alias in name:
+            return code
+    return None
+
+def competency_code(name: str) -> Optional[str]:
+    """コンピテンシー名（英語名・日本語名のいずれか）からコードを取得"""
+    return _match_code(normalize_text(name))
+
+def _parse_line(line: str) -> Optional[Dict]:
+    """◆行1行の解析（コンピテンシー名・点数が読み取れない場合はNone）"""
+    match = _SCORE_PATTERN.search(line)
+    stars = _STARS_PATTERN.search(line)
+    
+    # 名称は星・点数より前の部分
+    name_end = min(m.start() for m in (match, stars) if m) if (match or stars) else len(line)
+    code = _match_code(line[:name_end])
+    if code is None:
+        return None
+    
+    if match and float(match.group(2)) > 0:
+        score = round(float(match.group(1)) * MAX_SCORE / float(match.group(2)))
+    elif stars:
+        score = stars.group(0).count('★')
+    else:
+        return None
+    
+    return {'code': code, 'score': min(max(score, 1), MAX_SCORE)}
+
+def parse_competency_scores(text: Optional[str]) -> List[Dict]:
+    """評価結果テキストからコンピテンシーごとの点数を取得（同じコンピテンシーは最初の行のみ）
+    
+    全角括弧・全角数字はNFKC正規化で半角として扱う。点数は「(4/5)」の表記を優先し、
+    無い場合は★の数とする。一覧にない名称（例: 傾聴スキル）の行は無視する。
+    """
+    scores = []
+    seen = set()
+    for line in normalize_text(text).splitlines():
+        line = line.strip()
+        if not line.startswith('◆'):
+            continue
+        
+        parsed = _parse_line(line[1:])
+        if parsed and parsed['code'] not in seen:
+            seen.add(parsed['code'])
+            scores.append(parsed)
+    return scores
+
+def annotate_competency_scores(message_data: Dict) -> Dict:
+    """保存前に評価結果を構造化して competency_scores に格納（評価以外・解析済みの場合は何もしない）"""
+    if message_data.get('is_competency_evaluation') and 'competency_scores' not in message_data:
+        scores = parse_competency_scores(message_data.get('ai_response'))
+        message_data['competency_scores'] = scores
+        PARSE_RESULTS.labels('parsed' if scores else 'empty').inc()
+    return message_data
+
+def expand_competency_scores(records: Iterable[Dict], prompt_version: Optional[str] = None) -> List[Dict]:
+    """保存済みの構造化フィールドを1評価・1コンピテンシーごとの行に展開"""
+    return [
+        {
+            'user_id': record['user_id'],
+            'timestamp': record['timestamp'],
+            'code': entry['code'],
+            'score': entry['score']
+        }
+        for record in records
+        if prompt_version is None or record.get('prompt_version') == prompt_version
+        for entry in record.get('competency_scores') or ()
+    ]
+
+def count_competency_scores(records: Iterable[Dict], prompt_version: Optional[str] = None) -> List[Dict]:
+    """保存済みの構造化フィールドからコンピテンシー・点数ごとの件数を集計"""
+    counts = {}
+    for record in records:
+        if prompt_version is not None and record.get('prompt_version') != prompt_version:
+            continue
+        for entry in record.get('competency_scores') or ():
+            key = (entry['code'], entry['score'])
+            counts[key] = counts.get(key, 0) + 1
+    
+    return [{'code': code, 'score': score, 'count': count} for (code, score), count in counts.items()]
+
+def summarize_competency_scores(rows: Iterable[Dict]) -> List[Dict]:
+    """コンピテンシー・点数ごとの件数から平均・分布を算出（全コンピテンシーを記載順で返す）"""
+    distributions = {code: [0] * MAX_SCORE for code in COMPETENCIES}
+    for row in rows:
+        distribution = distributions.get(row['code'])
+        if distribution is not None and 1 <= row['score'] <= MAX_SCORE:
+            distribution[int(row['score']) - 1] += int(row['count'])
+    
+    summary = []
+    for code, (english, japanese) in COMPETENCIES.items():
+        distribution = distributions[code]
+        count = sum(distribution)
+        total = sum(score * n for score, n in enumerate(distribution, 1))
+        summary.append({
+            'code': code,
+            'name': f"{english}（{japanese}）",
+            'count': count,
+            'average': round(total / count, 2) if count else None,
+            'distribution': {str(score): n for score, n in enumerate(distribution, 1)}
+        })
+    return summary
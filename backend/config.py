@@ -16,18 +16,80 @@ class Config:
     AZURE_OPENAI_VERSION = os.environ.get('AZURE_OPENAI_VERSION', '2024-02-01')
     AZURE_OPENAI_DEPLOYMENT = os.environ.get('AZURE_OPENAI_DEPLOYMENT', 'gpt-4')
     
+    # Azure OpenAI送信制御（デプロイメントのクォータ。複数プロセスの場合はプロセスあたりの値、0で無制限）
+    AZURE_OPENAI_TPM = int(os.environ.get('AZURE_OPENAI_TPM', '0'))  # トークン/分
+    AZURE_OPENAI_RPM = int(os.environ.get('AZURE_OPENAI_RPM', '0'))  # リクエスト/分
+    AZURE_OPENAI_MAX_QUEUE_WAIT = float(os.environ.get('AZURE_OPENAI_MAX_QUEUE_WAIT', '30'))  # 秒（送信待ちの上限）
+    AZURE_OPENAI_MAX_RETRIES = int(os.environ.get('AZURE_OPENAI_MAX_RETRIES', '3'))  # 429応答時の再試行回数
+    AZURE_OPENAI_RETRY_BASE = float(os.environ.get('AZURE_OPENAI_RETRY_BASE', '1'))  # 秒（指数バックオフの初期値）
+    AZURE_OPENAI_RETRY_MAX = float(os.environ.get('AZURE_OPENAI_RETRY_MAX', '20'))  # 秒（バックオフの上限）
+    AZURE_OPENAI_REQUEST_TIMEOUT = float(os.environ.get('AZURE_OPENAI_REQUEST_TIMEOUT', '60'))  # 秒（応答待ちの上限、0でライブラリの既定値）
+    
+    # 複数デプロイメントへの振り分け（JSON配列、未設定時は上記の単一デプロイメントのみ）
+    # 例: [{"name": "east", "endpoint": "https://east.openai.azure.com/", "key": "...", "deployment": "gpt-4", "tpm": 80000}]
+    AZURE_OPENAI_DEPLOYMENTS = os.environ.get('AZURE_OPENAI_DEPLOYMENTS', '')
+    ROUTER_EWMA_ALPHA = float(os.environ.get('ROUTER_EWMA_ALPHA', '0.3'))  # 応答時間・エラー率の指数移動平均の重み
+    ROUTER_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('ROUTER_CIRCUIT_FAILURE_THRESHOLD', '5'))  # 連続失敗回数
+    ROUTER_CIRCUIT_RESET_TIMEOUT = float(os.environ.get('ROUTER_CIRCUIT_RESET_TIMEOUT', '30'))  # 秒（遮断から試行再開まで）
+    ROUTER_HEDGE_ENABLED = os.environ.get('ROUTER_HEDGE_ENABLED', 'false').lower() == 'true'
+    ROUTER_HEDGE_QUANTILE = float(os.environ.get('ROUTER_HEDGE_QUANTILE', '0.95'))  # この分位の応答時間を超えたら重複送信
+    ROUTER_HEDGE_MIN_DELAY = float(os.environ.get('ROUTER_HEDGE_MIN_DELAY', '1'))  # 秒（重複送信までの最短待ち時間）
+    
+    # モデル階層（JSON配列、採点が max_score 以下のリクエストを軽量モデルに送る。未設定時は上記の送信先のみ）
+    # 例: [{"name": "fast", "max_score": 2.0, "max_tokens": 400, "deployments": [{"deployment": "gpt-4o-mini"}]}]
+    MODEL_TIERS = os.environ.get('MODEL_TIERS', '')
+    # 採点の重み（JSONオブジェクト、例: {"general": 0, "per_100_tokens": 1.0, "keyword": 0.5, "history_turn": 0.25}）
+    MODEL_TIER_WEIGHTS = os.environ.get('MODEL_TIER_WEIGHTS', '')
+    
+    # プロンプト設定（prompts.jsonの更新は PROMPT_RELOAD_INTERVAL 秒以内に反映）
+    PROMPTS_FILE = os.environ.get('PROMPTS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prompts.json'))
+    PROMPT_RELOAD_INTERVAL = float(os.environ.get('PROMPT_RELOAD_INTERVAL', '5'))  # 秒（負の値で再読み込み無効）
+    
+    # キーワード分類の定義（コンピテンシー・状況・話題ごとのキーワード）
+    KEYWORDS_FILE = os.environ.get('KEYWORDS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'keywords.json'))
+    
+    # コンピテンシー評価キャッシュ設定
+    EVALUATION_CACHE_ENABLED = os.environ.get('EVALUATION_CACHE_ENABLED', 'true').lower() == 'true'
+    EVALUATION_CACHE_MAX_ENTRIES = int(os.environ.get('EVALUATION_CACHE_MAX_ENTRIES', '2048'))
+    EVALUATION_CACHE_TTL = float(os.environ.get('EVALUATION_CACHE_TTL', '86400'))  # 秒
+    EVALUATION_CACHE_DISK_PATH = os.environ.get('EVALUATION_CACHE_DISK_PATH', '')  # 空の場合はメモリのみ
+    
+    # 同じ内容の同時AI呼び出しを1回にまとめる（一斉送信・再送対策）
+    SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+    
+    # 会話コンテキスト設定（一般チャットで同一チャットの直近のやり取りをAIに渡す）
+    CONVERSATION_ENABLED = os.environ.get('CONVERSATION_ENABLED', 'true').lower() == 'true'
+    CONVERSATION_MAX_CHATS = int(os.environ.get('CONVERSATION_MAX_CHATS', '1000'))  # メモリに保持するチャット数
+    CONVERSATION_MAX_TURNS = int(os.environ.get('CONVERSATION_MAX_TURNS', '10'))  # そのまま渡すやり取りの件数（超過分は冒頭のみに切り詰める）
+    CONVERSATION_TOKEN_BUDGET = int(os.environ.get('CONVERSATION_TOKEN_BUDGET', '2000'))  # 会話履歴のトークン上限（推定）
+    CONVERSATION_SUMMARY_TOKENS = int(os.environ.get('CONVERSATION_SUMMARY_TOKENS', '300'))  # 切り詰めた古いやり取りのトークン上限
+    CONVERSATION_IDLE_TTL = float(os.environ.get('CONVERSATION_IDLE_TTL', '3600'))  # 秒（未使用のチャットを破棄）
+    
     # EntraID認証設定
     ENTRA_CLIENT_ID = os.environ.get('ENTRA_CLIENT_ID', 'your-client-id')
     ENTRA_CLIENT_SECRET = os.environ.get('ENTRA_CLIENT_SECRET', 'your-client-secret')
     ENTRA_TENANT_ID = os.environ.get('ENTRA_TENANT_ID', 'your-tenant-id')
     ENTRA_AUTHORITY = f"https://login.microsoftonline.com/{ENTRA_TENANT_ID or 'common'}"
+    ENTRA_ISSUER = os.environ.get('ENTRA_ISSUER', f"{ENTRA_AUTHORITY}/v2.0")
+    ENTRA_JWKS_URI = os.environ.get('ENTRA_JWKS_URI', f"{ENTRA_AUTHORITY}/discovery/v2.0/keys")
+    ENTRA_JWKS_REFRESH_INTERVAL = float(os.environ.get('ENTRA_JWKS_REFRESH_INTERVAL', '3600'))  # 秒
+    ENTRA_JWKS_MIN_REFRESH_INTERVAL = float(os.environ.get('ENTRA_JWKS_MIN_REFRESH_INTERVAL', '30'))  # 未知のkid受信時の再取得間隔（秒）
+    GRAPH_API_ENDPOINT = os.environ.get('GRAPH_API_ENDPOINT', 'https://graph.microsoft.com/v1.0')
+    ENTRA_HTTP_TIMEOUT = float(os.environ.get('ENTRA_HTTP_TIMEOUT', '5'))  # 秒
+    ENTRA_HTTP_POOL_SIZE = int(os.environ.get('ENTRA_HTTP_POOL_SIZE', '10'))
+    ENTRA_PROFILE_CACHE_TTL = float(os.environ.get('ENTRA_PROFILE_CACHE_TTL', '300'))  # Graphプロフィールのキャッシュ秒数
     
     # JWT設定
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', SECRET_KEY)
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=8)  # 8時間で期限切れ
+    TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', '10000'))  # 検証済みトークンキャッシュ上限
     
     # データベース設定
-    DATABASE_TYPE = os.environ.get('DATABASE_TYPE', 'cosmosdb')  # 'cosmosdb' or 'sharepoint'
+    DATABASE_TYPE = os.environ.get('DATABASE_TYPE', 'cosmosdb')  # 'cosmosdb', 'sharepoint', 'sqlite' or 'memory'
+    
+    # SQLite設定（DATABASE_TYPE=sqlite の場合。'memory' はプロセス内のインメモリDB）
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'rai_advising.db')
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '5'))  # 秒（ロック待ちの上限）
     
     # CosmosDB設定
     COSMOS_ENDPOINT = os.environ.get('COSMOS_ENDPOINT', 'https://your-account.documents.azure.com:443/')
@@ -36,12 +98,42 @@ class Config:
     COSMOS_CONTAINER_CHATS = os.environ.get('COSMOS_CONTAINER_CHATS', 'chats')
     COSMOS_CONTAINER_USERS = os.environ.get('COSMOS_CONTAINER_USERS', 'users')
     
+    # ライトビハインド永続化設定（保存をキューに積みバックグラウンドでバッチ書き込み）
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+    WRITE_BEHIND_MAX_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_MAX_QUEUE_SIZE', '10000'))  # キュー上限（メモリ使用量の上限）
+    WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', '50'))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', '0.5'))  # 秒
+    WRITE_BEHIND_MAX_RETRIES = int(os.environ.get('WRITE_BEHIND_MAX_RETRIES', '3'))
+    WRITE_BEHIND_RETRY_BACKOFF = float(os.environ.get('WRITE_BEHIND_RETRY_BACKOFF', '0.5'))  # 秒（指数バックオフの初期値）
+    WRITE_BEHIND_DEAD_LETTER_FILE = os.environ.get('WRITE_BEHIND_DEAD_LETTER_FILE', 'write_behind_dead_letter.jsonl')
+    
+    # 使用統計設定（集計クエリを毎回実行せず、保存時に更新した値を返す。全件走査による補正間隔は秒）
+    USAGE_STATS_MATERIALIZED = os.environ.get('USAGE_STATS_MATERIALIZED', 'true').lower() == 'true'
+    USAGE_STATS_RECONCILE_INTERVAL = float(os.environ.get('USAGE_STATS_RECONCILE_INTERVAL', '900'))
+    USAGE_STATS_HLL_PRECISION = int(os.environ.get('USAGE_STATS_HLL_PRECISION', '12'))  # アクティブユーザー推定の精度（誤差約1.6%）
+    
+    # CSVエクスポート設定（ストリーミングモードで1回のクエリで取得する件数）
+    EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '200'))
+    
+    # コホート分析設定（集計結果のキャッシュ。評価の保存時に破棄し、他プロセスからの保存はTTLで反映）
+    ANALYTICS_CACHE_TTL = float(os.environ.get('ANALYTICS_CACHE_TTL', '300'))  # 秒
+    ANALYTICS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYTICS_CACHE_MAX_ENTRIES', '64'))
+    
+    # 教員向け一括コンピテンシー評価設定
+    BULK_EVALUATION_WORKERS = int(os.environ.get('BULK_EVALUATION_WORKERS', '4'))  # 同時に評価する件数（全ジョブ共通）
+    BULK_EVALUATION_MAX_ITEMS = int(os.environ.get('BULK_EVALUATION_MAX_ITEMS', '500'))  # 1ジョブの最大件数
+    BULK_EVALUATION_SAVE_BATCH_SIZE = int(os.environ.get('BULK_EVALUATION_SAVE_BATCH_SIZE', '20'))
+    BULK_EVALUATION_MAX_RUNNING_JOBS = int(os.environ.get('BULK_EVALUATION_MAX_RUNNING_JOBS', '2'))
+    BULK_EVALUATION_JOB_TTL = float(os.environ.get('BULK_EVALUATION_JOB_TTL', '3600'))  # 秒（完了後に進捗を保持する時間）
+    
     # SharePoint設定
     SHAREPOINT_SITE_URL = os.environ.get('SHAREPOINT_SITE_URL', 'https://ritsumeikan.sharepoint.com/sites/your-site')
     SHAREPOINT_CLIENT_ID = os.environ.get('SHAREPOINT_CLIENT_ID', 'your-sharepoint-client-id')
     SHAREPOINT_CLIENT_SECRET = os.environ.get('SHAREPOINT_CLIENT_SECRET', 'your-sharepoint-secret')
     SHAREPOINT_LIST_CHATS = os.environ.get('SHAREPOINT_LIST_CHATS', 'RAI_Chats')
     SHAREPOINT_LIST_USERS = os.environ.get('SHAREPOINT_LIST_USERS', 'RAI_Users')
+    # 評価結果の構造化データを保存する列（複数行テキスト）。既存のリストには無いため、列を追加した場合のみ true にする
+    SHAREPOINT_COMPETENCY_SCORES_ENABLED = os.environ.get('SHAREPOINT_COMPETENCY_SCORES_ENABLED', 'false').lower() == 'true'
     
     # ログ設定
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -58,7 +150,11 @@ class Config:
     
     # モックモード設定（開発・テスト用）
     MOCK_MODE = os.environ.get('MOCK_MODE', 'true').lower() == 'true'
+    MOCK_AI = os.environ.get('MOCK_AI', 'true').lower() == 'true'  # falseの場合はMOCK_MODEでもAIのみ実際の接続先（スタブ等）を使う
     MOCK_AI_DELAY = float(os.environ.get('MOCK_AI_DELAY', '1.5'))  # AI応答の遅延シミュレーション（秒）
+    MOCK_AI_LATENCY = os.environ.get('MOCK_AI_LATENCY', '')  # 遅延分布（例: 'lognormal:1.2,0.5'、空の場合はMOCK_AI_DELAY固定）
+    MOCK_AI_LATENCY_SEED = int(os.environ['MOCK_AI_LATENCY_SEED']) if os.environ.get('MOCK_AI_LATENCY_SEED') else None
+    MOCK_STREAM_CHUNK_SIZE = int(os.environ.get('MOCK_STREAM_CHUNK_SIZE', '8'))  # ストリーミング時のモックチャンク長（文字数）
     
     @staticmethod
     def init_app(app):
@@ -0,0 +1,198 @@
+"""
+会話コンテキストモジュール
+チャットごとの直近のやり取りをメモリ上に保持し、トークン上限内で会話履歴としてAIに渡す
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from ai_service import GENERAL_ERROR_RESPONSE
+from prompt_registry import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+EARLIER_TURNS_HEADER = "これまでの会話（古いやり取り、各発言の冒頭のみ）:"
+EARLIER_SNIPPET_LENGTH = 80
+
+def _snippet(text: str) -> str:
+    text = ' '.join((text or '').split())
+    return text if len(text) <= EARLIER_SNIPPET_LENGTH else text[:EARLIER_SNIPPET_LENGTH] + '…'
+
+class _Conversation:
+    """1チャット分のコンテキスト（直近のやり取りと、冒頭のみに切り詰めた古いやり取り）"""
+    
+    def __init__(self, max_turns: int):
+        self.turns = deque()  # (user_message, ai_response, tokens)
+        self.turn_tokens = 0
+        self.earlier_lines = deque()  # (line, tokens)
+        self.earlier_tokens = 0
+        self.max_turns = max_turns
+        self.last_used = time.monotonic()
+
+class ConversationContextStore:
+    """チャットごとの会話コンテキスト（LRU）
+    
+    直近のやり取りは最大 max_turns 件・合計 token_budget トークンまで保持し、
+    超過した古いやり取りは各発言の冒頭だけを残した1行に切り詰める（要約はしない）。
+    切り詰めた行も合計 summary_tokens を超えた分は古い順に破棄する。
+    キャッシュに無いチャットは loader（DBの会話履歴）から再構築する。
+    コンピテンシー評価と、AI呼び出しに失敗した際の定型応答はコンテキストに含めない。
+    複数プロセスで動作する場合、別プロセスで処理されたやり取りはそのプロセスで
+    キャッシュが破棄されるまで反映されない。
+    """
+    
+    def __init__(self, max_chats: int = 1000, max_turns: int = 20, token_budget: int = 2000,
+                 summary_tokens: int = 300, idle_ttl: float = 3600):
+        self.max_chats = max_chats
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.idle_ttl = idle_ttl
+        
+        self._conversations = OrderedDict()  # (user_id, chat_id) -> _Conversation
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'rebuilds': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'truncated_turns': 0
+        }
+    
+    def get(self, user_id: str, chat_id: str) -> Optional[List[Dict]]:
+        """会話履歴をChat Completions形式で取得（キャッシュに無い場合はNone）"""
+        key = (user_id, chat_id)
+        now = time.monotonic()
+        
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is not None and now - conversation.last_used > self.idle_ttl:
+                del self._conversations[key]
+                self._stats['expirations'] += 1
+                conversation = None
+            
+            if conversation is None:
+                self._stats['misses'] += 1
+                return None
+            
+            conversation.last_used = now
+            self._conversations.move_to_end(key)
+            self._stats['hits'] += 1
+            return self._render(conversation)
+    
+    def load(self, user_id: str, chat_id: str, turns: List[Dict]) -> List[Dict]:
+        """DBの会話履歴（古い順）からコンテキストを再構築（コンピテンシー評価・失敗時の定型応答は含めない）"""
+        conversation = _Conversation(self.max_turns)
+        turns = [
+            turn for turn in turns
+            if not turn.get('is_competency_evaluation') and turn.get('ai_response') != GENERAL_ERROR_RESPONSE
+        ]
+        
+        with self._lock:
+            for turn in turns:
+                self._append(conversation, turn.get('user_message', ''), turn.get('ai_response', ''))
+            self._store(user_id, chat_id, conversation)
+            if turns:
+                self._stats['rebuilds'] += 1
+            return self._render(conversation)
+    
+    def get_messages(self, user_id: str, chat_id: str,
+                     loader: Optional[Callable[[str, str], List[Dict]]] = None) -> List[Dict]:
+        """会話履歴取得（キャッシュに無い場合は loader で再構築、loader省略時は新規チャット）"""
+        messages = self.get(user_id, chat_id)
+        if messages is not None:
+            return messages
+        
+        turns = []
+        if loader is not None:
+            try:
+                turns = loader(user_id, chat_id)
+            except Exception as e:
+                logger.error(f"Conversation context rebuild error: {str(e)}")
+        return self.load(user_id, chat_id, turns)
+    
+    async def get_messages_async(self, user_id: str, chat_id: str,
+                                 loader: Optional[Callable[[str, str], Awaitable[List[Dict]]]] = None) -> List[Dict]:
+        """会話履歴取得（get_messages のasyncio版、loader はコルーチン関数）"""
+        messages = self.get(user_id, chat_id)
+        if messages is not None:
+            return messages
+        
+        turns = []
+        if loader is not None:
+            try:
+                turns = await loader(user_id, chat_id)
+            except Exception as e:
+                logger.error(f"Conversation context rebuild error: {str(e)}")
+        return self.load(user_id, chat_id, turns)
+    
+    def append_turn(self, user_id: str, chat_id: str, user_message: str, ai_response: str):
+        """やり取りを追加（キャッシュに無いチャットは新規として扱う）"""
+        key = (user_id, chat_id)
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                conversation = _Conversation(self.max_turns)
+                self._store(user_id, chat_id, conversation)
+            else:
+                conversation.last_used = time.monotonic()
+                self._conversations.move_to_end(key)
+            self._append(conversation, user_message, ai_response)
+    
+    def _store(self, user_id: str, chat_id: str, conversation: _Conversation):
+        """キャッシュ登録（ロック取得済みで呼び出す）"""
+        self._conversations[(user_id, chat_id)] = conversation
+        self._conversations.move_to_end((user_id, chat_id))
+        while len(self._conversations) > self.max_chats:
+            self._conversations.popitem(last=False)
+            self._stats['evictions'] += 1
+    
+    def _append(self, conversation: _Conversation, user_message: str, ai_response: str):
+        tokens = estimate_tokens(user_message) + estimate_tokens(ai_response)
+        conversation.turns.append((user_message, ai_response, tokens))
+        conversation.turn_tokens += tokens
+        
+        # 件数・トークン上限を超えた古いやり取りを切り詰めて畳み込む（直近の1件は常に残す）
+        while len(conversation.turns) > 1 and (
+            len(conversation.turns) > conversation.max_turns or conversation.turn_tokens > self.token_budget
+        ):
+            old_user, old_response, old_tokens = conversation.turns.popleft()
+            conversation.turn_tokens -= old_tokens
+            self._truncate(conversation, old_user, old_response)
+    
+    def _truncate(self, conversation: _Conversation, user_message: str, ai_response: str):
+        line = f"- 学生: {_snippet(user_message)} / R-AI: {_snippet(ai_response)}"
+        tokens = estimate_tokens(line)
+        conversation.earlier_lines.append((line, tokens))
+        conversation.earlier_tokens += tokens
+        self._stats['truncated_turns'] += 1
+        
+        while conversation.earlier_lines and conversation.earlier_tokens > self.summary_tokens:
+            _, dropped_tokens = conversation.earlier_lines.popleft()
+            conversation.earlier_tokens -= dropped_tokens
+    
+    def _render(self, conversation: _Conversation) -> List[Dict]:
+        messages = []
+        if conversation.earlier_lines:
+            earlier = '\n'.join([EARLIER_TURNS_HEADER] + [line for line, _ in conversation.earlier_lines])
+            messages.append({"role": "system", "content": earlier})
+        
+        for user_message, ai_response, _ in conversation.turns:
+            messages.append({"role": "user", "content": user_message})
+            messages.append({"role": "assistant", "content": ai_response})
+        return messages
+    
+    def get_stats(self) -> Dict:
+        """ヒット率・保持チャット数などの統計取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['chats'] = len(self._conversations)
+        
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['max_chats'] = self.max_chats
+        stats['token_budget'] = self.token_budget
+        return stats
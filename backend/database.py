@@ -1,18 +1,65 @@
 """
 データベース管理モジュール
-CosmosDBとSharePointの両方に対応
+CosmosDB・SharePoint・SQLite（ローカル用）に対応
 """
+import asyncio
+import base64
 import json
 import logging
+import sqlite3
+import threading
+import time
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Any
+from urllib.parse import unquote, urlparse
 import uuid
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 
+from competency_scores import (
+    annotate_competency_scores, count_competency_scores, expand_competency_scores, summarize_competency_scores
+)
 from config import Config
+from evaluation_query import EXCERPT_FIELDS, EXCERPT_LENGTH, EvaluationQuery
+from metrics import QUEUE_DEPTH, record_error, track_stage
+from usage_stats import UsageStatistics, UsageStatsReconciler
+from write_behind import AsyncWriteBehindQueue, WriteBehindQueue
 
 logger = logging.getLogger(__name__)
 
+def encode_cursor(state: Dict) -> str:
+    """ページングカーソルの符号化（クライアントには不透明な文字列として渡す）"""
+    payload = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Dict:
+    """ページングカーソルの復号（不正な場合はValueError）"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    
+    if not isinstance(state, dict):
+        raise ValueError('Invalid cursor')
+    return state
+
+def odata_string(value: str) -> str:
+    """ODataのフィルター式に埋め込む文字列リテラル（' は '' にエスケープ）"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def extract_skiptoken(next_link: str) -> Optional[str]:
+    """次ページURLから$skiptokenの値をURLエンコードされたまま取り出す
+    
+    値（例: Paged=TRUE&p_ID=5）は & や = を含むため、復号するとそのままクエリ文字列に戻せない。
+    """
+    for part in urlparse(next_link).query.split('&'):
+        name, _, value = part.partition('=')
+        if unquote(name) == '$skiptoken':
+            return value or None
+    return None
+
 class DatabaseInterface(ABC):
     """データベースインターフェース"""
     
@@ -20,21 +67,118 @@ class DatabaseInterface(ABC):
     def save_chat_message(self, message_data: Dict) -> bool:
         pass
     
+    def save_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        """複数メッセージ保存（保存に失敗したメッセージを返す）"""
+        return [message_data for message_data in messages if not self.save_chat_message(message_data)]
+    
     @abstractmethod
     def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
         pass
     
+    def get_chat_history_page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """チャット履歴のページ取得（既定ではオフセットをカーソルに格納する）"""
+        offset = int(decode_cursor(cursor).get('offset', 0)) if cursor else 0
+        items = self.get_chat_history(user_id, limit + 1, offset)
+        
+        next_cursor = encode_cursor({'offset': offset + limit}) if len(items) > limit else None
+        return {'items': items[:limit], 'next_cursor': next_cursor}
+    
+    def get_chat_turns(self, user_id: str, chat_id: str, limit: int = 20) -> List[Dict]:
+        """チャット1件分の直近のやり取りを古い順に取得（既定では履歴のページを走査して絞り込む）"""
+        turns = []
+        cursor = None
+        while True:
+            page = self.get_chat_history_page(user_id, 100, cursor)
+            turns.extend(item for item in page['items'] if item.get('chat_id') == chat_id)
+            cursor = page['next_cursor']
+            if len(turns) >= limit or not cursor:
+                break
+        
+        turns = turns[:limit]
+        turns.reverse()
+        return turns
+    
     @abstractmethod
     def get_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None) -> List[Dict]:
         pass
     
+    def iter_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None,
+                                    page_size: int = 100) -> Iterator[Dict]:
+        """コンピテンシー評価データの逐次取得（既定では一括取得した結果を順に返す）"""
+        yield from self.get_competency_evaluations(start_date, end_date)
+    
+    def get_competency_evaluation_page(self, query: EvaluationQuery) -> Dict:
+        """評価一覧のページ取得（既定では期間内の評価を走査して絞り込み・並べ替えし、オフセットをカーソルに格納する）"""
+        return self._paginate_evaluations(query, self.iter_competency_evaluations(query.start_date, query.end_date))
+    
+    def _paginate_evaluations(self, query: EvaluationQuery, records: Iterable[Dict]) -> Dict:
+        """走査した評価の絞り込み・並べ替え・オフセットによるページ分割"""
+        offset = int(self._decode_evaluation_cursor(query).get('offset', 0))
+        records = [record for record in records if query.matches(record)]
+        records.sort(key=query.sort_value, reverse=query.descending)
+        
+        page = records[offset:offset + query.limit]
+        next_cursor = None
+        if len(records) > offset + query.limit:
+            next_cursor = encode_cursor({'sort': query.sort_key, 'offset': offset + query.limit})
+        return {'items': query.project_all(page), 'next_cursor': next_cursor}
+    
+    def _decode_evaluation_cursor(self, query: EvaluationQuery) -> Dict:
+        """評価一覧のカーソルの復号（並べ替え条件が異なる場合はValueError）"""
+        if not query.cursor:
+            return {}
+        state = decode_cursor(query.cursor)
+        if state.get('sort') != query.sort_key:
+            raise ValueError('Invalid cursor')
+        return state
+    
+    def get_competency_score_distribution(self, start_date: datetime = None, end_date: datetime = None,
+                                          prompt_version: Optional[str] = None) -> List[Dict]:
+        """コンピテンシー・点数ごとの件数（既定では評価データの構造化フィールドを走査して集計）"""
+        return count_competency_scores(self.iter_competency_evaluations(start_date, end_date), prompt_version)
+    
+    def get_competency_score_records(self, start_date: datetime = None, end_date: datetime = None,
+                                     prompt_version: Optional[str] = None) -> List[Dict]:
+        """評価点数の一覧（1評価・1コンピテンシーごとの user_id・timestamp・code・score、既定では構造化フィールドを展開）"""
+        return expand_competency_scores(self.iter_competency_evaluations(start_date, end_date), prompt_version)
+    
     @abstractmethod
     def get_usage_statistics(self) -> Dict:
         pass
+    
+    @abstractmethod
+    def iter_usage_records(self, page_size: int = 1000) -> Iterator[Dict]:
+        """使用統計の補正用に全メッセージのuser_id・評価フラグを逐次取得"""
+        pass
 
 class CosmosDBManager(DatabaseInterface):
     """CosmosDB管理クラス"""
     
+    TOTAL_MESSAGES_QUERY = "SELECT VALUE COUNT(1) FROM c"
+    COMPETENCY_COUNT_QUERY = "SELECT VALUE COUNT(1) FROM c WHERE c.is_competency_evaluation = true"
+    ACTIVE_USERS_QUERY = "SELECT VALUE COUNT(DISTINCT c.user_id) FROM c"
+    USAGE_RECORDS_QUERY = "SELECT c.user_id, c.is_competency_evaluation FROM c"
+    SCORE_RECORD_FIELDS = ['user_id', 'timestamp', 'prompt_version', 'competency_scores']
+    MAX_BATCH_OPERATIONS = 100  # トランザクションバッチの操作数上限
+    
+    # チャットコンテナのインデックス（評価一覧の学生ID順の並べ替えには複合インデックスが必要）
+    # 既存のコンテナには適用されないため、作成済みの場合はポータル等でインデックスポリシーを更新する
+    CHAT_INDEXING_POLICY = {
+        'indexingMode': 'consistent',
+        'includedPaths': [{'path': '/*'}],
+        'excludedPaths': [{'path': '/"_etag"/?'}],
+        'compositeIndexes': [
+            [
+                {'path': '/is_competency_evaluation', 'order': 'ascending'},
+                {'path': '/timestamp', 'order': 'descending'}
+            ],
+            [
+                {'path': '/user_id', 'order': 'ascending'},
+                {'path': '/timestamp', 'order': 'ascending'}
+            ]
+        ]
+    }
+    
     def __init__(self, config: Config):
         self.config = config
         self.client = None
@@ -64,6 +208,7 @@ class CosmosDBManager(DatabaseInterface):
             self.chat_container = self.database.create_container_if_not_exists(
                 id=self.config.COSMOS_CONTAINER_CHATS,
                 partition_key=PartitionKey(path="/user_id"),
+                indexing_policy=self.CHAT_INDEXING_POLICY,
                 offer_throughput=400
             )
             
@@ -86,19 +231,7 @@ class CosmosDBManager(DatabaseInterface):
                 logger.info(f"[MOCK] Saving chat message: {message_data['chat_id']}")
                 return True
             
-            # ドキュメント構造
-            document = {
-                'id': str(uuid.uuid4()),
-                'chat_id': message_data['chat_id'],
-                'user_id': message_data['user_id'],
-                'user_message': message_data['user_message'],
-                'ai_response': message_data['ai_response'],
-                'is_competency_evaluation': message_data['is_competency_evaluation'],
-                'timestamp': message_data['timestamp'],
-                'session_info': message_data.get('session_info', {}),
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'ttl': None  # TTL設定（必要に応じて）
-            }
+            document = self._build_document(message_data)
             
             self.chat_container.create_item(body=document)
             logger.info(f"Chat message saved: {document['id']}")
@@ -108,30 +241,62 @@ class CosmosDBManager(DatabaseInterface):
             logger.error(f"Error saving chat message: {str(e)}")
             return False
     
+    def save_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        """パーティションキー（user_id）ごとのトランザクションバッチで一括保存"""
+        if self.config.MOCK_MODE:
+            logger.info(f"[MOCK] Saving {len(messages)} chat messages in batch")
+            return []
+        
+        groups = {}
+        for message_data in messages:
+            # 再試行時も同じIDでupsertされるよう、IDはメッセージ側に保持する
+            message_data.setdefault('id', str(uuid.uuid4()))
+            groups.setdefault(message_data['user_id'], []).append(message_data)
+        
+        failed = []
+        for user_id, group in groups.items():
+            for i in range(0, len(group), self.MAX_BATCH_OPERATIONS):
+                chunk = group[i:i + self.MAX_BATCH_OPERATIONS]
+                try:
+                    operations = [("upsert", (self._build_document(message_data),)) for message_data in chunk]
+                    self.chat_container.execute_item_batch(batch_operations=operations, partition_key=user_id)
+                except Exception as e:
+                    logger.error(f"Error saving chat message batch for user {user_id}: {str(e)}")
+                    failed.extend(chunk)
+        
+        logger.info(f"Chat message batch saved: {len(messages) - len(failed)}/{len(messages)}")
+        return failed
+    
+    def _build_document(self, message_data: Dict) -> Dict:
+        """保存用ドキュメント構造構築"""
+        return {
+            'id': message_data.get('id') or str(uuid.uuid4()),
+            'chat_id': message_data['chat_id'],
+            'user_id': message_data['user_id'],
+            'user_message': message_data['user_message'],
+            'ai_response': message_data['ai_response'],
+            'is_competency_evaluation': message_data['is_competency_evaluation'],
+            'prompt_version': message_data.get('prompt_version'),
+            'competency_scores': message_data.get('competency_scores', []),
+            'timestamp': message_data['timestamp'],
+            'session_info': message_data.get('session_info', {}),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'ttl': None  # TTL設定（必要に応じて）
+        }
+    
     def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
         """チャット履歴取得"""
         try:
             if self.config.MOCK_MODE:
                 return self._get_mock_chat_history(user_id, limit, offset)
             
-            query = """
-                SELECT c.chat_id, c.user_message, c.ai_response, c.is_competency_evaluation, c.timestamp
-                FROM c 
-                WHERE c.user_id = @user_id
-                ORDER BY c.timestamp DESC
-                OFFSET @offset LIMIT @limit
-            """
-            
-            parameters = [
-                {"name": "@user_id", "value": user_id},
-                {"name": "@offset", "value": offset},
-                {"name": "@limit", "value": limit}
-            ]
+            query, parameters = self._build_chat_history_query(user_id, limit, offset)
             
+            # コンテナは/user_idでパーティション分割されているため単一パーティションで実行
             results = list(self.chat_container.query_items(
                 query=query,
                 parameters=parameters,
-                enable_cross_partition_query=True
+                partition_key=user_id
             ))
             
             return results
@@ -140,24 +305,62 @@ class CosmosDBManager(DatabaseInterface):
             logger.error(f"Error getting chat history: {str(e)}")
             return []
     
+    def get_chat_history_page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """チャット履歴のページ取得（CosmosDBの継続トークンを使用）"""
+        if self.config.MOCK_MODE:
+            return super().get_chat_history_page(user_id, limit, cursor)
+        
+        continuation = decode_cursor(cursor).get('token') if cursor else None
+        
+        try:
+            query, parameters = self._build_chat_history_query(user_id)
+            
+            pager = self.chat_container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=user_id,
+                max_item_count=limit
+            ).by_page(continuation)
+            
+            items = list(next(pager, []))
+            token = pager.continuation_token
+            
+            return {
+                'items': items,
+                'next_cursor': encode_cursor({'token': token}) if token else None
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting chat history page: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+    
+    def get_chat_turns(self, user_id: str, chat_id: str, limit: int = 20) -> List[Dict]:
+        """チャット1件分の直近のやり取りを古い順に取得"""
+        if self.config.MOCK_MODE:
+            return super().get_chat_turns(user_id, chat_id, limit)
+        
+        try:
+            query, parameters = self._build_chat_turns_query(user_id, chat_id, limit)
+            
+            results = list(self.chat_container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=user_id
+            ))
+            results.reverse()
+            return results
+        
+        except Exception as e:
+            logger.error(f"Error getting chat turns: {str(e)}")
+            return []
+    
     def get_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None) -> List[Dict]:
         """コンピテンシー評価データ取得"""
         try:
             if self.config.MOCK_MODE:
                 return self._get_mock_competency_evaluations(start_date, end_date)
             
-            query = "SELECT * FROM c WHERE c.is_competency_evaluation = true"
-            parameters = []
-            
-            if start_date:
-                query += " AND c.timestamp >= @start_date"
-                parameters.append({"name": "@start_date", "value": start_date.isoformat()})
-            
-            if end_date:
-                query += " AND c.timestamp <= @end_date"
-                parameters.append({"name": "@end_date", "value": end_date.isoformat()})
-            
-            query += " ORDER BY c.timestamp DESC"
+            query, parameters = self._build_competency_query(start_date, end_date)
             
             results = list(self.chat_container.query_items(
                 query=query,
@@ -171,6 +374,93 @@ class CosmosDBManager(DatabaseInterface):
             logger.error(f"Error getting competency evaluations: {str(e)}")
             return []
     
+    def iter_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None,
+                                    page_size: int = 100) -> Iterator[Dict]:
+        """コンピテンシー評価データをページ単位で逐次取得"""
+        if self.config.MOCK_MODE:
+            yield from self._get_mock_competency_evaluations(start_date, end_date)
+            return
+        
+        query, parameters = self._build_competency_query(
+            start_date, end_date,
+            fields=['timestamp', 'user_id', 'chat_id', 'user_message', 'ai_response']
+        )
+        
+        pages = self.chat_container.query_items(
+            query=query,
+            parameters=parameters,
+            enable_cross_partition_query=True,
+            max_item_count=page_size
+        ).by_page()
+        
+        for page in pages:
+            yield from page
+    
+    def get_competency_evaluation_page(self, query: EvaluationQuery) -> Dict:
+        """評価一覧のページ取得（絞り込み・並べ替えはサーバー側で行い、CosmosDBの継続トークンを使用）"""
+        if self.config.MOCK_MODE:
+            return super().get_competency_evaluation_page(query)
+        
+        continuation = self._decode_evaluation_cursor(query).get('token')
+        
+        try:
+            sql, parameters = self._build_evaluation_page_query(query)
+            
+            # 学生ID指定時は単一パーティションで実行
+            scope = {'partition_key': query.user_id} if query.user_id else {'enable_cross_partition_query': True}
+            pager = self.chat_container.query_items(
+                query=sql,
+                parameters=parameters,
+                max_item_count=query.limit,
+                **scope
+            ).by_page(continuation)
+            
+            items = list(next(pager, []))
+            token = pager.continuation_token
+            
+            return {
+                'items': query.project_all(items),
+                'next_cursor': encode_cursor({'sort': query.sort_key, 'token': token}) if token else None
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting competency evaluation page: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+    
+    def get_competency_score_distribution(self, start_date: datetime = None, end_date: datetime = None,
+                                          prompt_version: Optional[str] = None) -> List[Dict]:
+        """コンピテンシー・点数ごとの件数（構造化フィールドをJOINしてサーバー側で集計）"""
+        try:
+            if self.config.MOCK_MODE:
+                return count_competency_scores(self._get_mock_competency_evaluations(start_date, end_date), prompt_version)
+            
+            query, parameters = self._build_score_distribution_query(start_date, end_date, prompt_version)
+            
+            return list(self.chat_container.query_items(
+                query=query,
+                parameters=parameters,
+                enable_cross_partition_query=True
+            ))
+            
+        except Exception as e:
+            logger.error(f"Error getting competency score distribution: {str(e)}")
+            return []
+    
+    def get_competency_score_records(self, start_date: datetime = None, end_date: datetime = None,
+                                      prompt_version: Optional[str] = None) -> List[Dict]:
+        """評価点数の一覧（本文を除いた構造化フィールドのみを射影して取得）"""
+        if self.config.MOCK_MODE:
+            return expand_competency_scores(self._get_mock_competency_evaluations(start_date, end_date), prompt_version)
+        
+        query, parameters = self._build_competency_query(start_date, end_date, fields=self.SCORE_RECORD_FIELDS)
+        
+        records = self.chat_container.query_items(
+            query=query,
+            parameters=parameters,
+            enable_cross_partition_query=True
+        )
+        return expand_competency_scores(records, prompt_version)
+    
     def get_usage_statistics(self) -> Dict:
         """使用統計取得"""
         try:
@@ -178,23 +468,20 @@ class CosmosDBManager(DatabaseInterface):
                 return self._get_mock_usage_statistics()
             
             # 総メッセージ数
-            total_messages_query = "SELECT VALUE COUNT(1) FROM c"
             total_messages = list(self.chat_container.query_items(
-                query=total_messages_query,
+                query=self.TOTAL_MESSAGES_QUERY,
                 enable_cross_partition_query=True
             ))[0]
             
             # コンピテンシー評価数
-            competency_query = "SELECT VALUE COUNT(1) FROM c WHERE c.is_competency_evaluation = true"
             competency_count = list(self.chat_container.query_items(
-                query=competency_query,
+                query=self.COMPETENCY_COUNT_QUERY,
                 enable_cross_partition_query=True
             ))[0]
             
             # アクティブユーザー数
-            active_users_query = "SELECT VALUE COUNT(DISTINCT c.user_id) FROM c"
             active_users = list(self.chat_container.query_items(
-                query=active_users_query,
+                query=self.ACTIVE_USERS_QUERY,
                 enable_cross_partition_query=True
             ))[0]
             
@@ -209,6 +496,137 @@ class CosmosDBManager(DatabaseInterface):
             logger.error(f"Error getting usage statistics: {str(e)}")
             return {}
     
+    def iter_usage_records(self, page_size: int = 1000) -> Iterator[Dict]:
+        """使用統計の補正用に全メッセージのuser_id・評価フラグを逐次取得"""
+        if self.config.MOCK_MODE:
+            return
+        
+        yield from self.chat_container.query_items(
+            query=self.USAGE_RECORDS_QUERY,
+            enable_cross_partition_query=True,
+            max_item_count=page_size
+        )
+    
+    def _build_chat_turns_query(self, user_id: str, chat_id: str, limit: int):
+        """チャット1件分の直近のやり取りのクエリ構築（新しい順）"""
+        query = """
+            SELECT c.chat_id, c.user_message, c.ai_response, c.is_competency_evaluation, c.timestamp
+            FROM c 
+            WHERE c.user_id = @user_id AND c.chat_id = @chat_id
+            ORDER BY c.timestamp DESC
+            OFFSET 0 LIMIT @limit
+        """
+        
+        parameters = [
+            {"name": "@user_id", "value": user_id},
+            {"name": "@chat_id", "value": chat_id},
+            {"name": "@limit", "value": limit}
+        ]
+        
+        return query, parameters
+    
+    def _build_chat_history_query(self, user_id: str, limit: Optional[int] = None, offset: int = 0):
+        """チャット履歴クエリ構築（limit省略時は継続トークンでのページング用）"""
+        query = """
+            SELECT c.chat_id, c.user_message, c.ai_response, c.is_competency_evaluation, c.timestamp
+            FROM c 
+            WHERE c.user_id = @user_id
+            ORDER BY c.timestamp DESC
+        """
+        
+        parameters = [
+            {"name": "@user_id", "value": user_id}
+        ]
+        
+        if limit is not None:
+            query += " OFFSET @offset LIMIT @limit"
+            parameters.append({"name": "@offset", "value": offset})
+            parameters.append({"name": "@limit", "value": limit})
+        
+        return query, parameters
+    
+    def _build_competency_query(self, start_date: Optional[datetime], end_date: Optional[datetime],
+                                fields: Optional[List[str]] = None):
+        """コンピテンシー評価データクエリ構築（fields指定時は射影）"""
+        projection = ', '.join(f"c.{field}" for field in fields) if fields else '*'
+        query = f"SELECT {projection} FROM c WHERE c.is_competency_evaluation = true"
+        parameters = []
+        
+        if start_date:
+            query += " AND c.timestamp >= @start_date"
+            parameters.append({"name": "@start_date", "value": start_date.isoformat()})
+        
+        if end_date:
+            query += " AND c.timestamp <= @end_date"
+            parameters.append({"name": "@end_date", "value": end_date.isoformat()})
+        
+        query += " ORDER BY c.timestamp DESC"
+        
+        return query, parameters
+    
+    def _build_evaluation_page_query(self, query: EvaluationQuery):
+        """評価一覧クエリ構築（指定された項目のみ射影し、本文の抜粋はサーバー側で切り出す）"""
+        projection = ', '.join(
+            f"SUBSTRING(c.{EXCERPT_FIELDS[name]}, 0, {EXCERPT_LENGTH + 1}) AS {name}" if name in EXCERPT_FIELDS
+            else f"c.{name}"
+            for name in query.fields
+        )
+        sql = f"SELECT {projection} FROM c WHERE c.is_competency_evaluation = true"
+        parameters = []
+        
+        if query.start_date:
+            sql += " AND c.timestamp >= @start_date"
+            parameters.append({"name": "@start_date", "value": query.start_date.isoformat()})
+        
+        if query.end_date:
+            sql += " AND c.timestamp <= @end_date"
+            parameters.append({"name": "@end_date", "value": query.end_date.isoformat()})
+        
+        if query.user_id:
+            sql += " AND c.user_id = @user_id"
+            parameters.append({"name": "@user_id", "value": query.user_id})
+        
+        if query.competency:
+            sql += " AND EXISTS(SELECT VALUE s FROM s IN c.competency_scores WHERE s.code = @competency)"
+            parameters.append({"name": "@competency", "value": query.competency})
+        
+        if query.text:
+            sql += " AND (CONTAINS(c.user_message, @text, true) OR CONTAINS(c.ai_response, @text, true))"
+            parameters.append({"name": "@text", "value": query.text})
+        
+        direction = query.order.upper()
+        if query.sort == 'user_id':
+            sql += f" ORDER BY c.user_id {direction}, c.timestamp {direction}"
+        else:
+            sql += f" ORDER BY c.timestamp {direction}"
+        
+        return sql, parameters
+    
+    def _build_score_distribution_query(self, start_date: Optional[datetime], end_date: Optional[datetime],
+                                        prompt_version: Optional[str]):
+        """コンピテンシー・点数ごとの件数の集計クエリ構築"""
+        query = (
+            "SELECT s.code, s.score, COUNT(1) AS count FROM c JOIN s IN c.competency_scores"
+            " WHERE c.is_competency_evaluation = true"
+        )
+        parameters = []
+        
+        if start_date:
+            query += " AND c.timestamp >= @start_date"
+            parameters.append({"name": "@start_date", "value": start_date.isoformat()})
+        
+        if end_date:
+            query += " AND c.timestamp <= @end_date"
+            parameters.append({"name": "@end_date", "value": end_date.isoformat()})
+        
+        if prompt_version:
+            query += " AND c.prompt_version = @prompt_version"
+            parameters.append({"name": "@prompt_version", "value": prompt_version})
+        
+        query += " GROUP BY s.code, s.score"
+        
+        return query, parameters
+    
     def _get_mock_chat_history(self, user_id: str, limit: int, offset: int) -> List[Dict]:
         """モックチャット履歴"""
         mock_history = [
@@ -238,7 +656,8 @@ class CosmosDBManager(DatabaseInterface):
                 'user_id': 'student001',
                 'chat_id': 'chat_001',
                 'user_message': 'ピアサポートの授業でグループワークを通じて、相手の話をじっくり聞くことの大切さを学びました。',
-                'ai_response': '【コンピテンシー評価結果】\n\n◆ 共感力 ★★★★☆ (4/5)\n◆ 傾聴スキル ★★★★☆ (4/5)'
+                'ai_response': '【コンピテンシー評価結果】\n\n◆ 共感力 ★★★★☆ (4/5)\n◆ 傾聴スキル ★★★★☆ (4/5)',
+                'competency_scores': [{'code': 'E', 'score': 4}]
             }
         ]
     
@@ -254,6 +673,8 @@ class CosmosDBManager(DatabaseInterface):
 class SharePointManager(DatabaseInterface):
     """SharePoint管理クラス"""
     
+    MAX_PAGE_SIZE = 5000  # リストアイテムの$topの上限
+    
     def __init__(self, config: Config):
         self.config = config
         self.client = None
@@ -287,16 +708,7 @@ class SharePointManager(DatabaseInterface):
                 logger.info(f"[MOCK] Saving chat message to SharePoint: {message_data['chat_id']}")
                 return True
             
-            list_item = {
-                'Title': message_data['chat_id'],
-                'ChatId': message_data['chat_id'],
-                'UserId': message_data['user_id'],
-                'UserMessage': message_data['user_message'],
-                'AIResponse': message_data['ai_response'],
-                'IsCompetencyEvaluation': message_data['is_competency_evaluation'],
-                'Timestamp': message_data['timestamp'],
-                'SessionInfo': json.dumps(message_data.get('session_info', {}))
-            }
+            list_item = self._build_list_item(message_data)
             
             target_list = self.client.web.lists.get_by_title(self.config.SHAREPOINT_LIST_CHATS)
             target_list.add_item(list_item).execute_query()
@@ -308,30 +720,117 @@ class SharePointManager(DatabaseInterface):
             logger.error(f"Error saving to SharePoint: {str(e)}")
             return False
     
-    def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
-        """SharePointからチャット履歴取得"""
+    def save_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        """$batchリクエストで一括保存"""
+        if self.config.MOCK_MODE:
+            logger.info(f"[MOCK] Saving {len(messages)} chat messages to SharePoint in batch")
+            return []
+        
         try:
-            if self.config.MOCK_MODE:
-                return self._get_mock_chat_history(user_id, limit, offset)
+            target_list = self.client.web.lists.get_by_title(self.config.SHAREPOINT_LIST_CHATS)
+            for message_data in messages:
+                target_list.add_item(self._build_list_item(message_data))
+            self.client.execute_batch()
+            
+            logger.info(f"Chat message batch saved to SharePoint: {len(messages)}")
+            return []
+            
+        except Exception as e:
+            logger.error(f"Error saving batch to SharePoint: {str(e)}")
+            return messages
+    
+    def _build_list_item(self, message_data: Dict) -> Dict:
+        """保存用リストアイテム構築（CompetencyScores列は設定で有効にした場合のみ書き込む）"""
+        list_item = {
+            'Title': message_data['chat_id'],
+            'ChatId': message_data['chat_id'],
+            'UserId': message_data['user_id'],
+            'UserMessage': message_data['user_message'],
+            'AIResponse': message_data['ai_response'],
+            'IsCompetencyEvaluation': message_data['is_competency_evaluation'],
+            'Timestamp': message_data['timestamp'],
+            'SessionInfo': json.dumps(message_data.get('session_info', {}))
+        }
+        if self.config.SHAREPOINT_COMPETENCY_SCORES_ENABLED:
+            list_item['CompetencyScores'] = json.dumps(message_data.get('competency_scores', []))
+        return list_item
+    
+    def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        """SharePointからチャット履歴取得
+            
+        リストアイテムは$skipを使えないため、offset件は$skiptokenのページを辿って読み飛ばす
+        """
+        if self.config.MOCK_MODE:
+            return self._get_mock_chat_history(user_id, limit, offset)
+            
+        history = []
+        remaining_offset = offset
+        cursor = None
+        while len(history) < limit:
+            page_size = remaining_offset or limit - len(history)
+            page = self.get_chat_history_page(user_id, min(page_size, self.MAX_PAGE_SIZE), cursor)
+            if remaining_offset:
+                remaining_offset -= len(page['items'])
+            else:
+                history.extend(page['items'])
             
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        return history
+    
+    def get_chat_history_page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """SharePointからチャット履歴のページ取得（$skiptokenを使用）"""
+        if self.config.MOCK_MODE:
+            return super().get_chat_history_page(user_id, limit, cursor)
+        
+        skiptoken = decode_cursor(cursor).get('skiptoken') if cursor else None
+        
+        try:
             target_list = self.client.web.lists.get_by_title(self.config.SHAREPOINT_LIST_CHATS)
-            items = target_list.items.filter(f"UserId eq '{user_id}'").order_by("Timestamp desc").top(limit).execute_query()
-            
-            results = []
-            for item in items:
-                results.append({
-                    'chat_id': item.properties.get('ChatId'),
-                    'user_message': item.properties.get('UserMessage'),
-                    'ai_response': item.properties.get('AIResponse'),
-                    'is_competency_evaluation': item.properties.get('IsCompetencyEvaluation', False),
-                    'timestamp': item.properties.get('Timestamp')
-                })
+            items = target_list.items.filter(f"UserId eq {odata_string(user_id)}").order_by("Timestamp desc").top(limit)
+            if skiptoken:
+                # カーソルにはURLエンコードされたままの値を格納している（クエリ文字列の構築時に再エンコードされない）
+                items.query_options.custom['skiptoken'] = skiptoken
             
-            return results
+            next_links = []
+            self.client.after_execute(lambda response: next_links.append(self._next_link(response)))
+            items.get().execute_query()
+            
+            next_cursor = None
+            next_skiptoken = extract_skiptoken(next_links[0]) if next_links and next_links[0] else None
+            if next_skiptoken:
+                next_cursor = encode_cursor({'skiptoken': next_skiptoken})
+            
+            return {
+                'items': [self._to_history_entry(item) for item in items],
+                'next_cursor': next_cursor
+            }
             
         except Exception as e:
-            logger.error(f"Error getting chat history from SharePoint: {str(e)}")
-            return []
+            logger.error(f"Error getting chat history page from SharePoint: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+    
+    def _next_link(self, response) -> Optional[str]:
+        """レスポンスの次ページURL（verbose形式の __next・OData v4形式の @odata.nextLink）"""
+        json_format = self.client.pending_request().default_json_format
+        try:
+            payload = response.json()
+        except ValueError:
+            return None
+        if isinstance(payload, dict):
+            payload = payload.get(getattr(json_format, 'security', None), payload)
+        return payload.get(json_format.collection_next) if isinstance(payload, dict) else None
+    
+    def _to_history_entry(self, item) -> Dict:
+        """SharePointリストアイテムをチャット履歴形式に変換"""
+        return {
+            'chat_id': item.properties.get('ChatId'),
+            'user_message': item.properties.get('UserMessage'),
+            'ai_response': item.properties.get('AIResponse'),
+            'is_competency_evaluation': item.properties.get('IsCompetencyEvaluation', False),
+            'timestamp': item.properties.get('Timestamp')
+        }
     
     # 他のメソッドは省略（CosmosDBManagerと同様の実装）
     
@@ -348,26 +847,1172 @@ class SharePointManager(DatabaseInterface):
             return self._get_mock_usage_statistics()
         # 実装省略
         return {}
+    
+    def iter_usage_records(self, page_size: int = 1000) -> Iterator[Dict]:
+        """使用統計の補正用に全アイテムのUserId・評価フラグを取得"""
+        if self.config.MOCK_MODE:
+            return
+        
+        target_list = self.client.web.lists.get_by_title(self.config.SHAREPOINT_LIST_CHATS)
+        items = target_list.items.select(['UserId', 'IsCompetencyEvaluation']).get_all(page_size).execute_query()
+        
+        for item in items:
+            yield {
+                'user_id': item.properties.get('UserId'),
+                'is_competency_evaluation': item.properties.get('IsCompetencyEvaluation', False)
+            }
 
-class DatabaseManager:
-    """データベース管理ファクトリクラス"""
+class SQLiteManager(DatabaseInterface):
+    """SQLite管理クラス（ローカル・単一ノード用の組み込みバックエンド）
     
-    def __init__(self):
-        self.config = Config()
+    ファイルの場合はWALモードでスレッドごとに接続を持ち、読み取りは書き込みと並行して実行する。
+    ':memory:' の場合は1つの接続をロックで共有する。MOCK_MODEでも実際に保存する。
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id TEXT PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            user_message TEXT NOT NULL,
+            ai_response TEXT NOT NULL,
+            is_competency_evaluation INTEGER NOT NULL DEFAULT 0,
+            prompt_version TEXT,
+            timestamp TEXT NOT NULL,
+            session_info TEXT,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_user_timestamp
+            ON chat_messages (user_id, timestamp, id);
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_timestamp
+            ON chat_messages (user_id, chat_id, timestamp, id);
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_competency_timestamp
+            ON chat_messages (is_competency_evaluation, timestamp, id);
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_competency_user
+            ON chat_messages (is_competency_evaluation, user_id, timestamp, id);
+        CREATE TABLE IF NOT EXISTS competency_scores (
+            message_id TEXT NOT NULL,
+            code TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            prompt_version TEXT,
+            timestamp TEXT NOT NULL,
+            PRIMARY KEY (message_id, code)
+        );
+        CREATE INDEX IF NOT EXISTS idx_competency_scores_timestamp
+            ON competency_scores (timestamp, code, score);
+    """
+    
+    INSERT_QUERY = """
+        INSERT OR REPLACE INTO chat_messages
+            (id, chat_id, user_id, user_message, ai_response, is_competency_evaluation,
+             prompt_version, timestamp, session_info, created_at)
+        VALUES
+            (:id, :chat_id, :user_id, :user_message, :ai_response, :is_competency_evaluation,
+             :prompt_version, :timestamp, :session_info, :created_at)
+    """
+    
+    # 評価結果の構造化データは評価メッセージと同じトランザクションで置き換える
+    DELETE_SCORES_QUERY = "DELETE FROM competency_scores WHERE message_id = ?"
+    INSERT_SCORE_QUERY = """
+        INSERT INTO competency_scores (message_id, code, score, prompt_version, timestamp)
+        VALUES (:message_id, :code, :score, :prompt_version, :timestamp)
+    """
+    
+    HISTORY_COLUMNS = "id, chat_id, user_message, ai_response, is_competency_evaluation, timestamp"
+    
+    # 評価一覧の項目 -> 列（本文の抜粋は先頭のみ切り出して読み出す）
+    EVALUATION_COLUMNS = {
+        'id': 'id',
+        'timestamp': 'timestamp',
+        'user_id': 'user_id',
+        'chat_id': 'chat_id',
+        'prompt_version': 'prompt_version',
+        'user_message': 'user_message',
+        'ai_response': 'ai_response',
+        **{
+            name: f"substr({column}, 1, {EXCERPT_LENGTH + 1}) AS {name}"
+            for name, column in EXCERPT_FIELDS.items()
+        }
+    }
+    
+    def __init__(self, config: Config, path: Optional[str] = None):
+        self.config = config
+        self.path = path or (':memory:' if config.DATABASE_TYPE.lower() == 'memory' else config.SQLITE_PATH)
         
-        if self.config.DATABASE_TYPE.lower() == 'sharepoint':
-            self.db = SharePointManager(self.config)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._shared = None
+        
+        # インメモリDBは接続ごとに別のDBになるため1接続を共有する
+        if self.path == ':memory:':
+            self._shared = self._connect()
+        
+        with self._connection(write=True) as conn:
+            conn.executescript(self.SCHEMA)
+        
+        logger.info(f"SQLite database initialized: {self.path}")
+    
+    def _connect(self) -> sqlite3.Connection:
+        """SQLite接続作成"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.config.SQLITE_BUSY_TIMEOUT,
+            check_same_thread=False,
+            isolation_level=None  # トランザクションは明示的に開始する
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    @contextmanager
+    def _connection(self, write: bool = False):
+        """接続取得（書き込みはプロセス内で直列化する）"""
+        if self._shared is not None:
+            with self._write_lock:
+                yield self._shared
+            return
+        
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        
+        if write:
+            with self._write_lock:
+                yield conn
         else:
-            self.db = CosmosDBManager(self.config)
+            yield conn
+    
+    def close(self):
+        """共有接続・現在のスレッドの接続を閉じる"""
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def _build_row(self, message_data: Dict) -> Dict:
+        """保存用の行データ構築"""
+        return {
+            'id': message_data.setdefault('id', str(uuid.uuid4())),
+            'chat_id': message_data['chat_id'],
+            'user_id': message_data['user_id'],
+            'user_message': message_data['user_message'],
+            'ai_response': message_data['ai_response'],
+            'is_competency_evaluation': 1 if message_data['is_competency_evaluation'] else 0,
+            'prompt_version': message_data.get('prompt_version'),
+            'timestamp': message_data['timestamp'],
+            'session_info': json.dumps(message_data.get('session_info', {}), ensure_ascii=False),
+            'created_at': datetime.now(timezone.utc).isoformat()
+        }
+    
+    def _build_score_rows(self, message_data: Dict) -> List[Dict]:
+        """評価結果の構造化データの行構築（_build_row の後に呼び出す）"""
+        return [
+            {
+                'message_id': message_data['id'],
+                'code': entry['code'],
+                'score': entry['score'],
+                'prompt_version': message_data.get('prompt_version'),
+                'timestamp': message_data['timestamp']
+            }
+            for entry in message_data.get('competency_scores') or ()
+        ]
+    
+    def _insert_messages(self, conn: sqlite3.Connection, messages: List[Dict]):
+        """メッセージと評価結果の構造化データを1トランザクションで保存"""
+        rows = [self._build_row(message_data) for message_data in messages]
+        score_rows = [score_row for message_data in messages for score_row in self._build_score_rows(message_data)]
+        
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(self.INSERT_QUERY, rows)
+            conn.executemany(self.DELETE_SCORES_QUERY, [(row['id'],) for row in rows if row['is_competency_evaluation']])
+            conn.executemany(self.INSERT_SCORE_QUERY, score_rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def _to_dict(self, row: sqlite3.Row) -> Dict:
+        """行データを辞書に変換"""
+        record = dict(row)
+        if 'is_competency_evaluation' in record:
+            record['is_competency_evaluation'] = bool(record['is_competency_evaluation'])
+        if record.get('session_info'):
+            record['session_info'] = json.loads(record['session_info'])
+        return record
     
     def save_chat_message(self, message_data: Dict) -> bool:
-        return self.db.save_chat_message(message_data)
+        """チャットメッセージ保存"""
+        try:
+            with self._connection(write=True) as conn:
+                self._insert_messages(conn, [message_data])
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error saving chat message to SQLite: {str(e)}")
+            return False
+    
+    def save_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        """1トランザクションで一括保存"""
+        try:
+            with self._connection(write=True) as conn:
+                self._insert_messages(conn, messages)
+            
+            logger.info(f"Chat message batch saved to SQLite: {len(messages)}")
+            return []
+            
+        except Exception as e:
+            logger.error(f"Error saving chat message batch to SQLite: {str(e)}")
+            return list(messages)
     
     def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
-        return self.db.get_chat_history(user_id, limit, offset)
+        """チャット履歴取得"""
+        try:
+            with self._connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {self.HISTORY_COLUMNS} FROM chat_messages WHERE user_id = ? "
+                    "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+                    (user_id, limit, offset)
+                ).fetchall()
+            
+            return [self._to_history_entry(row) for row in rows]
+            
+        except Exception as e:
+            logger.error(f"Error getting chat history from SQLite: {str(e)}")
+            return []
+    
+    def get_chat_history_page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """チャット履歴のページ取得（(timestamp, id)によるキーセットページング）"""
+        state = decode_cursor(cursor) if cursor else {}
+        
+        try:
+            query = f"SELECT {self.HISTORY_COLUMNS} FROM chat_messages WHERE user_id = ?"
+            parameters = [user_id]
+            if 'timestamp' in state:
+                query += " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+                parameters.extend([state['timestamp'], state['timestamp'], state.get('id', '')])
+            query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+            parameters.append(limit + 1)
+            
+            with self._connection() as conn:
+                rows = conn.execute(query, parameters).fetchall()
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor({'timestamp': rows[-1]['timestamp'], 'id': rows[-1]['id']})
+            
+            return {
+                'items': [self._to_history_entry(row) for row in rows],
+                'next_cursor': next_cursor
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting chat history page from SQLite: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+    
+    def get_chat_turns(self, user_id: str, chat_id: str, limit: int = 20) -> List[Dict]:
+        """チャット1件分の直近のやり取りを古い順に取得"""
+        try:
+            with self._connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {self.HISTORY_COLUMNS} FROM chat_messages WHERE user_id = ? AND chat_id = ? "
+                    "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (user_id, chat_id, limit)
+                ).fetchall()
+            
+            return [self._to_history_entry(row) for row in reversed(rows)]
+        
+        except Exception as e:
+            logger.error(f"Error getting chat turns from SQLite: {str(e)}")
+            return []
+    
+    def _to_history_entry(self, row: sqlite3.Row) -> Dict:
+        """チャット履歴形式に変換（idは返さない）"""
+        entry = self._to_dict(row)
+        entry.pop('id', None)
+        return entry
     
     def get_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None) -> List[Dict]:
-        return self.db.get_competency_evaluations(start_date, end_date)
+        """コンピテンシー評価データ取得"""
+        try:
+            return list(self.iter_competency_evaluations(start_date, end_date))
+            
+        except Exception as e:
+            logger.error(f"Error getting competency evaluations from SQLite: {str(e)}")
+            return []
     
-    def get_usage_statistics(self) -> Dict:
-        return self.db.get_usage_statistics()
\ No newline at end of file
+    def iter_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None,
+                                    page_size: int = 100) -> Iterator[Dict]:
+        """コンピテンシー評価データをページ単位で逐次取得（ページ間で接続を保持しない）"""
+        base_query = "SELECT * FROM chat_messages WHERE is_competency_evaluation = 1"
+        base_parameters = []
+        
+        if start_date:
+            base_query += " AND timestamp >= ?"
+            base_parameters.append(start_date.isoformat())
+        
+        if end_date:
+            base_query += " AND timestamp <= ?"
+            base_parameters.append(end_date.isoformat())
+        
+        last = None
+        while True:
+            query, parameters = base_query, list(base_parameters)
+            if last is not None:
+                query += " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+                parameters.extend([last['timestamp'], last['timestamp'], last['id']])
+            query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+            parameters.append(page_size)
+            
+            with self._connection() as conn:
+                rows = conn.execute(query, parameters).fetchall()
+            
+            for row in rows:
+                yield self._to_dict(row)
+            
+            if len(rows) < page_size:
+                return
+            last = rows[-1]
+    
+    def get_competency_evaluation_page(self, query: EvaluationQuery) -> Dict:
+        """評価一覧のページ取得（(並べ替えの値, timestamp, id)によるキーセットページング）
+        
+        学生ID順・学生ID指定時は評価フラグ・学生IDのインデックス、それ以外は評価フラグ・日時のインデックスを使い、
+        コンピテンシーは competency_scores の主キーで絞り込む。本文の部分一致は絞り込み後の行に対して照合する。
+        """
+        state = self._decode_evaluation_cursor(query)
+        sort_columns = ['user_id', 'timestamp', 'id'] if query.sort == 'user_id' else ['timestamp', 'id']
+        position = state.get('position')
+        if position is not None and (not isinstance(position, list) or len(position) != len(sort_columns)):
+            raise ValueError('Invalid cursor')
+        
+        columns = [name for name in query.fields if name in self.EVALUATION_COLUMNS]
+        columns += [name for name in sort_columns if name not in columns]
+        sql = (
+            f"SELECT {', '.join(self.EVALUATION_COLUMNS[name] for name in columns)} FROM chat_messages"
+            " WHERE is_competency_evaluation = 1"
+        )
+        parameters = []
+        
+        if query.start_date:
+            sql += " AND timestamp >= ?"
+            parameters.append(query.start_date.isoformat())
+        
+        if query.end_date:
+            sql += " AND timestamp <= ?"
+            parameters.append(query.end_date.isoformat())
+        
+        if query.user_id:
+            sql += " AND user_id = ?"
+            parameters.append(query.user_id)
+        
+        if query.competency:
+            sql += " AND EXISTS (SELECT 1 FROM competency_scores s WHERE s.message_id = chat_messages.id AND s.code = ?)"
+            parameters.append(query.competency)
+        
+        if query.text:
+            pattern = '%' + query.text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            sql += " AND (user_message LIKE ? ESCAPE '\\' OR ai_response LIKE ? ESCAPE '\\')"
+            parameters.extend([pattern, pattern])
+        
+        if position is not None:
+            comparison = '<' if query.descending else '>'
+            sql += f" AND ({', '.join(sort_columns)}) {comparison} ({', '.join('?' * len(sort_columns))})"
+            parameters.extend(position)
+        
+        direction = 'DESC' if query.descending else 'ASC'
+        sql += f" ORDER BY {', '.join(f'{column} {direction}' for column in sort_columns)} LIMIT ?"
+        parameters.append(query.limit + 1)
+        
+        try:
+            with self._connection() as conn:
+                rows = [dict(row) for row in conn.execute(sql, parameters).fetchall()]
+                
+                next_cursor = None
+                if len(rows) > query.limit:
+                    rows = rows[:query.limit]
+                    next_cursor = encode_cursor({
+                        'sort': query.sort_key,
+                        'position': [rows[-1][column] for column in sort_columns]
+                    })
+                
+                if 'competency_scores' in query.fields and rows:
+                    self._attach_competency_scores(conn, rows)
+            
+            return {'items': query.project_all(rows), 'next_cursor': next_cursor}
+            
+        except Exception as e:
+            logger.error(f"Error getting competency evaluation page from SQLite: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+    
+    def _attach_competency_scores(self, conn: sqlite3.Connection, rows: List[Dict]):
+        """ページ内の評価に構造化データを付与（保存時の順で返す）"""
+        by_id = {row['id']: row for row in rows}
+        for row in rows:
+            row['competency_scores'] = []
+        
+        score_rows = conn.execute(
+            f"SELECT message_id, code, score FROM competency_scores WHERE message_id IN ({', '.join('?' * len(by_id))})"
+            " ORDER BY rowid",
+            list(by_id)
+        ).fetchall()
+        for score_row in score_rows:
+            by_id[score_row['message_id']]['competency_scores'].append({'code': score_row['code'], 'score': score_row['score']})
+    
+    def get_competency_score_distribution(self, start_date: datetime = None, end_date: datetime = None,
+                                          prompt_version: Optional[str] = None) -> List[Dict]:
+        """コンピテンシー・点数ごとの件数（competency_scoresテーブルを期間のインデックスで集計）"""
+        query = "SELECT code, score, COUNT(*) AS count FROM competency_scores"
+        conditions = []
+        parameters = []
+        
+        if start_date:
+            conditions.append("timestamp >= ?")
+            parameters.append(start_date.isoformat())
+        
+        if end_date:
+            conditions.append("timestamp <= ?")
+            parameters.append(end_date.isoformat())
+        
+        if prompt_version:
+            conditions.append("prompt_version = ?")
+            parameters.append(prompt_version)
+        
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " GROUP BY code, score"
+        
+        try:
+            with self._connection() as conn:
+                return [dict(row) for row in conn.execute(query, parameters).fetchall()]
+            
+        except Exception as e:
+            logger.error(f"Error getting competency score distribution from SQLite: {str(e)}")
+            return []
+    
+    def get_competency_score_records(self, start_date: datetime = None, end_date: datetime = None,
+                                      prompt_version: Optional[str] = None) -> List[Dict]:
+        """評価点数の一覧（competency_scoresテーブルを期間のインデックスで絞り込み、user_idのみ結合）"""
+        query = (
+            "SELECT m.user_id, s.timestamp, s.code, s.score FROM competency_scores s"
+            " JOIN chat_messages m ON m.id = s.message_id"
+        )
+        conditions = []
+        parameters = []
+        
+        if start_date:
+            conditions.append("s.timestamp >= ?")
+            parameters.append(start_date.isoformat())
+        
+        if end_date:
+            conditions.append("s.timestamp <= ?")
+            parameters.append(end_date.isoformat())
+        
+        if prompt_version:
+            conditions.append("s.prompt_version = ?")
+            parameters.append(prompt_version)
+        
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        with self._connection() as conn:
+            return [dict(row) for row in conn.execute(query, parameters).fetchall()]
+    
+    def get_usage_statistics(self) -> Dict:
+        """使用統計取得"""
+        try:
+            with self._connection() as conn:
+                row = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(is_competency_evaluation), 0), COUNT(DISTINCT user_id) FROM chat_messages"
+                ).fetchone()
+            
+            return {
+                'total_messages': row[0],
+                'competency_evaluations': row[1],
+                'active_users': row[2],
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting usage statistics from SQLite: {str(e)}")
+            return {}
+    
+    def iter_usage_records(self, page_size: int = 1000) -> Iterator[Dict]:
+        """使用統計の補正用に全メッセージのuser_id・評価フラグを逐次取得"""
+        last_rowid = 0
+        while True:
+            with self._connection() as conn:
+                rows = conn.execute(
+                    "SELECT rowid, user_id, is_competency_evaluation FROM chat_messages WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, page_size)
+                ).fetchall()
+            
+            for row in rows:
+                yield {'user_id': row['user_id'], 'is_competency_evaluation': bool(row['is_competency_evaluation'])}
+            
+            if len(rows) < page_size:
+                return
+            last_rowid = rows[-1]['rowid']
+
+class DatabaseManager:
+    """データベース管理ファクトリクラス"""
+    
+    def __init__(self):
+        self.config = Config()
+        
+        database_type = self.config.DATABASE_TYPE.lower()
+        if database_type == 'sharepoint':
+            self.db = SharePointManager(self.config)
+        elif database_type in ('sqlite', 'memory'):
+            self.db = SQLiteManager(self.config)
+        else:
+            self.db = CosmosDBManager(self.config)
+        
+        # 使用統計（保存成功時に更新し、定期的に全件走査で補正）
+        self.usage_stats = None
+        self.usage_reconciler = None
+        if self.config.USAGE_STATS_MATERIALIZED:
+            self.usage_stats = UsageStatistics(self.config.USAGE_STATS_HLL_PRECISION)
+            self.usage_reconciler = UsageStatsReconciler(
+                self.usage_stats,
+                self.db.iter_usage_records,
+                self.config.USAGE_STATS_RECONCILE_INTERVAL
+            )
+            self.usage_reconciler.start()
+        
+        # 評価の保存時に通知するコールバック（集計結果キャッシュの破棄など）
+        self._write_listeners = []
+        
+        # ライトビハインド（保存はキューに積んで即座に戻り、バックグラウンドでバッチ書き込み）
+        self.write_behind = None
+        if self.config.WRITE_BEHIND_ENABLED:
+            self.write_behind = WriteBehindQueue(
+                self.save_chat_messages,
+                max_queue_size=self.config.WRITE_BEHIND_MAX_QUEUE_SIZE,
+                batch_size=self.config.WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=self.config.WRITE_BEHIND_FLUSH_INTERVAL,
+                max_retries=self.config.WRITE_BEHIND_MAX_RETRIES,
+                retry_backoff=self.config.WRITE_BEHIND_RETRY_BACKOFF,
+                dead_letter_file=self.config.WRITE_BEHIND_DEAD_LETTER_FILE
+            )
+            self.write_behind.start()
+            QUEUE_DEPTH.labels('write_behind').set_function(lambda: self.write_behind.get_metrics()['queue_depth'])
+    
+    def save_chat_message(self, message_data: Dict) -> bool:
+        annotate_competency_scores(message_data)
+        
+        # キューが満杯の場合は同期書き込みにフォールバック
+        if self.write_behind and self.write_behind.enqueue(message_data):
+            return True
+        
+        with track_stage('db.save_chat_message'):
+            saved = self.db.save_chat_message(message_data)
+        if not saved:
+            record_error('db.save_chat_message')
+        if saved and self.usage_stats:
+            self.usage_stats.record(message_data)
+        if saved:
+            self._notify_write([message_data])
+        return saved
+    
+    def save_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        for message_data in messages:
+            annotate_competency_scores(message_data)
+        
+        with track_stage('db.save_chat_messages'):
+            failed = self.db.save_chat_messages(messages)
+        if failed:
+            record_error('db.save_chat_messages')
+        
+        failed_ids = {id(message_data) for message_data in failed}
+        saved = [m for m in messages if id(m) not in failed_ids]
+        if self.usage_stats:
+            self.usage_stats.record_many(saved)
+        self._notify_write(saved)
+        return failed
+    
+    def add_write_listener(self, listener):
+        """評価の保存時のコールバック登録（保存したメッセージの一覧を渡す）"""
+        self._write_listeners.append(listener)
+    
+    def _notify_write(self, messages: List[Dict]):
+        evaluations = [m for m in messages if m.get('is_competency_evaluation')]
+        if not evaluations:
+            return
+        for listener in self._write_listeners:
+            try:
+                listener(evaluations)
+            except Exception as e:
+                logger.error(f"Write listener error: {str(e)}")
+    
+    def get_persistence_metrics(self) -> Dict:
+        """ライトビハインドキューのメトリクス取得"""
+        if not self.write_behind:
+            return {'write_behind': False}
+        return {'write_behind': True, **self.write_behind.get_metrics()}
+    
+    def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        with track_stage('db.get_chat_history'):
+            return self.db.get_chat_history(user_id, limit, offset)
+    
+    def get_chat_history_page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        with track_stage('db.get_chat_history_page'):
+            return self.db.get_chat_history_page(user_id, limit, cursor)
+    
+    def get_chat_turns(self, user_id: str, chat_id: str, limit: int = 20) -> List[Dict]:
+        with track_stage('db.get_chat_turns'):
+            return self.db.get_chat_turns(user_id, chat_id, limit)
+    
+    def get_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None) -> List[Dict]:
+        with track_stage('db.get_competency_evaluations'):
+            return self.db.get_competency_evaluations(start_date, end_date)
+    
+    def iter_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None,
+                                    page_size: int = 100) -> Iterator[Dict]:
+        return self.db.iter_competency_evaluations(start_date, end_date, page_size)
+    
+    def get_competency_evaluation_page(self, query: EvaluationQuery) -> Dict:
+        with track_stage('db.get_competency_evaluation_page'):
+            return self.db.get_competency_evaluation_page(query)
+    
+    def get_competency_score_summary(self, start_date: datetime = None, end_date: datetime = None,
+                                     prompt_version: Optional[str] = None) -> List[Dict]:
+        """コンピテンシーごとの評価件数・平均点・点数分布"""
+        with track_stage('db.get_competency_score_distribution'):
+            rows = self.db.get_competency_score_distribution(start_date, end_date, prompt_version)
+        return summarize_competency_scores(rows)
+    
+    def get_competency_score_records(self, start_date: datetime = None, end_date: datetime = None,
+                                     prompt_version: Optional[str] = None) -> List[Dict]:
+        with track_stage('db.get_competency_score_records'):
+            return self.db.get_competency_score_records(start_date, end_date, prompt_version)
+    
+    def get_usage_statistics(self) -> Dict:
+        # 集計クエリは実行しない（初回の補正が完了するまでは reconciled=False の途中の値を返す）
+        if self.usage_stats:
+            return self.usage_stats.snapshot()
+        with track_stage('db.get_usage_statistics'):
+            return self.db.get_usage_statistics()
+
+class AsyncCosmosDBManager(CosmosDBManager):
+    """CosmosDB管理クラス（asyncio版、azure.cosmos.aio使用）
+    
+    DatabaseInterfaceと同じメソッド名・戻り値をコルーチンとして提供する。
+    """
+    
+    def __init__(self, config: Config):
+        # クライアントはイベントループ上で生成する必要があるため initialize() で初期化する
+        self.config = config
+        self.client = None
+        self.database = None
+        self.chat_container = None
+        self.user_container = None
+    
+    async def initialize(self):
+        """CosmosDB非同期クライアント初期化"""
+        if self.config.MOCK_MODE:
+            return
+        
+        try:
+            from azure.cosmos import PartitionKey
+            from azure.cosmos.aio import CosmosClient
+            
+            self.client = CosmosClient(
+                self.config.COSMOS_ENDPOINT,
+                self.config.COSMOS_KEY
+            )
+            
+            self.database = await self.client.create_database_if_not_exists(
+                id=self.config.COSMOS_DATABASE
+            )
+            
+            self.chat_container = await self.database.create_container_if_not_exists(
+                id=self.config.COSMOS_CONTAINER_CHATS,
+                partition_key=PartitionKey(path="/user_id"),
+                indexing_policy=self.CHAT_INDEXING_POLICY,
+                offer_throughput=400
+            )
+            
+            self.user_container = await self.database.create_container_if_not_exists(
+                id=self.config.COSMOS_CONTAINER_USERS,
+                partition_key=PartitionKey(path="/id"),
+                offer_throughput=400
+            )
+            
+            logger.info("CosmosDB async client initialized successfully")
+            
+        except Exception as e:
+            logger.error(f"CosmosDB async initialization error: {str(e)}")
+            raise
+    
+    async def close(self):
+        """CosmosDB非同期クライアント終了"""
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+    
+    async def save_chat_message(self, message_data: Dict) -> bool:
+        """チャットメッセージ保存"""
+        try:
+            if self.config.MOCK_MODE:
+                logger.info(f"[MOCK] Saving chat message: {message_data['chat_id']}")
+                return True
+            
+            document = self._build_document(message_data)
+            
+            await self.chat_container.create_item(body=document)
+            logger.info(f"Chat message saved: {document['id']}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error saving chat message: {str(e)}")
+            return False
+    
+    async def save_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        """パーティションキー（user_id）ごとのトランザクションバッチで一括保存"""
+        if self.config.MOCK_MODE:
+            logger.info(f"[MOCK] Saving {len(messages)} chat messages in batch")
+            return []
+        
+        groups = {}
+        for message_data in messages:
+            message_data.setdefault('id', str(uuid.uuid4()))
+            groups.setdefault(message_data['user_id'], []).append(message_data)
+        
+        failed = []
+        for user_id, group in groups.items():
+            for i in range(0, len(group), self.MAX_BATCH_OPERATIONS):
+                chunk = group[i:i + self.MAX_BATCH_OPERATIONS]
+                try:
+                    operations = [("upsert", (self._build_document(message_data),)) for message_data in chunk]
+                    await self.chat_container.execute_item_batch(batch_operations=operations, partition_key=user_id)
+                except Exception as e:
+                    logger.error(f"Error saving chat message batch for user {user_id}: {str(e)}")
+                    failed.extend(chunk)
+        
+        logger.info(f"Chat message batch saved: {len(messages) - len(failed)}/{len(messages)}")
+        return failed
+    
+    async def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        """チャット履歴取得"""
+        try:
+            if self.config.MOCK_MODE:
+                return self._get_mock_chat_history(user_id, limit, offset)
+            
+            query, parameters = self._build_chat_history_query(user_id, limit, offset)
+            
+            return [item async for item in self.chat_container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=user_id
+            )]
+            
+        except Exception as e:
+            logger.error(f"Error getting chat history: {str(e)}")
+            return []
+    
+    async def get_chat_history_page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """チャット履歴のページ取得（CosmosDBの継続トークンを使用）"""
+        if self.config.MOCK_MODE:
+            # 既定の実装と同じくオフセットをカーソルに格納する（get_chat_history はコルーチンのため待機する）
+            offset = int(decode_cursor(cursor).get('offset', 0)) if cursor else 0
+            items = await self.get_chat_history(user_id, limit + 1, offset)
+            
+            next_cursor = encode_cursor({'offset': offset + limit}) if len(items) > limit else None
+            return {'items': items[:limit], 'next_cursor': next_cursor}
+        
+        continuation = decode_cursor(cursor).get('token') if cursor else None
+        
+        try:
+            query, parameters = self._build_chat_history_query(user_id)
+            
+            pager = self.chat_container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=user_id,
+                max_item_count=limit
+            ).by_page(continuation)
+            
+            items = []
+            async for page in pager:
+                items = [item async for item in page]
+                break
+            token = pager.continuation_token
+            
+            return {
+                'items': items,
+                'next_cursor': encode_cursor({'token': token}) if token else None
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting chat history page: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+    
+    async def get_chat_turns(self, user_id: str, chat_id: str, limit: int = 20) -> List[Dict]:
+        """チャット1件分の直近のやり取りを古い順に取得"""
+        if self.config.MOCK_MODE:
+            # 既定の実装と同じく履歴のページを走査して絞り込む（ページ取得はコルーチンのため待機する）
+            turns = []
+            cursor = None
+            while True:
+                page = await self.get_chat_history_page(user_id, 100, cursor)
+                turns.extend(item for item in page['items'] if item.get('chat_id') == chat_id)
+                cursor = page['next_cursor']
+                if len(turns) >= limit or not cursor:
+                    break
+            
+            turns = turns[:limit]
+            turns.reverse()
+            return turns
+        
+        try:
+            query, parameters = self._build_chat_turns_query(user_id, chat_id, limit)
+            
+            results = [item async for item in self.chat_container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=user_id
+            )]
+            results.reverse()
+            return results
+        
+        except Exception as e:
+            logger.error(f"Error getting chat turns: {str(e)}")
+            return []
+    
+    async def get_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None) -> List[Dict]:
+        """コンピテンシー評価データ取得"""
+        try:
+            if self.config.MOCK_MODE:
+                return self._get_mock_competency_evaluations(start_date, end_date)
+            
+            query, parameters = self._build_competency_query(start_date, end_date)
+            
+            return [item async for item in self.chat_container.query_items(
+                query=query,
+                parameters=parameters
+            )]
+            
+        except Exception as e:
+            logger.error(f"Error getting competency evaluations: {str(e)}")
+            return []
+    
+    async def iter_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None,
+                                          page_size: int = 100):
+        """コンピテンシー評価データをページ単位で逐次取得"""
+        if self.config.MOCK_MODE:
+            for record in self._get_mock_competency_evaluations(start_date, end_date):
+                yield record
+            return
+        
+        query, parameters = self._build_competency_query(
+            start_date, end_date,
+            fields=['timestamp', 'user_id', 'chat_id', 'user_message', 'ai_response']
+        )
+        
+        async for item in self.chat_container.query_items(
+            query=query,
+            parameters=parameters,
+            max_item_count=page_size
+        ):
+            yield item
+    
+    async def get_competency_evaluation_page(self, query: EvaluationQuery) -> Dict:
+        """評価一覧のページ取得（絞り込み・並べ替えはサーバー側で行い、CosmosDBの継続トークンを使用）"""
+        if self.config.MOCK_MODE:
+            return self._paginate_evaluations(
+                query, self._get_mock_competency_evaluations(query.start_date, query.end_date)
+            )
+        
+        continuation = self._decode_evaluation_cursor(query).get('token')
+        
+        try:
+            sql, parameters = self._build_evaluation_page_query(query)
+            
+            # 学生ID指定時は単一パーティションで実行（非同期クライアントは既定でパーティションをまたいで実行する）
+            scope = {'partition_key': query.user_id} if query.user_id else {}
+            pager = self.chat_container.query_items(
+                query=sql,
+                parameters=parameters,
+                max_item_count=query.limit,
+                **scope
+            ).by_page(continuation)
+            
+            items = []
+            async for page in pager:
+                items = [item async for item in page]
+                break
+            token = pager.continuation_token
+            
+            return {
+                'items': query.project_all(items),
+                'next_cursor': encode_cursor({'sort': query.sort_key, 'token': token}) if token else None
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting competency evaluation page: {str(e)}")
+            return {'items': [], 'next_cursor': None}
+    
+    async def get_competency_score_distribution(self, start_date: datetime = None, end_date: datetime = None,
+                                                prompt_version: Optional[str] = None) -> List[Dict]:
+        """コンピテンシー・点数ごとの件数（構造化フィールドをJOINしてサーバー側で集計）"""
+        try:
+            if self.config.MOCK_MODE:
+                return count_competency_scores(self._get_mock_competency_evaluations(start_date, end_date), prompt_version)
+            
+            query, parameters = self._build_score_distribution_query(start_date, end_date, prompt_version)
+            
+            return [item async for item in self.chat_container.query_items(
+                query=query,
+                parameters=parameters
+            )]
+            
+        except Exception as e:
+            logger.error(f"Error getting competency score distribution: {str(e)}")
+            return []
+    
+    async def get_competency_score_records(self, start_date: datetime = None, end_date: datetime = None,
+                                           prompt_version: Optional[str] = None) -> List[Dict]:
+        """評価点数の一覧（本文を除いた構造化フィールドのみを射影して取得）"""
+        if self.config.MOCK_MODE:
+            return expand_competency_scores(self._get_mock_competency_evaluations(start_date, end_date), prompt_version)
+        
+        query, parameters = self._build_competency_query(start_date, end_date, fields=self.SCORE_RECORD_FIELDS)
+        
+        records = [item async for item in self.chat_container.query_items(
+            query=query,
+            parameters=parameters
+        )]
+        return expand_competency_scores(records, prompt_version)
+    
+    async def get_usage_statistics(self) -> Dict:
+        """使用統計取得"""
+        try:
+            if self.config.MOCK_MODE:
+                return self._get_mock_usage_statistics()
+            
+            # 3つの集計クエリを並行して実行
+            total_messages, competency_count, active_users = await asyncio.gather(
+                self._query_scalar(self.TOTAL_MESSAGES_QUERY),
+                self._query_scalar(self.COMPETENCY_COUNT_QUERY),
+                self._query_scalar(self.ACTIVE_USERS_QUERY)
+            )
+            
+            return {
+                'total_messages': total_messages,
+                'competency_evaluations': competency_count,
+                'active_users': active_users,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting usage statistics: {str(e)}")
+            return {}
+    
+    async def iter_usage_records(self, page_size: int = 1000):
+        """使用統計の補正用に全メッセージのuser_id・評価フラグを逐次取得"""
+        if self.config.MOCK_MODE:
+            return
+        
+        async for item in self.chat_container.query_items(
+            query=self.USAGE_RECORDS_QUERY,
+            max_item_count=page_size
+        ):
+            yield item
+    
+    async def _query_scalar(self, query: str):
+        """集計クエリの単一値取得"""
+        results = [item async for item in self.chat_container.query_items(query=query)]
+        return results[0] if results else 0
+
+class AsyncDatabaseManager:
+    """データベース管理ファクトリクラス（asyncio版）
+    
+    CosmosDBはazure.cosmos.aioを使用し、非同期クライアントを持たない
+    SharePoint・SQLiteは同期実装をスレッドプールで実行する。
+    """
+    
+    def __init__(self):
+        self.config = Config()
+        
+        database_type = self.config.DATABASE_TYPE.lower()
+        if database_type == 'sharepoint':
+            self.db = SharePointManager(self.config)
+            self.is_async = False
+        elif database_type in ('sqlite', 'memory'):
+            self.db = SQLiteManager(self.config)
+            self.is_async = False
+        else:
+            self.db = AsyncCosmosDBManager(self.config)
+            self.is_async = True
+        
+        self.usage_stats = None
+        self._reconcile_task = None
+        self._write_listeners = []
+        if self.config.USAGE_STATS_MATERIALIZED:
+            self.usage_stats = UsageStatistics(self.config.USAGE_STATS_HLL_PRECISION)
+    
+        # ライトビハインド（ワーカーはイベントループ上のタスクで、initialize() で開始する）
+        self.write_behind = None
+        if self.config.WRITE_BEHIND_ENABLED:
+            self.write_behind = AsyncWriteBehindQueue(
+                self.save_chat_messages,
+                max_queue_size=self.config.WRITE_BEHIND_MAX_QUEUE_SIZE,
+                batch_size=self.config.WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=self.config.WRITE_BEHIND_FLUSH_INTERVAL,
+                max_retries=self.config.WRITE_BEHIND_MAX_RETRIES,
+                retry_backoff=self.config.WRITE_BEHIND_RETRY_BACKOFF,
+                dead_letter_file=self.config.WRITE_BEHIND_DEAD_LETTER_FILE
+            )
+            QUEUE_DEPTH.labels('write_behind').set_function(lambda: self.write_behind.get_metrics()['queue_depth'])
+    
+    async def initialize(self):
+        if self.is_async:
+            await self.db.initialize()
+        if self.usage_stats:
+            self._reconcile_task = asyncio.ensure_future(self._reconcile_loop())
+        if self.write_behind:
+            await self.write_behind.start()
+    
+    async def close(self):
+        # クライアントを閉じる前にキューを全件書き出す
+        if self.write_behind:
+            await self.write_behind.stop()
+        if self._reconcile_task:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+        if self.is_async:
+            await self.db.close()
+    
+    async def _reconcile_loop(self):
+        """使用統計の定期補正（起動直後に1回、以降 USAGE_STATS_RECONCILE_INTERVAL 秒ごと）"""
+        while True:
+            try:
+                if self.is_async:
+                    started = time.perf_counter()
+                    counters = self.usage_stats.begin_reconciliation()
+                    async for record in self.db.iter_usage_records():
+                        counters.add(record)
+                    self.usage_stats.finish_reconciliation(counters, started)
+                else:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self.usage_stats.reconcile, self.db.iter_usage_records())
+            except asyncio.CancelledError:
+                self.usage_stats.abort_reconciliation()
+                raise
+            except Exception as e:
+                self.usage_stats.abort_reconciliation()
+                logger.error(f"Usage statistics reconciliation error: {str(e)}")
+            
+            await asyncio.sleep(self.config.USAGE_STATS_RECONCILE_INTERVAL)
+    
+    async def _call(self, method_name: str, *args):
+        method = getattr(self.db, method_name)
+        with track_stage(f'db.{method_name}'):
+            if self.is_async:
+                return await method(*args)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, method, *args)
+    
+    async def save_chat_message(self, message_data: Dict) -> bool:
+        annotate_competency_scores(message_data)
+        
+        # キューが満杯の場合は直接書き込みにフォールバック
+        if self.write_behind and self.write_behind.enqueue(message_data):
+            return True
+        
+        saved = await self._call('save_chat_message', message_data)
+        if not saved:
+            record_error('db.save_chat_message')
+        if saved and self.usage_stats:
+            self.usage_stats.record(message_data)
+        if saved:
+            self._notify_write([message_data])
+        return saved
+    
+    async def save_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        for message_data in messages:
+            annotate_competency_scores(message_data)
+        
+        failed = await self._call('save_chat_messages', messages)
+        if failed:
+            record_error('db.save_chat_messages')
+        
+        failed_ids = {id(message_data) for message_data in failed}
+        saved = [m for m in messages if id(m) not in failed_ids]
+        if self.usage_stats:
+            self.usage_stats.record_many(saved)
+        self._notify_write(saved)
+        return failed
+    
+    def add_write_listener(self, listener):
+        """評価の保存時のコールバック登録（保存したメッセージの一覧を渡す）"""
+        self._write_listeners.append(listener)
+    
+    def _notify_write(self, messages: List[Dict]):
+        evaluations = [m for m in messages if m.get('is_competency_evaluation')]
+        if not evaluations:
+            return
+        for listener in self._write_listeners:
+            try:
+                listener(evaluations)
+            except Exception as e:
+                logger.error(f"Write listener error: {str(e)}")
+    
+    def get_persistence_metrics(self) -> Dict:
+        """ライトビハインドキューのメトリクス取得"""
+        if not self.write_behind:
+            return {'write_behind': False}
+        return {'write_behind': True, **self.write_behind.get_metrics()}
+    
+    async def get_chat_history(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        return await self._call('get_chat_history', user_id, limit, offset)
+    
+    async def get_chat_history_page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        return await self._call('get_chat_history_page', user_id, limit, cursor)
+    
+    async def get_chat_turns(self, user_id: str, chat_id: str, limit: int = 20) -> List[Dict]:
+        return await self._call('get_chat_turns', user_id, chat_id, limit)
+    
+    async def get_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None) -> List[Dict]:
+        return await self._call('get_competency_evaluations', start_date, end_date)
+    
+    async def get_competency_evaluation_page(self, query: EvaluationQuery) -> Dict:
+        return await self._call('get_competency_evaluation_page', query)
+    
+    async def iter_competency_evaluations(self, start_date: datetime = None, end_date: datetime = None,
+                                          page_size: int = 100):
+        """コンピテンシー評価データの逐次取得（同期実装はページ単位でスレッドプールから取り出す）"""
+        if self.is_async:
+            async for record in self.db.iter_competency_evaluations(start_date, end_date, page_size):
+                yield record
+            return
+        
+        loop = asyncio.get_running_loop()
+        records = self.db.iter_competency_evaluations(start_date, end_date, page_size)
+        while True:
+            page = await loop.run_in_executor(None, list, islice(records, page_size))
+            if not page:
+                return
+            for record in page:
+                yield record
+    
+    async def get_competency_score_summary(self, start_date: datetime = None, end_date: datetime = None,
+                                           prompt_version: Optional[str] = None) -> List[Dict]:
+        rows = await self._call('get_competency_score_distribution', start_date, end_date, prompt_version)
+        return summarize_competency_scores(rows)
+    
+    async def get_competency_score_records(self, start_date: datetime = None, end_date: datetime = None,
+                                           prompt_version: Optional[str] = None) -> List[Dict]:
+        return await self._call('get_competency_score_records', start_date, end_date, prompt_version)
+    
+    async def get_usage_statistics(self) -> Dict:
+        if self.usage_stats:
+            return self.usage_stats.snapshot()
+        return await self._call('get_usage_statistics')
@@ -0,0 +1,383 @@
+"""
+デプロイメントルーティングモジュール
+複数のAzure OpenAIデプロイメント（エンドポイント）から直近の応答時間・エラー率が最も良いものを選んで送信する。
+デプロイメントごとにサーキットブレーカーを持ち、任意で遅い呼び出しを別デプロイメントに重複送信（ヘッジ）する
+"""
+import asyncio
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+from rate_governor import RateGovernor
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 200  # p95算出に使う直近の応答時間の件数
+MIN_HEDGE_SAMPLES = 20  # ヘッジ送信を始めるまでに必要な応答時間の件数
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    'rai_ai_deployment_circuit_open', 'Circuit breaker state per deployment (0=closed, 0.5=half-open, 1=open)', ['deployment']
+)
+DEPLOYMENT_CALLS = REGISTRY.counter(
+    'rai_ai_deployment_calls_total', 'AI calls per deployment and outcome', ['deployment', 'outcome']
+)
+HEDGED_CALLS = REGISTRY.counter(
+    'rai_ai_hedged_calls_total', 'Hedged AI calls by winner', ['winner']
+)
+
+class CircuitBreaker:
+    """連続失敗回数によるサーキットブレーカー
+    
+    failure_threshold 回連続で失敗すると reset_timeout 秒間は送信しない（open）。
+    経過後は1件だけ試行し（half-open）、成功すれば復帰、失敗すれば再度 open にする。
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+    
+    def available(self, now: float) -> bool:
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            return now - self.opened_at >= self.reset_timeout
+        return not self.probing
+    
+    def begin(self, now: float):
+        """送信開始（open の期限切れ・half-open の場合は試行中にする）"""
+        if self.state != 'closed':
+            self.state = 'half_open'
+            self.probing = True
+    
+    def record_success(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.probing = False
+    
+    def record_failure(self, now: float):
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened_at = now
+    
+    @property
+    def gauge_value(self) -> float:
+        return {'closed': 0.0, 'half_open': 0.5, 'open': 1.0}[self.state]
+
+class DeploymentTarget:
+    """送信先デプロイメント1件（接続設定・レート制御・応答時間とエラー率の指数移動平均）"""
+    
+    def __init__(self, name: str, endpoint: str, key: str, deployment: str, api_version: str,
+                 governor: RateGovernor, breaker: CircuitBreaker, request_timeout: Optional[float] = None):
+        self.name = name
+        self.endpoint = endpoint
+        self.key = key
+        self.deployment = deployment
+        self.api_version = api_version
+        self.governor = governor
+        self.breaker = breaker
+        self.request_timeout = request_timeout
+        
+        self.ewma_latency = None
+        self.ewma_error_rate = 0.0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+    
+    def request_options(self) -> Dict:
+        """openai.ChatCompletion.create に渡す接続設定（呼び出しごとに指定する）"""
+        return {
+            'engine': self.deployment,
+            'api_type': 'azure',
+            'api_base': self.endpoint,
+            'api_key': self.key,
+            'api_version': self.api_version,
+            'request_timeout': self.request_timeout
+        }
+    
+    def latency_quantile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+def load_targets(config, entries: Optional[List[Dict]] = None, name_prefix: str = '') -> List[DeploymentTarget]:
+    """送信先一覧の構築（entries省略時は AZURE_OPENAI_DEPLOYMENTS、未設定の場合は単一のデプロイメント）
+    
+    AZURE_OPENAI_DEPLOYMENTS はJSON配列。各要素は deployment のみ必須で、
+    name・endpoint・key・api_version・tpm・rpm を省略した場合は単一構成の設定値を使う。
+    name_prefix は送信先名（メトリクスのラベル）の接頭辞（モデル階層ごとに送信先を分ける場合）。
+    """
+    if entries is not None:
+        if not isinstance(entries, list) or not entries:
+            raise ValueError('Deployment list must be a non-empty array')
+    elif config.AZURE_OPENAI_DEPLOYMENTS:
+        try:
+            entries = json.loads(config.AZURE_OPENAI_DEPLOYMENTS)
+        except ValueError:
+            raise ValueError('AZURE_OPENAI_DEPLOYMENTS must be a JSON array')
+        if not isinstance(entries, list) or not entries:
+            raise ValueError('AZURE_OPENAI_DEPLOYMENTS must be a non-empty JSON array')
+    else:
+        entries = [{'deployment': config.AZURE_OPENAI_DEPLOYMENT}]
+    
+    targets = []
+    names = set()
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get('deployment'):
+            raise ValueError(f'AZURE_OPENAI_DEPLOYMENTS[{index}] requires deployment')
+        
+        name = name_prefix + (entry.get('name') or entry['deployment'])
+        if name in names:
+            name = f"{name}-{index}"
+        names.add(name)
+        governor = RateGovernor(
+            tpm=int(entry.get('tpm', config.AZURE_OPENAI_TPM)),
+            rpm=int(entry.get('rpm', config.AZURE_OPENAI_RPM)),
+            max_wait=config.AZURE_OPENAI_MAX_QUEUE_WAIT,
+            max_retries=config.AZURE_OPENAI_MAX_RETRIES,
+            retry_base=config.AZURE_OPENAI_RETRY_BASE,
+            retry_max=config.AZURE_OPENAI_RETRY_MAX,
+            name=name
+        )
+        targets.append(DeploymentTarget(
+            name=name,
+            endpoint=entry.get('endpoint', config.AZURE_OPENAI_ENDPOINT),
+            key=entry.get('key', config.AZURE_OPENAI_KEY),
+            deployment=entry['deployment'],
+            api_version=entry.get('api_version', config.AZURE_OPENAI_VERSION),
+            governor=governor,
+            breaker=CircuitBreaker(config.ROUTER_CIRCUIT_FAILURE_THRESHOLD, config.ROUTER_CIRCUIT_RESET_TIMEOUT),
+            request_timeout=config.AZURE_OPENAI_REQUEST_TIMEOUT or None
+        ))
+    return targets
+
+class DeploymentRouter:
+    """送信先の選択・失敗時の切り替え・ヘッジ送信
+    
+    選択は (応答時間の指数移動平均 × (1 + 処理中件数)) / (1 - エラー率) が最小のもの。
+    応答時間の記録が無い送信先は優先して試す。送信に失敗した場合は別の送信先で1回だけ再送する。
+    hedge_enabled の場合、応答が送信先の直近p95（hedge_min_delay 以上）を超えたら
+    次点の送信先にも同じ呼び出しを送り、先に成功した結果を返す。
+    """
+    
+    def __init__(self, targets: List[DeploymentTarget], ewma_alpha: float = 0.3, hedge_enabled: bool = False,
+                 hedge_quantile: float = 0.95, hedge_min_delay: float = 1.0, hedge_workers: int = 32):
+        if not targets:
+            raise ValueError('At least one deployment is required')
+        
+        self.targets = targets
+        self.ewma_alpha = ewma_alpha
+        self.hedge_enabled = hedge_enabled and len(targets) > 1
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        
+        self._lock = threading.Lock()
+        self._executor = None
+        if self.hedge_enabled:
+            self._executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='ai-hedge')
+        
+        for target in targets:
+            CIRCUIT_STATE.labels(target.name).set(0)
+    
+    def call(self, func: Callable[[DeploymentTarget], object], hedge: bool = True):
+        """送信先を選んで func(target) を実行"""
+        primary = self._acquire()
+        hedge_delay = self._hedge_delay(primary) if hedge else None
+        if hedge_delay is None:
+            try:
+                return self._invoke(primary, func)
+            except Exception as e:
+                return self._failover(primary, func, e)
+        
+        future = self._executor.submit(self._invoke, primary, func)
+        try:
+            return future.result(timeout=hedge_delay)
+        except FutureTimeoutError:
+            pass
+        except Exception as e:
+            return self._failover(primary, func, e)
+        
+        secondary = self._acquire(exclude=primary, required=False)
+        if secondary is None:
+            return future.result()
+        
+        hedged = self._executor.submit(self._invoke, secondary, func)
+        pending = {future, hedged}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for finished in done:
+                try:
+                    result = finished.result()
+                except Exception as e:
+                    error = e
+                    continue
+                HEDGED_CALLS.labels('hedge' if finished is hedged else 'primary').inc()
+                return result
+        raise error
+    
+    async def call_async(self, func: Callable[[DeploymentTarget], Awaitable], hedge: bool = True):
+        """送信先を選んで func(target) を実行（asyncio版、ヘッジで負けた呼び出しはキャンセルする）"""
+        primary = self._acquire()
+        hedge_delay = self._hedge_delay(primary) if hedge else None
+        if hedge_delay is None:
+            try:
+                return await self._invoke_async(primary, func)
+            except Exception as e:
+                return await self._failover_async(primary, func, e)
+        
+        task = asyncio.ensure_future(self._invoke_async(primary, func))
+        done, _ = await asyncio.wait({task}, timeout=hedge_delay)
+        if done:
+            try:
+                return task.result()
+            except Exception as e:
+                return await self._failover_async(primary, func, e)
+        
+        secondary = self._acquire(exclude=primary, required=False)
+        if secondary is None:
+            return await task
+        
+        hedged = asyncio.ensure_future(self._invoke_async(secondary, func))
+        pending = {task, hedged}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is not None:
+                        error = finished.exception()
+                        continue
+                    HEDGED_CALLS.labels('hedge' if finished is hedged else 'primary').inc()
+                    return finished.result()
+            raise error
+        finally:
+            for remaining in pending:
+                remaining.cancel()
+    
+    def _failover(self, failed: DeploymentTarget, func: Callable, error: Exception):
+        secondary = self._acquire(exclude=failed, required=False)
+        if secondary is None:
+            raise error
+        logger.warning(f"Deployment {failed.name} failed, retrying on {secondary.name}")
+        return self._invoke(secondary, func)
+    
+    async def _failover_async(self, failed: DeploymentTarget, func: Callable, error: Exception):
+        secondary = self._acquire(exclude=failed, required=False)
+        if secondary is None:
+            raise error
+        logger.warning(f"Deployment {failed.name} failed, retrying on {secondary.name}")
+        return await self._invoke_async(secondary, func)
+    
+    def _acquire(self, exclude: Optional[DeploymentTarget] = None, required: bool = True) -> Optional[DeploymentTarget]:
+        """送信先の選択（全てのブレーカーが open の場合、required なら最も早く再開する送信先を使う）"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                target for target in self.targets
+                if target is not exclude and target.breaker.available(now)
+            ]
+            if not candidates:
+                if not required:
+                    return None
+                candidates = [min(self.targets, key=lambda target: target.breaker.opened_at)]
+            
+            target = min(candidates, key=self._score)
+            target.breaker.begin(now)
+            target.in_flight += 1
+            CIRCUIT_STATE.labels(target.name).set(target.breaker.gauge_value)
+            return target
+    
+    def _score(self, target: DeploymentTarget) -> float:
+        if target.ewma_latency is None:
+            return target.in_flight * 1e-6
+        return target.ewma_latency * (1 + target.in_flight) / max(0.05, 1 - target.ewma_error_rate)
+    
+    def _hedge_delay(self, target: DeploymentTarget) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        quantile = target.latency_quantile(self.hedge_quantile)
+        if quantile is None:
+            return None
+        return max(self.hedge_min_delay, quantile)
+    
+    def _invoke(self, target: DeploymentTarget, func: Callable):
+        started = time.monotonic()
+        try:
+            result = func(target)
+        except Exception:
+            self._record(target, None)
+            raise
+        self._record(target, time.monotonic() - started)
+        return result
+    
+    async def _invoke_async(self, target: DeploymentTarget, func: Callable):
+        started = time.monotonic()
+        try:
+            result = await func(target)
+        except asyncio.CancelledError:
+            self._release(target)
+            raise
+        except Exception:
+            self._record(target, None)
+            raise
+        self._record(target, time.monotonic() - started)
+        return result
+    
+    def _record(self, target: DeploymentTarget, latency: Optional[float]):
+        """結果の記録（latency が None の場合は失敗）"""
+        alpha = self.ewma_alpha
+        with self._lock:
+            target.in_flight -= 1
+            if latency is None:
+                target.ewma_error_rate = alpha + (1 - alpha) * target.ewma_error_rate
+                target.breaker.record_failure(time.monotonic())
+            else:
+                target.ewma_error_rate = (1 - alpha) * target.ewma_error_rate
+                target.ewma_latency = latency if target.ewma_latency is None else alpha * latency + (1 - alpha) * target.ewma_latency
+                target.latencies.append(latency)
+                target.breaker.record_success()
+            CIRCUIT_STATE.labels(target.name).set(target.breaker.gauge_value)
+        
+        DEPLOYMENT_CALLS.labels(target.name, 'failure' if latency is None else 'success').inc()
+        if latency is None and target.breaker.state == 'open':
+            logger.warning(f"Circuit opened for deployment {target.name}")
+    
+    def _release(self, target: DeploymentTarget):
+        """キャンセルされた呼び出しの後始末（成功・失敗のどちらにも数えない）"""
+        with self._lock:
+            target.in_flight -= 1
+            if target.breaker.probing:
+                target.breaker.probing = False
+    
+    def get_stats(self) -> List[Dict]:
+        """送信先ごとの状態取得"""
+        with self._lock:
+            stats = []
+            for target in self.targets:
+                p95 = target.latency_quantile(0.95)
+                stats.append({
+                    'name': target.name,
+                    'deployment': target.deployment,
+                    'endpoint': target.endpoint,
+                    'circuit': target.breaker.state,
+                    'ewma_latency_ms': round(target.ewma_latency * 1000, 1) if target.ewma_latency is not None else None,
+                    'p95_latency_ms': round(p95 * 1000, 1) if p95 is not None else None,
+                    'error_rate': round(target.ewma_error_rate, 4),
+                    'in_flight': target.in_flight
+                })
+        
+        for entry, target in zip(stats, self.targets):
+            entry['rate_governor'] = target.governor.get_stats()
+        return stats
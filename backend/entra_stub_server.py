@@ -0,0 +1,276 @@
+"""
+EntraID互換スタブサーバー
+署名鍵セット（JWKS）とMicrosoft Graph /me を模擬し、スタブの鍵で署名したIDトークンと
+Graph用のアクセストークンを発行する。ネットワークに接続せずにローカルのトークン検証
+（署名・aud・iss・exp の確認、鍵のローテーション）を試験するために使用する
+
+実行例:
+    python entra_stub_server.py --port 9000 --client-id your-client-id
+    
+    # バックエンドの検証先をスタブに向ける（MOCK_MODE=false）
+    MOCK_MODE=false ENTRA_CLIENT_ID=your-client-id \\
+        ENTRA_JWKS_URI=http://127.0.0.1:9000/discovery/v2.0/keys ENTRA_ISSUER=http://127.0.0.1:9000/v2.0 \\
+        GRAPH_API_ENDPOINT=http://127.0.0.1:9000 python app.py
+    
+    # トークンを発行してログインする
+    curl -s -X POST http://127.0.0.1:9000/stub/token -d '{"email": "student001@st.ritsumei.ac.jp"}'
+
+エンドポイント:
+    GET  /discovery/v2.0/keys   署名鍵セット（JWKS）
+    GET  /me                    Graphのプロフィール（Authorization: Bearer <access_token>）
+    POST /stub/token            IDトークン・アクセストークンの発行（JSON、省略した項目は既定値）
+    POST /stub/rotate           署名鍵のローテーション（{"keep_previous": false} で旧鍵を削除）
+    GET  /stub/stats            受信件数
+"""
+import argparse
+import json
+import logging
+import secrets
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+logger = logging.getLogger(__name__)
+
+JWKS_PATH = '/discovery/v2.0/keys'
+
+class SigningKeys:
+    """スタブの署名鍵（最後に追加した鍵で署名し、保持している全鍵をJWKSで公開する）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}  # kid -> 秘密鍵
+        self.current_kid = None
+        self.rotate()
+    
+    @staticmethod
+    def generate() -> rsa.RSAPrivateKey:
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    
+    def rotate(self, keep_previous: bool = True) -> str:
+        """新しい鍵を追加して署名に使用（keep_previous=False の場合は旧鍵を公開しない）"""
+        kid = uuid.uuid4().hex
+        key = self.generate()
+        with self._lock:
+            if not keep_previous:
+                self._keys.clear()
+            self._keys[kid] = key
+            self.current_kid = kid
+        return kid
+    
+    def private_key(self, kid: Optional[str] = None) -> rsa.RSAPrivateKey:
+        with self._lock:
+            return self._keys[kid or self.current_kid]
+    
+    def jwks(self) -> Dict:
+        with self._lock:
+            keys = list(self._keys.items())
+        
+        published = []
+        for kid, key in keys:
+            jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+            jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+            published.append(jwk)
+        return {'keys': published}
+
+class EntraStubStats:
+    """エンドポイントごとの受信件数"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            'jwks_requests': 0,
+            'graph_requests': 0,
+            'graph_unauthorized': 0,
+            'tokens_issued': 0
+        }
+    
+    def add(self, name: str, value: int = 1):
+        with self._lock:
+            self._counts[name] += value
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return dict(self._counts)
+
+class EntraStubRequestHandler(BaseHTTPRequestHandler):
+    """JWKS・Graph・管理用エンドポイントの処理"""
+    
+    protocol_version = 'HTTP/1.1'
+    server_version = 'EntraStub/1.0'
+    
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == JWKS_PATH:
+            self.server.stats.add('jwks_requests')
+            self._send_json(200, self.server.keys.jwks())
+        elif path == '/me':
+            self._graph_me()
+        elif path == '/stub/stats':
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_error(404, 'NotFound', 'Resource not found')
+    
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._read_json()
+        if body is None:
+            self._send_error(400, 'BadRequest', 'Request body must be JSON')
+            return
+        
+        if path == '/stub/token':
+            try:
+                self._send_json(200, self.server.issue_tokens(**body))
+            except TypeError as e:
+                self._send_error(400, 'BadRequest', str(e))
+        elif path == '/stub/rotate':
+            kid = self.server.keys.rotate(keep_previous=bool(body.get('keep_previous', True)))
+            self._send_json(200, {'kid': kid})
+        else:
+            self._send_error(404, 'NotFound', 'Resource not found')
+    
+    def _graph_me(self):
+        self.server.stats.add('graph_requests')
+        token = self.headers.get('Authorization', '').replace('Bearer ', '')
+        profile = self.server.profile_for(token)
+        if profile is None:
+            self.server.stats.add('graph_unauthorized')
+            self._send_error(401, 'InvalidAuthenticationToken', 'Access token is empty or invalid.')
+            return
+        self._send_json(200, profile)
+    
+    def _read_json(self) -> Optional[Dict]:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw or b'{}')
+        except ValueError:
+            return None
+        return body if isinstance(body, dict) else None
+    
+    def _send_json(self, status: int, payload: Dict):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _send_error(self, status: int, code: str, message: str):
+        self._send_json(status, {'error': {'code': code, 'message': message}})
+    
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+class EntraStubServer(ThreadingHTTPServer):
+    """スタブサーバー（リクエストごとにスレッドで処理）"""
+    
+    daemon_threads = True
+    
+    def __init__(self, address: tuple, client_id: str):
+        super().__init__(address, EntraStubRequestHandler)
+        self.client_id = client_id
+        self.keys = SigningKeys()
+        self.stats = EntraStubStats()
+        self._profiles = {}  # アクセストークン -> Graphのプロフィール
+        self._lock = threading.Lock()
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    @property
+    def issuer(self) -> str:
+        return f"{self.base_url}/v2.0"
+    
+    @property
+    def jwks_uri(self) -> str:
+        return f"{self.base_url}{JWKS_PATH}"
+    
+    def issue_id_token(self, claims: Optional[Dict] = None, kid: Optional[str] = None, expires_in: float = 3600,
+                       signing_key: Optional[rsa.RSAPrivateKey] = None) -> str:
+        """IDトークン発行（claims の値は既定のクレームを上書きし、None を指定したクレームは含めない）
+        
+        signing_key を指定した場合は公開していない鍵で署名する（改ざんされたトークンの試験用）
+        """
+        now = int(time.time())
+        payload = {
+            'aud': self.client_id,
+            'iss': self.issuer,
+            'iat': now,
+            'nbf': now,
+            'exp': now + int(expires_in),
+            'oid': str(uuid.uuid4()),
+            'name': 'テスト ユーザー',
+            'preferred_username': 'student001@st.ritsumei.ac.jp'
+        }
+        payload.update(claims or {})
+        payload = {name: value for name, value in payload.items() if value is not None}
+        
+        kid = kid or self.keys.current_kid
+        key = signing_key or self.keys.private_key(kid)
+        self.stats.add('tokens_issued')
+        return jwt.encode(payload, key, algorithm='RS256', headers={'kid': kid})
+    
+    def issue_access_token(self, profile: Dict) -> str:
+        """Graph /me で profile を返すアクセストークン発行"""
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._profiles[token] = dict(profile)
+        return token
+    
+    def issue_tokens(self, email: str = 'student001@st.ritsumei.ac.jp', name: str = 'テスト ユーザー',
+                     oid: Optional[str] = None, expires_in: float = 3600) -> Dict:
+        """同じユーザーのIDトークン・アクセストークン発行（/stub/token）"""
+        oid = oid or str(uuid.uuid4())
+        id_token = self.issue_id_token({'oid': oid, 'name': name, 'preferred_username': email}, expires_in=expires_in)
+        access_token = self.issue_access_token({
+            'id': oid,
+            'displayName': name,
+            'mail': email,
+            'userPrincipalName': email
+        })
+        return {'id_token': id_token, 'access_token': access_token, 'oid': oid}
+    
+    def profile_for(self, access_token: str) -> Optional[Dict]:
+        with self._lock:
+            profile = self._profiles.get(access_token)
+        return dict(profile) if profile is not None else None
+
+def start_entra_stub_server(client_id: str = 'your-client-id', host: str = '127.0.0.1',
+                            port: int = 0) -> EntraStubServer:
+    """バックグラウンドスレッドでスタブサーバーを起動（port=0で空きポート）"""
+    server = EntraStubServer((host, port), client_id)
+    threading.Thread(target=server.serve_forever, name='entra-stub', daemon=True).start()
+    return server
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='EntraID JWKS / Microsoft Graph stub server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--client-id', default='your-client-id', help='発行するIDトークンの aud（ENTRA_CLIENT_ID と合わせる）')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    
+    server = EntraStubServer((args.host, args.port), args.client_id)
+    logger.info(f"EntraID stub server listening on {server.base_url} (issuer {server.issuer}, jwks {server.jwks_uri})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+コンピテンシー評価キャッシュモジュール
+正規化した入力文とプロンプトバージョンをキーに評価結果を再利用する
+"""
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def normalize_message(message: str) -> str:
+    """キャッシュキー用の入力文正規化（全角半角の統一・空白の畳み込み）"""
+    normalized = unicodedata.normalize('NFKC', message)
+    return re.sub(r'\s+', ' ', normalized).strip()
+
+class EvaluationCache:
+    """LRU + TTL のメモリキャッシュ（任意でSQLiteによるディスク層）
+    
+    キーは (プロンプトバージョン, 正規化済み入力文) のハッシュ。
+    プロンプトが変更された場合は set_prompt_version() で旧バージョンの結果を破棄する。
+    """
+    
+    def __init__(self, max_entries: int = 2048, ttl: float = 86400, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prompt_version = None
+        
+        self._entries = OrderedDict()  # key -> (response, expires_at, prompt_version)
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0
+        }
+        
+        self._disk = None
+        if disk_path:
+            self._initialize_disk(disk_path)
+    
+    def _initialize_disk(self, disk_path: str):
+        """ディスク層（SQLite）初期化"""
+        try:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("""
+                CREATE TABLE IF NOT EXISTS evaluation_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    prompt_version TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._disk.execute("DELETE FROM evaluation_cache WHERE expires_at < ?", (time.time(),))
+            self._disk.commit()
+            logger.info(f"Evaluation cache disk tier initialized: {disk_path}")
+        
+        except Exception as e:
+            logger.error(f"Evaluation cache disk tier initialization error: {str(e)}")
+            self._disk = None
+    
+    @property
+    def has_disk_tier(self) -> bool:
+        """ディスク層（sqlite）を使用しているか（読み書きがファイルI/Oを伴う）"""
+        return self._disk is not None
+    
+    def _make_key(self, message: str, prompt_version: str) -> str:
+        return hashlib.sha256(f"{prompt_version}\0{normalize_message(message)}".encode('utf-8')).hexdigest()
+    
+    def set_prompt_version(self, prompt_version: str):
+        """現行プロンプトバージョン設定（旧バージョンのエントリを破棄）"""
+        with self._lock:
+            if prompt_version == self.prompt_version:
+                return
+            self.prompt_version = prompt_version
+            
+            stale = [key for key, entry in self._entries.items() if entry[2] != prompt_version]
+            for key in stale:
+                del self._entries[key]
+            self._stats['invalidations'] += len(stale)
+            
+            if self._disk is not None:
+                try:
+                    cursor = self._disk.execute(
+                        "DELETE FROM evaluation_cache WHERE prompt_version != ?", (prompt_version,)
+                    )
+                    self._disk.commit()
+                    self._stats['invalidations'] += cursor.rowcount
+                except Exception as e:
+                    logger.error(f"Evaluation cache disk invalidation error: {str(e)}")
+        
+        logger.info(f"Evaluation cache prompt version set: {prompt_version}")
+    
+    def get(self, message: str, prompt_version: str) -> Optional[str]:
+        """キャッシュ取得（無い場合はNone）"""
+        key = self._make_key(message, prompt_version)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return entry[0]
+                del self._entries[key]
+                self._stats['expirations'] += 1
+            
+            if self._disk is not None:
+                try:
+                    row = self._disk.execute(
+                        "SELECT response, expires_at FROM evaluation_cache WHERE cache_key = ? AND expires_at > ?",
+                        (key, now)
+                    ).fetchone()
+                except Exception as e:
+                    logger.error(f"Evaluation cache disk read error: {str(e)}")
+                    row = None
+                
+                if row is not None:
+                    self._store_memory(key, row[0], row[1], prompt_version)
+                    self._stats['disk_hits'] += 1
+                    return row[0]
+            
+            self._stats['misses'] += 1
+            return None
+    
+    def set(self, message: str, prompt_version: str, response: str):
+        """キャッシュ登録"""
+        key = self._make_key(message, prompt_version)
+        expires_at = time.time() + self.ttl
+        
+        with self._lock:
+            self._store_memory(key, response, expires_at, prompt_version)
+            
+            if self._disk is not None:
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO evaluation_cache (cache_key, prompt_version, response, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, prompt_version, response, expires_at)
+                    )
+                    self._disk.commit()
+                except Exception as e:
+                    logger.error(f"Evaluation cache disk write error: {str(e)}")
+    
+    def _store_memory(self, key: str, response: str, expires_at: float, prompt_version: str):
+        """メモリ層への登録（ロック取得済みで呼び出す）"""
+        self._entries[key] = (response, expires_at, prompt_version)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+    
+    def get_stats(self) -> Dict:
+        """ヒット・ミス件数などの統計取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hits'] = hits
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl
+        stats['disk_tier'] = self.has_disk_tier
+        stats['prompt_version'] = self.prompt_version
+        return stats
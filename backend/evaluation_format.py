@@ -0,0 +1,166 @@
+"""
+評価結果の出力形式モジュール
+JSON出力モード（関数呼び出し）でモデルが返したコンピテンシーコード・点数・短いコメントを検証し、
+従来の【コンピテンシー評価結果】形式のテキストに整形する
+"""
+import json
+from typing import Dict, List, Optional
+
+from competency_scores import COMPETENCIES, MAX_SCORE
+
+OUTPUT_FORMAT_TEXT = 'text'
+OUTPUT_FORMAT_JSON = 'json'
+OUTPUT_FORMATS = (OUTPUT_FORMAT_TEXT, OUTPUT_FORMAT_JSON)
+
+MAX_COMPETENCIES = 3
+EVALUATION_FUNCTION_NAME = 'submit_competency_evaluation'
+
+# Chat Completionsの tools・tool_choice（関数呼び出しを強制し、引数として評価結果を受け取る）
+EVALUATION_TOOL_OPTIONS = {
+    'tools': [{
+        'type': 'function',
+        'function': {
+            'name': EVALUATION_FUNCTION_NAME,
+            'description': 'コンピテンシー評価結果を登録する',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'competencies': {
+                        'type': 'array',
+                        'minItems': 1,
+                        'maxItems': MAX_COMPETENCIES,
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'code': {'type': 'string', 'enum': list(COMPETENCIES)},
+                                'score': {'type': 'integer', 'minimum': 1, 'maximum': MAX_SCORE},
+                                'comment': {'type': 'string'}
+                            },
+                            'required': ['code', 'score', 'comment']
+                        }
+                    },
+                    'summary': {'type': 'string'},
+                    'advice': {'type': 'array', 'items': {'type': 'string'}}
+                },
+                'required': ['competencies', 'summary', 'advice']
+            }
+        }
+    }],
+    'tool_choice': {'type': 'function', 'function': {'name': EVALUATION_FUNCTION_NAME}}
+}
+
+def _require_text(value, name: str) -> str:
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f'{name} must be a non-empty string')
+    return value.strip()
+
+def _load_arguments(arguments: str) -> Dict:
+    try:
+        data = json.loads(arguments)
+    except (TypeError, ValueError):
+        raise ValueError('Evaluation is not valid JSON')
+    if not isinstance(data, dict):
+        raise ValueError('Evaluation must be a JSON object')
+    return data
+
+def _parse_competency(item, index: int, seen: set) -> Dict:
+    if not isinstance(item, dict):
+        raise ValueError(f'competencies[{index}] must be an object')
+    
+    code = item.get('code')
+    if code not in COMPETENCIES or code in seen:
+        raise ValueError(f'competencies[{index}].code is unknown or duplicated')
+    score = item.get('score')
+    if isinstance(score, bool) or not isinstance(score, int) or not 1 <= score <= MAX_SCORE:
+        raise ValueError(f'competencies[{index}].score must be an integer 1-{MAX_SCORE}')
+    
+    return {
+        'code': code,
+        'score': score,
+        'comment': _require_text(item.get('comment'), f'competencies[{index}].comment')
+    }
+
+def _parse_advice(advice) -> List[str]:
+    if isinstance(advice, str):
+        advice = [line for line in advice.splitlines() if line.strip()]
+    if not isinstance(advice, list) or not advice:
+        raise ValueError('advice must be a non-empty list')
+    return [_require_text(line, 'advice').lstrip('・') for line in advice]
+
+def parse_evaluation(arguments: str) -> Dict:
+    """関数呼び出しの引数（JSON文字列）の検証（不正な場合はValueError）"""
+    data = _load_arguments(arguments)
+    
+    items = data.get('competencies')
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_COMPETENCIES:
+        raise ValueError(f'competencies must have 1-{MAX_COMPETENCIES} items')
+    
+    competencies = []
+    seen = set()
+    for index, item in enumerate(items):
+        competencies.append(_parse_competency(item, index, seen))
+        seen.add(competencies[-1]['code'])
+    
+    return {
+        'competencies': competencies,
+        'summary': _require_text(data.get('summary'), 'summary'),
+        'advice': _parse_advice(data.get('advice'))
+    }
+
+def salvage_evaluation(arguments: str) -> Optional[Dict]:
+    """検証に失敗した引数から妥当な項目だけを取り出す
+    
+    不正なコンピテンシーは除外し（先頭から最大 MAX_COMPETENCIES 件）、総評・アドバイスが不正な場合は
+    その項目を省略する。JSONとして読めない場合・妥当なコンピテンシーが1件も無い場合はNone。
+    """
+    try:
+        data = _load_arguments(arguments)
+    except ValueError:
+        return None
+    
+    items = data.get('competencies')
+    competencies = []
+    seen = set()
+    for index, item in enumerate(items if isinstance(items, list) else []):
+        try:
+            competency = _parse_competency(item, index, seen)
+        except ValueError:
+            continue
+        competencies.append(competency)
+        seen.add(competency['code'])
+        if len(competencies) == MAX_COMPETENCIES:
+            break
+    if not competencies:
+        return None
+    
+    evaluation = {'competencies': competencies, 'summary': None, 'advice': []}
+    try:
+        evaluation['summary'] = _require_text(data.get('summary'), 'summary')
+    except ValueError:
+        pass
+    try:
+        evaluation['advice'] = _parse_advice(data.get('advice'))
+    except ValueError:
+        pass
+    return evaluation
+
+def render_evaluation(evaluation: Dict) -> str:
+    """評価結果を【コンピテンシー評価結果】形式のテキストに整形（総評・アドバイスが無い場合はその見出しを省略）"""
+    response = "【コンピテンシー評価結果】\n\n"
+    
+    for item in evaluation['competencies']:
+        english, japanese = COMPETENCIES[item['code']]
+        score = item['score']
+        stars = "★" * score + "☆" * (MAX_SCORE - score)
+        response += f"◆ {english}（{japanese}） {stars} ({score}/{MAX_SCORE})\n"
+        response += f"・{item['comment']}\n\n"
+    
+    if evaluation['summary']:
+        response += "【総評】\n"
+        response += evaluation['summary'] + "\n\n"
+    
+    if evaluation['advice']:
+        response += "【今後の学習へのアドバイス】\n"
+        response += "\n".join(f"・{line}" for line in evaluation['advice'])
+    
+    return response.rstrip("\n")
@@ -0,0 +1,141 @@
+"""
+評価一覧クエリモジュール
+教員向けのコンピテンシー評価一覧（学生ID・コンピテンシー・本文の部分一致による絞り込み、並べ替え、
+カーソルによるページング、返す項目の指定）の条件を検証し、各バックエンドで共通の形にする
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from competency_scores import COMPETENCIES, competency_code
+
+SORT_FIELDS = ('timestamp', 'user_id')
+SORT_ORDERS = ('desc', 'asc')
+
+# 一覧表示用の項目（既定）と本文・本文の抜粋
+LIST_FIELDS = ['id', 'timestamp', 'user_id', 'chat_id', 'prompt_version', 'competency_scores']
+BODY_FIELDS = ['user_message', 'ai_response']
+EXCERPT_FIELDS = {'user_message_excerpt': 'user_message', 'ai_response_excerpt': 'ai_response'}
+FIELDS = LIST_FIELDS + BODY_FIELDS + list(EXCERPT_FIELDS)
+
+REQUIRED_FIELDS = ['id', 'timestamp']  # カーソルの位置に使うため常に返す
+EXCERPT_LENGTH = 50
+MAX_LIMIT = 100
+MAX_TEXT_LENGTH = 100
+
+def excerpt(text: Optional[str]) -> str:
+    """本文の抜粋（EXCERPT_LENGTH 文字を超える場合は切り詰めて「…」を付ける）"""
+    text = text or ''
+    return text[:EXCERPT_LENGTH] + '…' if len(text) > EXCERPT_LENGTH else text
+
+@dataclass
+class EvaluationQuery:
+    """評価一覧の取得条件
+    
+    並べ替えは timestamp（既定は新しい順）または user_id（同じ学生内は timestamp 順）。
+    fields は返す項目で、既定では本文（user_message・ai_response）を含まない。
+    一覧表示には本文の代わりに先頭 EXCERPT_LENGTH 文字の抜粋（*_excerpt）を指定できる。
+    """
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    user_id: Optional[str] = None
+    competency: Optional[str] = None
+    text: Optional[str] = None
+    sort: str = 'timestamp'
+    order: str = 'desc'
+    fields: List[str] = field(default_factory=lambda: list(LIST_FIELDS))
+    limit: int = 50
+    cursor: Optional[str] = None
+    
+    @classmethod
+    def from_dict(cls, data: Dict, start_date: Optional[datetime] = None,
+                  end_date: Optional[datetime] = None) -> 'EvaluationQuery':
+        """リクエストのクエリパラメータからの構築（不正な形式はValueError）"""
+        competency = data.get('competency') or None
+        if competency is not None and competency not in COMPETENCIES:
+            competency = competency_code(competency)
+            if competency is None:
+                raise ValueError(f"Unknown competency: {data.get('competency')}")
+        
+        text = (data.get('q') or '').strip() or None
+        if text is not None and len(text) > MAX_TEXT_LENGTH:
+            raise ValueError(f'q must be at most {MAX_TEXT_LENGTH} characters')
+        
+        sort = data.get('sort') or 'timestamp'
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+        order = data.get('order') or ('desc' if sort == 'timestamp' else 'asc')
+        if order not in SORT_ORDERS:
+            raise ValueError(f"order must be one of: {', '.join(SORT_ORDERS)}")
+        
+        fields = list(LIST_FIELDS)
+        if data.get('fields'):
+            fields = [name.strip() for name in data['fields'].split(',') if name.strip()]
+            unknown = [name for name in fields if name not in FIELDS]
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        fields = REQUIRED_FIELDS + [name for name in fields if name not in REQUIRED_FIELDS]
+        
+        try:
+            limit = min(int(data.get('limit', 50)), MAX_LIMIT)
+        except (TypeError, ValueError):
+            raise ValueError('limit must be an integer')
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        
+        return cls(
+            start_date=start_date,
+            end_date=end_date,
+            user_id=data.get('user_id') or None,
+            competency=competency,
+            text=text,
+            sort=sort,
+            order=order,
+            fields=fields,
+            limit=limit,
+            cursor=data.get('cursor') or None
+        )
+    
+    @property
+    def sort_key(self) -> str:
+        """カーソルに記録する並べ替え条件（条件の異なるカーソルの流用を検出する）"""
+        return f"{self.sort}:{self.order}"
+    
+    @property
+    def descending(self) -> bool:
+        return self.order == 'desc'
+    
+    def matches(self, record: Dict) -> bool:
+        """絞り込み条件との照合（クエリで絞り込めないバックエンド用）"""
+        if self.user_id is not None and record.get('user_id') != self.user_id:
+            return False
+        if self.competency is not None and not any(
+            entry.get('code') == self.competency for entry in record.get('competency_scores') or ()
+        ):
+            return False
+        if self.text is not None:
+            text = self.text.casefold()
+            return any(text in (record.get(name) or '').casefold() for name in BODY_FIELDS)
+        return True
+    
+    def sort_value(self, record: Dict) -> List:
+        """並べ替えの値（同じ値の場合は timestamp・id の順）"""
+        values = [record.get('timestamp') or '', record.get('id') or '']
+        if self.sort == 'user_id':
+            values.insert(0, record.get('user_id') or '')
+        return values
+    
+    def project(self, record: Dict) -> Dict:
+        """指定された項目のみの辞書に変換（抜粋は本文または切り出し済みの値から作る）"""
+        projected = {}
+        for name in self.fields:
+            if name in EXCERPT_FIELDS:
+                projected[name] = excerpt(record.get(name, record.get(EXCERPT_FIELDS[name])))
+            elif name == 'competency_scores':
+                projected[name] = record.get(name) or []
+            else:
+                projected[name] = record.get(name)
+        return projected
+    
+    def project_all(self, records: Iterable[Dict]) -> List[Dict]:
+        return [self.project(record) for record in records]
@@ -0,0 +1,144 @@
+"""
+キーワード分類モジュール
+keywords.jsonのキーワードから一度だけAho-Corasickオートマトンを構築し、
+入力文を1回走査するだけで該当するコンピテンシー・状況・話題の分類を全て求める
+"""
+import json
+import logging
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """照合用の正規化（全角英数字・半角カナの統一と英字の大文字小文字の同一視）"""
+    return unicodedata.normalize('NFKC', text or '').casefold()
+
+class KeywordAutomaton:
+    """複数キーワードの同時照合（Aho-Corasick法）
+    
+    各キーワードには任意の値を対応付けられ、search() は入力文中に出現したキーワードの値を
+    出現位置によらず重複なしで返す。構築後は変更しない（複数スレッドから同時に使用できる）。
+    """
+    
+    def __init__(self, keywords: Iterable[Tuple[str, object]]):
+        self._goto = [{}]  # ノード番号 -> {文字: 遷移先ノード番号}
+        self._fail = [0]
+        self._output = [()]  # ノード番号 -> そのノードで終わるキーワードの値
+        self.size = 0
+        
+        for keyword, value in keywords:
+            if keyword:
+                self._add(keyword, value)
+        self._build_failure_links()
+    
+    def _add(self, keyword: str, value: object):
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = next_node
+        self._output[node] = self._output[node] + (value,)
+        self.size += 1
+    
+    def _build_failure_links(self):
+        """幅優先で失敗遷移を求め、失敗先の出力を各ノードに統合する"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+    
+    def search(self, text: str) -> set:
+        """入力文中に出現したキーワードの値の集合"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+@dataclass
+class KeywordMatch:
+    """分類結果（グループごとの該当ラベルをkeywords.jsonの記載順で保持）"""
+    groups: Dict[str, List[str]] = field(default_factory=dict)
+    keyword_count: int = 0  # 出現したキーワードの種類数
+    
+    def labels(self, group: str) -> List[str]:
+        return self.groups.get(group, [])
+    
+    def first(self, group: str) -> Optional[str]:
+        """記載順で最初に該当したラベル（優先度の高い分類、該当なしはNone）"""
+        labels = self.groups.get(group)
+        return labels[0] if labels else None
+    
+    def to_dict(self) -> Dict:
+        return {'groups': self.groups, 'keyword_count': self.keyword_count}
+
+class KeywordClassifier:
+    """キーワードによる入力文の分類
+    
+    定義は {グループ: {ラベル: [キーワード, ...]}} の形式で、グループ内のラベルは記載順を優先度とする
+    （例: competencies の R・S・T・E、situations の anxiety・communication）。
+    """
+    
+    def __init__(self, definitions: Dict[str, Dict[str, List[str]]]):
+        self.definitions = definitions
+        self._order = {}  # (グループ, ラベル) -> 記載順
+        
+        keywords = []
+        for group, labels in definitions.items():
+            for index, (label, words) in enumerate(labels.items()):
+                self._order[(group, label)] = index
+                for word in words:
+                    normalized = normalize_text(word)
+                    keywords.append((normalized, (group, label, normalized)))
+        self._automaton = KeywordAutomaton(keywords)
+    
+    @classmethod
+    def from_file(cls, path: str) -> 'KeywordClassifier':
+        """keywords.jsonから構築（読み込めない場合はキーワードなしで構築し、全ての入力を該当なしとする）"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                definitions = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Keyword file load error: {str(e)}")
+            definitions = {}
+        
+        classifier = cls(definitions)
+        logger.info(f"Keyword classifier compiled: {classifier.keyword_count} keywords")
+        return classifier
+    
+    @property
+    def keyword_count(self) -> int:
+        return self._automaton.size
+    
+    def classify(self, message: str) -> KeywordMatch:
+        """入力文の分類（1回の走査で全グループを判定）"""
+        hits = self._automaton.search(normalize_text(message))
+        
+        matched = {(group, label) for group, label, _ in hits}
+        groups = {}
+        for group, label in sorted(matched, key=lambda key: (key[0], self._order[key])):
+            groups.setdefault(group, []).append(label)
+        return KeywordMatch(groups=groups, keyword_count=len({keyword for _, _, keyword in hits}))
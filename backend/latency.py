@@ -0,0 +1,78 @@
+"""
+遅延分布モジュール
+モックAIの応答遅延を固定値ではなく分布から生成する（ベンチマーク・負荷試験用）
+
+指定形式:
+    fixed:1.5              常に1.5秒
+    uniform:0.5,2.5        0.5〜2.5秒の一様分布
+    normal:1.5,0.3         平均1.5秒・標準偏差0.3秒の正規分布
+    lognormal:1.2,0.5      中央値1.2秒・σ=0.5の対数正規分布（LLMの応答時間に近い裾の長い分布）
+    exponential:1.5        平均1.5秒の指数分布
+"""
+import math
+import random
+from typing import Dict, List, Optional
+
+DISTRIBUTIONS = {
+    'fixed': 1,
+    'uniform': 2,
+    'normal': 2,
+    'lognormal': 2,
+    'exponential': 1
+}
+
+class LatencyDistribution:
+    """遅延分布（sample()は0以上の秒数を返す）"""
+    
+    def __init__(self, kind: str, params: List[float], seed: Optional[int] = None):
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        if len(params) != DISTRIBUTIONS[kind]:
+            raise ValueError(f"Latency distribution '{kind}' takes {DISTRIBUTIONS[kind]} parameter(s)")
+        
+        self.kind = kind
+        self.params = params
+        self._random = random.Random(seed)
+    
+    @classmethod
+    def from_spec(cls, spec: str, seed: Optional[int] = None) -> 'LatencyDistribution':
+        """'kind:param1,param2' 形式の文字列から生成（数値のみの場合は固定値）"""
+        spec = spec.strip()
+        if ':' not in spec:
+            return cls('fixed', [float(spec)], seed)
+        
+        kind, _, raw_params = spec.partition(':')
+        try:
+            params = [float(value) for value in raw_params.split(',') if value.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        return cls(kind.strip().lower(), params, seed)
+    
+    def sample(self) -> float:
+        """遅延（秒）を1つ生成"""
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = self._random.uniform(self.params[0], self.params[1])
+        elif self.kind == 'normal':
+            value = self._random.gauss(self.params[0], self.params[1])
+        elif self.kind == 'lognormal':
+            value = self._random.lognormvariate(math.log(self.params[0]), self.params[1])
+        else:
+            value = self._random.expovariate(1.0 / self.params[0])
+        return max(0.0, value)
+    
+    @property
+    def mean(self) -> float:
+        """分布の平均（秒）"""
+        if self.kind == 'uniform':
+            return (self.params[0] + self.params[1]) / 2
+        if self.kind == 'lognormal':
+            return self.params[0] * math.exp(self.params[1] ** 2 / 2)
+        return self.params[0]
+    
+    def describe(self) -> Dict:
+        return {
+            'spec': f"{self.kind}:{','.join(str(param) for param in self.params)}",
+            'mean_seconds': round(self.mean, 4)
+        }
@@ -0,0 +1,292 @@
+"""
+メトリクスモジュール
+処理段階ごとのレイテンシ・処理中リクエスト数・エラー数を記録し、
+Prometheusのテキスト形式（/metrics）で出力する
+"""
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric(ABC):
+    """ラベル付きメトリクスの基底クラス"""
+    
+    kind = ''
+    
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, *values: str):
+        """ラベル値に対応する子メトリクス取得（初回のみ生成）"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+    
+    @abstractmethod
+    def _new_child(self):
+        """ラベル値ごとの子メトリクス生成"""
+        pass
+    
+    def _items(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return sorted(self._children.items())
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._items():
+            lines.extend(self._render_child(values, child))
+        return lines
+    
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.get())}"]
+
+class _Value:
+    """カウンター・ゲージの値"""
+    
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+    
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+    
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+    
+    def set_function(self, function: Callable[[], float]):
+        """出力時に値を取得する関数を設定（キュー深度など）"""
+        self._function = function
+    
+    def get(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return math.nan
+        return self._value
+
+class Counter(_Metric):
+    kind = 'counter'
+    
+    def _new_child(self):
+        return _Value()
+    
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    kind = 'gauge'
+    
+    def _new_child(self):
+        return _Value()
+
+class _HistogramValue:
+    """ヒストグラムの値（バケットごとの件数と合計）"""
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+    
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """バケット境界からの分位点の推定（件数が無い場合はNone）"""
+        counts, _ = self.snapshot()
+        total = sum(counts)
+        if not total:
+            return None
+        
+        target = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self._buckets + (math.inf,), counts):
+            if count and cumulative + count >= target:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (target - cumulative) / count
+            cumulative += count
+            lower = bound if bound != math.inf else lower
+        return lower
+
+class Histogram(_Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+    
+    def _render_child(self, values, child) -> List[str]:
+        counts, total = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, values, ('le', _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """メトリクスの登録・Prometheusテキスト形式での出力"""
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+    
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+    
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+    
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    'rai_stage_duration_seconds', 'Duration of each processing stage', ['stage']
+)
+STAGE_ERRORS = REGISTRY.counter(
+    'rai_stage_errors_total', 'Errors raised or reported by each processing stage', ['stage']
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    'rai_http_requests_total', 'HTTP requests by endpoint and status', ['endpoint', 'method', 'status']
+)
+HTTP_DURATION = REGISTRY.histogram(
+    'rai_http_request_duration_seconds', 'HTTP request duration by endpoint', ['endpoint']
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'rai_http_requests_in_flight', 'HTTP requests currently being processed', ['endpoint']
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    'rai_queue_depth', 'Items waiting in background queues', ['queue']
+)
+
+_started_at = time.time()
+
+@contextmanager
+def track_stage(stage: str):
+    """処理段階の所要時間を記録（例外発生時はエラー数も加算して再送出）"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+def observe_stage(stage: str, seconds: float):
+    """計測済みの所要時間を記録"""
+    STAGE_DURATION.labels(stage).observe(seconds)
+
+def record_error(stage: str):
+    """例外以外で失敗を検知した場合のエラー数加算（保存失敗など）"""
+    STAGE_ERRORS.labels(stage).inc()
+
+def begin_request(endpoint: str) -> float:
+    """リクエスト開始（処理中リクエスト数を加算）"""
+    HTTP_IN_FLIGHT.labels(endpoint).inc()
+    return time.perf_counter()
+
+def end_request(endpoint: str, method: str, status: int, started: float):
+    """リクエスト終了（処理中リクエスト数を減算し、所要時間・ステータスを記録）"""
+    HTTP_IN_FLIGHT.labels(endpoint).dec()
+    HTTP_DURATION.labels(endpoint).observe(time.perf_counter() - started)
+    HTTP_REQUESTS.labels(endpoint, method, str(status)).inc()
+
+def render_metrics() -> str:
+    """Prometheusテキスト形式での出力"""
+    return REGISTRY.render()
+
+def get_health_summary() -> Dict:
+    """/health用の要約（処理中リクエスト数・段階ごとの件数と推定p50/p95）"""
+    stages = {}
+    for (stage,), child in STAGE_DURATION._items():
+        counts, total = child.snapshot()
+        count = sum(counts)
+        if not count:
+            continue
+        p50 = child.quantile(0.5)
+        p95 = child.quantile(0.95)
+        stages[stage] = {
+            'count': count,
+            'mean_ms': round(total / count * 1000, 2),
+            'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 2) if p95 is not None else None,
+            'errors': int(STAGE_ERRORS.labels(stage).get())
+        }
+    
+    return {
+        'uptime_seconds': round(time.time() - _started_at, 1),
+        'requests_in_flight': int(sum(child.get() for _, child in HTTP_IN_FLIGHT._items())),
+        'stages': stages
+    }
@@ -0,0 +1,215 @@
+"""
+モデル階層選択モジュール
+リクエストごとにモード・入力文の長さ・キーワード分類・会話履歴からローカルで複雑さを採点し、
+軽量モデル（高速・低コスト）と大規模モデルのどちらに送るか、max_tokens をいくつにするかを決める。
+階層ごとの応答時間を記録し、採点ルールの調整に使う
+"""
+import json
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from deployment_router import DeploymentRouter, load_targets
+from keyword_classifier import KeywordMatch
+from metrics import REGISTRY
+from prompt_registry import estimate_tokens
+from rate_governor import PRIORITY_COMPETENCY, PRIORITY_GENERAL
+
+logger = logging.getLogger(__name__)
+
+MODE_COMPETENCY = 'competency'
+MODE_GENERAL = 'general'
+
+DEFAULT_TIER = 'default'
+LATENCY_SAMPLES = 500  # 階層・モードごとに保持する直近の応答時間の件数
+
+# 採点の重み（MODEL_TIER_WEIGHTS で上書き）
+DEFAULT_WEIGHTS = {
+    'competency': 10.0,     # コンピテンシー評価（既定では常に大規模モデルを使う）
+    'general': 0.0,         # 一般チャット
+    'per_100_tokens': 1.0,  # 入力文100トークンあたり
+    'keyword': 0.5,         # キーワード分類で該当したキーワード1種類あたり
+    'history_turn': 0.25    # 会話履歴1メッセージあたり
+}
+
+TIER_REQUESTS = REGISTRY.counter(
+    'rai_ai_tier_requests_total', 'AI calls per model tier, mode and outcome', ['tier', 'mode', 'outcome']
+)
+TIER_LATENCY = REGISTRY.histogram(
+    'rai_ai_tier_latency_seconds', 'Upstream AI latency per model tier and mode', ['tier', 'mode'],
+    buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0)
+)
+TIER_SCORES = REGISTRY.histogram(
+    'rai_ai_tier_score', 'Complexity score of AI requests per mode', ['mode'],
+    buckets=(0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 10.0, 15.0)
+)
+
+class ModelTier:
+    """モデル階層1件（送信先デプロイメント群・max_tokens・対象とする採点の上限）"""
+    
+    def __init__(self, name: str, router: DeploymentRouter, max_tokens: int, max_score: Optional[float] = None):
+        self.name = name
+        self.router = router
+        self.max_tokens = max_tokens
+        self.max_score = max_score  # Noneは上限なし（最上位の階層）
+        
+        self._lock = threading.Lock()
+        self._latencies = {}  # mode -> deque（秒）
+        self._counts = {}  # (mode, outcome) -> 件数
+        self._score_sums = {}  # mode -> 採点の合計
+    
+    def record(self, mode: str, score: float, latency: Optional[float]):
+        """結果の記録（latency が None の場合は失敗）"""
+        outcome = 'failure' if latency is None else 'success'
+        with self._lock:
+            self._counts[(mode, outcome)] = self._counts.get((mode, outcome), 0) + 1
+            self._score_sums[mode] = self._score_sums.get(mode, 0.0) + score
+            if latency is not None:
+                self._latencies.setdefault(mode, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+        
+        TIER_REQUESTS.labels(self.name, mode, outcome).inc()
+        if latency is not None:
+            TIER_LATENCY.labels(self.name, mode).observe(latency)
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            modes = {}
+            for mode in sorted({mode for mode, _ in self._counts}):
+                success = self._counts.get((mode, 'success'), 0)
+                failure = self._counts.get((mode, 'failure'), 0)
+                latencies = sorted(self._latencies.get(mode, ()))
+                modes[mode] = {
+                    'requests': success + failure,
+                    'failures': failure,
+                    'mean_score': round(self._score_sums[mode] / (success + failure), 3),
+                    'latency_ms': {
+                        'mean': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+                        'p50': round(latencies[int(0.5 * (len(latencies) - 1))] * 1000, 1) if latencies else None,
+                        'p95': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1) if latencies else None
+                    }
+                }
+        
+        return {
+            'name': self.name,
+            'max_score': self.max_score,
+            'max_tokens': self.max_tokens,
+            'deployments': [target.name for target in self.router.targets],
+            'modes': modes
+        }
+
+@dataclass
+class TierDecision:
+    """1リクエスト分の階層選択結果"""
+    tier: ModelTier
+    mode: str
+    score: float
+    
+    @property
+    def router(self) -> DeploymentRouter:
+        return self.tier.router
+    
+    @property
+    def max_tokens(self) -> int:
+        return self.tier.max_tokens
+    
+    @property
+    def priority(self) -> int:
+        """送信制御の優先度（コンピテンシー評価を優先）"""
+        return PRIORITY_COMPETENCY if self.mode == MODE_COMPETENCY else PRIORITY_GENERAL
+    
+    def record(self, latency: Optional[float]):
+        self.tier.record(self.mode, self.score, latency)
+
+class ModelTierSelector:
+    """採点による階層選択
+    
+    採点 = モードの重み + 入力文のトークン数/100 × per_100_tokens + 該当キーワード数 × keyword
+    + 会話履歴のメッセージ数 × history_turn。max_score の小さい階層から順に、採点が
+    max_score 以下の最初の階層を選ぶ（どれにも収まらない場合は最上位の階層）。
+    """
+    
+    def __init__(self, tiers: List[ModelTier], weights: Optional[Dict[str, float]] = None):
+        if not tiers or tiers[-1].max_score is not None:
+            raise ValueError('The last model tier must have no max_score')
+        
+        self.tiers = tiers
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    
+    def score(self, mode: str, message: str, history: Optional[List[Dict]] = None,
+              match: Optional[KeywordMatch] = None) -> float:
+        weights = self.weights
+        score = weights.get(mode, 0.0)
+        score += estimate_tokens(message) / 100 * weights['per_100_tokens']
+        if match is not None:
+            score += match.keyword_count * weights['keyword']
+        if history:
+            score += len(history) * weights['history_turn']
+        return score
+    
+    def select(self, mode: str, message: str, history: Optional[List[Dict]] = None,
+               match: Optional[KeywordMatch] = None) -> TierDecision:
+        """階層の選択（階層が1つの場合は採点のみ記録する）"""
+        score = self.score(mode, message, history, match)
+        TIER_SCORES.labels(mode).observe(score)
+        
+        for tier in self.tiers:
+            if tier.max_score is None or score <= tier.max_score:
+                return TierDecision(tier, mode, score)
+        return TierDecision(self.tiers[-1], mode, score)
+    
+    def get_stats(self) -> Dict:
+        return {
+            'weights': dict(self.weights),
+            'tiers': [tier.get_stats() for tier in self.tiers]
+        }
+
+def load_tiers(config, default_router: DeploymentRouter, default_max_tokens: int) -> ModelTierSelector:
+    """階層設定の構築（MODEL_TIERS未設定時は既定の送信先のみ）
+    
+    MODEL_TIERS はJSON配列で、各要素は name・max_score・deployments（AZURE_OPENAI_DEPLOYMENTSと同じ形式）が必須、
+    max_tokens は省略可。既定の送信先（AZURE_OPENAI_DEPLOYMENTS）は上限なしの最上位の階層 'default' になる。
+    """
+    entries = []
+    if config.MODEL_TIERS:
+        try:
+            entries = json.loads(config.MODEL_TIERS)
+        except ValueError:
+            raise ValueError('MODEL_TIERS must be a JSON array')
+        if not isinstance(entries, list):
+            raise ValueError('MODEL_TIERS must be a JSON array')
+    
+    weights = {}
+    if config.MODEL_TIER_WEIGHTS:
+        try:
+            weights = {name: float(value) for name, value in json.loads(config.MODEL_TIER_WEIGHTS).items()}
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError('MODEL_TIER_WEIGHTS must be a JSON object of numbers')
+    
+    tiers = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get('name') or entry.get('max_score') is None:
+            raise ValueError(f'MODEL_TIERS[{index}] requires name and max_score')
+        if entry['name'] == DEFAULT_TIER:
+            raise ValueError(f"MODEL_TIERS[{index}] must not be named '{DEFAULT_TIER}'")
+        
+        router = DeploymentRouter(
+            load_targets(config, entry.get('deployments'), name_prefix=f"{entry['name']}/"),
+            ewma_alpha=config.ROUTER_EWMA_ALPHA,
+            hedge_enabled=config.ROUTER_HEDGE_ENABLED,
+            hedge_quantile=config.ROUTER_HEDGE_QUANTILE,
+            hedge_min_delay=config.ROUTER_HEDGE_MIN_DELAY
+        )
+        tiers.append(ModelTier(
+            entry['name'],
+            router,
+            int(entry.get('max_tokens', default_max_tokens)),
+            float(entry['max_score'])
+        ))
+    
+    tiers.sort(key=lambda tier: tier.max_score)
+    tiers.append(ModelTier(DEFAULT_TIER, default_router, default_max_tokens))
+    if len(tiers) > 1:
+        logger.info(f"Model tiers: {', '.join(f'{tier.name}<={tier.max_score}' for tier in tiers[:-1])}, {DEFAULT_TIER}")
+    return ModelTierSelector(tiers, weights)
@@ -0,0 +1,452 @@
+"""
+Azure OpenAI互換スタブサーバー
+Chat Completions API（通常応答・ストリーミング）を模擬し、応答遅延・生成速度を分布から生成する。
+429・500・タイムアウトを指定した確率で発生させ、本番と同じクライアント経路を
+ローカルで負荷試験するために使用する
+
+実行例:
+    python openai_stub_server.py --port 8081 --latency lognormal:0.8,0.4 --token-rate normal:40,10 \\
+        --rate-429 0.05 --rate-500 0.01 --rate-timeout 0.01 --seed 42
+    
+    # バックエンドのAIの接続先をスタブに向ける（MOCK_AI=false で認証・DBはモックのままAIのみ実際に接続）
+    MOCK_AI=false AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8081/ AZURE_OPENAI_KEY=stub python app.py
+
+エンドポイント:
+    POST /openai/deployments/<deployment>/chat/completions   Chat Completions（stream=true でSSE、tools指定時は関数呼び出しで応答）
+    GET  /stub/stats                                         受信件数・発生させた障害の件数
+    GET  /stub/config                                        現在の設定
+    POST /stub/config                                        設定の変更（JSON、指定した項目のみ）
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from latency import LatencyDistribution
+from prompt_registry import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CHAT_PATH = re.compile(r'^/openai/deployments/(?P<deployment>[^/]+)/chat/completions$')
+
+FILLER_SENTENCES = [
+    "振り返りを読ませていただきました。",
+    "授業での経験を具体的に言語化できている点が素晴らしいですね。",
+    "相手の話に耳を傾けることで、新しい気づきが得られたようです。",
+    "次の授業では、今回の学びをどのように活かせそうでしょうか。",
+    "グループでの役割を意識しながら取り組めていることが伝わってきます。",
+    "うまくいかなかった場面を振り返る姿勢は、成長につながる大切な力です。",
+    "ピアサポーターとして、周囲への配慮も感じられる内容でした。"
+]
+
+class StubSettings:
+    """スタブの動作設定（実行中に /stub/config で変更できる）"""
+    
+    FIELDS = ('latency', 'token_rate', 'completion_tokens', 'rate_429', 'rate_500', 'rate_timeout',
+              'retry_after', 'hang_seconds', 'api_key')
+    
+    def __init__(self, latency: str = 'lognormal:0.8,0.4', token_rate: str = 'normal:40,10',
+                 completion_tokens: str = 'uniform:80,300', rate_429: float = 0.0, rate_500: float = 0.0,
+                 rate_timeout: float = 0.0, retry_after: float = 1.0, hang_seconds: float = 120.0,
+                 api_key: str = '', seed: Optional[int] = None):
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.update({
+            'latency': latency,
+            'token_rate': token_rate,
+            'completion_tokens': completion_tokens,
+            'rate_429': rate_429,
+            'rate_500': rate_500,
+            'rate_timeout': rate_timeout,
+            'retry_after': retry_after,
+            'hang_seconds': hang_seconds,
+            'api_key': api_key
+        })
+    
+    def update(self, values: Dict):
+        """設定の変更（分布の指定が不正な場合はValueError、変更は行わない）"""
+        unknown = [name for name in values if name not in self.FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown stub settings: {', '.join(unknown)}")
+        
+        parsed = {}
+        for name in ('latency', 'token_rate', 'completion_tokens'):
+            if name in values:
+                parsed[f'_{name}_dist'] = LatencyDistribution.from_spec(str(values[name]), self._random.randrange(2 ** 32))
+                parsed[name] = str(values[name])
+        for name in ('rate_429', 'rate_500', 'rate_timeout', 'retry_after', 'hang_seconds'):
+            if name in values:
+                parsed[name] = float(values[name])
+        if 'api_key' in values:
+            parsed['api_key'] = str(values['api_key'] or '')
+        
+        rates = [parsed.get(name, getattr(self, name, 0.0)) for name in ('rate_429', 'rate_500', 'rate_timeout')]
+        if any(rate < 0 for rate in rates) or sum(rates) > 1:
+            raise ValueError('Fault rates must be non-negative and sum to at most 1')
+        
+        with self._lock:
+            for name, value in parsed.items():
+                setattr(self, name, value)
+    
+    def plan(self) -> Dict:
+        """1リクエスト分の応答計画（障害の種類・応答開始までの遅延・生成トークン数・生成速度）"""
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.rate_429:
+                fault = '429'
+            elif roll < self.rate_429 + self.rate_500:
+                fault = '500'
+            elif roll < self.rate_429 + self.rate_500 + self.rate_timeout:
+                fault = 'timeout'
+            else:
+                fault = None
+            
+            return {
+                'fault': fault,
+                'latency': self._latency_dist.sample(),
+                'completion_tokens': max(1, int(self._completion_tokens_dist.sample())),
+                'token_rate': max(1.0, self._token_rate_dist.sample()),
+                'retry_after': self.retry_after,
+                'hang_seconds': self.hang_seconds
+            }
+    
+    def describe(self) -> Dict:
+        with self._lock:
+            return {name: getattr(self, name) for name in self.FIELDS if name != 'api_key'}
+
+class StubStats:
+    """受信件数・応答種別ごとの件数"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            'requests': 0,
+            'streamed': 0,
+            'completed': 0,
+            'rate_limited': 0,
+            'server_errors': 0,
+            'timeouts': 0,
+            'unauthorized': 0,
+            'completion_tokens': 0
+        }
+        self.in_flight = 0
+    
+    def add(self, name: str, value: int = 1):
+        with self._lock:
+            self._counts[name] += value
+    
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self._counts['requests'] += 1
+    
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {**self._counts, 'in_flight': self.in_flight}
+
+def build_completion_text(tokens: int, rng: random.Random) -> List[str]:
+    """指定トークン数の応答テキストをトークン単位の断片で生成（日本語は概ね1文字1トークン）"""
+    pieces = []
+    while len(pieces) < tokens:
+        pieces.extend(rng.choice(FILLER_SENTENCES))
+    return pieces[:tokens]
+
+def build_tool_call(tools: List[Dict], rng: random.Random) -> Dict:
+    """関数呼び出しの応答生成（コンピテンシー評価の関数はenumのコードから2-3件を選んで引数を組み立てる）"""
+    function = tools[0].get('function', {})
+    properties = function.get('parameters', {}).get('properties', {})
+    codes = properties.get('competencies', {}).get('items', {}).get('properties', {}).get('code', {}).get('enum') or ['R']
+    
+    arguments = {
+        'competencies': [
+            {'code': code, 'score': rng.randint(3, 5), 'comment': rng.choice(FILLER_SENTENCES)}
+            for code in rng.sample(codes, min(len(codes), rng.randint(2, 3)))
+        ],
+        'summary': ''.join(rng.sample(FILLER_SENTENCES, 2)),
+        'advice': rng.sample(FILLER_SENTENCES, 2)
+    }
+    return {
+        'id': f"call_{uuid.uuid4().hex[:24]}",
+        'type': 'function',
+        'function': {'name': function.get('name', ''), 'arguments': json.dumps(arguments, ensure_ascii=False)}
+    }
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Chat Completions・管理用エンドポイントの処理"""
+    
+    protocol_version = 'HTTP/1.1'  # クライアントの接続再利用を試験するためkeep-aliveで応答する
+    server_version = 'OpenAIStub/1.0'
+    
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/stub/stats':
+            self._send_json(200, self.server.stats.snapshot())
+        elif path == '/stub/config':
+            self._send_json(200, self.server.settings.describe())
+        else:
+            self._send_error(404, 'NotFound', 'Resource not found')
+    
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._read_json()
+        if body is None:
+            self._send_error(400, 'BadRequest', 'Request body must be JSON')
+            return
+        
+        if path == '/stub/config':
+            try:
+                self.server.settings.update(body)
+            except (TypeError, ValueError) as e:
+                self._send_error(400, 'BadRequest', str(e))
+                return
+            self._send_json(200, self.server.settings.describe())
+            return
+        
+        match = CHAT_PATH.match(path)
+        if not match:
+            self._send_error(404, 'DeploymentNotFound', 'The API deployment for this resource does not exist.')
+            return
+        
+        stats = self.server.stats
+        stats.enter()
+        try:
+            self._chat_completions(match.group('deployment'), body)
+        finally:
+            stats.leave()
+    
+    def _chat_completions(self, deployment: str, body: Dict):
+        settings = self.server.settings
+        stats = self.server.stats
+        if settings.api_key and self.headers.get('api-key') != settings.api_key:
+            stats.add('unauthorized')
+            self._send_error(401, '401', 'Access denied due to invalid subscription key.')
+            return
+        
+        messages = body.get('messages')
+        if not isinstance(messages, list) or not messages:
+            self._send_error(400, 'BadRequest', "'messages' is a required property")
+            return
+        
+        plan = settings.plan()
+        prompt_tokens = sum(estimate_tokens(str(message.get('content') or '')) for message in messages)
+        completion_tokens = min(plan['completion_tokens'], int(body.get('max_tokens') or plan['completion_tokens']))
+        
+        if plan['fault'] == '429':
+            stats.add('rate_limited')
+            retry_after = plan['retry_after']
+            self._send_error(429, '429', f'Requests have exceeded the call rate limit. Please retry after {retry_after:g} seconds.', {
+                'Retry-After': str(int(retry_after + 0.999)),
+                'retry-after-ms': str(int(retry_after * 1000))
+            })
+            return
+        
+        time.sleep(plan['latency'])
+        
+        if plan['fault'] == 'timeout':
+            # 応答せずに待機して切断する（クライアントのタイムアウト処理の確認用）
+            stats.add('timeouts')
+            time.sleep(plan['hang_seconds'])
+            self.close_connection = True
+            return
+        if plan['fault'] == '500':
+            stats.add('server_errors')
+            self._send_error(500, 'InternalServerError', 'The server had an error while processing your request.')
+            return
+        
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        
+        if body.get('tools') and not body.get('stream'):
+            # 関数呼び出しで応答（引数の長さを生成トークン数とする）
+            tool_call = build_tool_call(body['tools'], self.server.text_random)
+            message = {'role': 'assistant', 'content': None, 'tool_calls': [tool_call]}
+            generated = estimate_tokens(tool_call['function']['arguments'])
+            finish_reason = 'stop'
+        else:
+            pieces = build_completion_text(completion_tokens, self.server.text_random)
+            generated = len(pieces)
+            finish_reason = 'length' if completion_tokens < plan['completion_tokens'] else 'stop'
+        
+            if body.get('stream'):
+                stats.add('completion_tokens', generated)
+                stats.add('streamed')
+                self._stream(completion_id, created, deployment, pieces, plan['token_rate'])
+                return
+            message = {'role': 'assistant', 'content': ''.join(pieces)}
+        
+        stats.add('completion_tokens', generated)
+        time.sleep(generated / plan['token_rate'])
+        stats.add('completed')
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': deployment,
+            'choices': [{
+                'index': 0,
+                'finish_reason': finish_reason,
+                'message': message
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': generated,
+                'total_tokens': prompt_tokens + generated
+            }
+        })
+    
+    def _stream(self, completion_id: str, created: int, deployment: str, pieces: List[str], token_rate: float):
+        """SSEでトークンを生成速度に合わせて送信（Azureと同様に先頭はchoicesが空のチャンク）"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        
+        def chunk(choices: List[Dict]) -> Dict:
+            return {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': deployment,
+                'choices': choices
+            }
+        
+        try:
+            self._write_event(json.dumps({**chunk([]), 'prompt_filter_results': []}))
+            self._write_event(json.dumps(chunk([{'index': 0, 'finish_reason': None, 'delta': {'role': 'assistant'}}])))
+            
+            started = time.monotonic()
+            for index, piece in enumerate(pieces):
+                # 生成速度（トークン/秒）に合わせて送信時刻を調整する
+                delay = started + (index + 1) / token_rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self._write_event(json.dumps(
+                    chunk([{'index': 0, 'finish_reason': None, 'delta': {'content': piece}}]),
+                    ensure_ascii=False
+                ))
+            
+            self._write_event(json.dumps(chunk([{'index': 0, 'finish_reason': 'stop', 'delta': {}}])))
+            self._write_event('[DONE]')
+            self._write_chunk(b'')
+            self.server.stats.add('completed')
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントの切断（ストリーム途中のキャンセル）
+            self.close_connection = True
+    
+    def _write_event(self, data: str):
+        self._write_chunk(f"data: {data}\n\n".encode('utf-8'))
+    
+    def _write_chunk(self, payload: bytes):
+        self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b"\r\n")
+        self.wfile.flush()
+    
+    def _read_json(self) -> Optional[Dict]:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw or b'{}')
+        except ValueError:
+            return None
+        return body if isinstance(body, dict) else None
+    
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _send_error(self, status: int, code: str, message: str, headers: Optional[Dict] = None):
+        self._send_json(status, {'error': {'code': code, 'message': message}}, headers)
+    
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+class OpenAIStubServer(ThreadingHTTPServer):
+    """スタブサーバー（リクエストごとにスレッドで処理）"""
+    
+    daemon_threads = True
+    
+    def __init__(self, address: tuple, settings: StubSettings):
+        super().__init__(address, StubRequestHandler)
+        self.settings = settings
+        self.stats = StubStats()
+        self.text_random = random.Random(settings.seed)
+    
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+def start_stub_server(settings: Optional[StubSettings] = None, host: str = '127.0.0.1',
+                      port: int = 0) -> OpenAIStubServer:
+    """バックグラウンドスレッドでスタブサーバーを起動（port=0で空きポート）"""
+    server = OpenAIStubServer((host, port), settings or StubSettings())
+    threading.Thread(target=server.serve_forever, name='openai-stub', daemon=True).start()
+    return server
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Azure OpenAI compatible stub server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', default='lognormal:0.8,0.4', help='応答開始までの遅延分布（秒）')
+    parser.add_argument('--token-rate', default='normal:40,10', help='生成速度の分布（トークン/秒）')
+    parser.add_argument('--completion-tokens', default='uniform:80,300', help='生成トークン数の分布（max_tokensで上限）')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='429（レート制限）を返す確率')
+    parser.add_argument('--rate-500', type=float, default=0.0, help='500を返す確率')
+    parser.add_argument('--rate-timeout', type=float, default=0.0, help='応答せずに待機する確率')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='429応答のRetry-After（秒）')
+    parser.add_argument('--hang-seconds', type=float, default=120.0, help='タイムアウト時に待機する秒数')
+    parser.add_argument('--api-key', default='', help='指定時はapi-keyヘッダーを検証する')
+    parser.add_argument('--seed', type=int, help='乱数シード（再現性のため）')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    
+    try:
+        settings = StubSettings(
+            latency=args.latency,
+            token_rate=args.token_rate,
+            completion_tokens=args.completion_tokens,
+            rate_429=args.rate_429,
+            rate_500=args.rate_500,
+            rate_timeout=args.rate_timeout,
+            retry_after=args.retry_after,
+            hang_seconds=args.hang_seconds,
+            api_key=args.api_key,
+            seed=args.seed
+        )
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    
+    server = OpenAIStubServer((args.host, args.port), settings)
+    logger.info(f"OpenAI stub server listening on {server.endpoint} ({json.dumps(settings.describe())})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
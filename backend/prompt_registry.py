@@ -0,0 +1,316 @@
+"""
+プロンプトレジストリモジュール
+prompts.jsonのバージョンごとにシステムプロンプトを一度だけ構築し、
+ファイル更新時は再起動なしで差し替える
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from competency_scores import competency_code
+from evaluation_format import EVALUATION_FUNCTION_NAME, OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_TEXT, OUTPUT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPTS = {
+    "competency_evaluation_prompt": {
+        "system_role": "あなたは立命館大学の学習支援AIアシスタント「R-AI」です。",
+        "competency_definitions": {
+            "competencies": [
+                {"japanese": "しなやかさ", "description": "困ったことや失敗したことから学び立ち直る力"},
+                {"japanese": "自発性", "description": "自分で自分の目標を決め、あきらめることなく取り組む"},
+                {"japanese": "チームワーク", "description": "目的を達成するために他の人と協力する"},
+                {"japanese": "自己効力感", "description": "自分ならどういうふうに問題解決し、自分を信じる感覚"},
+                {"japanese": "理解力", "description": "科学的に物事を理解する"},
+                {"japanese": "マルチタスキング", "description": "複数の課題にバランスよく取り組む"},
+                {"japanese": "共感力", "description": "他人の気持ちを想像して、その心に寄り添う"},
+                {"japanese": "変革力", "description": "新しい考え方で、物事に変化を生み出す"}
+            ]
+        }
+    },
+    "general_chat_prompt": {
+        "system_role": "あなたは立命館大学の学習支援AIアシスタント「R-AI」です。"
+    }
+}
+
+# ユーザープロンプトは入力文の前後を固定文で挟む（前半が毎回同一バイト列になるよう入力文より前に可変部分を置かない）
+COMPETENCY_USER_PREFIX = """
+以下は学生がピアサポート論の授業で体験した内容や学びについて記述したものです。
+この内容からコンピテンシーを評価してください。
+
+【学生の入力】
+"""
+
+COMPETENCY_USER_SUFFIX = """
+
+上記の内容から、特に発揮されているコンピテンシーを評価し、建設的なフィードバックをお願いします。
+"""
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+_encoding = None
+_encoding_checked = False
+
+def _get_encoding():
+    """tiktokenのエンコーディング取得（未導入・取得失敗時はNone）"""
+    global _encoding, _encoding_checked
+    if not _encoding_checked:
+        _encoding_checked = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の見積もり（tiktoken未導入時は文字種ベースの近似）"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    
+    # 日本語は概ね1文字1トークン、英数字は4文字1トークン程度
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    other_chars = len(text) - cjk_chars
+    return cjk_chars + (other_chars + 3) // 4
+
+def build_competency_system_prompt(prompts: Dict, output_format: str = OUTPUT_FORMAT_TEXT) -> str:
+    """コンピテンシー評価用システムプロンプト構築（JSON出力モードではコードを併記し、関数呼び出しで回答させる）"""
+    prompt_config = prompts["competency_evaluation_prompt"]
+    
+    system_prompt = f"""
+{prompt_config["system_role"]}
+
+## コンピテンシー定義
+立命館大学では以下のコンピテンシーを重視しています：
+
+"""
+
+    competencies = prompt_config["competency_definitions"]["competencies"]
+    for comp in competencies:
+        if output_format == OUTPUT_FORMAT_JSON:
+            code = competency_code(comp.get('english') or comp['japanese']) or '-'
+            system_prompt += f"・{code} {comp['japanese']}: {comp['description']}\n"
+        else:
+            system_prompt += f"・{comp['japanese']}: {comp['description']}\n"
+    
+    system_prompt += """
+## 授業コンテキスト
+- 科目名: ピアサポート論
+- 学習方法: グループディスカッション、ペアワーク、体験学習、振り返り活動
+- 重要概念: ピアサポート、カウンセリングマインド、傾聴、共感、自己開示
+
+## 評価指針
+1. 学生の入力内容から特に発揮されているコンピテンシー2-3個を特定
+2. 5段階評価（1:発揮されていない〜5:優秀）で評価
+3. 建設的で具体的なフィードバックを提供
+4. 次の学習につながる示唆を含める
+"""
+
+    if output_format == OUTPUT_FORMAT_JSON:
+        system_prompt += f"""
+## 回答フォーマット
+文章では回答せず、{EVALUATION_FUNCTION_NAME} 関数を呼び出してください。
+- competencies: 特に発揮されているコンピテンシー2-3個（code: 上記のコード、score: 1〜5の整数、comment: 1文の具体的なコメント）
+- summary: 全体的な評価と成長のポイント（2文程度）
+- advice: 次の学習に向けた具体的な提案（2-3項目、各1文）
+"""
+        return system_prompt
+    
+    system_prompt += """
+## 回答フォーマット
+【コンピテンシー評価結果】
+
+◆ [コンピテンシー名] ★★★★☆ ([点数]/5)
+◆ [コンピテンシー名] ★★★★☆ ([点数]/5)
+
+【総評】
+[全体的な評価と成長のポイント]
+
+【今後の学習へのアドバイス】
+[具体的な提案]
+"""
+    return system_prompt
+
+def build_general_system_prompt(prompts: Dict) -> str:
+    """一般チャット用システムプロンプト構築"""
+    prompt_config = prompts["general_chat_prompt"]
+    
+    return f"""
+{prompt_config["system_role"]}
+
+あなたは学生の学習をサポートし、授業に関連した質問や相談に適切な支援を提供します。
+
+## 対応範囲
+- ピアサポート論の授業内容に関する質問
+- カウンセリング基礎知識
+- コミュニケーション技法
+- グループワークに関する相談
+- 一般的な学習相談
+
+## 対応しない内容
+- リアルタイム情報（天気、最新ニュースなど）
+- 個人の成績や評価
+- 他の学生の個人情報
+- 大学の内部機密情報
+
+温かく支援的な態度で、学生の学習意欲を高める前向きな回答を心がけてください。
+"""
+
+@dataclass(frozen=True)
+class CompiledPrompts:
+    """構築済みプロンプト一式（prompts.jsonの1バージョンに対応、不変）"""
+    version: str
+    prompts: Dict
+    competency_system: str
+    general_system: str
+    token_counts: Dict
+    source: str
+    output_format: str = OUTPUT_FORMAT_TEXT
+    competency_json_system: Optional[str] = None  # JSON出力モードのみ
+    loaded_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    
+    def render_competency_user(self, user_message: str) -> str:
+        """コンピテンシー評価用ユーザープロンプト"""
+        return COMPETENCY_USER_PREFIX + user_message + COMPETENCY_USER_SUFFIX
+    
+    @property
+    def competencies(self) -> List[Dict]:
+        return self.prompts["competency_evaluation_prompt"]["competency_definitions"]["competencies"]
+
+def compile_prompts(prompts: Dict, source: str) -> CompiledPrompts:
+    """プロンプト設定からシステムプロンプトを構築（output_formatが不正な場合はValueError）"""
+    output_format = prompts["competency_evaluation_prompt"].get("output_format", OUTPUT_FORMAT_TEXT)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output_format: {output_format}")
+    
+    competency_system = build_competency_system_prompt(prompts)
+    general_system = build_general_system_prompt(prompts)
+    competency_json_system = None
+    token_counts = {
+        'competency_system': estimate_tokens(competency_system),
+        'competency_user_template': estimate_tokens(COMPETENCY_USER_PREFIX + COMPETENCY_USER_SUFFIX),
+        'general_system': estimate_tokens(general_system)
+    }
+    if output_format == OUTPUT_FORMAT_JSON:
+        competency_json_system = build_competency_system_prompt(prompts, OUTPUT_FORMAT_JSON)
+        token_counts['competency_json_system'] = estimate_tokens(competency_json_system)
+    
+    # バージョンは構築後プロンプトのハッシュ（出力に影響しない変更ではバージョンが変わらない）
+    digest = hashlib.sha256()
+    parts = [competency_system, COMPETENCY_USER_PREFIX, COMPETENCY_USER_SUFFIX, general_system]
+    if competency_json_system is not None:
+        parts.append(competency_json_system)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    
+    return CompiledPrompts(
+        version=digest.hexdigest()[:16],
+        prompts=prompts,
+        competency_system=competency_system,
+        general_system=general_system,
+        token_counts=token_counts,
+        source=source,
+        output_format=output_format,
+        competency_json_system=competency_json_system
+    )
+
+class PromptRegistry:
+    """プロンプトレジストリ
+    
+    prompts.jsonの更新時刻を reload_interval 秒ごとに確認し、変更があれば
+    新しい CompiledPrompts を構築して参照を差し替える。読み込みに失敗した場合は
+    直前のバージョンを使い続ける。
+    """
+    
+    def __init__(self, path: str, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._mtime = None
+        self._last_checked = 0.0
+        self._current = self._load() or compile_prompts(DEFAULT_PROMPTS, 'default')
+    
+    def current(self) -> CompiledPrompts:
+        """現行バージョンのプロンプト取得（必要に応じて再読み込み）"""
+        now = time.monotonic()
+        if self._check_due(now):
+            self._check_for_update(now)
+        return self._current
+    
+    def check_due(self) -> bool:
+        """次の current() で更新確認（ファイルのstat・再読み込み）を行うか"""
+        return self._check_due(time.monotonic())
+    
+    def _check_due(self, now: float) -> bool:
+        return self.reload_interval >= 0 and now - self._last_checked >= self.reload_interval
+    
+    def add_listener(self, listener: Callable[[CompiledPrompts], None]):
+        """バージョン変更時のコールバック登録"""
+        self._listeners.append(listener)
+    
+    def get_info(self) -> Dict:
+        """現行バージョン情報取得"""
+        compiled = self.current()
+        return {
+            'version': compiled.version,
+            'source': compiled.source,
+            'loaded_at': compiled.loaded_at,
+            'output_format': compiled.output_format,
+            'token_counts': compiled.token_counts
+        }
+    
+    def _check_for_update(self, now: float):
+        # 同時に複数スレッドが確認しないよう、ロック取得済みの場合は現行版を使う
+        if not self._lock.acquire(blocking=False):
+            return
+        
+        try:
+            self._last_checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            
+            compiled = self._load()
+            if compiled is None or compiled.version == self._current.version:
+                return
+            
+            previous = self._current.version
+            self._current = compiled
+            logger.info(f"Prompts reloaded: {previous} -> {compiled.version}")
+            
+            for listener in self._listeners:
+                try:
+                    listener(compiled)
+                except Exception as e:
+                    logger.error(f"Prompt reload listener error: {str(e)}")
+        finally:
+            self._lock.release()
+    
+    def _load(self) -> Optional[CompiledPrompts]:
+        """prompts.json読み込み・構築"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'r', encoding='utf-8') as f:
+                prompts = json.load(f)
+            compiled = compile_prompts(prompts, self.path)
+            self._mtime = mtime
+            return compiled
+        except FileNotFoundError:
+            logger.warning("Prompts file not found, using default prompts")
+            return None
+        except Exception as e:
+            logger.error(f"Error loading prompts: {str(e)}")
+            return None
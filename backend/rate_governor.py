@@ -0,0 +1,300 @@
+"""
+レート制御モジュール
+Azure OpenAIデプロイメントのTPM（トークン/分）・RPM（リクエスト/分）の上限内に収まるよう
+送信前に待機させ、429（レート制限）応答は Retry-After に従ってジッター付きで再試行する
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+from metrics import QUEUE_DEPTH, REGISTRY, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# 優先度（値が小さいほど先に送信する）
+PRIORITY_COMPETENCY = 0
+PRIORITY_GENERAL = 1
+
+WINDOW_SECONDS = 60.0
+POLL_INTERVAL = 0.05  # 先頭以外の待機者・asyncio版の再確認間隔（秒）
+
+THROTTLED_RESPONSES = REGISTRY.counter(
+    'rai_ai_throttled_total', 'Rate limited (429) responses from Azure OpenAI', ['deployment']
+)
+RATE_WAIT_TIMEOUTS = REGISTRY.counter(
+    'rai_ai_rate_wait_timeouts_total', 'AI calls abandoned while waiting for TPM/RPM capacity'
+)
+
+def _parse_retry_after(headers) -> Optional[float]:
+    """Retry-After（秒）・retry-after-ms（ミリ秒）ヘッダーの解析"""
+    if not headers:
+        return None
+    
+    for name, scale in (('retry-after-ms', 0.001), ('Retry-After-Ms', 0.001), ('retry-after', 1.0), ('Retry-After', 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+class _Ticket:
+    """送信待ちの呼び出し1件"""
+    
+    def __init__(self, tokens: int, priority: int, seq: int):
+        self.tokens = tokens
+        self.priority = priority
+        self.seq = seq
+        self.entry = None  # 送信許可後のウィンドウ記録 [送信時刻, トークン数]
+    
+    def __lt__(self, other: '_Ticket') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class RateGovernor:
+    """送信側のレート制御（プロセス単位）
+    
+    直近60秒の送信リクエスト数・推定トークン数を記録し、上限を超える場合は優先度順に待機させる。
+    トークン数は送信前の推定値（プロンプト + max_tokens）で計上し、応答のusageが得られた場合は実績値に置き換える。
+    複数プロセスで動作する場合は、デプロイメントの上限をプロセス数で割った値を設定する。
+    tpm・rpm が0の場合はその上限を適用しない（429時の再試行のみ行う）。
+    """
+    
+    def __init__(self, tpm: int = 0, rpm: int = 0, max_wait: float = 30.0, max_retries: int = 3,
+                 retry_base: float = 1.0, retry_max: float = 20.0, name: str = 'default'):
+        self.name = name
+        self.tpm = tpm
+        self.rpm = rpm
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        
+        self._window = deque()  # [送信時刻, トークン数]
+        self._window_tokens = 0
+        self._waiting = []  # _Ticketのヒープ
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._stats = {
+            'granted': 0,
+            'delayed': 0,
+            'timeouts': 0,
+            'throttled': 0,
+            'retries': 0
+        }
+        
+        QUEUE_DEPTH.labels(f'rate_governor:{name}').set_function(lambda: len(self._waiting))
+    
+    def call(self, func: Callable, tokens: int, priority: int = PRIORITY_GENERAL,
+             usage: Optional[Callable] = None):
+        """上限内で func を実行（429は再試行、usage は応答から実績トークン数を取り出す関数）"""
+        attempt = 0
+        while True:
+            ticket = self.acquire(tokens, priority)
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            
+            self._settle(ticket, result, usage)
+            return result
+    
+    async def call_async(self, func: Callable[[], Awaitable], tokens: int, priority: int = PRIORITY_GENERAL,
+                         usage: Optional[Callable] = None):
+        """上限内で func を実行（asyncio版）"""
+        attempt = 0
+        while True:
+            ticket = await self.acquire_async(tokens, priority)
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            
+            self._settle(ticket, result, usage)
+            return result
+    
+    def acquire(self, tokens: int, priority: int = PRIORITY_GENERAL) -> _Ticket:
+        """送信許可の取得（上限・優先度に従って待機、max_wait を超えた場合はTimeoutError）"""
+        started = time.monotonic()
+        with self._condition:
+            ticket = self._enqueue(tokens, priority)
+            while True:
+                delay = self._try_grant(ticket)
+                if delay is None:
+                    self._condition.notify_all()
+                    break
+                remaining = self.max_wait - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._abandon(ticket)
+                    raise TimeoutError('Timed out waiting for Azure OpenAI rate limit capacity')
+                self._condition.wait(min(delay, remaining))
+        
+        self._observe_wait(started)
+        return ticket
+    
+    async def acquire_async(self, tokens: int, priority: int = PRIORITY_GENERAL) -> _Ticket:
+        """送信許可の取得（asyncio版、イベントループをブロックしない）"""
+        started = time.monotonic()
+        with self._condition:
+            ticket = self._enqueue(tokens, priority)
+        
+        try:
+            while True:
+                with self._condition:
+                    delay = self._try_grant(ticket)
+                    if delay is None:
+                        self._condition.notify_all()
+                        break
+                    remaining = self.max_wait - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._abandon(ticket)
+                        raise TimeoutError('Timed out waiting for Azure OpenAI rate limit capacity')
+                await asyncio.sleep(min(delay, remaining, POLL_INTERVAL))
+        except asyncio.CancelledError:
+            with self._condition:
+                if ticket.entry is None:
+                    self._abandon(ticket)
+            raise
+        
+        self._observe_wait(started)
+        return ticket
+    
+    def pause(self, seconds: float):
+        """全呼び出しの送信停止（429のRetry-After受信時）"""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def _enqueue(self, tokens: int, priority: int) -> _Ticket:
+        ticket = _Ticket(tokens, priority, next(self._seq))
+        heapq.heappush(self._waiting, ticket)
+        return ticket
+    
+    def _abandon(self, ticket: _Ticket):
+        """待機中の呼び出しの取り消し（ロック取得済みで呼び出す）"""
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        self._stats['timeouts'] += 1
+        RATE_WAIT_TIMEOUTS.inc()
+        self._condition.notify_all()
+    
+    def _try_grant(self, ticket: _Ticket) -> Optional[float]:
+        """送信可能であれば許可してNone、不可の場合は再確認までの秒数を返す（ロック取得済みで呼び出す）"""
+        now = time.monotonic()
+        self._expire(now)
+        
+        if self._waiting[0] is not ticket:
+            return POLL_INTERVAL
+        if now < self._paused_until:
+            return self._paused_until - now
+        
+        delay = self._capacity_delay(ticket.tokens, now)
+        if delay > 0:
+            return delay
+        
+        heapq.heappop(self._waiting)
+        ticket.entry = [now, ticket.tokens]
+        self._window.append(ticket.entry)
+        self._window_tokens += ticket.tokens
+        self._stats['granted'] += 1
+        return None
+    
+    def _capacity_delay(self, tokens: int, now: float) -> float:
+        """上限内に収まるまでの秒数（収まる場合は0）"""
+        delay = 0.0
+        if self.rpm and len(self._window) >= self.rpm:
+            delay = self._window[len(self._window) - self.rpm][0] + WINDOW_SECONDS - now
+        
+        # 1件でTPMを超える呼び出しはウィンドウが空になった時点で許可する
+        if self.tpm and self._window and self._window_tokens + tokens > self.tpm:
+            excess = self._window_tokens + tokens - self.tpm
+            freed = 0
+            for sent_at, entry_tokens in self._window:
+                freed += entry_tokens
+                if freed >= excess:
+                    break
+            delay = max(delay, sent_at + WINDOW_SECONDS - now)
+        return max(0.0, delay)
+    
+    def _expire(self, now: float):
+        while self._window and self._window[0][0] + WINDOW_SECONDS <= now:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+    
+    def _settle(self, ticket: _Ticket, result, usage: Optional[Callable]):
+        """推定トークン数を応答の実績値に置き換え"""
+        if usage is None or ticket.entry is None:
+            return
+        
+        try:
+            actual = usage(result)
+        except Exception:
+            actual = None
+        if not actual:
+            return
+        
+        with self._condition:
+            if ticket.entry[0] + WINDOW_SECONDS > time.monotonic():
+                self._window_tokens += actual - ticket.entry[1]
+                ticket.entry[1] = actual
+            self._condition.notify_all()
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """429の場合は再試行までの秒数（Retry-After + ジッター、無い場合はフルジッターの指数バックオフ）"""
+        if getattr(error, 'http_status', None) != 429:
+            return None
+        
+        THROTTLED_RESPONSES.labels(self.name).inc()
+        with self._condition:
+            self._stats['throttled'] += 1
+        if attempt >= self.max_retries:
+            return None
+        
+        retry_after = _parse_retry_after(getattr(error, 'headers', None))
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.retry_base)
+            self.pause(retry_after)
+        else:
+            delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        
+        with self._condition:
+            self._stats['retries'] += 1
+        logger.warning(f"Azure OpenAI rate limited, retrying in {delay:.2f}s (attempt {attempt + 1})")
+        return delay
+    
+    def _observe_wait(self, started: float):
+        waited = time.monotonic() - started
+        observe_stage('ai.rate_wait', waited)
+        if waited >= POLL_INTERVAL:
+            with self._condition:
+                self._stats['delayed'] += 1
+    
+    def get_stats(self) -> Dict:
+        """直近60秒の使用量・待機数などの統計取得"""
+        with self._condition:
+            self._expire(time.monotonic())
+            stats = dict(self._stats)
+            stats['waiting'] = len(self._waiting)
+            stats['window_requests'] = len(self._window)
+            stats['window_tokens'] = self._window_tokens
+        
+        stats['tpm_limit'] = self.tpm
+        stats['rpm_limit'] = self.rpm
+        return stats
@@ -0,0 +1,124 @@
+"""
+シングルフライトモジュール
+同じ内容のAI呼び出しが同時に複数届いた場合（授業中の一斉送信や再送など）に
+上流への呼び出しを1回にまとめ、全ての呼び出し元に同じ結果を返す
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from evaluation_cache import normalize_message
+from metrics import REGISTRY
+
+UPSTREAM_CALLS = REGISTRY.counter(
+    'rai_ai_upstream_calls_total', 'AI calls actually sent upstream after coalescing', ['mode']
+)
+COALESCED_CALLS = REGISTRY.counter(
+    'rai_ai_coalesced_calls_total', 'AI calls served by an identical in-flight call', ['mode']
+)
+
+def make_flight_key(prompt_version: str, mode: str, message: str, history: Optional[List[Dict]] = None) -> str:
+    """まとめる単位のキー（プロンプトバージョン・モード・正規化済み入力文・会話履歴）"""
+    parts = [prompt_version or '', mode, normalize_message(message)]
+    if history:
+        parts.append(json.dumps(history, ensure_ascii=False, sort_keys=True))
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+class _Flight:
+    """実行中の呼び出し1件"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """同一キーの実行中の呼び出しを1回にまとめる（スレッド用）
+    
+    最初の呼び出し元が func を実行し、完了までに届いた同じキーの呼び出し元はその結果を待つ。
+    完了後はキーを破棄するため、結果の再利用（キャッシュ）は行わない。例外も全員に伝える。
+    """
+    
+    def __init__(self, mode: str):
+        self.mode = mode
+        
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+        self._stats = {
+            'upstream_calls': 0,
+            'coalesced_calls': 0,
+            'errors': 0
+        }
+    
+    def do(self, key: str, func: Callable[[], str]) -> str:
+        """func の実行（同じキーが実行中の場合はその結果を待つ）"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self._stats['upstream_calls'] += 1
+            else:
+                self._stats['coalesced_calls'] += 1
+        
+        if not leader:
+            COALESCED_CALLS.labels(self.mode).inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        
+        UPSTREAM_CALLS.labels(self.mode).inc()
+        try:
+            flight.result = func()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+    
+    def get_stats(self) -> Dict:
+        """上流呼び出し数・まとめた呼び出し数などの統計取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        
+        total = stats['upstream_calls'] + stats['coalesced_calls']
+        stats['coalesced_rate'] = stats['coalesced_calls'] / total if total else 0.0
+        return stats
+
+class AsyncSingleFlight(SingleFlight):
+    """同一キーの実行中の呼び出しを1回にまとめる（asyncio用）
+    
+    上流呼び出しは独立したタスクで実行するため、最初の呼び出し元が切断（キャンセル）されても
+    待機中の呼び出し元には結果が返る。
+    """
+    
+    async def do(self, key: str, func: Callable[[], Awaitable[str]]) -> str:
+        """func の実行（同じキーが実行中の場合はその結果を待つ）"""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._flights[key] = task
+            self._stats['upstream_calls'] += 1
+            UPSTREAM_CALLS.labels(self.mode).inc()
+            task.add_done_callback(lambda finished: self._finish(key, finished))
+        else:
+            self._stats['coalesced_calls'] += 1
+            COALESCED_CALLS.labels(self.mode).inc()
+        
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: str, task: 'asyncio.Future'):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._stats['errors'] += 1
@@ -0,0 +1,61 @@
+"""
+テスト共通設定
+バックエンドのモジュールを直接importできるようにし、設定はモック・インメモリDBを既定にする
+（Config は import 時に環境変数を読むため、各テストモジュールの import より前に設定する）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_TYPE', 'memory')
+os.environ.setdefault('MOCK_MODE', 'true')
+os.environ.setdefault('MOCK_AI_DELAY', '0')
+
+import pytest
+
+from config import Config
+from database import SQLiteManager
+
+@pytest.fixture
+def sqlite():
+    """テストごとに独立したインメモリのSQLiteバックエンド"""
+    manager = SQLiteManager(Config(), path=':memory:')
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    """openai_stub_server を送信先にした設定（MOCK_AI=false、設定は settings で上書き）"""
+    from openai_stub_server import StubSettings, start_stub_server
+    
+    servers = []
+    
+    def start(**settings):
+        server = start_stub_server(StubSettings(seed=0, **{
+            'latency': 'fixed:0.01', 'token_rate': 'fixed:1000', 'completion_tokens': 'fixed:8', **settings
+        }))
+        servers.append(server)
+        monkeypatch.setattr(Config, 'MOCK_AI', False)
+        monkeypatch.setattr(Config, 'AZURE_OPENAI_ENDPOINT', server.endpoint)
+        monkeypatch.setattr(Config, 'AZURE_OPENAI_KEY', 'stub')
+        monkeypatch.setattr(Config, 'AZURE_OPENAI_DEPLOYMENT', 'gpt-stub')
+        monkeypatch.setattr(Config, 'AZURE_OPENAI_DEPLOYMENTS', '')
+        monkeypatch.setattr(Config, 'MODEL_TIERS', '')
+        return server
+    
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture(scope='session')
+def flask_app():
+    """Flask版アプリのモジュール（サービスはモック・インメモリDBで1回だけ構築される）"""
+    import app
+    app.app.config['TESTING'] = True
+    return app
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.app.test_client()
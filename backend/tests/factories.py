@@ -0,0 +1,79 @@
+"""
+テスト用のデータとバックエンド
+メッセージの生成、既定の実装（DatabaseInterface）だけを使うバックエンド、カーソルを辿るヘルパー、
+テストクライアントでのモックログイン、SSE応答の解析
+"""
+import json
+
+from competency_scores import annotate_competency_scores
+from database import DatabaseInterface
+
+def message(index: int, user_id: str = 'student001', chat_id: str = 'chat_a', evaluation: bool = False,
+            timestamp: str = None, ai_response: str = None) -> dict:
+    return annotate_competency_scores({
+        'id': f'msg{index:03d}',
+        'chat_id': chat_id,
+        'user_id': user_id,
+        'user_message': f'振り返り{index}',
+        'ai_response': ai_response or f'応答{index}',
+        'is_competency_evaluation': evaluation,
+        'prompt_version': 'v1',
+        'timestamp': timestamp or f'2026-04-01T09:{index:02d}:00+00:00',
+        'session_info': {}
+    })
+
+class ListBackend(DatabaseInterface):
+    """既定の実装（オフセットによるページング）を確認するためのリスト上のバックエンド"""
+    
+    def __init__(self):
+        self.messages = []
+    
+    def save_chat_message(self, message_data):
+        self.messages.append(dict(message_data))
+        return True
+    
+    def get_chat_history(self, user_id, limit=50, offset=0):
+        history = sorted(
+            (m for m in self.messages if m['user_id'] == user_id),
+            key=lambda m: (m['timestamp'], m['id']), reverse=True
+        )
+        return history[offset:offset + limit]
+    
+    def get_competency_evaluations(self, start_date=None, end_date=None):
+        return [m for m in self.messages if m['is_competency_evaluation']]
+    
+    def get_usage_statistics(self):
+        return {}
+    
+    def iter_usage_records(self, page_size=1000):
+        return iter(self.messages)
+
+def walk(fetch, cursor=None):
+    """カーソルを辿って全ページの項目を取得"""
+    items = []
+    pages = 0
+    while True:
+        page = fetch(cursor)
+        items.extend(page['items'])
+        pages += 1
+        cursor = page['next_cursor']
+        if not cursor:
+            return items, pages
+
+STUDENT = ('student001@st.ritsumei.ac.jp', 'password123')
+FACULTY = ('professor@fc.ritsumei.ac.jp', 'faculty123')
+
+def login(client, account=STUDENT) -> dict:
+    """モックユーザーでログインし、Authorizationヘッダーを返す"""
+    email, password = account
+    response = client.post('/api/auth/login', json={'email': email, 'password': password})
+    assert response.status_code == 200
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+def parse_sse(body: str) -> list:
+    """SSEフレームを (event, data) の一覧に変換"""
+    events = []
+    for frame in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in frame.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
@@ -0,0 +1,211 @@
+"""
+AIサービスのテスト（同期版・asyncio版の上流リクエストの共通化、イベントループ上のI/O、JSON出力モード）
+"""
+import asyncio
+import json
+import threading
+
+import openai
+import pytest
+
+import openai_stub_server
+from ai_service import COMPETENCY_ERROR_RESPONSE, STRUCTURED_EVALUATIONS, AIService, AsyncAIService
+from config import Config
+from prompt_registry import DEFAULT_PROMPTS, compile_prompts
+
+HISTORY = [{'role': 'user', 'content': '前回の質問'}, {'role': 'assistant', 'content': '前回の回答'}]
+
+def record_requests(monkeypatch) -> list:
+    """ChatCompletion.create・acreate に渡された引数を記録（送信はそのまま行う）"""
+    requests = []
+    create, acreate = openai.ChatCompletion.create, openai.ChatCompletion.acreate
+    
+    def recording_create(**kwargs):
+        requests.append(kwargs)
+        return create(**kwargs)
+    
+    async def recording_acreate(**kwargs):
+        requests.append(kwargs)
+        return await acreate(**kwargs)
+    
+    monkeypatch.setattr(openai.ChatCompletion, 'create', recording_create)
+    monkeypatch.setattr(openai.ChatCompletion, 'acreate', recording_acreate)
+    return requests
+
+async def with_async_service(func):
+    service = AsyncAIService()
+    await service.initialize()
+    try:
+        return await func(service)
+    finally:
+        await service.close()
+
+def test_sync_and_async_services_send_the_same_request(openai_stub, monkeypatch):
+    openai_stub()
+    requests = record_requests(monkeypatch)
+    
+    sync_response = AIService().generate_general_response('授業の感想です', history=HISTORY)
+    async_response = asyncio.run(with_async_service(
+        lambda service: service.generate_general_response('授業の感想です', history=HISTORY)
+    ))
+    
+    assert sync_response and async_response
+    assert len(requests) == 2 and requests[0] == requests[1]
+    assert [m['content'] for m in requests[0]['messages'][1:]] == ['前回の質問', '前回の回答', '授業の感想です']
+    assert requests[0]['engine'] == 'gpt-stub' and 'stream' not in requests[0]
+
+def test_sync_and_async_streams_send_the_same_request(openai_stub, monkeypatch):
+    server = openai_stub()
+    requests = record_requests(monkeypatch)
+    
+    async def stream(service):
+        return [delta async for delta in service.iter_general_response('授業の感想です')]
+    
+    sync_deltas = list(AIService().iter_general_response('授業の感想です'))
+    async_deltas = asyncio.run(with_async_service(stream))
+    
+    assert len(sync_deltas) == len(async_deltas) == 8
+    assert requests[0] == requests[1] and requests[0]['stream'] is True
+    assert server.stats.snapshot()['streamed'] == 2
+
+def test_async_disk_cache_runs_off_the_event_loop(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'EVALUATION_CACHE_DISK_PATH', str(tmp_path / 'cache.db'))
+    service = AsyncAIService()
+    threads = []
+    
+    for name in ('get', 'set'):
+        original = getattr(service.evaluation_cache, name)
+        
+        def recorded(*args, original=original):
+            threads.append(threading.current_thread())
+            return original(*args)
+        
+        monkeypatch.setattr(service.evaluation_cache, name, recorded)
+    
+    async def run():
+        first = await service.evaluate_competency('グループワークで発言できました')
+        second = await service.evaluate_competency('グループワークで発言できました')
+        return first, second
+    
+    first, second = asyncio.run(run())
+    
+    assert first == second
+    assert len(threads) == 3 and threading.main_thread() not in threads
+
+def test_async_prompt_reload_check_runs_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(Config, 'PROMPT_RELOAD_INTERVAL', 0)
+    service = AsyncAIService()
+    threads = []
+    current = service.prompt_registry.current
+    
+    def recorded():
+        threads.append(threading.current_thread())
+        return current()
+    
+    monkeypatch.setattr(service.prompt_registry, 'current', recorded)
+    
+    prompt_set = asyncio.run(service.get_prompt_set())
+    
+    assert prompt_set.version == service.prompt_registry._current.version
+    assert threads and threading.main_thread() not in threads
+
+def json_prompt_set():
+    prompts = json.loads(json.dumps(DEFAULT_PROMPTS))
+    prompts['competency_evaluation_prompt']['output_format'] = 'json'
+    return compile_prompts(prompts, 'test')
+
+def serve_tool_arguments(monkeypatch, *payloads):
+    """スタブが返す関数呼び出しの引数を順に差し替える（最後の値を繰り返す）"""
+    remaining = list(payloads)
+    
+    def build_tool_call(tools, rng):
+        payload = remaining.pop(0) if len(remaining) > 1 else remaining[0]
+        arguments = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        return {'id': 'call_test', 'type': 'function',
+                'function': {'name': 'submit_competency_evaluation', 'arguments': arguments}}
+    
+    monkeypatch.setattr(openai_stub_server, 'build_tool_call', build_tool_call)
+
+def outcomes() -> dict:
+    return {name: STRUCTURED_EVALUATIONS.labels(name).get() for name in ('valid', 'partial', 'retry', 'failed')}
+
+def delta(before: dict) -> dict:
+    return {name: value - before[name] for name, value in outcomes().items() if value != before[name]}
+
+VALID_ARGUMENTS = {
+    'competencies': [{'code': 'T', 'score': 4, 'comment': 'ペアワークに参加しました'}],
+    'summary': '丁寧な振り返りです。',
+    'advice': ['次回も発言してみましょう']
+}
+
+@pytest.fixture
+def json_service(openai_stub, monkeypatch):
+    """JSON出力モードの評価をスタブに送るAIService（評価キャッシュなし）"""
+    monkeypatch.setattr(Config, 'EVALUATION_CACHE_ENABLED', False)
+    server = openai_stub()
+    return server, AIService(), json_prompt_set()
+
+def test_json_mode_renders_valid_tool_call(json_service, monkeypatch):
+    server, service, prompt_set = json_service
+    serve_tool_arguments(monkeypatch, VALID_ARGUMENTS)
+    requests = record_requests(monkeypatch)
+    before = outcomes()
+    
+    text = service.evaluate_competency('ペアワークで発言できました', prompt_set)
+    
+    assert text.startswith('【コンピテンシー評価結果】') and '◆ Teamwork（チームワーク） ★★★★☆ (4/5)' in text
+    assert requests[0]['tool_choice']['function']['name'] == 'submit_competency_evaluation'
+    assert delta(before) == {'valid': 1}
+
+def test_json_mode_renders_partial_arguments_without_a_second_call(json_service, monkeypatch):
+    server, service, prompt_set = json_service
+    serve_tool_arguments(monkeypatch, {**VALID_ARGUMENTS, 'competencies': [
+        {'code': 'X', 'score': 4, 'comment': '不明なコード'},
+        {'code': 'E', 'score': 3, 'comment': '周囲に配慮しています'}
+    ], 'advice': []})
+    before = outcomes()
+    
+    text = service.evaluate_competency('ペアワークで発言できました', prompt_set)
+    
+    assert '◆ Empathy（共感力）' in text and '【今後の学習へのアドバイス】' not in text
+    assert server.stats.snapshot()['requests'] == 1
+    assert delta(before) == {'partial': 1}
+
+def test_json_mode_retries_once_through_the_governor(json_service, monkeypatch):
+    server, service, prompt_set = json_service
+    serve_tool_arguments(monkeypatch, '{"competencies": [', VALID_ARGUMENTS)
+    requests = record_requests(monkeypatch)
+    governor = service.router.targets[0].governor
+    before, granted = outcomes(), governor.get_stats()['granted']
+    
+    text = service.evaluate_competency('ペアワークで発言できました', prompt_set)
+    
+    assert '◆ Teamwork（チームワーク）' in text
+    # 再送は関数呼び出しを強制したまま温度0で送り、テキスト形式では再評価しない
+    assert [request['temperature'] for request in requests] == [0.7, 0]
+    assert all('tools' in request for request in requests)
+    assert governor.get_stats()['granted'] - granted == 2
+    assert delta(before) == {'retry': 1, 'valid': 1}
+
+def test_json_mode_fails_after_one_retry(json_service, monkeypatch):
+    server, service, prompt_set = json_service
+    serve_tool_arguments(monkeypatch, 'not json')
+    before = outcomes()
+    
+    assert service.get_competency_evaluation('ペアワークで発言できました', prompt_set) == COMPETENCY_ERROR_RESPONSE
+    assert server.stats.snapshot()['requests'] == 2
+    assert delta(before) == {'retry': 1, 'failed': 1}
+
+def test_async_json_mode_shares_the_retry_path(openai_stub, monkeypatch):
+    monkeypatch.setattr(Config, 'EVALUATION_CACHE_ENABLED', False)
+    server = openai_stub()
+    serve_tool_arguments(monkeypatch, 'not json', VALID_ARGUMENTS)
+    before = outcomes()
+    
+    text = asyncio.run(with_async_service(
+        lambda service: service.evaluate_competency('ペアワークで発言できました', json_prompt_set())
+    ))
+    
+    assert '◆ Teamwork（チームワーク）' in text
+    assert server.stats.snapshot()['requests'] == 2
+    assert delta(before) == {'retry': 1, 'valid': 1}
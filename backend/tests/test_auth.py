@@ -0,0 +1,99 @@
+"""
+JWT検証のテスト（検証済みトークンキャッシュ、require_auth の権限確認）
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from quart import Quart, g, jsonify
+
+from auth import AuthManager, VerifiedTokenCache
+from config import Config
+from factories import FACULTY, login
+
+STUDENT = {'id': 'student001', 'email': 'student001@st.ritsumei.ac.jp', 'role': 'student', 'name': '山田 太郎'}
+
+def expired_token(user=STUDENT) -> str:
+    issued = datetime.now(timezone.utc) - timedelta(hours=9)
+    return jwt.encode({
+        'user_id': user['id'], 'email': user['email'], 'role': user['role'], 'name': user['name'],
+        'iat': issued, 'exp': issued + timedelta(hours=8)
+    }, Config.JWT_SECRET_KEY, algorithm='HS256')
+
+def test_verified_token_is_decoded_once():
+    auth_manager = AuthManager()
+    token = auth_manager.generate_token(STUDENT)
+    
+    first = auth_manager.verify_token(token)
+    first['role'] = 'admin'  # 返した値を変更してもキャッシュには影響しない
+    second = auth_manager.verify_token(token)
+    
+    assert second == STUDENT
+    stats = auth_manager.get_token_cache_stats()
+    assert stats['decodes'] == 1 and stats['hits'] == 1 and stats['entries'] == 1
+
+def test_rejected_tokens_are_not_cached():
+    auth_manager = AuthManager()
+    token = auth_manager.generate_token(STUDENT)
+    tampered = token[:-2] + ('AA' if not token.endswith('AA') else 'BB')
+    
+    assert auth_manager.verify_token(expired_token()) is None
+    assert auth_manager.verify_token(tampered) is None
+    assert auth_manager.verify_token('') is None
+    assert auth_manager.get_token_cache_stats()['entries'] == 0
+
+def test_cached_entry_expires_with_the_token():
+    cache = VerifiedTokenCache()
+    cache.set('expired', STUDENT, time.time() - 1)
+    cache.set('valid', STUDENT, time.time() + 60)
+    
+    assert cache.get('expired') is None
+    assert cache.get('valid') == STUDENT
+    assert cache.get_stats()['entries'] == 1
+
+def test_full_cache_drops_expired_then_earliest_expiry():
+    cache = VerifiedTokenCache(max_entries=2)
+    now = time.time()
+    cache.set('expired', STUDENT, now - 1)
+    cache.set('later', STUDENT, now + 120)
+    cache.set('new', STUDENT, now + 60)  # 期限切れのエントリを破棄
+    cache.set('newest', STUDENT, now + 180)  # 期限切れが無いため最も早く期限切れになる new を破棄
+    
+    assert cache.get('expired') is None and cache.get('new') is None
+    assert cache.get('later') and cache.get('newest')
+
+def test_require_auth_checks_token_role_and_owner(client):
+    student = login(client)
+    
+    assert client.get('/api/chat/history/student001').status_code == 401
+    assert client.get('/api/chat/history/student001', headers={'Authorization': 'Bearer invalid'}).status_code == 401
+    assert client.get('/api/chat/history/student001', headers=student).status_code == 200
+    # 本人以外の履歴・教員向けAPIは拒否する
+    assert client.get('/api/chat/history/student002', headers=student).status_code == 401
+    response = client.get('/api/admin/stats', headers=student)
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Unauthorized - Faculty access required'}
+    assert client.get('/api/admin/stats', headers=login(client, FACULTY)).status_code == 200
+
+def test_require_auth_wraps_coroutine_views():
+    auth_manager = AuthManager()
+    app = Quart(__name__)
+    
+    @app.route('/admin')
+    @auth_manager.require_auth(role='faculty')
+    async def admin_view():
+        await asyncio.sleep(0)
+        return jsonify({'user': g.user['id']})
+    
+    async def run():
+        client = app.test_client()
+        faculty = auth_manager.generate_token({**STUDENT, 'id': 'professor001', 'role': 'faculty'})
+        denied = await client.get('/admin', headers={'Authorization': f'Bearer {auth_manager.generate_token(STUDENT)}'})
+        allowed = await client.get('/admin', headers={'Authorization': f'Bearer {faculty}'})
+        return denied.status_code, allowed.status_code, await allowed.get_json()
+    
+    denied, allowed, body = asyncio.run(run())
+    
+    assert denied == 401
+    assert allowed == 200 and body == {'user': 'professor001'}
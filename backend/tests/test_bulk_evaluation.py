@@ -0,0 +1,155 @@
+"""
+一括コンピテンシー評価のテスト（同時実行数の上限、バッチ保存、失敗項目、中止、実行中ジョブ数の上限、API）
+"""
+import threading
+import time
+
+import pytest
+
+from bulk_evaluation import BulkEvaluationManager
+from factories import FACULTY, login, parse_sse
+
+def items(count: int) -> list:
+    return [{'user_id': f'student{index:03d}', 'message': f'振り返り{index}', 'chat_id': None} for index in range(count)]
+
+def build_record(job, item, response):
+    return {'user_id': item['user_id'], 'chat_id': f"chat_{item['user_id']}", 'ai_response': response}
+
+class Saver:
+    """save_func の呼び出しを記録し、fail_users のメッセージを保存失敗として返す"""
+    
+    def __init__(self, fail_users=()):
+        self.batches = []
+        self.fail_users = set(fail_users)
+    
+    def __call__(self, messages):
+        self.batches.append([m['user_id'] for m in messages])
+        return [m for m in messages if m['user_id'] in self.fail_users]
+
+def run_job(manager, job_items, evaluate, **kwargs):
+    job = manager.start(job_items, evaluate, build_record, 'professor001', 'v1', **kwargs)
+    return job, list(job.iter_events(keepalive=5))
+
+@pytest.fixture
+def make_manager():
+    managers = []
+    
+    def make(save_func, **options):
+        manager = BulkEvaluationManager(save_func, **options)
+        managers.append(manager)
+        return manager
+    
+    yield make
+    for manager in managers:
+        manager.shutdown()
+
+def test_items_are_evaluated_within_the_worker_limit(make_manager):
+    saver = Saver()
+    manager = make_manager(saver, max_workers=2, save_batch_size=2)
+    lock = threading.Lock()
+    running = [0, 0]  # 実行中の件数・最大値
+    
+    def evaluate(message):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return f'評価: {message}'
+    
+    job, events = run_job(manager, items(5), evaluate)
+    
+    assert running[1] <= 2
+    results = [data for event, data in events if event == 'result']
+    assert sorted(result['index'] for result in results) == [0, 1, 2, 3, 4]
+    assert all(result['success'] and result['message'].startswith('評価: ') for result in results)
+    # 2件ごとにまとめて保存し、残りは完了時に保存する
+    assert [len(batch) for batch in saver.batches] == [2, 2, 1]
+    assert [event for event, _ in events].count('progress') == 3
+    assert events[0][0] == 'start' and events[-1] == ('done', job.progress())
+    assert job.progress()['status'] == 'completed' and job.saved == 5
+
+def test_failed_items_are_reported_and_not_saved(make_manager):
+    saver = Saver(fail_users={'student002'})
+    manager = make_manager(saver, max_workers=2)
+    
+    def evaluate(message):
+        if message == '振り返り1':
+            raise ConnectionError('upstream unavailable')
+        return '評価'
+    
+    job, events = run_job(manager, items(4), evaluate)
+    
+    failed = [data for event, data in events if event == 'result' and not data['success']]
+    assert [(data['index'], data['error']) for data in failed] == [(1, 'Evaluation failed')]
+    assert sorted(saver.batches[0]) == ['student000', 'student002', 'student003']
+    progress = job.progress()
+    assert progress['failed'] == 1 and progress['saved'] == 2 and progress['save_failed'] == 1
+
+def test_cancel_stops_unstarted_items(make_manager):
+    manager = make_manager(Saver(), max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    
+    def evaluate(message):
+        started.set()
+        release.wait(5)
+        return '評価'
+    
+    job = manager.start(items(10), evaluate, build_record, 'professor001', 'v1')
+    assert started.wait(5)
+    assert manager.cancel(job.job_id) is job
+    release.set()
+    events = list(job.iter_events(keepalive=5))
+    
+    # 実行中だった項目だけが完了し、未着手の項目は評価しない
+    assert events[-1][1]['status'] == 'cancelled'
+    assert job.completed < job.total and not job.cancel()
+
+def test_running_jobs_are_limited(make_manager):
+    manager = make_manager(Saver(), max_workers=1, max_running_jobs=1)
+    release = threading.Event()
+    
+    job = manager.start(items(1), lambda message: release.wait(5) and '評価', build_record, 'professor001', 'v1')
+    with pytest.raises(RuntimeError):
+        manager.start(items(1), lambda message: '評価', build_record, 'professor001', 'v1')
+    release.set()
+    list(job.iter_events(keepalive=5))
+    
+    assert manager.start(items(1), lambda message: '評価', build_record, 'professor001', 'v1') is not None
+
+def test_bulk_endpoint_streams_results_and_saves_evaluations(client):
+    headers = login(client, FACULTY)
+    job_items = [{'user_id': 'student_bulk', 'message': f'グループワークで発言できた{index}'} for index in range(3)]
+    
+    response = client.post('/api/admin/evaluations/bulk', json={'items': job_items}, headers=headers)
+    
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    events = parse_sse(response.get_data(as_text=True))
+    job_id = response.headers['X-Bulk-Job-Id']
+    assert events[0] == ('start', {'job_id': job_id, 'total': 3, 'prompt_version': events[0][1]['prompt_version']})
+    assert [data['success'] for event, data in events if event == 'result'] == [True] * 3
+    assert events[-1][0] == 'done' and events[-1][1]['saved'] == 3
+    
+    saved = client.get('/api/admin/evaluations?fields=chat_id,user_message&user_id=student_bulk', headers=headers)
+    assert sorted(item['user_message'] for item in saved.get_json()['evaluations']) == [item['message'] for item in job_items]
+    
+    status = client.get(f'/api/admin/evaluations/bulk/{job_id}', headers=headers).get_json()['job']
+    assert status['status'] == 'completed' and status['requested_by'] == events[-1][1]['requested_by']
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'items': [{'user_id': 'student001'}]},
+    {'items': ['振り返り']}
+], ids=['missing-items', 'missing-message', 'not-an-object'])
+def test_bulk_endpoint_rejects_invalid_items(client, body):
+    response = client.post('/api/admin/evaluations/bulk', json=body, headers=login(client, FACULTY))
+    
+    assert response.status_code == 400
+
+def test_bulk_endpoint_requires_faculty(client):
+    response = client.post('/api/admin/evaluations/bulk', json={'items': items(1)}, headers=login(client))
+    
+    assert response.status_code == 401
+    assert client.get('/api/admin/evaluations/bulk/unknown', headers=login(client, FACULTY)).status_code == 404
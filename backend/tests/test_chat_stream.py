@@ -0,0 +1,79 @@
+"""
+SSEによる逐次応答のテスト（モックモードのチャンク出力、完了後の保存、応答失敗時のエラー応答）
+"""
+import asyncio
+
+from ai_service import GENERAL_ERROR_RESPONSE, AsyncAIService
+from config import Config
+from factories import login, parse_sse
+
+def saved_message(client, headers, chat_id: str) -> dict:
+    history = client.get('/api/chat/history/student001?offset=0&limit=100', headers=headers).get_json()['history']
+    return next(m for m in history if m['chat_id'] == chat_id)
+
+def test_stream_sends_deltas_and_saves_the_full_reply(client, monkeypatch):
+    monkeypatch.setattr(Config, 'MOCK_STREAM_CHUNK_SIZE', 4)
+    headers = login(client)
+    
+    response = client.post('/api/chat/stream', json={'message': 'グループで話し合いました'}, headers=headers)
+    
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    events = parse_sse(response.get_data(as_text=True))
+    names = [name for name, _ in events]
+    assert names[0] == 'start' and names[-1] == 'done' and set(names[1:-1]) == {'delta'}
+    deltas = [data['content'] for name, data in events if name == 'delta']
+    assert len(deltas) > 1 and all(len(delta) <= 4 for delta in deltas)
+    
+    chat_id = events[0][1]['chat_id']
+    assert events[-1][1]['chat_id'] == chat_id and events[-1][1]['success']
+    assert saved_message(client, headers, chat_id)['ai_response'] == ''.join(deltas)
+
+def test_competency_stream_is_cached_after_completion(client):
+    headers = login(client)
+    body = {'message': 'ペアワークで相手の話を聞くことができました（ストリーミング）', 'is_competency_evaluation': True}
+    
+    first = parse_sse(client.post('/api/chat/stream', json=body, headers=headers).get_data(as_text=True))
+    second = parse_sse(client.post('/api/chat/stream', json=body, headers=headers).get_data(as_text=True))
+    
+    first_text = ''.join(data['content'] for name, data in first if name == 'delta')
+    second_deltas = [data['content'] for name, data in second if name == 'delta']
+    assert first_text.startswith('【コンピテンシー評価結果】')
+    # 2回目はキャッシュ済みの評価を1チャンクで返す
+    assert second_deltas == [first_text]
+
+def test_failed_general_stream_ends_with_the_error_reply(flask_app, client, monkeypatch):
+    headers = login(client)
+    
+    def failing(user_message, prompt_set=None, history=None):
+        yield '途中まで'
+        raise ConnectionError('upstream closed')
+    
+    monkeypatch.setattr(flask_app.ai_service, 'iter_general_response', failing)
+    
+    events = parse_sse(client.post('/api/chat/stream', json={'message': '質問です'}, headers=headers)
+                       .get_data(as_text=True))
+    
+    deltas = [data['content'] for name, data in events if name == 'delta']
+    assert deltas == ['途中まで', GENERAL_ERROR_RESPONSE]
+    chat_id = events[0][1]['chat_id']
+    assert saved_message(client, headers, chat_id)['ai_response'] == '途中まで' + GENERAL_ERROR_RESPONSE
+    # エラー応答は会話履歴に追加しない
+    assert flask_app.conversation_store.get('student001', chat_id) == []
+
+def test_empty_message_is_rejected(client):
+    response = client.post('/api/chat/stream', json={'message': '  '}, headers=login(client))
+    
+    assert response.status_code == 400
+
+def test_async_service_streams_mock_chunks(monkeypatch):
+    monkeypatch.setattr(Config, 'MOCK_STREAM_CHUNK_SIZE', 5)
+    service = AsyncAIService()
+    
+    async def run():
+        return [delta async for delta in service.stream_general_response('チームワークについて')]
+    
+    deltas = asyncio.run(run())
+    
+    assert len(deltas) > 1 and all(len(delta) <= 5 for delta in deltas)
+    assert ''.join(deltas) == service._mock_text('general', 'チームワークについて')
@@ -0,0 +1,185 @@
+"""
+コホート分析のテスト（列指向の読み込み、コンピテンシー別・週別・セクション別の集計、傾向とパーセンタイル、
+集計結果のキャッシュと保存時の破棄、API）
+"""
+import asyncio
+
+import pytest
+
+from cohort_analytics import CohortAnalytics, CohortFilter, ScoreColumns, build_cohort_report
+from factories import FACULTY, login, message
+
+ROWS = [
+    {'user_id': 's1', 'timestamp': '2026-04-06T09:00:00+00:00', 'code': 'T', 'score': 2},
+    {'user_id': 's1', 'timestamp': '2026-04-13T09:00:00+00:00', 'code': 'T', 'score': 4},
+    {'user_id': 's2', 'timestamp': '2026-04-08T09:00:00+00:00', 'code': 'T', 'score': 5},
+    {'user_id': 's2', 'timestamp': '2026-04-08T09:00:00+00:00', 'code': 'E', 'score': 3},
+    {'user_id': 's3', 'timestamp': '2026-04-14T09:00:00+00:00', 'code': 'T', 'score': 1}
+]
+
+def report(rows=ROWS, **cohort_filter) -> dict:
+    return build_cohort_report(ScoreColumns.from_rows(rows), CohortFilter(**cohort_filter))
+
+def students(result: dict) -> dict:
+    return {student['user_id']: student for student in result['students']}
+
+def test_invalid_rows_are_dropped():
+    columns = ScoreColumns.from_rows(ROWS + [
+        {'user_id': 's4', 'timestamp': '2026-04-06T09:00:00+00:00', 'code': 'X', 'score': 3},
+        {'user_id': 's4', 'timestamp': '2026-04-06T09:00:00+00:00', 'code': 'T', 'score': 6},
+        {'user_id': 's4', 'timestamp': '2026-04-06T09:00:00+00:00', 'code': 'T', 'score': '3'}
+    ])
+    
+    assert len(columns) == 5 and columns.user_ids == ['s1', 's2', 's3']
+
+def test_competency_distribution():
+    result = report()
+    
+    assert result['score_count'] == 5 and result['student_count'] == 3
+    assert result['competencies']['T'] == {
+        'count': 4, 'mean': 3.0, 'histogram': {'1': 1, '2': 1, '3': 0, '4': 1, '5': 1}
+    }
+    assert result['competencies']['R'] == {
+        'count': 0, 'mean': None, 'histogram': {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0}
+    }
+
+def test_weekly_buckets_start_on_monday():
+    weekly = report()['weekly']
+    
+    assert [week['week_start'] for week in weekly] == ['2026-04-06', '2026-04-13']
+    assert weekly[0]['competencies']['T'] == {'count': 2, 'mean': 3.5}
+    assert weekly[0]['competencies']['E'] == {'count': 1, 'mean': 3.0}
+    assert weekly[1]['competencies']['T'] == {'count': 2, 'mean': 2.5}
+
+def test_student_trend_and_percentile():
+    result = students(report())
+    
+    assert result['s1']['competencies']['T'] == {'count': 2, 'mean': 3.0, 'trend_per_week': 2.0, 'percentile': 50.0}
+    # 1時点だけの学生は傾向を計算しない
+    assert result['s2']['competencies']['T'] == {'count': 1, 'mean': 5.0, 'trend_per_week': None, 'percentile': 83.333}
+    assert result['s3']['competencies']['T']['percentile'] == 16.667
+    assert list(result['s2']['competencies']) == ['T', 'E']
+
+def test_tied_means_share_the_middle_rank():
+    rows = [dict(row, score=3) for row in ROWS if row['code'] == 'T']
+    
+    assert {user_id: student['competencies']['T']['percentile'] for user_id, student in students(report(rows)).items()} == {
+        's1': 50.0, 's2': 50.0, 's3': 50.0
+    }
+
+def test_sections_use_the_first_roster_listing():
+    result = report(sections={'A': ['s1', 's3'], 'B': ['s2', 's1', 'unknown']})
+    
+    assert [(section['name'], section['student_count']) for section in result['sections']] == [('A', 2), ('B', 1)]
+    assert result['sections'][0]['competencies']['T']['count'] == 3
+    assert {user_id: student['section'] for user_id, student in students(result).items()} == {
+        's1': 'A', 's2': 'B', 's3': 'A'
+    }
+
+def test_students_outside_the_roster_are_excluded():
+    result = report(sections={'A': ['s2']})
+    
+    assert result['score_count'] == 2 and list(students(result)) == ['s2']
+
+def test_competency_filter():
+    result = report(competency='E')
+    
+    assert list(result['competencies']) == ['E'] and result['score_count'] == 1
+    assert list(students(result)) == ['s2']
+
+@pytest.mark.parametrize('data', [
+    {'competency': 'Z'},
+    {'sections': ['s1']},
+    {'sections': {'A': 's1'}},
+    {'sections': {'A': [1]}}
+], ids=['unknown-competency', 'sections-list', 'roster-string', 'roster-ids'])
+def test_filter_rejects_invalid_input(data):
+    with pytest.raises(ValueError):
+        CohortFilter.from_dict(data)
+
+def test_reports_are_cached_until_invalidated():
+    calls = []
+    
+    def loader(start_date, end_date, prompt_version):
+        calls.append(prompt_version)
+        return ROWS
+    
+    analytics = CohortAnalytics(loader)
+    first = analytics.get_report(None, None, CohortFilter())
+    second = analytics.get_report(None, None, CohortFilter(sections={'A': ['s1']}))
+    
+    assert analytics.get_report(None, None, CohortFilter()) is first
+    assert analytics.get_report(None, None, CohortFilter(sections={'A': ['s1']})) is second
+    analytics.invalidate()
+    analytics.get_report(None, None, CohortFilter())
+    
+    assert len(calls) == 3
+    stats = analytics.get_stats()
+    assert stats['hits'] == 2 and stats['invalidations'] == 1 and stats['entries'] == 1
+
+def test_report_computed_during_a_save_is_not_cached():
+    analytics = None
+    
+    def loader(start_date, end_date, prompt_version):
+        # 集計中に評価が保存された場合
+        analytics.invalidate()
+        return ROWS
+    
+    analytics = CohortAnalytics(loader)
+    analytics.get_report(None, None, CohortFilter())
+    
+    assert analytics.get_stats()['entries'] == 0
+
+def test_expired_report_is_recomputed():
+    calls = []
+    analytics = CohortAnalytics(lambda *args: calls.append(args) or ROWS, ttl=0)
+    
+    analytics.get_report(None, None, CohortFilter())
+    analytics.get_report(None, None, CohortFilter())
+    
+    assert len(calls) == 2
+
+def test_async_report_awaits_loader():
+    calls = []
+    
+    async def loader(start_date, end_date, prompt_version):
+        calls.append(prompt_version)
+        await asyncio.sleep(0)
+        return ROWS
+    
+    analytics = CohortAnalytics(loader)
+    
+    async def run():
+        first = await analytics.get_report_async(None, None, CohortFilter(prompt_version='v1'))
+        second = await analytics.get_report_async(None, None, CohortFilter(prompt_version='v1'))
+        return first, second
+    
+    first, second = asyncio.run(run())
+    
+    assert first is second and first['competencies']['T']['count'] == 4
+    assert calls == ['v1']
+
+def test_cohort_endpoint_reflects_new_evaluations(flask_app, client):
+    headers = login(client, FACULTY)
+    body = {'start_date': '2002-04-01T00:00:00Z', 'end_date': '2002-05-01T00:00:00Z'}
+    flask_app.db_manager.save_chat_message(message(
+        300, user_id='student_cohort', evaluation=True, timestamp='2002-04-08T09:00:00+00:00',
+        ai_response='◆ チームワーク ★★☆☆☆ (2/5)'
+    ))
+    
+    first = client.post('/api/admin/analytics/cohort', json=body, headers=headers).get_json()['analytics']
+    flask_app.db_manager.save_chat_message(message(
+        301, user_id='student_cohort', evaluation=True, timestamp='2002-04-15T09:00:00+00:00',
+        ai_response='◆ チームワーク ★★★★☆ (4/5)'
+    ))
+    second = client.post('/api/admin/analytics/cohort', json=body, headers=headers).get_json()['analytics']
+    
+    assert first['competencies']['T']['count'] == 1
+    # 評価の保存で集計結果が破棄され、新しい評価が反映される
+    assert second['competencies']['T'] == {'count': 2, 'mean': 3.0, 'histogram': {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0}}
+    assert students(second)['student_cohort']['competencies']['T']['trend_per_week'] == 2.0
+
+def test_cohort_endpoint_rejects_invalid_filter(client):
+    response = client.post('/api/admin/analytics/cohort', json={'competency': 'Z'}, headers=login(client, FACULTY))
+    
+    assert response.status_code == 400
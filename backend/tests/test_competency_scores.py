@@ -0,0 +1,78 @@
+"""
+評価結果の構造化のテスト（◆行からのコンピテンシー・点数の抽出と集計）
+"""
+from competency_scores import (
+    annotate_competency_scores, competency_code, count_competency_scores, parse_competency_scores,
+    summarize_competency_scores
+)
+
+EVALUATION = """【コンピテンシー評価結果】
+
+◆ Empathy（共感力） ★★★★☆ (4/5)
+相手の話に耳を傾けています。
+
+◆ 傾聴スキル ★★★★☆ (4/5)
+◆ チームワーク ★★★☆☆ (3/5)
+◆ Resilience ★★☆☆☆
+"""
+
+def test_parses_known_competencies_in_order():
+    assert parse_competency_scores(EVALUATION) == [
+        {'code': 'E', 'score': 4},
+        {'code': 'T', 'score': 3},
+        {'code': 'R', 'score': 2}
+    ]
+
+def test_fraction_takes_precedence_over_stars():
+    assert parse_competency_scores('◆ 自発性 ★★☆☆☆ (4/5)') == [{'code': 'I', 'score': 4}]
+
+def test_scales_other_denominators_and_clamps():
+    text = '◆ 理解力 (8/10)\n◆ 変革力 (0/5)\n◆ 自己効力感 (9/5)'
+    
+    assert parse_competency_scores(text) == [
+        {'code': 'U', 'score': 4},
+        {'code': 'C', 'score': 1},
+        {'code': 'S', 'score': 5}
+    ]
+
+def test_accepts_full_width_notation():
+    assert parse_competency_scores('◆ マルチタスキング　★★★☆☆　（３／５）') == [{'code': 'M', 'score': 3}]
+
+def test_keeps_first_line_per_competency():
+    text = '◆ 共感力 (5/5)\n◆ Empathy (2/5)'
+    
+    assert parse_competency_scores(text) == [{'code': 'E', 'score': 5}]
+
+def test_ignores_lines_without_score_or_marker():
+    text = '共感力 ★★★★☆ (4/5)\n◆ 共感力\n◆ まとめ (3/5)'
+    
+    assert parse_competency_scores(text) == []
+    assert parse_competency_scores(None) == []
+
+def test_competency_code_accepts_either_name():
+    assert competency_code('Teamwork') == 'T'
+    assert competency_code('しなやかさ') == 'R'
+    assert competency_code('傾聴スキル') is None
+
+def test_annotates_only_evaluations_once():
+    evaluation = {'is_competency_evaluation': True, 'ai_response': '◆ 共感力 (3/5)'}
+    general = {'is_competency_evaluation': False, 'ai_response': '◆ 共感力 (3/5)'}
+    parsed = {'is_competency_evaluation': True, 'ai_response': '◆ 共感力 (3/5)', 'competency_scores': []}
+    
+    assert annotate_competency_scores(evaluation)['competency_scores'] == [{'code': 'E', 'score': 3}]
+    assert 'competency_scores' not in annotate_competency_scores(general)
+    assert annotate_competency_scores(parsed)['competency_scores'] == []
+
+def test_summarizes_counts_per_competency():
+    records = [
+        {'competency_scores': [{'code': 'E', 'score': 4}, {'code': 'T', 'score': 3}], 'prompt_version': 'v1'},
+        {'competency_scores': [{'code': 'E', 'score': 2}], 'prompt_version': 'v2'}
+    ]
+    
+    summary = {entry['code']: entry for entry in summarize_competency_scores(count_competency_scores(records))}
+    
+    assert summary['E']['count'] == 2
+    assert summary['E']['average'] == 3.0
+    assert summary['E']['distribution'] == {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0}
+    assert summary['R']['average'] is None
+    assert count_competency_scores(records, 'v2') == [{'code': 'E', 'score': 2, 'count': 1}]
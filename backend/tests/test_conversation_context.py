@@ -0,0 +1,138 @@
+"""
+会話コンテキストのテスト（件数・トークン上限、古いやり取りの切り詰め、DBからの再構築、LRU）
+"""
+import asyncio
+
+from ai_service import GENERAL_ERROR_RESPONSE
+from conversation_context import EARLIER_TURNS_HEADER, ConversationContextStore
+
+def turn(index: int, **fields) -> dict:
+    return {'user_message': f'質問{index}', 'ai_response': f'回答{index}', 'is_competency_evaluation': False, **fields}
+
+def contents(messages) -> list:
+    return [message['content'] for message in messages]
+
+def test_recent_turns_are_kept_in_order():
+    store = ConversationContextStore(max_turns=3)
+    for index in range(1, 3):
+        store.append_turn('student001', 'chat_a', f'質問{index}', f'回答{index}')
+    
+    assert store.get('student001', 'chat_a') == [
+        {'role': 'user', 'content': '質問1'},
+        {'role': 'assistant', 'content': '回答1'},
+        {'role': 'user', 'content': '質問2'},
+        {'role': 'assistant', 'content': '回答2'}
+    ]
+    assert store.get('student001', 'chat_b') is None
+
+def test_turns_over_the_limit_are_truncated():
+    store = ConversationContextStore(max_turns=2)
+    store.append_turn('student001', 'chat_a', '長い質問' * 40, '回答1')
+    for index in range(2, 4):
+        store.append_turn('student001', 'chat_a', f'質問{index}', f'回答{index}')
+    
+    messages = store.get('student001', 'chat_a')
+    
+    # 古いやり取りは各発言の冒頭だけを残した1行になる
+    earlier = messages[0]
+    assert earlier['role'] == 'system'
+    header, line = earlier['content'].split('\n')
+    assert header == EARLIER_TURNS_HEADER
+    assert line.startswith('- 学生: 長い質問') and '…' in line and line.endswith('R-AI: 回答1')
+    assert contents(messages[1:]) == ['質問2', '回答2', '質問3', '回答3']
+    assert store.get_stats()['truncated_turns'] == 1
+
+def test_token_budget_keeps_latest_turn():
+    store = ConversationContextStore(max_turns=10, token_budget=50)
+    store.append_turn('student001', 'chat_a', '質問' * 20, '回答' * 20)
+    store.append_turn('student001', 'chat_a', '質問' * 30, '回答' * 30)
+    
+    messages = store.get('student001', 'chat_a')
+    
+    # 予算を超えても直近の1件は残す
+    assert messages[0]['role'] == 'system'
+    assert contents(messages[1:]) == ['質問' * 30, '回答' * 30]
+
+def test_truncated_lines_are_dropped_over_their_budget():
+    store = ConversationContextStore(max_turns=1, summary_tokens=20)
+    for index in range(1, 6):
+        store.append_turn('student001', 'chat_a', f'質問{index}', f'回答{index}')
+    
+    earlier_lines = store.get('student001', 'chat_a')[0]['content'].split('\n')[1:]
+    
+    # 上限を超えた分は古い行から破棄する
+    assert earlier_lines == ['- 学生: 質問3 / R-AI: 回答3', '- 学生: 質問4 / R-AI: 回答4']
+
+def test_load_skips_evaluations_and_failed_replies():
+    store = ConversationContextStore()
+    
+    messages = store.load('student001', 'chat_a', [
+        turn(1),
+        turn(2, is_competency_evaluation=True),
+        turn(3, ai_response=GENERAL_ERROR_RESPONSE),
+        turn(4)
+    ])
+    
+    assert contents(messages) == ['質問1', '回答1', '質問4', '回答4']
+    assert store.get('student001', 'chat_a') == messages
+
+def test_get_messages_loads_only_on_miss():
+    store = ConversationContextStore()
+    calls = []
+    
+    def loader(user_id, chat_id):
+        calls.append((user_id, chat_id))
+        return [turn(1)]
+    
+    first = store.get_messages('student001', 'chat_a', loader)
+    second = store.get_messages('student001', 'chat_a', loader)
+    
+    assert first == second and contents(first) == ['質問1', '回答1']
+    assert calls == [('student001', 'chat_a')]
+    assert store.get_stats()['rebuilds'] == 1
+
+def test_get_messages_starts_empty_when_loader_fails():
+    store = ConversationContextStore()
+    
+    def loader(user_id, chat_id):
+        raise ConnectionError('database unavailable')
+    
+    assert store.get_messages('student001', 'chat_a', loader) == []
+    assert store.get_messages('student001', 'chat_b') == []
+
+def test_get_messages_async_awaits_loader():
+    store = ConversationContextStore()
+    calls = []
+    
+    async def loader(user_id, chat_id):
+        calls.append(chat_id)
+        await asyncio.sleep(0)
+        return [turn(1), turn(2, ai_response=GENERAL_ERROR_RESPONSE)]
+    
+    async def run():
+        first = await store.get_messages_async('student001', 'chat_a', loader)
+        second = await store.get_messages_async('student001', 'chat_a', loader)
+        return first, second
+    
+    first, second = asyncio.run(run())
+    
+    assert first == second and contents(first) == ['質問1', '回答1']
+    assert calls == ['chat_a']
+
+def test_least_recently_used_chat_is_evicted():
+    store = ConversationContextStore(max_chats=2)
+    store.append_turn('student001', 'chat_a', '質問1', '回答1')
+    store.append_turn('student001', 'chat_b', '質問2', '回答2')
+    store.get('student001', 'chat_a')
+    store.append_turn('student001', 'chat_c', '質問3', '回答3')
+    
+    assert store.get('student001', 'chat_b') is None
+    assert store.get('student001', 'chat_a') is not None
+    assert store.get_stats()['evictions'] == 1
+
+def test_idle_chat_expires():
+    store = ConversationContextStore(idle_ttl=0)
+    store.append_turn('student001', 'chat_a', '質問1', '回答1')
+    
+    assert store.get('student001', 'chat_a') is None
+    assert store.get_stats()['expirations'] == 1
@@ -0,0 +1,83 @@
+"""
+CSVエクスポートのテスト（ページ単位の逐次取得、チャンク出力、gzip・BOM、ストリーミング応答）
+"""
+import asyncio
+import csv
+import gzip
+import io
+
+import pytest
+
+from api_helpers import CSV_HEADER, gzip_stream, iter_csv
+from database import AsyncDatabaseManager
+from factories import FACULTY, login, message
+
+def rows(text: str) -> list:
+    return list(csv.reader(io.StringIO(text)))
+
+@pytest.mark.parametrize('count', [4, 5])
+def test_iter_competency_evaluations_pages(sqlite, count):
+    for index in range(count):
+        sqlite.save_chat_message(message(index, evaluation=True, timestamp='2026-04-01T09:00:00+00:00' if index < 3 else None))
+    sqlite.save_chat_message(message(40))
+    
+    records = list(sqlite.iter_competency_evaluations(page_size=2))
+    
+    # 同じ日時の評価がページ境界をまたいでも重複・欠落しない
+    assert [record['id'] for record in records] == [
+        record['id'] for record in sorted(records, key=lambda r: (r['timestamp'], r['id']), reverse=True)
+    ]
+    assert len({record['id'] for record in records}) == count
+
+def test_async_manager_iterates_sync_backend_by_page():
+    manager = AsyncDatabaseManager()
+    for index in range(6):
+        manager.db.save_chat_message(message(index, evaluation=True))
+    manager.db.save_chat_message(message(90))
+    
+    async def run():
+        return [record['id'] async for record in manager.iter_competency_evaluations(page_size=4)]
+    
+    assert asyncio.run(run()) == ['msg005', 'msg004', 'msg003', 'msg002', 'msg001', 'msg000']
+
+def test_iter_csv_yields_bounded_chunks():
+    records = [message(index, ai_response='評価,"引用"\n2行目') for index in range(50)]
+    
+    chunks = list(iter_csv(iter(records), bom=True, chunk_size=256))
+    
+    assert len(chunks) > 1 and all(len(chunk.encode('utf-8')) < 512 for chunk in chunks)
+    text = ''.join(chunks)
+    assert text.startswith('﻿')
+    parsed = rows(text[1:])
+    assert parsed[0] == CSV_HEADER and len(parsed) == 51
+    assert parsed[1][4] == '評価,"引用"\n2行目'
+
+def test_gzip_stream_round_trips():
+    chunks = ['日時,学生ID\n', 'a,b\n' * 1000]
+    
+    assert gzip.decompress(b''.join(gzip_stream(iter(chunks)))).decode('utf-8') == ''.join(chunks)
+
+def test_streaming_export_endpoint(flask_app, client):
+    for index in range(3):
+        flask_app.db_manager.save_chat_message(message(
+            200 + index, user_id='student_csv', evaluation=True, timestamp=f'2001-02-03T10:0{index}:00+00:00'
+        ))
+    
+    response = client.post('/api/admin/export', headers=login(client, FACULTY), json={
+        'start_date': '2001-02-03T00:00:00Z', 'end_date': '2001-02-04T00:00:00Z',
+        'stream': True, 'gzip': True, 'bom': True
+    })
+    
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Disposition'].startswith('attachment; filename="competency_evaluation_')
+    text = gzip.decompress(response.get_data()).decode('utf-8')
+    assert text.startswith('﻿')
+    parsed = rows(text[1:])
+    assert parsed[0] == CSV_HEADER
+    assert [row[1] for row in parsed[1:]] == ['student_csv'] * 3
+
+def test_export_requires_faculty(client):
+    response = client.post('/api/admin/export', headers=login(client), json={'stream': True})
+    
+    assert response.status_code == 401
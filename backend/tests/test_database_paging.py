@@ -0,0 +1,172 @@
+"""
+チャット履歴のページングのテスト（カーソルの符号化、SQLiteのキーセットページング、既定のオフセットによるページング）
+"""
+import asyncio
+import base64
+import json
+import re
+from unittest import mock
+from urllib.parse import unquote
+
+import pytest
+import requests
+
+from config import Config
+from database import AsyncCosmosDBManager, SharePointManager, decode_cursor, encode_cursor
+from factories import ListBackend, message, walk
+
+def test_cursor_round_trip():
+    state = {'timestamp': '2026-04-01T09:00:00+00:00', 'id': 'msg001', 'position': ['学生', 1]}
+    cursor = encode_cursor(state)
+    
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == state
+
+@pytest.mark.parametrize('cursor', [
+    '!!!',
+    base64.urlsafe_b64encode(b'[1, 2]').decode('ascii'),
+    base64.urlsafe_b64encode(b'not json').decode('ascii')
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor)
+
+def test_history_pages_cover_all_messages_once(sqlite):
+    # 同じ日時のメッセージはidの順で区切る
+    for index in range(7):
+        sqlite.save_chat_message(message(index, timestamp='2026-04-01T09:00:00+00:00' if index < 4 else None))
+    sqlite.save_chat_message(message(50, user_id='student002'))
+    
+    items, pages = walk(lambda cursor: sqlite.get_chat_history_page('student001', 3, cursor))
+    
+    assert pages == 3
+    assert [item['user_message'] for item in items] == [
+        item['user_message'] for item in sqlite.get_chat_history('student001', 100)
+    ]
+    assert len({item['user_message'] for item in items}) == 7
+
+def test_history_cursor_is_stable_across_new_messages(sqlite):
+    for index in range(1, 5):
+        sqlite.save_chat_message(message(index))
+    
+    first = sqlite.get_chat_history_page('student001', 2)
+    sqlite.save_chat_message(message(30))  # 1ページ目の取得後に新しいメッセージを保存
+    second = sqlite.get_chat_history_page('student001', 2, first['next_cursor'])
+    
+    assert [item['user_message'] for item in first['items'] + second['items']] == [
+        '振り返り4', '振り返り3', '振り返り2', '振り返り1'
+    ]
+    assert second['next_cursor'] is None
+
+def test_chat_turns_are_oldest_first(sqlite):
+    for index in range(1, 6):
+        sqlite.save_chat_message(message(index, chat_id='chat_a' if index % 2 else 'chat_b'))
+    
+    turns = sqlite.get_chat_turns('student001', 'chat_a', 2)
+    
+    assert [turn['user_message'] for turn in turns] == ['振り返り3', '振り返り5']
+
+def test_default_history_pages_store_offset():
+    backend = ListBackend()
+    for index in range(5):
+        backend.save_chat_message(message(index, chat_id='chat_a' if index % 2 else 'chat_b'))
+    
+    page = backend.get_chat_history_page('student001', 2)
+    
+    assert decode_cursor(page['next_cursor']) == {'offset': 2}
+    items, pages = walk(lambda cursor: backend.get_chat_history_page('student001', 2, cursor))
+    assert pages == 3
+    assert [item['id'] for item in items] == ['msg004', 'msg003', 'msg002', 'msg001', 'msg000']
+    assert [turn['id'] for turn in backend.get_chat_turns('student001', 'chat_a')] == ['msg001', 'msg003']
+
+def test_async_cosmos_mock_pages_history_and_turns():
+    manager = AsyncCosmosDBManager(Config())
+    
+    async def run():
+        first = await manager.get_chat_history_page('student001', 1)
+        second = await manager.get_chat_history_page('student001', 1, first['next_cursor'])
+        turns = await manager.get_chat_turns('student001', 'chat_001', 5)
+        return first, second, turns
+    
+    first, second, turns = asyncio.run(run())
+    
+    assert decode_cursor(first['next_cursor']) == {'offset': 1}
+    assert first['items'][0] != second['items'][0]
+    assert turns and all(turn['chat_id'] == 'chat_001' for turn in turns)
+    assert [turn['timestamp'] for turn in turns] == sorted(turn['timestamp'] for turn in turns)
+
+class FakeSharePointList:
+    """SharePoint REST APIのリストアイテム取得（$filter・$top・$skiptoken）の模擬"""
+    
+    FILTER = re.compile(r"\$filter=UserId eq '((?:[^']|'')*)'&")
+    
+    def __init__(self, items):
+        self.items = items
+        self.requests = []
+    
+    def get(self, url=None, **kwargs):
+        self.requests.append(url)
+        match = self.FILTER.search(url)
+        assert match, f'unexpected filter: {url}'
+        user_id = match.group(1).replace("''", "'")
+        top = int(re.search(r'\$top=(\d+)', url).group(1))
+        skiptoken = re.search(r'\$skiptoken=([^&]+)', url)
+        start = int(re.search(r'p_ID=(\d+)', unquote(skiptoken.group(1))).group(1)) if skiptoken else 0
+        
+        matching = [item for item in self.items if item['UserId'] == user_id]
+        payload = {'results': matching[start:start + top]}
+        if start + top < len(matching):
+            payload['__next'] = f"{url.split('?')[0]}?$skiptoken=Paged%3dTRUE%26p_ID%3d{start + top}"
+        
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json;odata=verbose'
+        response._content = json.dumps({'d': payload}).encode('utf-8')
+        return response
+
+@pytest.fixture
+def sharepoint(monkeypatch):
+    """SharePointManager（クライアントはREST呼び出しを FakeSharePointList に向ける）"""
+    from office365.sharepoint.client_context import ClientContext
+    
+    config = Config()
+    manager = SharePointManager(config)  # モックモードで生成し、クライアントは差し替える
+    config.MOCK_MODE = False
+    config.SHAREPOINT_LIST_CHATS = 'chats'
+    manager.client = ClientContext('https://example.sharepoint.com/sites/advising')
+    manager.client.authentication_context.authenticate_request = lambda request: None
+    
+    items = [
+        {'ChatId': f'chat_{index}', 'UserId': "o'brien" if index < 8 else 'student001',
+         'UserMessage': f'振り返り{index}', 'AIResponse': f'応答{index}', 'IsCompetencyEvaluation': False,
+         'Timestamp': f'2026-04-01T09:{59 - index:02d}:00+00:00'}
+        for index in range(10)
+    ]
+    fake = FakeSharePointList(items)
+    with mock.patch('requests.get', fake.get):
+        yield manager, fake
+
+def test_sharepoint_filter_escapes_quotes(sharepoint):
+    manager, fake = sharepoint
+    
+    page = manager.get_chat_history_page("o'brien", 3)
+    injected = manager.get_chat_history_page("x' or UserId ne 'x", 3)
+    
+    assert [item['user_message'] for item in page['items']] == ['振り返り0', '振り返り1', '振り返り2']
+    assert "UserId eq 'o''brien'" in fake.requests[0]
+    assert injected == {'items': [], 'next_cursor': None}
+    
+    items, pages = walk(lambda cursor: manager.get_chat_history_page("o'brien", 3, cursor))
+    assert pages == 3 and len(items) == 8
+
+def test_sharepoint_legacy_offset_follows_skiptoken(sharepoint):
+    manager, fake = sharepoint
+    
+    history = manager.get_chat_history("o'brien", limit=3, offset=4)
+    
+    assert [item['user_message'] for item in history] == ['振り返り4', '振り返り5', '振り返り6']
+    # offset分のページを読み飛ばしてから limit 件のページを取得する
+    assert [re.search(r'\$top=(\d+)', url).group(1) for url in fake.requests] == ['4', '3']
+    assert [item['user_message'] for item in manager.get_chat_history("o'brien", limit=5, offset=6)] == [
+        '振り返り6', '振り返り7'
+    ]
@@ -0,0 +1,219 @@
+"""
+デプロイメントルーティング・レート制御のテスト
+openai_stub_server をローカルで起動し、本番と同じ openai クライアント経路で
+429の再試行・サーキットブレーカー・失敗時の切り替え・ヘッジ送信を確認する
+"""
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+
+from deployment_router import MIN_HEDGE_SAMPLES, CircuitBreaker, DeploymentRouter, DeploymentTarget
+from openai_stub_server import StubSettings, start_stub_server
+from rate_governor import RateGovernor
+
+MESSAGES = [{'role': 'user', 'content': '今日の授業の振り返りです。'}]
+FAST = {'latency': 'fixed:0.01', 'token_rate': 'fixed:1000', 'completion_tokens': 'fixed:5'}
+
+@pytest.fixture
+def stub_server():
+    """スタブサーバーの起動（テスト終了時に停止）"""
+    servers = []
+    
+    def start(**settings):
+        server = start_stub_server(StubSettings(seed=0, **{**FAST, **settings}))
+        servers.append(server)
+        return server
+    
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def make_target(server, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                **governor_options) -> DeploymentTarget:
+    governor_options.setdefault('retry_base', 0.01)
+    return DeploymentTarget(
+        name=name,
+        endpoint=server.endpoint,
+        key='stub',
+        deployment=name,
+        api_version='2024-02-01',
+        governor=RateGovernor(name=name, **governor_options),
+        breaker=CircuitBreaker(failure_threshold, reset_timeout),
+        request_timeout=5
+    )
+
+def complete(target: DeploymentTarget):
+    return target.governor.call(
+        lambda: openai.ChatCompletion.create(messages=MESSAGES, max_tokens=16, **target.request_options()), 100
+    )
+
+async def complete_async(target: DeploymentTarget):
+    return await target.governor.call_async(
+        lambda: openai.ChatCompletion.acreate(messages=MESSAGES, max_tokens=16, **target.request_options()), 100
+    )
+
+def requests_to(server) -> int:
+    return server.stats.snapshot()['requests']
+
+def test_retries_429_after_retry_after(stub_server):
+    server = stub_server(rate_429=1.0, retry_after=0.3)
+    target = make_target(server, 'primary')
+    attempts = []
+    
+    def create():
+        attempts.append(time.monotonic())
+        try:
+            return openai.ChatCompletion.create(messages=MESSAGES, max_tokens=16, **target.request_options())
+        finally:
+            server.settings.update({'rate_429': 0.0})  # 2回目以降は成功させる
+    
+    response = target.governor.call(create, 100)
+    
+    assert response['model'] == 'primary'
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.3
+    stats = target.governor.get_stats()
+    assert stats['throttled'] == 1
+    assert stats['retries'] == 1
+
+def test_429_pauses_other_callers(stub_server):
+    server = stub_server(rate_429=1.0, retry_after=0.5)
+    target = make_target(server, 'primary')
+    
+    def create():
+        try:
+            return openai.ChatCompletion.create(messages=MESSAGES, max_tokens=16, **target.request_options())
+        finally:
+            server.settings.update({'rate_429': 0.0})
+    
+    throttled = threading.Thread(target=target.governor.call, args=(create, 100))
+    throttled.start()
+    while target.governor.get_stats()['retries'] == 0:
+        time.sleep(0.01)
+    
+    # 429を受けた呼び出し以外も Retry-After の間は送信しない
+    started = time.monotonic()
+    complete(target)
+    throttled.join()
+    assert time.monotonic() - started >= 0.4
+    assert requests_to(server) == 3
+
+def test_gives_up_after_max_retries(stub_server):
+    server = stub_server(rate_429=1.0, retry_after=0.05)
+    target = make_target(server, 'primary', max_retries=2)
+    
+    with pytest.raises(openai.error.RateLimitError):
+        complete(target)
+    
+    assert requests_to(server) == 3
+    assert target.governor.get_stats()['retries'] == 2
+
+def test_fails_over_to_second_target(stub_server):
+    primary_server = stub_server(rate_500=1.0)
+    secondary_server = stub_server()
+    router = DeploymentRouter([
+        make_target(primary_server, 'primary'),
+        make_target(secondary_server, 'secondary')
+    ])
+    
+    response = router.call(complete)
+    
+    assert response['model'] == 'secondary'
+    assert requests_to(primary_server) == 1
+    assert requests_to(secondary_server) == 1
+    assert router.targets[0].ewma_error_rate > 0
+
+def test_raises_when_every_target_fails(stub_server):
+    router = DeploymentRouter([
+        make_target(stub_server(rate_500=1.0), 'primary'),
+        make_target(stub_server(rate_500=1.0), 'secondary')
+    ])
+    
+    with pytest.raises(openai.error.APIError):
+        router.call(complete)
+
+def test_circuit_opens_and_recovers_through_half_open(stub_server):
+    primary_server = stub_server(rate_500=1.0)
+    secondary_server = stub_server()
+    primary = make_target(primary_server, 'primary', failure_threshold=2, reset_timeout=0.3)
+    router = DeploymentRouter([primary, make_target(secondary_server, 'secondary')])
+    
+    for _ in range(2):
+        assert router.call(complete)['model'] == 'secondary'
+    assert primary.breaker.state == 'open'
+    
+    # open の間は送信しない
+    router.call(complete)
+    assert requests_to(primary_server) == 2
+    
+    # 期限切れ後の試行（half-open）が失敗した場合は再度 open
+    time.sleep(0.3)
+    router.call(complete)
+    assert requests_to(primary_server) == 3
+    assert primary.breaker.state == 'open'
+    
+    # 復旧後の試行が成功すれば closed に戻る
+    primary_server.settings.update({'rate_500': 0.0})
+    time.sleep(0.3)
+    assert router.call(complete)['model'] == 'primary'
+    assert requests_to(primary_server) == 4
+    assert primary.breaker.state == 'closed'
+    assert primary.breaker.consecutive_failures == 0
+
+def prime_latencies(router: DeploymentRouter, latency: float):
+    """先頭の送信先にヘッジ送信の判定に必要な応答時間を記録し、優先して選ばれるようにする"""
+    primary, secondary = router.targets
+    primary.latencies.extend([latency] * MIN_HEDGE_SAMPLES)
+    primary.ewma_latency = latency
+    secondary.ewma_latency = latency * 10
+
+def test_hedges_when_primary_exceeds_p95(stub_server):
+    slow_server = stub_server(latency='fixed:2.0')
+    fast_server = stub_server()
+    router = DeploymentRouter(
+        [make_target(slow_server, 'primary'), make_target(fast_server, 'secondary')],
+        hedge_enabled=True, hedge_min_delay=0.05
+    )
+    prime_latencies(router, 0.05)
+    
+    started = time.monotonic()
+    response = router.call(complete)
+    
+    assert response['model'] == 'secondary'
+    assert time.monotonic() - started < 1.0
+    assert requests_to(slow_server) == 1
+
+def test_no_hedge_within_p95(stub_server):
+    primary_server = stub_server()
+    secondary_server = stub_server()
+    router = DeploymentRouter(
+        [make_target(primary_server, 'primary'), make_target(secondary_server, 'secondary')],
+        hedge_enabled=True, hedge_min_delay=0.5
+    )
+    prime_latencies(router, 0.5)
+    
+    assert router.call(complete)['model'] == 'primary'
+    assert requests_to(secondary_server) == 0
+
+def test_hedges_async_and_cancels_loser(stub_server):
+    slow_server = stub_server(latency='fixed:2.0')
+    fast_server = stub_server()
+    router = DeploymentRouter(
+        [make_target(slow_server, 'primary'), make_target(fast_server, 'secondary')],
+        hedge_enabled=True, hedge_min_delay=0.05
+    )
+    prime_latencies(router, 0.05)
+    
+    started = time.monotonic()
+    response = asyncio.run(router.call_async(complete_async))
+    
+    assert response['model'] == 'secondary'
+    assert time.monotonic() - started < 1.0
+    # 負けた呼び出しはキャンセルされ、成功・失敗のどちらにも数えない
+    primary = router.targets[0]
+    assert primary.in_flight == 0
+    assert primary.breaker.consecutive_failures == 0
@@ -0,0 +1,146 @@
+"""
+EntraIDトークン検証のテスト
+entra_stub_server をプロセス内で起動し、JWKSの取得からGraph /me までネットワークに接続せずに確認する
+"""
+import time
+
+import pytest
+
+from auth import AuthManager
+from config import Config
+from entra_stub_server import SigningKeys, start_entra_stub_server
+
+CLIENT_ID = 'test-client-id'
+
+@pytest.fixture(scope='module')
+def entra_stub():
+    server = start_entra_stub_server(client_id=CLIENT_ID)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def make_auth_manager(entra_stub, monkeypatch):
+    """スタブを検証先にしたAuthManager（JWKSキャッシュの再取得間隔を指定できる）"""
+    monkeypatch.setattr(Config, 'MOCK_MODE', False)
+    monkeypatch.setattr(Config, 'ENTRA_CLIENT_ID', CLIENT_ID)
+    monkeypatch.setattr(Config, 'ENTRA_ISSUER', entra_stub.issuer)
+    monkeypatch.setattr(Config, 'ENTRA_JWKS_URI', entra_stub.jwks_uri)
+    monkeypatch.setattr(Config, 'GRAPH_API_ENDPOINT', entra_stub.base_url)
+    
+    def make(min_refresh_interval: float = 30, refresh_interval: float = 3600) -> AuthManager:
+        monkeypatch.setattr(Config, 'ENTRA_JWKS_MIN_REFRESH_INTERVAL', min_refresh_interval)
+        monkeypatch.setattr(Config, 'ENTRA_JWKS_REFRESH_INTERVAL', refresh_interval)
+        return AuthManager()
+    
+    return make
+
+def jwks_requests(server) -> int:
+    return server.stats.snapshot()['jwks_requests']
+
+def test_valid_id_token(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager()
+    before = jwks_requests(entra_stub)
+    
+    user = auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token({
+        'oid': 'oid-123', 'name': '中島 教授', 'preferred_username': 'professor@fc.ritsumei.ac.jp'
+    }))
+    auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token())
+    
+    assert user == {
+        'id': 'oid-123',
+        'name': '中島 教授',
+        'email': 'professor@fc.ritsumei.ac.jp',
+        'role': 'faculty',
+        'entra_id': 'oid-123'
+    }
+    # 鍵セットは1回だけ取得して以降はキャッシュを使う
+    assert jwks_requests(entra_stub) - before == 1
+
+@pytest.mark.parametrize('claims', [
+    {'aud': 'another-client-id'},
+    {'iss': 'https://login.microsoftonline.com/another-tenant/v2.0'},
+    {'oid': None},
+    {'preferred_username': 'someone@example.com'}
+], ids=['audience', 'issuer', 'missing-oid', 'email-domain'])
+def test_rejected_claims(entra_stub, make_auth_manager, claims):
+    auth_manager = make_auth_manager()
+    
+    assert auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token(claims)) is None
+
+def test_expired_token(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager()
+    token = entra_stub.issue_id_token({'iat': int(time.time()) - 7200, 'nbf': int(time.time()) - 7200},
+                                      expires_in=-3600)
+    
+    assert auth_manager.authenticate_entra_id_token(token) is None
+
+def test_signature_from_unpublished_key(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager()
+    # 公開中の kid を名乗るが別の鍵で署名したトークン
+    forged = entra_stub.issue_id_token(signing_key=SigningKeys.generate())
+    
+    assert auth_manager.authenticate_entra_id_token(forged) is None
+    assert auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token()) is not None
+
+def test_unknown_kid_refreshes_jwks(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager(min_refresh_interval=0)
+    assert auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token()) is not None
+    before = jwks_requests(entra_stub)
+    
+    entra_stub.keys.rotate(keep_previous=False)
+    user = auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token({'oid': 'rotated'}))
+    
+    assert user['id'] == 'rotated'
+    assert jwks_requests(entra_stub) - before == 1
+
+def test_unknown_kid_refresh_is_throttled(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager(min_refresh_interval=60)
+    assert auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token()) is not None
+    before = jwks_requests(entra_stub)
+    
+    # 未知の kid が続いても min_refresh_interval 以内は再取得しない
+    unknown = entra_stub.issue_id_token(kid='unknown-kid', signing_key=entra_stub.keys.private_key())
+    for _ in range(5):
+        assert auth_manager.authenticate_entra_id_token(unknown) is None
+    entra_stub.keys.rotate()
+    assert auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token()) is None
+    assert jwks_requests(entra_stub) == before
+    
+    # 間隔を過ぎると新しい鍵を取得して検証できる
+    auth_manager.jwks_cache._fetched_at -= 60
+    assert auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token()) is not None
+    assert jwks_requests(entra_stub) - before == 1
+
+def test_jwks_expires_after_refresh_interval(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager(refresh_interval=0)
+    before = jwks_requests(entra_stub)
+    
+    for _ in range(3):
+        assert auth_manager.authenticate_entra_id_token(entra_stub.issue_id_token()) is not None
+    
+    assert jwks_requests(entra_stub) - before == 3
+
+def test_graph_profile_is_cached(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager()
+    tokens = entra_stub.issue_tokens(email='student002@st.ritsumei.ac.jp', name='佐藤 花子', oid='oid-456')
+    before = entra_stub.stats.snapshot()['graph_requests']
+    
+    first = auth_manager.authenticate_login({'access_token': tokens['access_token']})
+    second = auth_manager.authenticate_login({'access_token': tokens['access_token']})
+    
+    assert first == second
+    assert first['id'] == 'oid-456' and first['role'] == 'student'
+    assert entra_stub.stats.snapshot()['graph_requests'] - before == 1
+
+def test_graph_rejects_unknown_access_token(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager()
+    
+    assert auth_manager.authenticate_entra_id('not-issued') is None
+    assert entra_stub.stats.snapshot()['graph_unauthorized'] >= 1
+
+def test_graph_profile_without_id(entra_stub, make_auth_manager):
+    auth_manager = make_auth_manager()
+    token = entra_stub.issue_access_token({'displayName': '田中 太郎', 'mail': 'student001@st.ritsumei.ac.jp'})
+    
+    assert auth_manager.authenticate_entra_id(token) is None
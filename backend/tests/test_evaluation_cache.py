@@ -0,0 +1,90 @@
+"""
+コンピテンシー評価キャッシュのテスト（正規化キー、LRU・TTL、プロンプト更新時の破棄、ディスク層、評価での再利用）
+"""
+import time
+
+from ai_service import COMPETENCY_ERROR_RESPONSE, AIService
+from config import Config
+from evaluation_cache import EvaluationCache, normalize_message
+
+def test_normalized_message_shares_the_entry():
+    cache = EvaluationCache()
+    cache.set('グループワーク　で  発言できた', 'v1', '評価結果')
+    
+    assert normalize_message('ＡＢＣ\n  def ') == 'ABC def'
+    assert cache.get(' グループワーク で 発言できた', 'v1') == '評価結果'
+    assert cache.get('グループワーク で 発言できた', 'v2') is None
+    assert cache.get_stats()['memory_hits'] == 1 and cache.get_stats()['misses'] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = EvaluationCache(max_entries=2)
+    cache.set('a', 'v1', 'A')
+    cache.set('b', 'v1', 'B')
+    cache.get('a', 'v1')
+    cache.set('c', 'v1', 'C')
+    
+    assert cache.get('b', 'v1') is None
+    assert cache.get('a', 'v1') == 'A' and cache.get('c', 'v1') == 'C'
+    assert cache.get_stats()['evictions'] == 1
+
+def test_expired_entry_is_a_miss():
+    cache = EvaluationCache(ttl=0.01)
+    cache.set('a', 'v1', 'A')
+    time.sleep(0.02)
+    
+    assert cache.get('a', 'v1') is None
+    assert cache.get_stats()['expirations'] == 1
+
+def test_prompt_version_change_drops_old_entries(tmp_path):
+    cache = EvaluationCache(disk_path=str(tmp_path / 'cache.db'))
+    cache.set_prompt_version('v1')
+    cache.set('a', 'v1', 'A')
+    
+    cache.set_prompt_version('v2')
+    
+    assert cache.get('a', 'v1') is None
+    # メモリ層・ディスク層の両方で破棄される
+    assert cache.get_stats()['invalidations'] == 2
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    EvaluationCache(disk_path=path).set('a', 'v1', 'A')
+    
+    restarted = EvaluationCache(disk_path=path)
+    
+    assert restarted.get('a', 'v1') == 'A'
+    assert restarted.get('a', 'v1') == 'A'
+    stats = restarted.get_stats()
+    assert stats['disk_hits'] == 1 and stats['memory_hits'] == 1 and stats['disk_tier']
+
+def test_service_reuses_cached_evaluation(monkeypatch):
+    service = AIService()
+    calls = []
+    
+    def request(user_message, prompt_set):
+        calls.append(user_message)
+        return '【コンピテンシー評価結果】'
+    
+    monkeypatch.setattr(service, '_request_competency_evaluation', request)
+    
+    first = service.evaluate_competency('グループワークで発言できた')
+    second = service.evaluate_competency('  グループワークで発言できた\n')
+    
+    assert first == second and calls == ['グループワークで発言できた']
+    assert service.get_cache_stats()['hits'] == 1
+
+def test_error_response_is_not_cached(monkeypatch):
+    service = AIService()
+    
+    def failing(user_message, prompt_set):
+        raise ConnectionError('upstream unavailable')
+    
+    monkeypatch.setattr(service, '_request_competency_evaluation', failing)
+    
+    assert service.get_competency_evaluation('グループワークで発言できた') == COMPETENCY_ERROR_RESPONSE
+    assert service.get_cache_stats()['entries'] == 0
+
+def test_cache_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(Config, 'EVALUATION_CACHE_ENABLED', False)
+    
+    assert AIService().get_cache_stats() == {'enabled': False}
@@ -0,0 +1,78 @@
+"""
+JSON出力モードの評価結果の検証・整形のテスト
+"""
+import json
+
+import pytest
+
+from evaluation_format import parse_evaluation, render_evaluation, salvage_evaluation
+
+VALID = {
+    'competencies': [
+        {'code': 'T', 'score': 4, 'comment': 'ペアワークに参加しました'},
+        {'code': 'E', 'score': 3, 'comment': '周囲に配慮しています'}
+    ],
+    'summary': '丁寧な振り返りです。',
+    'advice': ['次回も発言してみましょう', '・質問を準備しましょう']
+}
+
+def arguments(**fields) -> str:
+    return json.dumps({**VALID, **fields}, ensure_ascii=False)
+
+def test_valid_arguments_are_rendered():
+    text = render_evaluation(parse_evaluation(arguments()))
+    
+    assert text.splitlines() == [
+        '【コンピテンシー評価結果】',
+        '',
+        '◆ Teamwork（チームワーク） ★★★★☆ (4/5)',
+        '・ペアワークに参加しました',
+        '',
+        '◆ Empathy（共感力） ★★★☆☆ (3/5)',
+        '・周囲に配慮しています',
+        '',
+        '【総評】',
+        '丁寧な振り返りです。',
+        '',
+        '【今後の学習へのアドバイス】',
+        '・次回も発言してみましょう',
+        '・質問を準備しましょう'
+    ]
+
+@pytest.mark.parametrize('fields', [
+    {'competencies': [{'code': 'X', 'score': 4, 'comment': '不明なコード'}]},
+    {'competencies': [{'code': 'T', 'score': 6, 'comment': '範囲外の点数'}]},
+    {'competencies': []},
+    {'summary': ''},
+    {'advice': []}
+], ids=['unknown-code', 'score-range', 'no-competencies', 'empty-summary', 'empty-advice'])
+def test_invalid_arguments_are_rejected(fields):
+    with pytest.raises(ValueError):
+        parse_evaluation(arguments(**fields))
+
+def test_salvage_keeps_valid_competencies_only():
+    evaluation = salvage_evaluation(arguments(competencies=[
+        {'code': 'X', 'score': 4, 'comment': '不明なコード'},
+        {'code': 'T', 'score': 4, 'comment': 'ペアワークに参加しました'},
+        {'code': 'T', 'score': 3, 'comment': '重複'},
+        {'code': 'R', 'score': True, 'comment': '点数が真偽値'},
+        {'code': 'S', 'score': 3, 'comment': '自分の課題を把握しています'}
+    ], advice='該当なし'))
+    
+    assert [item['code'] for item in evaluation['competencies']] == ['T', 'S']
+    assert evaluation['summary'] == '丁寧な振り返りです。'
+    assert evaluation['advice'] == ['該当なし']
+
+def test_salvage_omits_invalid_sections():
+    text = render_evaluation(salvage_evaluation(arguments(summary=None, advice=[''])))
+    
+    assert '【総評】' not in text and '【今後の学習へのアドバイス】' not in text
+    assert text.endswith('・周囲に配慮しています')
+
+@pytest.mark.parametrize('raw', [
+    '{"competencies": [{"code": "T"',
+    json.dumps(['not', 'an', 'object']),
+    arguments(competencies=[{'code': 'X', 'score': 4, 'comment': '不明なコード'}])
+], ids=['truncated-json', 'not-object', 'no-valid-competency'])
+def test_salvage_gives_up_without_a_valid_competency(raw):
+    assert salvage_evaluation(raw) is None
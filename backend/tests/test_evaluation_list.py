@@ -0,0 +1,80 @@
+"""
+管理画面の評価一覧API（絞り込み・並べ替え・ページング）のテスト
+SQLiteのキーセットページングと既定のオフセットによるページングで同じ結果になることを確認する
+"""
+import pytest
+
+from evaluation_query import EvaluationQuery
+from factories import ListBackend, message, walk
+
+EVALUATIONS = [
+    # (学生ID, 分, 評価結果)
+    ('student003', 1, '◆ 共感力 ★★★★☆ (4/5)'),
+    ('student001', 2, '◆ チームワーク ★★★☆☆ (3/5)\n達成率100%でした'),
+    ('student002', 3, '◆ 共感力 ★★☆☆☆ (2/5)'),
+    ('student001', 3, '◆ しなやかさ ★★★★★ (5/5)'),
+    ('student002', 5, '◆ 共感力 ★★★☆☆ (3/5)\n◆ 自発性 ★★★☆☆ (3/5)'),
+    ('student003', 6, '◆ 理解力 ★★★★☆ (4/5)')
+]
+
+def save_evaluations(backend):
+    for index, (user_id, minute, response) in enumerate(EVALUATIONS):
+        backend.save_chat_message(message(
+            index, user_id=user_id, evaluation=True, ai_response=response,
+            timestamp=f'2026-04-01T09:{minute:02d}:00+00:00'
+        ))
+    backend.save_chat_message(message(90, ai_response='◆ 共感力 (5/5)'))  # 評価以外は含めない
+
+@pytest.fixture(params=['sqlite', 'default'])
+def evaluation_backend(request, sqlite):
+    """キーセットページング（SQLite）と既定のオフセットによるページングで同じ結果になることを確認する"""
+    backend = sqlite if request.param == 'sqlite' else ListBackend()
+    save_evaluations(backend)
+    return backend
+
+def list_evaluations(backend, limit: int = 2, **params):
+    params = {key: str(value) for key, value in params.items()}
+    items, _ = walk(lambda cursor: backend.get_competency_evaluation_page(
+        EvaluationQuery.from_dict({**params, 'limit': limit, **({'cursor': cursor} if cursor else {})})
+    ))
+    return items
+
+def test_evaluations_newest_first(evaluation_backend):
+    items = list_evaluations(evaluation_backend)
+    
+    assert [item['id'] for item in items] == ['msg005', 'msg004', 'msg003', 'msg002', 'msg001', 'msg000']
+    assert items[0]['competency_scores'] == [{'code': 'U', 'score': 4}]
+    assert 'user_message' not in items[0]
+
+def test_evaluations_by_user_id(evaluation_backend):
+    items = list_evaluations(evaluation_backend, sort='user_id')
+    
+    assert [(item['user_id'], item['id']) for item in items] == [
+        ('student001', 'msg001'), ('student001', 'msg003'),
+        ('student002', 'msg002'), ('student002', 'msg004'),
+        ('student003', 'msg000'), ('student003', 'msg005')
+    ]
+
+def test_evaluations_filtered(evaluation_backend):
+    assert [item['id'] for item in list_evaluations(evaluation_backend, competency='共感力')] == [
+        'msg004', 'msg002', 'msg000'
+    ]
+    assert [item['id'] for item in list_evaluations(evaluation_backend, user_id='student002', order='asc')] == [
+        'msg002', 'msg004'
+    ]
+    # % は部分一致の記号ではなく文字として照合する
+    assert [item['id'] for item in list_evaluations(evaluation_backend, q='100%')] == ['msg001']
+
+def test_evaluation_fields_and_excerpts(evaluation_backend):
+    items = list_evaluations(evaluation_backend, limit=10, fields='user_id,ai_response_excerpt')
+    
+    assert set(items[0]) == {'id', 'timestamp', 'user_id', 'ai_response_excerpt'}
+    assert items[-1]['ai_response_excerpt'] == '◆ 共感力 ★★★★☆ (4/5)'
+
+def test_evaluation_cursor_rejects_other_sort(evaluation_backend):
+    page = evaluation_backend.get_competency_evaluation_page(EvaluationQuery.from_dict({'limit': '2'}))
+    
+    with pytest.raises(ValueError):
+        evaluation_backend.get_competency_evaluation_page(
+            EvaluationQuery.from_dict({'limit': '2', 'sort': 'user_id', 'cursor': page['next_cursor']})
+        )
@@ -0,0 +1,80 @@
+"""
+キーワード分類のテスト（Aho-Corasickオートマトン・正規化・分類の優先順）
+"""
+from keyword_classifier import KeywordAutomaton, KeywordClassifier, normalize_text
+
+def test_finds_overlapping_keywords():
+    automaton = KeywordAutomaton([(word, word) for word in ('he', 'she', 'his', 'hers')])
+    
+    assert automaton.search('ushers') == {'she', 'he', 'hers'}
+    assert automaton.search('this') == {'his'}
+
+def test_reports_keywords_ending_inside_longer_match():
+    # 「協力」の照合途中で失敗遷移した先の「力」も出力する
+    automaton = KeywordAutomaton([('協力する', 'cooperate'), ('力', 'power'), ('協調', 'harmony')])
+    
+    assert automaton.search('協力した') == {'power'}
+    assert automaton.search('皆で協力する') == {'cooperate', 'power'}
+    assert automaton.search('協協調') == {'harmony'}
+
+def test_values_are_deduplicated_and_shared_keywords_keep_all_values():
+    automaton = KeywordAutomaton([('不安', 'anxiety'), ('不安', 'resilience'), ('緊張', 'anxiety')])
+    
+    assert automaton.size == 3
+    assert automaton.search('不安で緊張したが、不安は消えた') == {'anxiety', 'resilience'}
+
+def test_ignores_empty_keywords_and_unmatched_text():
+    automaton = KeywordAutomaton([('', 'empty'), ('傾聴', 'listening')])
+    
+    assert automaton.size == 1
+    assert automaton.search('') == set()
+    assert automaton.search('今日は晴れでした') == set()
+
+def test_matches_same_as_naive_search():
+    keywords = ['ab', 'abc', 'bca', 'c', 'caa', 'aab']
+    automaton = KeywordAutomaton([(word, word) for word in keywords])
+    
+    for text in ('abcaab', 'caabca', 'bbbb', 'aabcaa'):
+        assert automaton.search(text) == {word for word in keywords if word in text}
+
+def test_normalize_text_unifies_width_and_case():
+    assert normalize_text('ＧＲＯＵＰ　Work') == 'group work'
+    assert normalize_text('ｸﾞﾙｰﾌﾟ') == 'グループ'
+    assert normalize_text(None) == ''
+
+DEFINITIONS = {
+    'competencies': {
+        'R': ['困難', '失敗'],
+        'T': ['グループ', 'team'],
+        'E': ['相手の気持ち']
+    },
+    'situations': {
+        'anxiety': ['不安'],
+        'communication': ['話し合']
+    }
+}
+
+def test_classifier_orders_labels_by_definition():
+    classifier = KeywordClassifier(DEFINITIONS)
+    
+    match = classifier.classify('ＴＥＡＭで話し合い、失敗や不安もあったが相手の気持ちを考えた')
+    
+    assert match.labels('competencies') == ['R', 'T', 'E']
+    assert match.first('competencies') == 'R'
+    assert match.labels('situations') == ['anxiety', 'communication']
+    assert match.keyword_count == 5
+
+def test_classifier_without_matches():
+    classifier = KeywordClassifier(DEFINITIONS)
+    
+    match = classifier.classify('特になし')
+    
+    assert match.groups == {}
+    assert match.first('competencies') is None
+    assert classifier.keyword_count == 7
+
+def test_missing_keyword_file_classifies_nothing(tmp_path):
+    classifier = KeywordClassifier.from_file(str(tmp_path / 'missing.json'))
+    
+    assert classifier.keyword_count == 0
+    assert classifier.classify('グループで困難があった').groups == {}
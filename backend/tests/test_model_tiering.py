@@ -0,0 +1,140 @@
+"""
+モデル階層選択のテスト（複雑さの採点、階層の選択、MODEL_TIERSの検証、応答時間の記録、AIサービスでの送信先）
+"""
+import json
+
+import pytest
+
+from ai_service import AIService
+from config import Config
+from deployment_router import DeploymentRouter, load_targets
+from keyword_classifier import KeywordMatch
+from model_tiering import (
+    DEFAULT_TIER, MODE_COMPETENCY, MODE_GENERAL, ModelTier, ModelTierSelector, load_tiers
+)
+from prompt_registry import estimate_tokens
+from rate_governor import PRIORITY_COMPETENCY, PRIORITY_GENERAL
+
+class TierConfig(Config):
+    """load_tiers に渡す設定（階層の送信先は単一構成の値を使う）"""
+    
+    AZURE_OPENAI_ENDPOINT = 'http://127.0.0.1:1'
+    AZURE_OPENAI_DEPLOYMENTS = ''
+    MODEL_TIERS = ''
+    MODEL_TIER_WEIGHTS = ''
+
+def make_config(tiers=None, weights=None) -> TierConfig:
+    config = TierConfig()
+    config.MODEL_TIERS = json.dumps(tiers) if tiers is not None else ''
+    config.MODEL_TIER_WEIGHTS = json.dumps(weights) if weights is not None else ''
+    return config
+
+def make_router() -> DeploymentRouter:
+    return DeploymentRouter(load_targets(make_config()))
+
+def make_selector(weights=None) -> ModelTierSelector:
+    router = make_router()
+    return ModelTierSelector([
+        ModelTier('light', router, 200, max_score=1.0),
+        ModelTier('medium', router, 500, max_score=3.0),
+        ModelTier(DEFAULT_TIER, router, 800)
+    ], weights)
+
+def test_score_adds_mode_length_keywords_and_history():
+    selector = make_selector()
+    message = '今日はグループワークで発言できた'
+    history = [{'role': 'user', 'content': '質問1'}, {'role': 'assistant', 'content': '回答1'}]
+    
+    score = selector.score(MODE_GENERAL, message, history, KeywordMatch(keyword_count=2))
+    
+    assert score == pytest.approx(estimate_tokens(message) / 100 + 2 * 0.5 + 2 * 0.25)
+    assert selector.score(MODE_COMPETENCY, message) == pytest.approx(10 + estimate_tokens(message) / 100)
+
+def test_select_picks_the_smallest_tier_that_fits():
+    selector = make_selector()
+    
+    short = selector.select(MODE_GENERAL, 'こんにちは')
+    with_keywords = selector.select(MODE_GENERAL, 'こんにちは', match=KeywordMatch(keyword_count=4))
+    competency = selector.select(MODE_COMPETENCY, 'こんにちは')
+    
+    assert (short.tier.name, short.max_tokens, short.priority) == ('light', 200, PRIORITY_GENERAL)
+    assert with_keywords.tier.name == 'medium'
+    assert (competency.tier.name, competency.priority) == (DEFAULT_TIER, PRIORITY_COMPETENCY)
+
+def test_weights_override_the_defaults():
+    selector = make_selector({'competency': 0.0})
+    
+    assert selector.select(MODE_COMPETENCY, 'こんにちは').tier.name == 'light'
+    assert selector.weights['keyword'] == 0.5
+
+def test_last_tier_must_be_unbounded():
+    with pytest.raises(ValueError):
+        ModelTierSelector([ModelTier('light', make_router(), 200, max_score=1.0)])
+
+def test_records_latency_and_failures_per_mode():
+    selector = make_selector()
+    decision = selector.select(MODE_GENERAL, 'こんにちは')
+    
+    for latency in (0.1, 0.3, None):
+        decision.record(latency)
+    
+    stats = decision.tier.get_stats()['modes'][MODE_GENERAL]
+    assert stats['requests'] == 3 and stats['failures'] == 1
+    assert stats['latency_ms']['mean'] == 200.0 and stats['latency_ms']['p50'] == 100.0
+    assert stats['mean_score'] == round(decision.score, 3)
+
+def test_load_tiers_without_configuration_uses_the_default_router():
+    router = make_router()
+    
+    selector = load_tiers(make_config(), router, 800)
+    
+    assert [(tier.name, tier.router, tier.max_tokens) for tier in selector.tiers] == [(DEFAULT_TIER, router, 800)]
+
+def test_load_tiers_sorts_by_max_score():
+    config = make_config([
+        {'name': 'medium', 'max_score': 3, 'deployments': [{'deployment': 'gpt-medium'}]},
+        {'name': 'light', 'max_score': 1, 'max_tokens': 200, 'deployments': [{'deployment': 'gpt-light'}]}
+    ], {'keyword': 1})
+    
+    selector = load_tiers(config, make_router(), 800)
+    
+    assert [(tier.name, tier.max_score, tier.max_tokens) for tier in selector.tiers] == [
+        ('light', 1.0, 200), ('medium', 3.0, 800), (DEFAULT_TIER, None, 800)
+    ]
+    # 送信先名は階層ごとに接頭辞を付けて区別する
+    assert selector.get_stats()['tiers'][0]['deployments'] == ['light/gpt-light']
+    assert selector.weights['keyword'] == 1.0
+
+@pytest.mark.parametrize('tiers, weights', [
+    ('not json', ''),
+    ('{"name": "light"}', ''),
+    ('[{"name": "light", "deployments": [{"deployment": "gpt-light"}]}]', ''),
+    ('[{"name": "default", "max_score": 1, "deployments": [{"deployment": "gpt-light"}]}]', ''),
+    ('[{"name": "light", "max_score": 1, "deployments": []}]', ''),
+    ('', '["keyword"]')
+], ids=['invalid-json', 'not-an-array', 'missing-max-score', 'default-name', 'no-deployments', 'weights'])
+def test_load_tiers_rejects_invalid_configuration(tiers, weights):
+    config = make_config()
+    config.MODEL_TIERS = tiers
+    config.MODEL_TIER_WEIGHTS = weights
+    
+    with pytest.raises(ValueError):
+        load_tiers(config, make_router(), 800)
+
+def test_service_sends_each_tier_to_its_deployments(openai_stub, monkeypatch):
+    light = openai_stub()
+    default = openai_stub()
+    monkeypatch.setattr(Config, 'MODEL_TIERS', json.dumps([{
+        'name': 'light', 'max_score': 1, 'max_tokens': 200,
+        'deployments': [{'deployment': 'gpt-light', 'endpoint': light.endpoint}]
+    }]))
+    service = AIService()
+    
+    service.generate_general_response('こんにちは')
+    service.evaluate_competency('グループワークで自分の意見を伝えることができた')
+    
+    assert light.stats.snapshot()['requests'] == 1
+    assert default.stats.snapshot()['requests'] == 1
+    tiers = {tier['name']: tier for tier in service.get_model_tier_stats()['tiers']}
+    assert list(tiers['light']['modes']) == [MODE_GENERAL]
+    assert list(tiers[DEFAULT_TIER]['modes']) == [MODE_COMPETENCY]
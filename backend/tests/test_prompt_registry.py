@@ -0,0 +1,91 @@
+"""
+プロンプトレジストリのテスト（バージョンごとの構築、更新時刻による再読み込み、読み込み失敗時の継続）
+"""
+import json
+import os
+
+from factories import FACULTY, login
+from prompt_registry import (
+    COMPETENCY_USER_PREFIX, DEFAULT_PROMPTS, PromptRegistry, compile_prompts, estimate_tokens
+)
+
+def write_prompts(path, system_role: str, mtime: float = None):
+    prompts = json.loads(json.dumps(DEFAULT_PROMPTS))
+    prompts['competency_evaluation_prompt']['system_role'] = system_role
+    path.write_text(json.dumps(prompts, ensure_ascii=False), encoding='utf-8')
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+def test_compiled_prompts_are_versioned_by_content():
+    first = compile_prompts(DEFAULT_PROMPTS, 'a')
+    second = compile_prompts(json.loads(json.dumps(DEFAULT_PROMPTS)), 'b')
+    
+    assert first.version == second.version
+    assert first.token_counts['competency_system'] == estimate_tokens(first.competency_system)
+    # ユーザープロンプトは入力文より前が同一（プロンプトのプレフィックスキャッシュが効くように）
+    assert first.render_competency_user('入力A').startswith(COMPETENCY_USER_PREFIX)
+    assert first.render_competency_user('入力B').startswith(COMPETENCY_USER_PREFIX)
+
+def test_missing_file_uses_default_prompts(tmp_path):
+    registry = PromptRegistry(str(tmp_path / 'prompts.json'))
+    
+    assert registry.current().source == 'default'
+    assert registry.current().version == compile_prompts(DEFAULT_PROMPTS, 'default').version
+
+def test_changed_file_is_reloaded(tmp_path):
+    path = tmp_path / 'prompts.json'
+    write_prompts(path, 'R-AI v1', mtime=1000)
+    registry = PromptRegistry(str(path), reload_interval=0)
+    versions = []
+    registry.add_listener(lambda compiled: versions.append(compiled.version))
+    first = registry.current()
+    
+    write_prompts(path, 'R-AI v2', mtime=2000)
+    second = registry.current()
+    
+    assert 'R-AI v1' in first.competency_system and 'R-AI v2' in second.competency_system
+    assert versions == [second.version]
+    # 取得済みのプロンプトは差し替え後も変わらない（1リクエスト内で同じ版を使う）
+    assert 'R-AI v1' in first.competency_system
+
+def test_reload_waits_for_the_interval(tmp_path):
+    path = tmp_path / 'prompts.json'
+    write_prompts(path, 'R-AI v1', mtime=1000)
+    registry = PromptRegistry(str(path), reload_interval=3600)
+    registry.current()
+    
+    write_prompts(path, 'R-AI v2', mtime=2000)
+    
+    assert not registry.check_due()
+    assert 'R-AI v1' in registry.current().competency_system
+
+def test_invalid_file_keeps_the_current_version(tmp_path):
+    path = tmp_path / 'prompts.json'
+    write_prompts(path, 'R-AI v1', mtime=1000)
+    registry = PromptRegistry(str(path), reload_interval=0)
+    version = registry.current().version
+    
+    path.write_text('{"competency_evaluation_prompt": ', encoding='utf-8')
+    os.utime(path, (2000, 2000))
+    
+    assert registry.current().version == version
+    assert registry.get_info()['version'] == version
+
+def test_unknown_output_format_is_rejected(tmp_path):
+    path = tmp_path / 'prompts.json'
+    prompts = json.loads(json.dumps(DEFAULT_PROMPTS))
+    prompts['competency_evaluation_prompt']['output_format'] = 'xml'
+    path.write_text(json.dumps(prompts), encoding='utf-8')
+    
+    assert PromptRegistry(str(path)).current().source == 'default'
+
+def test_responses_report_the_prompt_version(flask_app, client):
+    response = client.post('/api/chat/send', json={'message': '授業の感想です', 'is_competency_evaluation': True},
+                           headers=login(client))
+    
+    body = response.get_json()
+    assert body['prompt_version'] == flask_app.ai_service.get_prompt_set().version
+    # 保存した評価にも応答に使ったバージョンを記録する
+    evaluations = client.get('/api/admin/evaluations?fields=chat_id,prompt_version&user_id=student001',
+                             headers=login(client, FACULTY)).get_json()['evaluations']
+    assert [e['prompt_version'] for e in evaluations if e['chat_id'] == body['chat_id']] == [body['prompt_version']]
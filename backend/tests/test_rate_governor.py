@@ -0,0 +1,192 @@
+"""
+レート制御のテスト（RPM・TPMの上限、優先度順の送信、待機のタイムアウト、実績トークン数、429の再試行）
+直近60秒のウィンドウは記録済みの送信時刻をずらして経過させる
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_governor import PRIORITY_COMPETENCY, PRIORITY_GENERAL, RateGovernor, _parse_retry_after
+
+class Throttled(Exception):
+    """openai.error.RateLimitError と同じ属性を持つ429応答"""
+    
+    http_status = 429
+    
+    def __init__(self, headers=None):
+        super().__init__('rate limited')
+        self.headers = headers or {}
+
+def age_window(governor: RateGovernor, seconds: float):
+    """記録済みの送信を seconds 秒前に移動"""
+    for entry in governor._window:
+        entry[0] -= seconds
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met in time'
+        time.sleep(0.01)
+
+def test_rpm_limit_times_out_until_the_window_moves():
+    governor = RateGovernor(rpm=2, max_wait=0.1)
+    governor.acquire(10)
+    governor.acquire(10)
+    
+    with pytest.raises(TimeoutError):
+        governor.acquire(10)
+    
+    age_window(governor, 60)
+    governor.acquire(10)
+    stats = governor.get_stats()
+    assert stats['granted'] == 3 and stats['timeouts'] == 1
+    assert stats['window_requests'] == 1 and stats['waiting'] == 0
+
+def test_tpm_limit_counts_estimated_tokens():
+    governor = RateGovernor(tpm=100, max_wait=0.1)
+    governor.acquire(60)
+    
+    with pytest.raises(TimeoutError):
+        governor.acquire(50)
+    governor.acquire(40)
+    
+    assert governor.get_stats()['window_tokens'] == 100
+
+def test_oversized_call_is_granted_on_an_empty_window():
+    governor = RateGovernor(tpm=100, max_wait=0.1)
+    
+    governor.acquire(500)
+    
+    with pytest.raises(TimeoutError):
+        governor.acquire(1)
+
+def test_waiter_is_granted_when_the_oldest_entry_expires():
+    governor = RateGovernor(tpm=100, max_wait=5)
+    governor.acquire(80)
+    age_window(governor, 59.8)
+    started = time.monotonic()
+    
+    governor.acquire(50)
+    
+    # 最も古い送信がウィンドウから外れるまでの時間だけ待機する
+    assert 0.1 <= time.monotonic() - started < 2
+    assert governor.get_stats()['delayed'] == 1
+
+def test_competency_calls_are_sent_before_general_calls():
+    governor = RateGovernor(max_wait=5)
+    governor.pause(0.2)
+    threads = [
+        threading.Thread(target=governor.acquire, args=(tokens, priority))
+        for tokens, priority in ((1, PRIORITY_GENERAL), (2, PRIORITY_COMPETENCY))
+    ]
+    threads[0].start()
+    wait_until(lambda: governor.get_stats()['waiting'] == 1)
+    threads[1].start()
+    wait_until(lambda: governor.get_stats()['waiting'] == 2)
+    
+    for thread in threads:
+        thread.join(5)
+    
+    # 後から届いた評価の呼び出しが先に送信される
+    assert [tokens for _, tokens in governor._window] == [2, 1]
+
+def test_actual_usage_replaces_the_estimate():
+    governor = RateGovernor(tpm=1000)
+    
+    result = governor.call(lambda: {'usage': {'total_tokens': 30}}, 400,
+                           usage=lambda response: response['usage']['total_tokens'])
+    governor.call(lambda: {}, 200, usage=lambda response: response['usage']['total_tokens'])
+    
+    assert result == {'usage': {'total_tokens': 30}}
+    # 実績値を取り出せない応答は推定値のまま
+    assert governor.get_stats()['window_tokens'] == 230
+
+def test_429_is_retried_after_retry_after():
+    governor = RateGovernor(retry_base=0.01)
+    attempts = []
+    
+    def func():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise Throttled({'retry-after-ms': '100'})
+        return '応答'
+    
+    assert governor.call(func, 10) == '応答'
+    assert attempts[1] - attempts[0] >= 0.1
+    stats = governor.get_stats()
+    assert stats['throttled'] == 1 and stats['retries'] == 1 and stats['granted'] == 2
+
+def test_429_is_raised_after_max_retries():
+    governor = RateGovernor(max_retries=1, retry_base=0.01)
+    attempts = []
+    
+    def func():
+        attempts.append(1)
+        raise Throttled()
+    
+    with pytest.raises(Throttled):
+        governor.call(func, 10)
+    
+    assert len(attempts) == 2
+    assert governor.get_stats()['throttled'] == 2 and governor.get_stats()['retries'] == 1
+
+def test_other_errors_are_not_retried():
+    governor = RateGovernor(retry_base=0.01)
+    attempts = []
+    
+    def func():
+        attempts.append(1)
+        raise ConnectionError('upstream unavailable')
+    
+    with pytest.raises(ConnectionError):
+        governor.call(func, 10)
+    
+    assert attempts == [1] and governor.get_stats()['retries'] == 0
+
+@pytest.mark.parametrize('headers, expected', [
+    ({'retry-after-ms': '250'}, 0.25),
+    ({'Retry-After': '2'}, 2.0),
+    ({'retry-after': 'soon'}, None),
+    (None, None)
+])
+def test_parse_retry_after(headers, expected):
+    assert _parse_retry_after(headers) == expected
+
+def test_async_call_retries_and_waits_without_blocking():
+    governor = RateGovernor(rpm=2, max_wait=0.1, retry_base=0.01)
+    attempts = []
+    
+    async def func():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Throttled({'retry-after-ms': '10'})
+        return '応答'
+    
+    async def run():
+        result = await governor.call_async(func, 10)
+        # RPMの上限に達した呼び出しは待機中もイベントループを止めない
+        ticker = asyncio.ensure_future(asyncio.sleep(0.01))
+        with pytest.raises(TimeoutError):
+            await governor.acquire_async(10)
+        return result, ticker.done()
+    
+    assert asyncio.run(run()) == ('応答', True)
+    # 429で終わった送信もRPMの枠を使う
+    assert len(attempts) == 2 and governor.get_stats()['window_requests'] == 2
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    governor = RateGovernor(max_wait=5)
+    governor.pause(5)
+    
+    async def run():
+        waiter = asyncio.ensure_future(governor.acquire_async(10))
+        await asyncio.sleep(0.05)
+        waiting = governor.get_stats()['waiting']
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return waiting
+    
+    assert asyncio.run(run()) == 1
+    assert governor.get_stats()['waiting'] == 0
@@ -0,0 +1,132 @@
+"""
+シングルフライトのテスト（同時呼び出しの集約、例外の共有、切断時の継続、AIサービスでの上流呼び出し数）
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ai_service import AIService, AsyncAIService
+from single_flight import AsyncSingleFlight, SingleFlight, make_flight_key
+
+def test_flight_key_normalizes_message_and_separates_history():
+    key = make_flight_key('v1', 'general', 'グループワーク　で発言できた')
+    
+    assert key == make_flight_key('v1', 'general', ' グループワーク で発言できた\n')
+    assert key != make_flight_key('v2', 'general', 'グループワーク で発言できた')
+    assert key != make_flight_key('v1', 'competency', 'グループワーク で発言できた')
+    assert key != make_flight_key('v1', 'general', 'グループワーク で発言できた', [{'role': 'user', 'content': '質問1'}])
+
+def test_concurrent_calls_share_one_upstream_call():
+    flights = SingleFlight('general')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    
+    def upstream():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return '回答'
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flights.do, 'key', upstream)
+        assert started.wait(5)
+        followers = [executor.submit(flights.do, 'key', upstream) for _ in range(3)]
+        # 後続の呼び出し元が待機に入るまで上流の完了を遅らせる
+        while flights.get_stats()['coalesced_calls'] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        results = [leader.result(5)] + [future.result(5) for future in followers]
+    
+    assert results == ['回答'] * 4 and calls == [1]
+    stats = flights.get_stats()
+    assert stats['upstream_calls'] == 1 and stats['coalesced_rate'] == 0.75 and stats['in_flight'] == 0
+
+def test_completed_flight_is_not_reused():
+    flights = SingleFlight('general')
+    
+    assert flights.do('key', lambda: '1回目') == '1回目'
+    assert flights.do('key', lambda: '2回目') == '2回目'
+    assert flights.get_stats()['upstream_calls'] == 2
+
+def test_error_is_raised_to_every_caller():
+    flights = SingleFlight('competency')
+    started = threading.Event()
+    release = threading.Event()
+    
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ConnectionError('upstream unavailable')
+    
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flights.do, 'key', failing)
+        assert started.wait(5)
+        follower = executor.submit(flights.do, 'key', failing)
+        while not flights.get_stats()['coalesced_calls']:
+            threading.Event().wait(0.01)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ConnectionError):
+                future.result(5)
+    
+    assert flights.get_stats()['errors'] == 1
+
+def test_async_calls_share_one_task():
+    flights = AsyncSingleFlight('general')
+    calls = []
+    
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return '回答'
+    
+    async def run():
+        return await asyncio.gather(*(flights.do('key', upstream) for _ in range(5)))
+    
+    assert asyncio.run(run()) == ['回答'] * 5 and calls == [1]
+    assert flights.get_stats()['coalesced_calls'] == 4 and flights.get_stats()['in_flight'] == 0
+
+def test_async_leader_cancellation_does_not_cancel_followers():
+    flights = AsyncSingleFlight('general')
+    
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return '回答'
+    
+    async def run():
+        leader = asyncio.ensure_future(flights.do('key', upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do('key', upstream))
+        await asyncio.sleep(0)
+        # 最初の呼び出し元が切断しても上流の呼び出しは継続する
+        leader.cancel()
+        return await follower, leader.cancelled()
+    
+    assert asyncio.run(run()) == ('回答', True)
+    assert flights.get_stats()['upstream_calls'] == 1
+
+def test_identical_requests_reach_upstream_once(openai_stub):
+    server = openai_stub(latency='fixed:0.2')
+    service = AIService()
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(service.get_general_response, ['グループワークのコツは？'] * 4))
+    
+    assert len(set(responses)) == 1
+    assert server.stats.snapshot()['requests'] == 1
+    assert service.get_single_flight_stats()['general']['coalesced_calls'] == 3
+
+def test_async_identical_requests_reach_upstream_once(openai_stub):
+    server = openai_stub(latency='fixed:0.1')
+    service = AsyncAIService()
+    
+    async def run():
+        return await asyncio.gather(*(
+            service.generate_general_response('グループワークのコツは？') for _ in range(3)
+        ))
+    
+    assert len(set(asyncio.run(run()))) == 1
+    assert server.stats.snapshot()['requests'] == 1
@@ -0,0 +1,178 @@
+"""
+使用統計のテスト（HyperLogLogによるユニーク数の推定・補正）
+"""
+import asyncio
+import threading
+
+import pytest
+
+from config import Config
+from database import AsyncDatabaseManager, DatabaseManager, SQLiteManager
+from factories import message
+from usage_stats import HyperLogLog, UsageStatistics, UsageStatsReconciler
+
+def test_small_counts_use_linear_counting():
+    hll = HyperLogLog(12)
+    for index in range(100):
+        hll.add(f'student{index:03d}')
+    
+    # 空のレジスタが多い間は線形カウンティング（レジスタの衝突分のみずれる）
+    assert 95 <= hll.count() <= 100
+
+def test_duplicates_do_not_change_estimate():
+    hll = HyperLogLog(12)
+    for index in range(50):
+        hll.add(f'student{index:03d}')
+    estimate = hll.count()
+    
+    for _ in range(5):
+        for index in range(50):
+            hll.add(f'student{index:03d}')
+    
+    assert hll.count() == estimate
+    assert 45 <= estimate <= 50
+
+@pytest.mark.parametrize('precision, cardinality', [(10, 20000), (12, 50000), (14, 100000)])
+def test_large_counts_within_standard_error(precision, cardinality):
+    hll = HyperLogLog(precision)
+    for index in range(cardinality):
+        hll.add(f'user-{index}')
+    
+    # 標準誤差の3倍以内（ハッシュは決定的なため毎回同じ推定値になる）
+    assert abs(hll.count() - cardinality) / cardinality < 3 * hll.relative_error
+
+def test_empty_estimate_is_zero():
+    assert HyperLogLog(4).count() == 0
+
+@pytest.mark.parametrize('precision', [3, 17])
+def test_rejects_precision_out_of_range(precision):
+    with pytest.raises(ValueError):
+        HyperLogLog(precision)
+
+def test_count_is_cached_until_registers_change():
+    hll = HyperLogLog(8)
+    hll.add('a')
+    assert hll.count() == 1
+    
+    hll.add('a')
+    assert not hll._dirty
+    hll.add('b')
+    assert hll.count() == 2
+
+def records(count: int, users: int, evaluations_every: int = 2):
+    return [
+        {'user_id': f'student{index % users}', 'is_competency_evaluation': index % evaluations_every == 0}
+        for index in range(count)
+    ]
+
+def test_record_updates_counters():
+    stats = UsageStatistics(10)
+    stats.record_many(records(10, 3))
+    
+    snapshot = stats.snapshot()
+    assert snapshot['total_messages'] == 10
+    assert snapshot['competency_evaluations'] == 5
+    assert snapshot['active_users'] == 3
+    assert not stats.is_reconciled and not snapshot['reconciled']
+
+def test_reconcile_replaces_counters_and_reports_drift():
+    stats = UsageStatistics(10)
+    stats.record_many(records(4, 2))
+    
+    stats.reconcile(records(10, 5))
+    
+    snapshot = stats.snapshot()
+    assert stats.is_reconciled
+    assert snapshot['total_messages'] == 10
+    assert snapshot['active_users'] == 5
+    assert snapshot['last_drift'] == {'total_messages': 6, 'competency_evaluations': 3}
+
+def test_writes_during_reconciliation_are_kept():
+    stats = UsageStatistics(10)
+    
+    def scan():
+        yield from records(3, 3)
+        # 走査中の書き込み
+        stats.record({'user_id': 'late', 'is_competency_evaluation': True})
+    
+    stats.reconcile(scan())
+    
+    snapshot = stats.snapshot()
+    assert snapshot['total_messages'] == 4
+    assert snapshot['active_users'] == 4
+
+def test_failed_reconciliation_keeps_current_counters():
+    stats = UsageStatistics(10)
+    stats.record_many(records(4, 2))
+    
+    def scan():
+        yield from records(10, 5)
+        raise RuntimeError('scan failed')
+    
+    with pytest.raises(RuntimeError):
+        stats.reconcile(scan())
+    
+    assert stats.snapshot()['total_messages'] == 4
+    assert not stats.is_reconciled
+
+@pytest.fixture
+def no_count_queries(monkeypatch):
+    """リクエスト処理中の集計クエリ（全件走査）を禁止する"""
+    def count_query(self):
+        raise AssertionError('usage statistics must not be computed with COUNT queries')
+    monkeypatch.setattr(SQLiteManager, 'get_usage_statistics', count_query)
+
+def test_manager_serves_partial_counters_until_reconciled(monkeypatch, no_count_queries):
+    # 初回の補正を止めておき、補正前の応答を確認する
+    scan_started = threading.Event()
+    release_scan = threading.Event()
+    original_run_once = UsageStatsReconciler.run_once
+    
+    def blocked_run_once(self):
+        scan_started.set()
+        release_scan.wait(5)
+        return original_run_once(self)
+    
+    monkeypatch.setattr(UsageStatsReconciler, 'run_once', blocked_run_once)
+    manager = DatabaseManager()
+    assert scan_started.wait(5)
+    manager.save_chat_message(message(1, evaluation=True))
+    manager.save_chat_message(message(2, user_id='student002'))
+    
+    partial = manager.get_usage_statistics()
+    
+    assert partial['reconciled'] is False
+    assert (partial['total_messages'], partial['competency_evaluations'], partial['active_users']) == (2, 1, 2)
+    
+    release_scan.set()
+    manager.usage_reconciler.stop()
+    reconciled = manager.get_usage_statistics()
+    assert reconciled['reconciled'] is True and reconciled['total_messages'] == 2
+
+def test_manager_materializes_in_mock_mode(no_count_queries):
+    assert Config.MOCK_MODE
+    manager = DatabaseManager()
+    manager.usage_reconciler.stop()
+    
+    assert manager.get_usage_statistics()['source'] == 'materialized'
+
+def test_async_manager_serves_partial_counters(no_count_queries):
+    manager = AsyncDatabaseManager()
+    
+    async def run():
+        # initialize() 前は補正が始まっていない
+        await manager.save_chat_message(message(1))
+        partial = await manager.get_usage_statistics()
+        await manager.initialize()
+        for _ in range(100):
+            if manager.usage_stats.is_reconciled:
+                break
+            await asyncio.sleep(0.01)
+        reconciled = await manager.get_usage_statistics()
+        await manager.close()
+        return partial, reconciled
+    
+    partial, reconciled = asyncio.run(run())
+    
+    assert partial['reconciled'] is False and partial['total_messages'] == 1
+    assert reconciled['reconciled'] is True and reconciled['total_messages'] == 1
@@ -0,0 +1,199 @@
+"""
+ライトビハインド永続化のテスト（バッチ化、再試行、デッドレター、満杯時のフォールバック、asyncio版）
+"""
+import asyncio
+import json
+import threading
+import time
+
+from config import Config
+from database import AsyncCosmosDBManager, AsyncDatabaseManager, DatabaseManager
+from factories import message
+from write_behind import AsyncWriteBehindQueue, WriteBehindQueue
+
+class Recorder:
+    """flush_func の呼び出しを記録し、fail_times 回まで指定したメッセージを失敗として返す"""
+    
+    def __init__(self, fail_times: int = 0, fail_ids=()):
+        self.batches = []
+        self.fail_times = fail_times
+        self.fail_ids = set(fail_ids)
+        self.flushed = threading.Event()
+    
+    def __call__(self, messages):
+        self.batches.append([m['id'] for m in messages])
+        failed = []
+        if self.fail_times:
+            self.fail_times -= 1
+            failed = [m for m in messages if m['id'] in self.fail_ids]
+        self.flushed.set()
+        return failed
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met in time'
+        time.sleep(0.01)
+
+def test_enqueued_messages_are_flushed_in_batches():
+    recorder = Recorder()
+    write_behind = WriteBehindQueue(recorder, batch_size=3, flush_interval=0.05)
+    for index in range(7):
+        assert write_behind.enqueue(message(index))
+    
+    write_behind.start()
+    write_behind.stop()
+    
+    assert [len(batch) for batch in recorder.batches] == [3, 3, 1]
+    metrics = write_behind.get_metrics()
+    assert metrics['flushed'] == 7 and metrics['batches'] == 3 and metrics['queue_depth'] == 0
+
+def test_partial_batch_is_flushed_after_interval():
+    recorder = Recorder()
+    write_behind = WriteBehindQueue(recorder, batch_size=50, flush_interval=0.05)
+    write_behind.start()
+    try:
+        write_behind.enqueue(message(1))
+        assert recorder.flushed.wait(2)
+        assert recorder.batches == [['msg001']]
+    finally:
+        write_behind.stop()
+
+def test_failed_messages_are_retried():
+    recorder = Recorder(fail_times=2, fail_ids={'msg002'})
+    write_behind = WriteBehindQueue(recorder, batch_size=10, flush_interval=0.01, retry_backoff=0.01)
+    for index in range(1, 4):
+        write_behind.enqueue(message(index))
+    
+    write_behind.start()
+    write_behind.stop()
+    
+    # 失敗したメッセージだけを再送する
+    assert recorder.batches == [['msg001', 'msg002', 'msg003'], ['msg002'], ['msg002']]
+    metrics = write_behind.get_metrics()
+    assert metrics['retried'] == 2 and metrics['flushed'] == 3 and metrics['dead_lettered'] == 0
+
+def test_messages_are_dead_lettered_after_max_retries(tmp_path):
+    dead_letter_file = tmp_path / 'dead_letter.jsonl'
+    
+    def failing(messages):
+        raise ConnectionError('database unavailable')
+    
+    write_behind = WriteBehindQueue(failing, flush_interval=0.01, max_retries=2, retry_backoff=0.01,
+                                    dead_letter_file=str(dead_letter_file))
+    write_behind.enqueue(message(1))
+    write_behind.enqueue(message(2))
+    write_behind.start()
+    write_behind.stop()
+    
+    lines = [json.loads(line) for line in dead_letter_file.read_text(encoding='utf-8').splitlines()]
+    assert [line['id'] for line in lines] == ['msg001', 'msg002']
+    metrics = write_behind.get_metrics()
+    assert metrics['dead_lettered'] == 2 and metrics['retried'] == 4 and metrics['flushed'] == 0
+
+def test_full_queue_rejects_and_manager_writes_through(monkeypatch):
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', True)
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_MAX_QUEUE_SIZE', 1)
+    manager = DatabaseManager()
+    manager.write_behind.stop()  # ワーカーを止めてキューを満杯のままにする
+    
+    assert manager.save_chat_message(message(1))
+    assert manager.save_chat_message(message(2))
+    
+    # 1件目はキューに残り、2件目は同期書き込みで保存済み
+    assert [item['user_message'] for item in manager.get_chat_history('student001')] == ['振り返り2']
+    assert manager.get_persistence_metrics()['rejected'] == 1
+    assert manager.get_persistence_metrics()['queue_depth'] == 1
+
+def test_manager_flushes_through_backend_batch(monkeypatch):
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', True)
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.01)
+    manager = DatabaseManager()
+    
+    for index in range(5):
+        manager.save_chat_message(message(index))
+    wait_for(lambda: len(manager.get_chat_history('student001')) == 5)
+    manager.write_behind.stop()
+    
+    assert manager.get_persistence_metrics()['flushed'] == 5
+
+def test_async_queue_batches_retries_and_drains_on_stop():
+    batches = []
+    failures = {'msg001': 1}
+    
+    async def flush(messages):
+        batches.append([m['id'] for m in messages])
+        failed = [m for m in messages if failures.get(m['id'])]
+        for m in failed:
+            failures[m['id']] -= 1
+        return failed
+    
+    async def run():
+        write_behind = AsyncWriteBehindQueue(flush, batch_size=2, flush_interval=0.01, retry_backoff=0.01)
+        await write_behind.start()
+        for index in range(3):
+            assert write_behind.enqueue(message(index))
+        await write_behind.stop()
+        return write_behind.get_metrics()
+    
+    metrics = asyncio.run(run())
+    
+    assert batches == [['msg000', 'msg001'], ['msg001'], ['msg002']]
+    assert metrics['flushed'] == 3 and metrics['retried'] == 1 and not metrics['running']
+
+def test_async_queue_rejects_when_full():
+    async def run():
+        write_behind = AsyncWriteBehindQueue(lambda messages: None, max_queue_size=1)
+        return write_behind.enqueue(message(1)), write_behind.enqueue(message(2)), write_behind.get_metrics()
+    
+    first, second, metrics = asyncio.run(run())
+    
+    assert first and not second
+    assert metrics['rejected'] == 1 and metrics['queue_depth'] == 1
+
+def test_async_manager_writes_behind(monkeypatch):
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', True)
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.01)
+    manager = AsyncDatabaseManager()
+    written = []
+    manager.add_write_listener(written.extend)
+    
+    async def run():
+        await manager.initialize()
+        for index in range(4):
+            assert await manager.save_chat_message(message(index, evaluation=index % 2 == 0))
+        # close() はキューを書き出してから終了する
+        await manager.close()
+        return await manager.get_chat_history('student001')
+    
+    history = asyncio.run(run())
+    
+    assert len(history) == 4
+    assert sorted(m['id'] for m in written) == ['msg000', 'msg002']
+    assert manager.get_persistence_metrics()['flushed'] == 4
+
+class FakeAsyncContainer:
+    """azure.cosmos.aio のコンテナ（execute_item_batch はコルーチン）"""
+    
+    def __init__(self, failing_partition=None):
+        self.failing_partition = failing_partition
+        self.batches = []
+    
+    async def execute_item_batch(self, batch_operations, partition_key):
+        await asyncio.sleep(0)
+        if partition_key == self.failing_partition:
+            raise RuntimeError('batch failed')
+        self.batches.append((partition_key, [operation[1][0]['id'] for operation in batch_operations]))
+        return []
+
+def test_async_cosmos_batch_save_awaits_container():
+    config = Config()
+    config.MOCK_MODE = False
+    manager = AsyncCosmosDBManager(config)
+    manager.chat_container = FakeAsyncContainer(failing_partition='student002')
+    messages = [message(1), message(2, user_id='student002'), message(3)]
+    
+    failed = asyncio.run(manager.save_chat_messages(messages))
+    
+    assert manager.chat_container.batches == [('student001', ['msg001', 'msg003'])]
+    assert [m['id'] for m in failed] == ['msg002']
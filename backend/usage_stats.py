@@ -0,0 +1,228 @@
+"""
+使用統計モジュール
+総メッセージ数・コンピテンシー評価数・アクティブユーザー数を書き込み時に更新し、
+/api/admin/stats では集計クエリを実行せずに保持している値を返す
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+class HyperLogLog:
+    """HyperLogLogによるユニーク数の推定
+    
+    2^precision 個のレジスタ（precision=12で4KB）で件数に関わらず一定のメモリで動作する。
+    標準誤差は概ね 1.04 / sqrt(2^precision)（precision=12で約1.6%）。
+    """
+    
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+        self._count = 0
+        self._dirty = False
+        
+        if self.num_registers == 16:
+            self._alpha = 0.673
+        elif self.num_registers == 32:
+            self._alpha = 0.697
+        elif self.num_registers == 64:
+            self._alpha = 0.709
+        else:
+            self._alpha = 0.7213 / (1 + 1.079 / self.num_registers)
+    
+    def add(self, value: str):
+        """値を追加"""
+        hashed = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            self._dirty = True
+    
+    def count(self) -> int:
+        """ユニーク数の推定値（レジスタ更新時のみ再計算）"""
+        if not self._dirty:
+            return self._count
+        
+        estimate = self._alpha * self.num_registers ** 2 / sum(2.0 ** -register for register in self.registers)
+        
+        # 小さい値の補正（空のレジスタが残っている間は線形カウンティングを使う）
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.num_registers and zeros:
+            estimate = self.num_registers * math.log(self.num_registers / zeros)
+        
+        self._count = int(round(estimate))
+        self._dirty = False
+        return self._count
+    
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.num_registers)
+
+class UsageCounters:
+    """使用統計のカウンター一式"""
+    
+    def __init__(self, precision: int = 12):
+        self.total_messages = 0
+        self.competency_evaluations = 0
+        self.users = HyperLogLog(precision)
+    
+    def add(self, record: Dict):
+        """保存済みメッセージ1件を反映"""
+        self.total_messages += 1
+        if record.get('is_competency_evaluation'):
+            self.competency_evaluations += 1
+        
+        user_id = record.get('user_id')
+        if user_id:
+            self.users.add(str(user_id))
+
+class UsageStatistics:
+    """書き込み時に更新する使用統計
+    
+    record() で保存成功したメッセージを反映し、reconcile() で全件走査の結果に置き換える。
+    複数プロセスで動作する場合、他プロセスの書き込みは次回の補正で反映される。
+    """
+    
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        
+        self._lock = threading.Lock()
+        self._counters = UsageCounters(precision)
+        self._pending = None  # 補正中の書き込み（補正完了時に新しいカウンターへ反映）
+        self._updated_at = None
+        self._reconciled_at = None
+        self._last_reconcile_ms = None
+        self._last_drift = None
+    
+    @property
+    def is_reconciled(self) -> bool:
+        return self._reconciled_at is not None
+    
+    def record(self, message_data: Dict):
+        """保存済みメッセージを反映"""
+        with self._lock:
+            self._counters.add(message_data)
+            if self._pending is not None:
+                self._pending.append(message_data)
+            self._updated_at = datetime.now(timezone.utc).isoformat()
+    
+    def record_many(self, messages: Iterable[Dict]):
+        """保存済みメッセージをまとめて反映"""
+        for message_data in messages:
+            self.record(message_data)
+    
+    def begin_reconciliation(self) -> UsageCounters:
+        """補正開始（走査結果を積み上げる空のカウンターを返す）"""
+        with self._lock:
+            self._pending = []
+        return UsageCounters(self.precision)
+    
+    def finish_reconciliation(self, counters: UsageCounters, started: float):
+        """走査結果で現在のカウンターを置き換える"""
+        with self._lock:
+            # 走査中の書き込みを反映（走査結果に含まれていた場合は次回の補正で解消される）
+            for message_data in self._pending or []:
+                counters.add(message_data)
+            self._pending = None
+            
+            self._last_drift = {
+                'total_messages': counters.total_messages - self._counters.total_messages,
+                'competency_evaluations': counters.competency_evaluations - self._counters.competency_evaluations
+            }
+            self._counters = counters
+            self._reconciled_at = datetime.now(timezone.utc).isoformat()
+            self._updated_at = self._reconciled_at
+            self._last_reconcile_ms = (time.perf_counter() - started) * 1000
+        
+        logger.info(f"Usage statistics reconciled: {counters.total_messages} messages, drift {self._last_drift}")
+    
+    def abort_reconciliation(self):
+        """補正中止"""
+        with self._lock:
+            self._pending = None
+    
+    def reconcile(self, records: Iterable[Dict]):
+        """全件走査の結果でカウンターを補正"""
+        started = time.perf_counter()
+        counters = self.begin_reconciliation()
+        try:
+            for record in records:
+                counters.add(record)
+        except Exception:
+            self.abort_reconciliation()
+            raise
+        self.finish_reconciliation(counters, started)
+    
+    def snapshot(self) -> Dict:
+        """現在の使用統計（updated_atは最後に値が更新された時刻）
+        
+        初回の補正が完了するまでは起動後に保存した分のみの値で、reconciled は False になる
+        """
+        with self._lock:
+            return {
+                'total_messages': self._counters.total_messages,
+                'competency_evaluations': self._counters.competency_evaluations,
+                'active_users': self._counters.users.count(),
+                'active_users_relative_error': round(self._counters.users.relative_error, 4),
+                'updated_at': self._updated_at,
+                'reconciled_at': self._reconciled_at,
+                'last_reconcile_ms': self._last_reconcile_ms,
+                'last_drift': self._last_drift,
+                'reconciled': self._reconciled_at is not None,
+                'source': 'materialized'
+            }
+
+class UsageStatsReconciler:
+    """使用統計の定期補正スレッド（起動直後に1回、以降 interval 秒ごとに全件走査）"""
+    
+    def __init__(self, stats: UsageStatistics, scan_func: Callable[[], Iterable[Dict]], interval: float = 900):
+        self.stats = stats
+        self.scan_func = scan_func
+        self.interval = interval
+        
+        self._stop_event = threading.Event()
+        self._worker = None
+    
+    def start(self):
+        """補正スレッド開始"""
+        if self._worker is not None:
+            return
+        
+        self._worker = threading.Thread(target=self._run, name='usage-stats-reconciler', daemon=True)
+        self._worker.start()
+    
+    def stop(self, timeout: Optional[float] = 5.0):
+        """補正スレッド停止"""
+        if self._worker is None:
+            return
+        
+        self._stop_event.set()
+        self._worker.join(timeout)
+        self._worker = None
+    
+    def run_once(self) -> bool:
+        """補正を1回実行"""
+        try:
+            self.stats.reconcile(self.scan_func())
+            return True
+        except Exception as e:
+            logger.error(f"Usage statistics reconciliation error: {str(e)}")
+            return False
+    
+    def _run(self):
+        while True:
+            self.run_once()
+            if self._stop_event.wait(self.interval):
+                return
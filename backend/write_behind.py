@@ -0,0 +1,269 @@
+"""
+ライトビハインド永続化モジュール
+チャットメッセージをメモリ上のキューに積み、バックグラウンドでバッチ書き込みする
+"""
+import asyncio
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    """チャットメッセージのバッチ書き込みキュー
+    
+    enqueue()は即座に戻り、ワーカースレッドが batch_size 件または flush_interval 秒
+    ごとにまとめて flush_func に渡す。flush_func は保存に失敗したメッセージを返す。
+    失敗分はバックオフ付きで再試行し、上限を超えたものはデッドレターファイルに記録する。
+    """
+    
+    QUEUE_FULL = queue.Full
+    
+    def __init__(self, flush_func: Callable[[List[Dict]], List[Dict]], max_queue_size: int = 10000,
+                 batch_size: int = 50, flush_interval: float = 0.5, max_retries: int = 3,
+                 retry_backoff: float = 0.5, dead_letter_file: Optional[str] = None):
+        self.flush_func = flush_func
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dead_letter_file = dead_letter_file
+        
+        # maxsizeでメモリ使用量を制限する（満杯時はenqueueがFalseを返す）
+        self._queue = self._create_queue(max_queue_size)
+        self._stop_event = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._metrics = {
+            'enqueued': 0,
+            'rejected': 0,
+            'flushed': 0,
+            'retried': 0,
+            'dead_lettered': 0,
+            'batches': 0,
+            'last_flush_latency_ms': 0.0,
+            'max_flush_latency_ms': 0.0,
+            'total_flush_latency_ms': 0.0,
+            'last_flush_at': None
+        }
+    
+    def _create_queue(self, max_queue_size: int):
+        return queue.Queue(maxsize=max_queue_size)
+    
+    def start(self):
+        """ワーカースレッド開始"""
+        if self._worker is not None:
+            return
+        
+        self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._worker.start()
+        
+        # プロセス終了時にキューを全件書き出す
+        atexit.register(self.stop)
+        logger.info("Write-behind queue started")
+    
+    def stop(self, timeout: float = 30.0):
+        """キューを書き出してワーカースレッドを停止"""
+        if self._worker is None:
+            return
+        
+        self._stop_event.set()
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            logger.error(f"Write-behind queue did not drain within {timeout}s, {self._queue.qsize()} messages pending")
+        else:
+            logger.info("Write-behind queue drained and stopped")
+        self._worker = None
+    
+    def enqueue(self, message_data: Dict) -> bool:
+        """メッセージをキューに追加（キューが満杯の場合はFalse）"""
+        try:
+            self._queue.put_nowait(message_data)
+        except self.QUEUE_FULL:
+            with self._lock:
+                self._metrics['rejected'] += 1
+            logger.warning("Write-behind queue is full")
+            return False
+        
+        with self._lock:
+            self._metrics['enqueued'] += 1
+        return True
+    
+    def get_metrics(self) -> Dict:
+        """キュー深度・フラッシュ遅延などのメトリクス取得"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        
+        total_latency_ms = metrics.pop('total_flush_latency_ms')
+        metrics['avg_flush_latency_ms'] = total_latency_ms / metrics['batches'] if metrics['batches'] else 0.0
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['max_queue_size'] = self._queue.maxsize
+        metrics['running'] = self._is_running()
+        return metrics
+    
+    def _is_running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+    
+    def _run(self):
+        """ワーカーループ"""
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stop_event.is_set():
+                return
+    
+    def _next_batch(self) -> List[Dict]:
+        """最大batch_size件のメッセージを取り出す"""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _flush(self, batch: List[Dict]):
+        """バッチ書き込み（失敗分は再試行し、最終的にデッドレターへ）"""
+        started = time.perf_counter()
+        pending = batch
+        
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self._metrics['retried'] += len(pending)
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+            
+            try:
+                pending = self.flush_func(pending)
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {str(e)}")
+            
+            if not pending:
+                break
+        
+        self._record_flush(batch, pending, started)
+    
+    def _record_flush(self, batch: List[Dict], pending: List[Dict], started: float):
+        """バッチのメトリクス記録（保存できなかったメッセージはデッドレターへ）"""
+        latency_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._metrics['batches'] += 1
+            self._metrics['flushed'] += len(batch) - len(pending)
+            self._metrics['last_flush_latency_ms'] = latency_ms
+            self._metrics['max_flush_latency_ms'] = max(self._metrics['max_flush_latency_ms'], latency_ms)
+            self._metrics['total_flush_latency_ms'] += latency_ms
+            self._metrics['last_flush_at'] = datetime.now(timezone.utc).isoformat()
+        
+        if pending:
+            self._dead_letter(pending)
+    
+    def _dead_letter(self, messages: List[Dict]):
+        """再試行上限を超えたメッセージをJSON Lines形式で記録"""
+        with self._lock:
+            self._metrics['dead_lettered'] += len(messages)
+        
+        logger.error(f"Write-behind giving up on {len(messages)} messages after {self.max_retries} retries")
+        if not self.dead_letter_file:
+            return
+        
+        try:
+            with open(self.dead_letter_file, 'a', encoding='utf-8') as f:
+                for message_data in messages:
+                    f.write(json.dumps(message_data, ensure_ascii=False, default=str) + '\n')
+        except Exception as e:
+            logger.error(f"Error writing dead letter file: {str(e)}")
+
+class AsyncWriteBehindQueue(WriteBehindQueue):
+    """チャットメッセージのバッチ書き込みキュー（asyncio版、asgi_app.py用）
+    
+    ワーカーはイベントループ上のタスクで、flush_func はコルーチン関数。
+    start()・stop() はイベントループ上で呼び出す。
+    """
+    
+    QUEUE_FULL = asyncio.QueueFull
+    
+    def _create_queue(self, max_queue_size: int):
+        return asyncio.Queue(maxsize=max_queue_size)
+    
+    async def start(self):
+        """ワーカータスク開始"""
+        if self._worker is not None:
+            return
+        
+        self._stop_event = asyncio.Event()
+        self._worker = asyncio.ensure_future(self._run())
+        logger.info("Write-behind queue started")
+    
+    async def stop(self, timeout: float = 30.0):
+        """キューを書き出してワーカータスクを停止"""
+        if self._worker is None:
+            return
+        
+        self._stop_event.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker), timeout)
+            logger.info("Write-behind queue drained and stopped")
+        except asyncio.TimeoutError:
+            self._worker.cancel()
+            logger.error(f"Write-behind queue did not drain within {timeout}s, {self._queue.qsize()} messages pending")
+        self._worker = None
+    
+    def _is_running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+    
+    async def _run(self):
+        """ワーカーループ"""
+        while True:
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            elif self._stop_event.is_set():
+                return
+    
+    async def _next_batch(self) -> List[Dict]:
+        """最大batch_size件のメッセージを取り出す"""
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self._queue.get(), self.flush_interval))
+        except asyncio.TimeoutError:
+            return batch
+        
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+    
+    async def _flush(self, batch: List[Dict]):
+        """バッチ書き込み（失敗分は再試行し、最終的にデッドレターへ）"""
+        started = time.perf_counter()
+        pending = batch
+        
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self._metrics['retried'] += len(pending)
+                await asyncio.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+            
+            try:
+                pending = await self.flush_func(pending)
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {str(e)}")
+            
+            if not pending:
+                break
+        
+        # デッドレターのファイル書き込みはイベントループを止めないようスレッドで行う
+        await asyncio.to_thread(self._record_flush, batch, pending, started)